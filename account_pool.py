@@ -0,0 +1,140 @@
+"""
+Pre-created QITO / ByPass accounts for instant delivery.
+
+A background thread keeps a stock of available accounts for every
+(provider, device limit, duration) used by an active QITO or ByPass plan.
+A purchase claims one in the same transaction that debits the buyer
+(database.claim_provider_account), the same way a VPN key is claimed, and
+wakes the thread to replace it. When the stock is empty the purchase falls
+back to a live API call.
+
+The provider API has no way to change an account's expiry once created, so
+pooled accounts are created to expire duration + ACCOUNT_POOL_FRESHNESS_HOURS
+from now, and are only sold while younger than that window. Every buyer
+gets at least the full duration; older accounts are marked stale.
+
+The stock size is the 'provider_account_pool_size' setting on the web
+admin's Account Setup page (0, the default, turns the pool off).
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import (get_active_plans, get_account_setup_config, add_provider_account,
+                      claim_provider_account, mark_stale_provider_accounts, count_provider_accounts,
+                      get_provider_account_summary,
+                      PURCHASE_SUCCESS, PURCHASE_OUT_OF_STOCK, PLAN_TYPE_QITO, PLAN_TYPE_BYPASS)
+from provider_client import qito_client, bypass_client, account_credentials
+
+ACCOUNT_POOL_FRESHNESS_HOURS = float(os.getenv('ACCOUNT_POOL_FRESHNESS_HOURS', '24'))
+# Seconds between refill rounds when no purchase wakes the thread
+ACCOUNT_POOL_REFILL_INTERVAL = 60.0
+POOL_SIZE_CONFIG_KEY = 'provider_account_pool_size'
+
+PROVIDER_CLIENTS = {PLAN_TYPE_QITO: qito_client, PLAN_TYPE_BYPASS: bypass_client}
+
+_pool_thread = None
+_pool_lock = threading.Lock()
+_wake = threading.Event()
+
+def get_pool_target():
+    """Accounts to keep per (provider, device limit, duration); 0 means the pool is off"""
+    value = get_account_setup_config(POOL_SIZE_CONFIG_KEY)
+    try:
+        return max(0, int(value or 0))
+    except ValueError:
+        print(f"⚠️ Invalid {POOL_SIZE_CONFIG_KEY} value {value!r}, pool disabled")
+        return 0
+
+def _fresh_after():
+    """created_at (UTC, as stored by CURRENT_TIMESTAMP) of the oldest account that may still be sold"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - ACCOUNT_POOL_FRESHNESS_HOURS * 3600))
+
+def pool_combinations():
+    """(provider, device_limit, duration_days) for every active QITO / ByPass plan"""
+    combinations = set()
+    for provider in PROVIDER_CLIENTS:
+        for plan in get_active_plans(provider):
+            duration_days, device_limit = plan[5], plan[9]
+            combinations.add((provider, device_limit or 1, duration_days))
+    return sorted(combinations)
+
+def refill_pool():
+    """Retire stale accounts and top every combination up to the target; returns how many were created"""
+    fresh_after = _fresh_after()
+    retired = mark_stale_provider_accounts(fresh_after)
+    if retired:
+        print(f"🗑 Retired {retired} pooled provider account(s) older than {ACCOUNT_POOL_FRESHNESS_HOURS:g}h")
+
+    target = get_pool_target()
+    if target <= 0:
+        return 0
+
+    created = 0
+    for provider, device_limit, duration_days in pool_combinations():
+        client = PROVIDER_CLIENTS[provider]
+        missing = target - count_provider_accounts(provider, device_limit, duration_days, fresh_after)
+        for _ in range(missing):
+            expires_at = datetime.now() + timedelta(days=duration_days, hours=ACCOUNT_POOL_FRESHNESS_HOURS)
+            api_response = client.create_user(device_limit, duration_days, expires_at)
+            if not api_response:
+                # Provider failing; try again next round (an open circuit makes this cheap)
+                break
+            add_provider_account(provider, device_limit, duration_days, account_credentials(api_response),
+                                 json.dumps(api_response), expires_at.strftime('%Y-%m-%d %H:%M:%S'))
+            created += 1
+    if created:
+        print(f"📦 Pre-created {created} provider account(s)")
+    return created
+
+def _pool_loop():
+    while True:
+        try:
+            refill_pool()
+        except Exception as e:
+            print(f"❌ Account pool refill error: {e}")
+        _wake.wait(ACCOUNT_POOL_REFILL_INTERVAL)
+        _wake.clear()
+
+def start_account_pool():
+    """Start the refill thread if it is not running"""
+    global _pool_thread
+    with _pool_lock:
+        if _pool_thread is None or not _pool_thread.is_alive():
+            _pool_thread = threading.Thread(target=_pool_loop, name='account-pool', daemon=True)
+            _pool_thread.start()
+
+def claim_pooled_account(provider, user_id, plan_id, device_limit, duration_days, credits_required,
+                         purchase_job_id=None):
+    """Sell a pooled account; returns (status, api_response, expiry_date).
+
+    status is PURCHASE_SUCCESS (the buyer has been debited and the
+    user_plans row written, and the purchase job, if given, marked
+    recorded), PURCHASE_OUT_OF_STOCK (pool off or empty: fall back to a live
+    API call) or PURCHASE_INSUFFICIENT_FUNDS (nothing written: do not buy
+    an account). api_response and expiry_date are only set on success.
+    """
+    if get_pool_target() <= 0:
+        return PURCHASE_OUT_OF_STOCK, None, None
+    claim = claim_provider_account(user_id, plan_id, provider, device_limit, duration_days,
+                                   credits_required, _fresh_after(), purchase_job_id)
+    if claim.status != PURCHASE_SUCCESS:
+        return claim.status, None, None
+    _wake.set()
+    return claim.status, json.loads(claim.api_response), datetime.strptime(claim.expiry_date, '%Y-%m-%d %H:%M:%S')
+
+def get_account_pool_stats():
+    """Pool settings and account counts per provider, device limit, duration and status"""
+    return {
+        'target': get_pool_target(),
+        'freshness_hours': ACCOUNT_POOL_FRESHNESS_HOURS,
+        'refill_thread_alive': _pool_thread is not None and _pool_thread.is_alive(),
+        'accounts': [
+            {'provider': provider, 'device_limit': device_limit, 'duration_days': duration_days,
+             'status': status, 'count': count}
+            for provider, device_limit, duration_days, status, count in get_provider_account_summary()
+        ],
+    }
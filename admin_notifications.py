@@ -0,0 +1,162 @@
+"""
+Admin notifications, sent at once or folded into a periodic digest.
+
+Purchase notices (VPN key, QITO and ByPass) and low key alerts go through
+notify_admin() with a category. Categories listed in ADMIN_DIGEST_CATEGORIES
+are only counted: the first one starts a window of ADMIN_DIGEST_SECONDS,
+after which a single digest gives the totals per category with a per-plan
+breakdown. Other categories are sent straight away, as before. Payment
+proofs do not come through here; they carry the Approve / Deny buttons and
+are always sent at once.
+
+An empty ADMIN_DIGEST_CATEGORIES turns digests off (one message per event).
+Counts wait in memory, so a restart loses at most one window of them. If a
+digest cannot be sent, its counts are kept and go out with the next one.
+"""
+
+import os
+import threading
+from datetime import datetime
+
+from metrics import Counters
+
+NOTIFY_PURCHASE = 'purchase'
+NOTIFY_LOW_STOCK = 'low_stock'
+
+ADMIN_DIGEST_SECONDS = float(os.getenv('ADMIN_DIGEST_SECONDS', '300'))
+ADMIN_DIGEST_CATEGORIES = frozenset(
+    category.strip()
+    for category in os.getenv('ADMIN_DIGEST_CATEGORIES', f'{NOTIFY_PURCHASE},{NOTIFY_LOW_STOCK}').split(',')
+    if category.strip()
+)
+
+DIGEST_TITLES = {
+    NOTIFY_PURCHASE: '🛒 Purchases',
+    NOTIFY_LOW_STOCK: '⚠️ Low key alerts',
+}
+
+_send = None
+_pending = {}  # category -> {plan name: [events, credits, latest detail]}
+_window_started = None
+_flush_timer = None
+_pending_lock = threading.Lock()
+_stats = Counters(
+    sent_immediately=0,
+    digested=0,
+    digests_sent=0,
+    send_errors=0,
+)
+
+def start_admin_notifications(send):
+    """Set how messages reach the admin: send(text, parse_mode)"""
+    global _send
+    _send = send
+
+def _deliver(text, parse_mode=None):
+    if _send is None:
+        print("⚠️ Admin notifications are not started, message dropped")
+        return False
+    try:
+        _send(text, parse_mode)
+        return True
+    except Exception as e:
+        _stats.bump('send_errors')
+        print(f"❌ Failed to send admin notification: {e}")
+        return False
+
+def _arm_flush_timer():
+    """Start the timer that ends the digest window; the caller holds _pending_lock"""
+    global _flush_timer
+    _flush_timer = threading.Timer(ADMIN_DIGEST_SECONDS, flush_admin_digest)
+    _flush_timer.daemon = True
+    _flush_timer.start()
+
+def notify_admin(category, text, items=(), parse_mode=None):
+    """Send text to the admin now, or count items in the next digest if the category is digested.
+
+    items are (plan name, credits, detail) tuples for the digest breakdown;
+    a detail (e.g. "Out of stock") replaces the plan's count, latest wins.
+    """
+    global _window_started
+    if category not in ADMIN_DIGEST_CATEGORIES:
+        if _deliver(text, parse_mode):
+            _stats.bump('sent_immediately')
+        return
+
+    with _pending_lock:
+        plans = _pending.setdefault(category, {})
+        for plan_name, credits, detail in items:
+            entry = plans.setdefault(plan_name, [0, 0, None])
+            entry[0] += 1
+            entry[1] += credits or 0
+            if detail:
+                entry[2] = detail
+        if _flush_timer is None:
+            _window_started = datetime.now()
+            _arm_flush_timer()
+    _stats.bump('digested')
+
+def format_admin_digest(pending, started, ended):
+    """Digest text for {category: {plan name: [events, credits, detail]}}"""
+    text = f"📊 Admin digest {started.strftime('%H:%M')} - {ended.strftime('%H:%M')}"
+    for category, plans in pending.items():
+        events = sum(entry[0] for entry in plans.values())
+        credits = sum(entry[1] for entry in plans.values())
+        text += f"\n\n{DIGEST_TITLES.get(category, category)}: {events}"
+        if credits:
+            text += f" ({credits} Credits)"
+        for plan_name, (plan_events, plan_credits, detail) in sorted(plans.items(), key=lambda item: -item[1][0]):
+            if detail:
+                text += f"\n• {plan_name}: {detail}"
+            elif plan_credits:
+                text += f"\n• {plan_name}: {plan_events} ({plan_credits} Credits)"
+            else:
+                text += f"\n• {plan_name}: {plan_events}"
+    return text
+
+def flush_admin_digest():
+    """Send the digest of everything counted so far (called when the window ends); returns True if one was sent"""
+    global _window_started, _flush_timer
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+        started = _window_started
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+        _flush_timer = None
+        _window_started = None
+    if not pending:
+        return False
+    if not _deliver(format_admin_digest(pending, started, datetime.now())):
+        _restore_pending(pending, started)
+        return False
+    _stats.bump('digests_sent')
+    return True
+
+def _restore_pending(pending, started):
+    """Put the counts of a digest that was not sent back, merged with any counted since, and wait for the next window"""
+    global _window_started
+    with _pending_lock:
+        for category, plans in _pending.items():
+            merged = pending.setdefault(category, {})
+            for plan_name, (events, credits, detail) in plans.items():
+                entry = merged.setdefault(plan_name, [0, 0, None])
+                entry[0] += events
+                entry[1] += credits
+                entry[2] = detail or entry[2]
+        _pending.clear()
+        _pending.update(pending)
+        _window_started = started
+        if _flush_timer is None:
+            _arm_flush_timer()
+
+def get_admin_notification_stats():
+    """Counters for this process and the events waiting for the next digest"""
+    stats = _stats.snapshot()
+    with _pending_lock:
+        stats['waiting'] = {category: sum(entry[0] for entry in plans.values())
+                            for category, plans in _pending.items()}
+        stats['window_started'] = _window_started.isoformat() if _window_started else None
+    stats['digest_seconds'] = ADMIN_DIGEST_SECONDS
+    stats['digest_categories'] = sorted(ADMIN_DIGEST_CATEGORIES)
+    return stats
@@ -0,0 +1,115 @@
+"""
+Delivery of apk_files/latest.apk for the "📱 Download APK" button.
+
+The APK is uploaded to Telegram once per version. The file_id Telegram
+returns is stored in telegram_files, keyed by the SHA-256 of the file
+content, and every later request sends that file_id, so no bytes are
+uploaded again. When the web admin replaces the file, prewarm_apk() uploads
+the new version to the admin chat straight away, so the first user to tap
+the button does not wait for the upload either.
+
+A file_id Telegram no longer accepts is dropped and the file is uploaded
+again.
+"""
+
+import hashlib
+import os
+import threading
+
+import telebot
+from telebot.apihelper import ApiTelegramException
+from dotenv import load_dotenv
+
+from metrics import Counters
+from database import get_telegram_file_id, save_telegram_file_id, delete_telegram_file_id
+
+load_dotenv()
+
+APK_FILE_PATH = os.path.join('apk_files', 'latest.apk')
+APK_CAPTION = "📱 VPN APK File\n\nဤဖိုင်ကို သင့်ဖုန်းတွင် ထည့်သွင်းပါ။"
+APK_UPLOAD_TIMEOUT = 60
+
+_hash_cache = {}  # path -> ((size, mtime_ns), sha256 hex digest)
+_upload_lock = threading.Lock()
+_stats = Counters(
+    cached_sends=0,
+    uploads=0,
+    stale_file_ids=0,
+)
+
+def apk_file_hash(path=APK_FILE_PATH):
+    """SHA-256 of the file content, recomputed only when its size or mtime changes"""
+    stat = os.stat(path)
+    version = (stat.st_size, stat.st_mtime_ns)
+    cached = _hash_cache.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as apk_file:
+        for chunk in iter(lambda: apk_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    _hash_cache[path] = (version, digest.hexdigest())
+    return digest.hexdigest()
+
+def _send_cached(bot, chat_id, file_hash, caption):
+    """Send by stored file_id; returns the Message, or None if there is no usable file_id"""
+    file_id = get_telegram_file_id(file_hash)
+    if file_id is None:
+        return None
+    try:
+        message = bot.send_document(chat_id, file_id, caption=caption)
+    except ApiTelegramException as e:
+        if e.error_code != 400:
+            raise
+        # e.g. "wrong file identifier": forget it and upload the file again
+        print(f"⚠️ Cached APK file_id rejected ({e.description}), uploading again")
+        delete_telegram_file_id(file_hash)
+        _stats.bump('stale_file_ids')
+        return None
+    _stats.bump('cached_sends')
+    return message
+
+def _upload(bot, chat_id, file_hash, caption):
+    with open(APK_FILE_PATH, 'rb') as apk_file:
+        message = bot.send_document(chat_id, apk_file, caption=caption, timeout=APK_UPLOAD_TIMEOUT)
+    save_telegram_file_id(file_hash, message.document.file_id, message.document.file_size)
+    _stats.bump('uploads')
+    print(f"📱 APK uploaded to Telegram ({message.document.file_size} bytes), file_id cached")
+    return message
+
+def send_apk(bot, chat_id, caption=APK_CAPTION):
+    """Send the current APK to chat_id, uploading it only if this version has no file_id yet"""
+    file_hash = apk_file_hash()
+    message = _send_cached(bot, chat_id, file_hash, caption)
+    if message is not None:
+        return message
+    with _upload_lock:
+        # Users who tapped during an upload get the file_id it produced
+        message = _send_cached(bot, chat_id, file_hash, caption)
+        if message is not None:
+            return message
+        return _upload(bot, chat_id, file_hash, caption)
+
+def prewarm_apk(bot=None, chat_id=None):
+    """Upload a new APK to the admin chat so its file_id is cached; returns True if it was uploaded"""
+    chat_id = chat_id or os.getenv('ADMIN_TELEGRAM_ID')
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not os.path.exists(APK_FILE_PATH) or not chat_id or (bot is None and not token):
+        return False
+    try:
+        file_hash = apk_file_hash()
+        if get_telegram_file_id(file_hash):
+            return False
+        bot = bot or telebot.TeleBot(token, threaded=False)
+        with _upload_lock:
+            _upload(bot, chat_id, file_hash,
+                    "📱 New APK uploaded from the admin panel.\n\nUsers tapping Download APK now get this file instantly.")
+        return True
+    except Exception as e:
+        print(f"❌ Could not pre-upload the APK: {e}")
+        return False
+
+def get_apk_delivery_stats():
+    """Send counters for this process"""
+    stats = _stats.snapshot()
+    return stats
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for reply keyboard button dispatch in bot.py.
+
+Compares telebot's handler matching for the old layout (one
+message.text == "..." filter per button, in registration order) with the
+current one (a single handler that looks the label up in
+text_button_handlers). Only the filter tests are timed, the same loop
+telebot runs for every incoming text message; no handler is called.
+Importing bot.py migrates its database, so it is pointed at a scratch
+file first and bot_database.db is never opened.
+
+    python benchmark_text_buttons.py
+"""
+
+import os
+import tempfile
+import time
+
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:benchmark')
+
+from telebot import TeleBot
+from telebot.types import Message
+
+import db_pool
+
+# Removed again when the benchmark exits
+_scratch_dir = tempfile.TemporaryDirectory(prefix='benchmark_text_buttons_')
+db_pool.DB_FILE = os.path.join(_scratch_dir.name, 'benchmark.db')
+
+import bot
+
+def _old_handlers():
+    """The current handler list with the router swapped back for one filter per button"""
+    old_bot = TeleBot('0:benchmark', threaded=False)
+    noop = lambda message: None
+    for label in bot.text_button_handlers:
+        old_bot.register_message_handler(noop, func=lambda message, label=label: message.text == label)
+    handlers = []
+    for handler in bot.bot.message_handlers:
+        if handler['function'] is bot.handle_text_button:
+            handlers.extend(old_bot.message_handlers)
+        else:
+            handlers.append(handler)
+    return old_bot, handlers
+
+def _text_message(text):
+    return Message.de_json({
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': 1, 'type': 'private'},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'Benchmark'},
+        'text': text,
+    })
+
+def _time_match(telebot_instance, handlers, message, iterations):
+    """Average ns to find the first matching handler, as telebot does per message"""
+    test = telebot_instance._test_message_handler
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for handler in handlers:
+            if test(handler, message):
+                break
+    return (time.perf_counter() - start) / iterations * 1e9
+
+def main(iterations=20000):
+    old_bot, old_handlers = _old_handlers()
+    new_handlers = bot.bot.message_handlers
+    labels = list(bot.text_button_handlers)
+
+    samples = {
+        f'first button ({labels[0]})': labels[0],
+        f'last button ({labels[-1]})': labels[-1],
+        'free text (catch-all)': 'hello',
+    }
+    print(f"{len(old_handlers)} message handlers before, {len(new_handlers)} now "
+          f"({len(labels)} buttons)\n")
+    print(f"{'message':45} {'before':>12} {'now':>12}")
+    for label, text in samples.items():
+        message = _text_message(text)
+        before_ns = _time_match(old_bot, old_handlers, message, iterations)
+        now_ns = _time_match(bot.bot, new_handlers, message, iterations)
+        print(f"{label:45} {before_ns:9.0f} ns {now_ns:9.0f} ns")
+
+if __name__ == '__main__':
+    main()
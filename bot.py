@@ -1,30 +1,35 @@
 import os
-import sqlite3
 import telebot
-import requests
-import json
-from datetime import datetime
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
 from database import (init_database, ensure_user_exists, get_user_balance, get_topup_options, 
                      get_payment_methods, init_payment_tables, create_pending_payment, 
-                     get_pending_payment, update_payment_status, add_user_balance,
-                     init_plan_tables, get_active_plans, get_plan, assign_key_to_user, 
-                     get_user_plans, get_available_keys, check_low_key_plans, get_plan_key_statistics,
+                     get_pending_payment, set_payment_proof, update_payment_status, add_user_balance,
+                     init_plan_tables, get_active_plans, get_plan, 
+                     get_user_plans_page, get_available_key_count, check_low_key_plans, get_plan_key_statistics,
                      init_contact_tables, get_active_contact_config, check_and_delete_expired_keys,
                      get_expiring_soon_keys, get_expired_keys_stats, cleanup_orphaned_keys,
                      init_account_setup_tables, get_account_setup_config, get_all_users,
-                     get_all_active_plans_for_notification)
+                     get_all_active_plans_for_notification, get_connection, purchase_vpn_key,
+                     clear_user_blocked,
+                     PURCHASE_SUCCESS, PURCHASE_INSUFFICIENT_FUNDS, PURCHASE_OUT_OF_STOCK, PURCHASE_PLAN_NOT_FOUND,
+                     PLAN_TYPE_VPN, PLAN_TYPE_QITO, PLAN_TYPE_BYPASS)
+from bot_webhook import get_bot_mode, run_webhook_server, BOT_MODE_WEBHOOK, WEBHOOK_PORT
+from update_dispatcher import ShardedTeleBot
+from send_scheduler import ScheduledSendMixin, send_lane, LANE_BULK
+from account_pool import start_account_pool
+from apk_delivery import send_apk, APK_FILE_PATH
+from admin_notifications import start_admin_notifications, notify_admin, NOTIFY_PURCHASE, NOTIFY_LOW_STOCK
+from stock_alerts import start_stock_alerts, record_stock_level, get_low_stock_threshold, LOW_STOCK_THRESHOLD
+from purchase_jobs import (start_purchase_workers, queue_purchase, submit_purchase_job,
+                           PURCHASE_PROVIDER_UNAVAILABLE)
+from callback_router import CallbackRouter
+from broadcast import (start_broadcast_worker, queue_broadcast, pause_broadcast, resume_broadcast,
+                       cancel_broadcast, refresh_broadcast_progress)
 
 # Load environment variables
 load_dotenv()
 
-# QITO API Configuration
-QITO_API_URL = os.getenv('QITO_API_URL', 'http://localhost:3000/api/users')
-
-# ByPass API Configuration
-BYPASS_API_URL = os.getenv('BYPASS_API_URL', 'http://localhost:3000/api/users')
-
 # Initialize database
 init_database()
 init_payment_tables()
@@ -32,8 +37,11 @@ init_plan_tables()
 init_contact_tables()
 init_account_setup_tables()
 
+class QitoTeleBot(ScheduledSendMixin, ShardedTeleBot):
+    """Updates handled per chat (update_dispatcher.py), sends rate-limited by lane (send_scheduler.py)"""
+
 # Initialize bot with token from environment variable
-bot = telebot.TeleBot(os.getenv('TELEGRAM_BOT_TOKEN'))
+bot = QitoTeleBot(os.getenv('TELEGRAM_BOT_TOKEN'))
 
 # Get admin telegram ID
 ADMIN_TELEGRAM_ID = os.getenv('ADMIN_TELEGRAM_ID')
@@ -46,15 +54,21 @@ def is_admin(user_id):
 admin_custom_notification_state = {}
 
 def send_low_key_notification():
-    """Send notification to admin about plans with low key availability"""
+    """Send the admin every VPN plan below its low key threshold (the /lowkeys command).
+
+    This full scan is only for the manual command. It is sent straight away
+    on the interactive lane, not through notify_admin(), because the admin
+    is waiting for the answer and a digest could hold it for minutes. Alerts
+    for sales come from stock_alerts.py, which only looks at the plan sold.
+    """
     if not ADMIN_TELEGRAM_ID:
         return
     
-    low_key_plans = check_low_key_plans(min_keys=10)
+    low_key_plans = check_low_key_plans(min_keys=LOW_STOCK_THRESHOLD, plan_type=PLAN_TYPE_VPN)
     
     if low_key_plans:
         notification_text = "⚠️ **LOW KEY ALERT**\n\n"
-        notification_text += "The following plans have fewer than 10 available keys:\n\n"
+        notification_text += "The following plans are below their low key threshold:\n\n"
         
         for plan_id, plan_name, available_keys in low_key_plans:
             notification_text += f"🔑 **{plan_name}**\n"
@@ -67,104 +81,50 @@ def send_low_key_notification():
         except Exception as e:
             print(f"Failed to send low key notification: {e}")
 
-def check_and_notify_low_keys():
-    """Check for low keys and send notification if needed"""
-    try:
-        send_low_key_notification()
-    except Exception as e:
-        print(f"Error checking low keys: {e}")
-
-def create_qito_user_api(device_limit, duration_days):
-    """Create QITO user via API"""
-    try:
-        from datetime import datetime, timedelta
-        # Calculate expiry date
-        expiry_date = datetime.now() + timedelta(days=duration_days)
-        expiry_date_str = expiry_date.strftime('%Y-%m-%dT%H:%M')
-        
-        # Prepare API request data
-        api_data = {
-            "expire_date": expiry_date_str,
-            "device_limit": device_limit
-        }
-        
-        # Make API request
-        headers = {
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Connection': 'keep-alive',
-            'Content-Type': 'application/json',
-            'Sec-Fetch-Dest': 'empty',
-            'Sec-Fetch-Mode': 'cors',
-            'Sec-Fetch-Site': 'same-origin',
-            'User-Agent': 'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Mobile Safari/537.36',
-            'sec-ch-ua': '"Google Chrome";v="137", "Chromium";v="137", "Not/A)Brand";v="24"',
-            'sec-ch-ua-mobile': '?1',
-        }
-        
-        response = requests.post(QITO_API_URL, headers=headers, json=api_data, timeout=30)
-        
-        if response.status_code == 200 or response.status_code == 201:
-            return response.json()
-        else:
-            print(f"API request failed with status {response.status_code}: {response.text}")
-            return None
-            
-    except Exception as e:
-        print(f"Error creating QITO user via API: {e}")
-        return None
-
-def create_bypass_user_api(device_limit, duration_days):
-    """Create ByPass user via API"""
-    try:
-        from datetime import datetime, timedelta
-        # Calculate expiry date
-        expiry_date = datetime.now() + timedelta(days=duration_days)
-        expiry_date_str = expiry_date.strftime('%Y-%m-%dT%H:%M')
-        
-        # Prepare API request data
-        api_data = {
-            "expire_date": expiry_date_str,
-            "device_limit": device_limit
-        }
-        
-        # Make API request
-        headers = {
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Connection': 'keep-alive',
-            'Content-Type': 'application/json',
-            'Sec-Fetch-Dest': 'empty',
-            'Sec-Fetch-Mode': 'cors',
-            'Sec-Fetch-Site': 'same-origin',
-            'User-Agent': 'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Mobile Safari/537.36',
-            'sec-ch-ua': '"Google Chrome";v="137", "Chromium";v="137", "Not/A)Brand";v="24"',
-            'sec-ch-ua-mobile': '?1',
-        }
-        
-        response = requests.post(BYPASS_API_URL, headers=headers, json=api_data, timeout=30)
-        
-        if response.status_code == 200 or response.status_code == 201:
-            return response.json()
-        else:
-            print(f"ByPass API request failed with status {response.status_code}: {response.text}")
-            return None
-            
-    except Exception as e:
-        print(f"Error creating ByPass user via API: {e}")
-        return None
+def send_admin_notification(text, parse_mode=None):
+    """Deliver an admin notice or digest (admin_notifications.py) on the bulk lane"""
+    if not ADMIN_TELEGRAM_ID:
+        return
+    with send_lane(LANE_BULK):
+        bot.send_message(ADMIN_TELEGRAM_ID, text, parse_mode=parse_mode)
+
+def send_stock_alert(text, items):
+    """Low key alert from the stock alert thread (stock_alerts.py): to the admin or the next digest"""
+    notify_admin(NOTIFY_LOW_STOCK, text, items, parse_mode='Markdown')
+
+def start_low_stock_alerts():
+    """Start the background low key alert sender"""
+    start_stock_alerts(send_stock_alert)
+
+# Reply keyboard button labels. Each label is both the button text and the
+# key handle_text_button() dispatches on, so it must match exactly
+BUTTON_MY_CREDIT = "👤 ကျွန်ုပ်၏ Credit"
+BUTTON_TOPUP = "💳 ငွေဖြည့်"
+BUTTON_BUY_VPN_KEY = "VPN Key ဝယ်ရန်"
+BUTTON_QITO_NET = "🗝 QITO Net"
+BUTTON_BYPASS_VIP = "🔓 Bypass VIP"
+BUTTON_OUR_CHANNEL = "📞 Our Channel"
+BUTTON_MY_PLANS = "📋 ကျွန်ုပ်၏ပက်ကေ့ချ်"
+BUTTON_CONTACT = "📞 ဆက်သွယ်ရန်"
+BUTTON_NOTIFICATION = "📢 Notification"
+BUTTON_CUSTOM_NOTIFICATION = "✏️ Custom Notification"
+# Older buttons, no longer on the menus but still handled
+BUTTON_NEW_ORDER = "🆕 New Order"
+BUTTON_BUY_VPN_KEYS = "🔐 Buy VPN Keys"
+BUTTON_ORDER_LISTS = "📋 Order Lists"
+BUTTON_DOWNLOAD_APK = "📱 Download APK"
 
 # Create the main menu (Reply Keyboard)
 def create_main_menu():
     markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-    item1 = KeyboardButton("👤 ကျွန်ုပ်၏ Credit")
-    item2 = KeyboardButton("💳 ငွေဖြည့်")
-    item3 = KeyboardButton("VPN Key ဝယ်ရန်")
-    item4 = KeyboardButton("🗝 QITO Net")
-    item5 = KeyboardButton("🔓 Bypass VIP")
-    item6 = KeyboardButton("📞 Our Channel")
-    item7 = KeyboardButton("📋 ကျွန်ုပ်၏ပက်ကေ့ချ်")
-    item8 = KeyboardButton("📞 ဆက်သွယ်ရန်")
+    item1 = KeyboardButton(BUTTON_MY_CREDIT)
+    item2 = KeyboardButton(BUTTON_TOPUP)
+    item3 = KeyboardButton(BUTTON_BUY_VPN_KEY)
+    item4 = KeyboardButton(BUTTON_QITO_NET)
+    item5 = KeyboardButton(BUTTON_BYPASS_VIP)
+    item6 = KeyboardButton(BUTTON_OUR_CHANNEL)
+    item7 = KeyboardButton(BUTTON_MY_PLANS)
+    item8 = KeyboardButton(BUTTON_CONTACT)
     markup.add(item1, item2)
     markup.add(item3, item4)
     markup.add(item5, item6)
@@ -174,16 +134,16 @@ def create_main_menu():
 def create_admin_menu():
     """Create admin menu keyboard with notification button"""
     markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-    item1 = KeyboardButton("👤 ကျွန်ုပ်၏ Credit")
-    item2 = KeyboardButton("💳 ငွေဖြည့်")
-    item3 = KeyboardButton("VPN Key ဝယ်ရန်")
-    item4 = KeyboardButton("📋 ကျွန်ုပ်၏ပက်ကေ့ချ်")
-    item5 = KeyboardButton("📞 ဆက်သွယ်ရန်")
-    item6 = KeyboardButton("🗝 QITO Net")
-    item7 = KeyboardButton("🔓 Bypass VIP")
-    item8 = KeyboardButton("📞 Our Channel")
-    item9 = KeyboardButton("📢 Notification")  # Admin only
-    item10 = KeyboardButton("✏️ Custom Notification")  # Admin only
+    item1 = KeyboardButton(BUTTON_MY_CREDIT)
+    item2 = KeyboardButton(BUTTON_TOPUP)
+    item3 = KeyboardButton(BUTTON_BUY_VPN_KEY)
+    item4 = KeyboardButton(BUTTON_MY_PLANS)
+    item5 = KeyboardButton(BUTTON_CONTACT)
+    item6 = KeyboardButton(BUTTON_QITO_NET)
+    item7 = KeyboardButton(BUTTON_BYPASS_VIP)
+    item8 = KeyboardButton(BUTTON_OUR_CHANNEL)
+    item9 = KeyboardButton(BUTTON_NOTIFICATION)  # Admin only
+    item10 = KeyboardButton(BUTTON_CUSTOM_NOTIFICATION)  # Admin only
     markup.add(item1, item2)
     markup.add(item3, item6)
     markup.add(item7, item8)
@@ -191,6 +151,25 @@ def create_admin_menu():
     markup.add(item9, item10)  # Admin notification buttons
     return markup
 
+# Reply keyboards sent with broadcasts, serialized once instead of per recipient
+_broadcast_menus = {True: create_admin_menu().to_json(), False: create_main_menu().to_json()}
+
+def broadcast_reply_markup(telegram_id):
+    """Reply keyboard to attach to a broadcast message for this user"""
+    return _broadcast_menus[is_admin(telegram_id)]
+
+def start_broadcasts():
+    """Start the background broadcast sender (also resumes interrupted broadcasts)"""
+    start_broadcast_worker(bot, broadcast_reply_markup)
+
+def start_background_workers():
+    """Start the broadcast sender, the purchase workers, the low key alert sender and the provider account pool refill thread"""
+    start_admin_notifications(send_admin_notification)
+    start_broadcasts()
+    start_purchases()
+    start_low_stock_alerts()
+    start_account_pool()
+
 # Create inline keyboard for quick actions
 def create_inline_menu():
     markup = InlineKeyboardMarkup()
@@ -212,6 +191,25 @@ def create_info_inline_menu():
     markup.add(button3)
     return markup
 
+# Reply keyboard buttons: label -> handler, filled in by @text_button below.
+# A single message handler looks the label up in this dict, instead of
+# telebot testing one message.text == "..." filter per button in turn.
+text_button_handlers = {}
+
+def text_button(label):
+    """Decorator: register a handler for the reply keyboard button with this label"""
+    def decorator(handler):
+        if label in text_button_handlers:
+            raise ValueError(f"Button '{label}' is already registered")
+        text_button_handlers[label] = handler
+        return handler
+    return decorator
+
+@bot.message_handler(func=lambda message: message.text in text_button_handlers)
+def handle_text_button(message):
+    """Handle all reply keyboard buttons"""
+    text_button_handlers[message.text](message)
+
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
     
@@ -223,6 +221,8 @@ def send_welcome(message):
         first_name=message.from_user.first_name,
         last_name=message.from_user.last_name
     )
+    # Pressing Start again after blocking the bot puts the user back on broadcasts
+    clear_user_blocked(message.from_user.id)
     
     if user_existed:
         welcome_text = f"ပြန်လည်ကြိုဆိုပါတယ်၊ {message.from_user.first_name}! 👋\n\nကျွန်ုပ်တို့၏ VPN ဝန်ဆောင်မှုဘော့သို့ ကြိုဆိုပါတယ်! အောက်ပါမီနူးမှ ရွေးချယ်ပါ။"
@@ -271,7 +271,7 @@ def check_keys_command(message):
         bot.send_message(message.chat.id, "❌ Unauthorized access.", reply_markup=create_main_menu())
         return
     
-    stats = get_plan_key_statistics()
+    stats = get_plan_key_statistics(PLAN_TYPE_VPN)
     
     if not stats:
         bot.send_message(message.chat.id, "📊 **Key Status**\n\nNo active plans found.", 
@@ -286,7 +286,7 @@ def check_keys_command(message):
         status_text += f"Available: {available_keys}\n"
         status_text += f"Used: {used_keys}\n"
         
-        if available_keys < 10:
+        if available_keys < get_low_stock_threshold(plan_id):
             status_text += "⚠️ **LOW KEYS!**\n"
         
         status_text += "\n"
@@ -393,17 +393,22 @@ def get_key_statistics_command(message):
 
 @bot.message_handler(commands=['cleanup'])
 def cleanup_orphaned_keys_command(message):
-    """Clean up orphaned keys"""
+    """Clean up orphaned keys (/cleanup dry only lists them)"""
     if str(message.from_user.id) != str(ADMIN_TELEGRAM_ID):
         bot.send_message(message.chat.id, "❌ Unauthorized access.", reply_markup=create_main_menu())
         return
     
     try:
-        deleted_count, deleted_keys = cleanup_orphaned_keys()
+        dry_run = 'dry' in message.text.split()[1:]
+        deleted_count, deleted_keys = cleanup_orphaned_keys(dry_run=dry_run)
         
         if deleted_count > 0:
-            cleanup_text = f"🧹 **Orphaned Keys Cleanup**\n\n"
-            cleanup_text += f"Deleted {deleted_count} orphaned keys:\n\n"
+            if dry_run:
+                cleanup_text = f"🔍 **Orphaned Keys Cleanup (dry run)**\n\n"
+                cleanup_text += f"Would delete {deleted_count} orphaned keys:\n\n"
+            else:
+                cleanup_text = f"🧹 **Orphaned Keys Cleanup**\n\n"
+                cleanup_text += f"Deleted {deleted_count} orphaned keys:\n\n"
             
             for key in deleted_keys:
                 cleanup_text += f"• Key: {key['key_value']}\n"
@@ -423,7 +428,7 @@ def admin_commands(message):
     """Handle admin commands"""
     if str(message.from_user.id) == str(ADMIN_TELEGRAM_ID):
         # Get pending payments
-        conn = sqlite3.connect('bot_database.db')
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute('''
             SELECT id, user_id, credits, mmk_price, status, created_at 
@@ -447,7 +452,7 @@ def admin_commands(message):
             admin_text = "✅ No pending payments at the moment.\n\n"
         
         # Check for low keys
-        low_key_plans = check_low_key_plans(min_keys=10)
+        low_key_plans = check_low_key_plans(min_keys=LOW_STOCK_THRESHOLD, plan_type=PLAN_TYPE_VPN)
         if low_key_plans:
             admin_text += "⚠️ **Low Key Alert:**\n"
             for plan_id, plan_name, available_keys in low_key_plans:
@@ -460,7 +465,8 @@ def admin_commands(message):
         admin_text += "/expired - Check and delete expired keys\n"
         admin_text += "/expiring - Check keys expiring soon\n"
         admin_text += "/keystats - Get key statistics\n"
-        admin_text += "/cleanup - Clean up orphaned keys"
+        admin_text += "/cleanup - Clean up orphaned keys\n"
+        admin_text += "/cleanup dry - List orphaned keys without deleting them"
         
         bot.send_message(message.chat.id, admin_text, parse_mode='Markdown')
     else:
@@ -494,7 +500,7 @@ def send_random(message):
                     parse_mode='Markdown', reply_markup=create_main_menu())
 
 # Handle menu button messages
-@bot.message_handler(func=lambda message: message.text == "👤 ကျွန်ုပ်၏ Credit")
+@text_button(BUTTON_MY_CREDIT)
 def handle_my_balance(message):
     """Handle My Balance button"""
     # Ensure user exists in database
@@ -522,7 +528,7 @@ def handle_my_balance(message):
     
     bot.send_message(message.chat.id, balance_text, reply_markup=create_main_menu())
 
-@bot.message_handler(func=lambda message: message.text == "💳 ငွေဖြည့်")
+@text_button(BUTTON_TOPUP)
 def handle_topup(message):
     """Handle Topup button"""
     # Get topup options from database
@@ -552,7 +558,7 @@ def handle_topup(message):
     
     bot.send_message(message.chat.id, topup_text, reply_markup=markup)
 
-@bot.message_handler(func=lambda message: message.text == "🆕 New Order")
+@text_button(BUTTON_NEW_ORDER)
 def handle_new_order(message):
     """Handle New Order button"""
     order_text = """
@@ -587,7 +593,7 @@ Click below to start your order:
     
     bot.send_message(message.chat.id, order_text, parse_mode='Markdown', reply_markup=markup)
 
-@bot.message_handler(func=lambda message: message.text == "🔐 Buy VPN Keys")
+@text_button(BUTTON_BUY_VPN_KEYS)
 def handle_buy_vpn_keys(message):
     """Handle Buy VPN Keys button"""
     vpn_text = """
@@ -624,7 +630,7 @@ Choose your package below:
     
     bot.send_message(message.chat.id, vpn_text, parse_mode='Markdown', reply_markup=markup)
 
-@bot.message_handler(func=lambda message: message.text == "📋 Order Lists")
+@text_button(BUTTON_ORDER_LISTS)
 def handle_order_lists(message):
     """Handle Order Lists button"""
     orders_text = f"""
@@ -657,7 +663,7 @@ Click below to view detailed order information:
     
     bot.send_message(message.chat.id, orders_text, parse_mode='Markdown', reply_markup=markup)
 
-@bot.message_handler(func=lambda message: message.text == "VPN Key ဝယ်ရန်")
+@text_button(BUTTON_BUY_VPN_KEY)
 def handle_buy_plans(message):
     """Handle Buy Plans button"""
     # Ensure user exists
@@ -668,9 +674,8 @@ def handle_buy_plans(message):
         last_name=message.from_user.last_name
     )
     
-    # Get active plans (excluding QITO and ByPass plans)
-    all_plans = get_active_plans()
-    plans = [plan for plan in all_plans if 'QITO' not in plan[2] and 'ByPass' not in plan[2]]  # Filter out QITO and ByPass plans (plan[2] is name)
+    # Get active VPN key plans (QITO and ByPass plans have their own menus)
+    plans = get_active_plans(PLAN_TYPE_VPN)
     
     if not plans:
         bot.send_message(message.chat.id, "❌ လက်ရှိတွင် VPN ပက်ကေ့ချ်များ မရှိပါ။ ကျေးဇူးပြု၍ ဝန်ဆောင်မှုကို ဆက်သွယ်ပါ။", 
@@ -691,64 +696,73 @@ def handle_buy_plans(message):
     
     bot.send_message(message.chat.id, plans_text, parse_mode='Markdown', reply_markup=markup)
 
-@bot.message_handler(func=lambda message: message.text == "📋 ကျွန်ုပ်၏ပက်ကေ့ချ်")
-def handle_my_plans(message):
-    """Handle My Plans button"""
-    # Ensure user exists
-    ensure_user_exists(
-        telegram_id=message.from_user.id,
-        username=message.from_user.username,
-        first_name=message.from_user.first_name,
-        last_name=message.from_user.last_name
-    )
-    
-    # Get user's plans
-    user_plans = get_user_plans(message.from_user.id)
-    
+# Plans shown per page of "My Plans" (keeps the message well under Telegram's 4096 characters)
+MY_PLANS_PAGE_SIZE = 5
+
+def build_my_plans_page(user_id, before_id=None, after_id=None):
+    """Text and Newer / Older buttons for one page of the user's plans; (None, None) if the page is empty"""
+    user_plans, has_older, has_newer = get_user_plans_page(user_id, MY_PLANS_PAGE_SIZE, before_id, after_id)
     if not user_plans:
-        bot.send_message(message.chat.id, "📋 **ကျွန်ုပ်၏ပက်ကေ့ချ်များ**\n\nသင်သည် မည်သည့်ပက်ကေ့ချ်ကိုမှ မဝယ်ယူရသေးပါ။\n\nရရှိနိုင်သောပက်ကေ့ချ်များကို ကြည့်ရှုရန် 'VPN Key ဝယ်ရန်' ကို အသုံးပြုပါ။", 
-                        parse_mode='Markdown', reply_markup=create_main_menu())
-        return
+        return None, None
     
     plans_text = """📋 **ကျွန်ုပ်၏ဝယ်ယူထားသော ပက်ကေ့ချ်များ**
 
 သင့်လုပ်ဆောင်နေသော ပက်ကေ့ချ်များ:"""
     
     for plan in user_plans:
-        plan_id, name, description, key_value, purchase_date, expiry_date, status, api_response = plan
+        plan_id, name, description, key_value, purchase_date, expiry_date, status, plan_type, account_username, account_password = plan
         
         plans_text += f"\n\n**{name}**"
         if description:
             plans_text += f"\n{description}"
         
-        # Check if this is a QITO or ByPass plan with API response
-        if api_response and ('QITO' in name or 'ByPass' in name):
-            try:
-                api_data = json.loads(api_response)
-                username = api_data.get('username', 'N/A')
-                password = api_data.get('password', 'N/A')
-                if 'ByPass' in name:
-                    plans_text += f"\n🔓 ByPass Username: `{username}`"
-                    plans_text += f"\n🔓 ByPass Password: `{password}`"
-                else:
-                    plans_text += f"\n🗝 QITO Username: `{username}`"
-                    plans_text += f"\n🗝 QITO Password: `{password}`"
-            except:
-                # Fallback to key_value if API response parsing fails
-                if key_value:
-                    plans_text += f"\n🔑 VPN Key: `{key_value}`"
-        else:
+        if account_username is not None and plan_type == PLAN_TYPE_BYPASS:
+            plans_text += f"\n🔓 ByPass Username: `{account_username}`"
+            plans_text += f"\n🔓 ByPass Password: `{account_password or 'N/A'}`"
+        elif account_username is not None:
+            plans_text += f"\n🗝 QITO Username: `{account_username}`"
+            plans_text += f"\n🗝 QITO Password: `{account_password or 'N/A'}`"
+        elif key_value:
             # Regular VPN plan
-            if key_value:
-                plans_text += f"\n🔑 VPN Key: `{key_value}`"
+            plans_text += f"\n🔑 VPN Key: `{key_value}`"
         
         plans_text += f"\n📅 Purchased: {purchase_date[:10]}"
         plans_text += f"\n⏰ Expires: {expiry_date[:10] if expiry_date else 'Never'}"
         plans_text += f"\n📊 Status: {status.title()}"
     
-    bot.send_message(message.chat.id, plans_text, parse_mode='Markdown', reply_markup=create_main_menu())
+    markup = None
+    if has_newer or has_older:
+        markup = InlineKeyboardMarkup()
+        buttons = []
+        if has_newer:
+            buttons.append(InlineKeyboardButton("⬅️ Newer", callback_data=f'my_plans_newer_{user_plans[0][0]}'))
+        if has_older:
+            buttons.append(InlineKeyboardButton("Older ➡️", callback_data=f'my_plans_older_{user_plans[-1][0]}'))
+        markup.row(*buttons)
+    return plans_text, markup
+
+@text_button(BUTTON_MY_PLANS)
+def handle_my_plans(message):
+    """Handle My Plans button"""
+    # Ensure user exists
+    ensure_user_exists(
+        telegram_id=message.from_user.id,
+        username=message.from_user.username,
+        first_name=message.from_user.first_name,
+        last_name=message.from_user.last_name
+    )
+    
+    # First page: the newest plans
+    plans_text, page_buttons = build_my_plans_page(message.from_user.id)
+    
+    if plans_text is None:
+        bot.send_message(message.chat.id, "📋 **ကျွန်ုပ်၏ပက်ကေ့ချ်များ**\n\nသင်သည် မည်သည့်ပက်ကေ့ချ်ကိုမှ မဝယ်ယူရသေးပါ။\n\nရရှိနိုင်သောပက်ကေ့ချ်များကို ကြည့်ရှုရန် 'VPN Key ဝယ်ရန်' ကို အသုံးပြုပါ။", 
+                        parse_mode='Markdown', reply_markup=create_main_menu())
+        return
+    
+    bot.send_message(message.chat.id, plans_text, parse_mode='Markdown', reply_markup=page_buttons or create_main_menu())
 
-@bot.message_handler(func=lambda message: message.text == "🗝 QITO Net")
+@text_button(BUTTON_QITO_NET)
 def handle_qito_key(message):
     """Handle QITO Key button"""
     print("=" * 50)
@@ -766,18 +780,8 @@ def handle_qito_key(message):
         last_name=message.from_user.last_name
     )
     
-    # Get QITO plans only (plans with "QITO" in the name, excluding ByPass)
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT p.*, 
-               COALESCE(p.device_limit, 1) as device_limit
-        FROM plans p
-        WHERE p.name LIKE '%QITO%' AND p.name NOT LIKE '%ByPass%' AND p.is_active = 1
-        ORDER BY p.plan_id_number
-    ''')
-    qito_plans = cursor.fetchall()
-    conn.close()
+    # Get QITO plans only
+    qito_plans = get_active_plans(PLAN_TYPE_QITO)
     
     if not qito_plans:
         bot.send_message(message.chat.id, "❌ လက်ရှိတွင် QITO ပက်ကေ့ချ်များ မရှိပါ။ ကျေးဇူးပြု၍ ဝန်ဆောင်မှုကို ဆက်သွယ်ပါ။", 
@@ -792,8 +796,8 @@ QITO ပက်ကေ့ချ်များကို ကြည့်ရှု
     print(f"📋 Creating QITO plan buttons for {len(qito_plans)} plans...")
     markup = InlineKeyboardMarkup()
     for plan in qito_plans:
-        plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit, device_limit_alias = plan
-        button_text = f"{name} - {credits_required} Credits ({duration_days} days, {device_limit_alias} devices)"
+        plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+        button_text = f"{name} - {credits_required} Credits ({duration_days} days, {device_limit or 1} devices)"
         button = InlineKeyboardButton(button_text, callback_data=f'qito_plan_{plan_id}')
         markup.add(button)
         print(f"  ✅ Added: {button_text}")
@@ -803,7 +807,7 @@ QITO ပက်ကေ့ချ်များကို ကြည့်ရှု
     bot.send_message(message.chat.id, qito_text, parse_mode='Markdown', reply_markup=markup)
     print("✅ QITO plans message sent successfully!")
 
-@bot.message_handler(func=lambda message: message.text == "🔓 Bypass VIP")
+@text_button(BUTTON_BYPASS_VIP)
 def handle_bypass_plan(message):
     """Handle ByPass Plan button"""
     print("=" * 50)
@@ -821,18 +825,8 @@ def handle_bypass_plan(message):
         last_name=message.from_user.last_name
     )
     
-    # Get ByPass plans only (plans with "ByPass" in the name)
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT p.*, 
-               COALESCE(p.device_limit, 1) as device_limit
-        FROM plans p
-        WHERE p.name LIKE '%ByPass%' AND p.is_active = 1
-        ORDER BY p.plan_id_number
-    ''')
-    bypass_plans = cursor.fetchall()
-    conn.close()
+    # Get ByPass plans only
+    bypass_plans = get_active_plans(PLAN_TYPE_BYPASS)
     
     if not bypass_plans:
         bot.send_message(message.chat.id, "❌ လက်ရှိတွင် ByPass ပက်ကေ့ချ်များ မရှိပါ။ ကျေးဇူးပြု၍ ဝန်ဆောင်မှုကို ဆက်သွယ်ပါ။", 
@@ -847,8 +841,8 @@ ByPass Plan များကို ကြည့်ရှုပြီး ရွေ
     print(f"📋 Creating ByPass plan buttons for {len(bypass_plans)} plans...")
     markup = InlineKeyboardMarkup()
     for plan in bypass_plans:
-        plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit, device_limit_alias = plan
-        button_text = f"{name} - {credits_required} Credits ({duration_days} days, {device_limit_alias} devices)"
+        plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+        button_text = f"{name} - {credits_required} Credits ({duration_days} days, {device_limit or 1} devices)"
         button = InlineKeyboardButton(button_text, callback_data=f'bypass_plan_{plan_id}')
         markup.add(button)
         print(f"  ✅ Added: {button_text}")
@@ -858,7 +852,7 @@ ByPass Plan များကို ကြည့်ရှုပြီး ရွေ
     bot.send_message(message.chat.id, bypass_text, parse_mode='Markdown', reply_markup=markup)
     print("✅ ByPass plans message sent successfully!")
 
-@bot.message_handler(func=lambda message: message.text == "📢 Notification")
+@text_button(BUTTON_NOTIFICATION)
 def handle_notification(message):
     """Handle admin notification button - send all plans to all users"""
     # Check if user is admin
@@ -873,10 +867,12 @@ def handle_notification(message):
     print(f"🆔 Admin ID: {message.from_user.id}")
     print("=" * 50)
     
-    # Get all active plans
-    plans = get_all_active_plans_for_notification()
+    # Get all active plans, one plan type at a time
+    vpn_plans = get_all_active_plans_for_notification(PLAN_TYPE_VPN)
+    qito_plans = get_all_active_plans_for_notification(PLAN_TYPE_QITO)
+    bypass_plans = get_all_active_plans_for_notification(PLAN_TYPE_BYPASS)
     
-    if not plans:
+    if not (vpn_plans or qito_plans or bypass_plans):
         bot.send_message(message.chat.id, "❌ No active plans found to send notification.", 
                         reply_markup=create_admin_menu())
         return
@@ -886,20 +882,6 @@ def handle_notification(message):
 
 """
     
-    # Separate VPN, QITO, and ByPass plans
-    vpn_plans = []
-    qito_plans = []
-    bypass_plans = []
-    
-    for plan in plans:
-        plan_id_number, name, description, credits_required, duration_days, device_limit, available_keys = plan
-        if 'ByPass' in name:
-            bypass_plans.append(plan)
-        elif 'QITO' in name:
-            qito_plans.append(plan)
-        else:
-            vpn_plans.append(plan)
-    
     # Add VPN plans
     if vpn_plans:
         notification_text += "**➖➖➖ VPN ပက်ကေ့ချ်များ ➖➖➖**\n"
@@ -922,49 +904,18 @@ def handle_notification(message):
             notification_text += f"{name} | {credits_required} Credits | {duration_days} ရက် | In stock {available_keys} pcs\n"
     
     
-    # Get all users
-    users = get_all_users()
-    
-    if not users:
+    if not get_all_users():
         bot.send_message(message.chat.id, "❌ No users found to send notification.", 
                         reply_markup=create_admin_menu())
         return
     
-    # Send notification to all users
-    sent_count = 0
-    failed_count = 0
-    
-    bot.send_message(message.chat.id, f"📤 Sending notification to {len(users)} users...", 
+    # Sent in the background by broadcast.py; the admin gets a live progress message
+    bot.send_message(message.chat.id, "📤 Notification queued. You can keep using the bot while it is sent.", 
                     reply_markup=create_admin_menu())
-    
-    for user in users:
-        telegram_id, username, first_name, last_name = user
-        try:
-            # Determine which menu to use based on admin status
-            if is_admin(telegram_id):
-                menu = create_admin_menu()
-            else:
-                menu = create_main_menu()
-            
-            bot.send_message(telegram_id, notification_text, parse_mode='Markdown', reply_markup=menu)
-            sent_count += 1
-            print(f"✅ Notification sent to user {telegram_id} ({first_name})")
-        except Exception as e:
-            failed_count += 1
-            print(f"❌ Failed to send notification to user {telegram_id}: {e}")
-    
-    # Send summary to admin
-    summary_text = f"""📊 **Notification Summary**
-
-✅ Successfully sent: {sent_count} users
-❌ Failed to send: {failed_count} users
-📤 Total users: {len(users)}
+    start_broadcasts()
+    queue_broadcast('plans', notification_text, message.chat.id)
 
-Notification sent at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
-    
-    bot.send_message(message.chat.id, summary_text, reply_markup=create_admin_menu())
-
-@bot.message_handler(func=lambda message: message.text == "✏️ Custom Notification")
+@text_button(BUTTON_CUSTOM_NOTIFICATION)
 def handle_custom_notification(message):
     """Handle custom notification button - ask for custom text"""
     # Check if user is admin
@@ -1029,7 +980,7 @@ def handle_custom_notification_text(message):
                     parse_mode='Markdown', 
                     reply_markup=confirm_markup)
 
-@bot.message_handler(func=lambda message: message.text == "📞 Our Channel")
+@text_button(BUTTON_OUR_CHANNEL)
 def handle_our_channel(message):
     """Handle Our Channel button - opens Telegram channel"""
     channel_url = "https://t.me/qitotech9"
@@ -1055,7 +1006,7 @@ You can also visit:
                     parse_mode='Markdown', 
                     reply_markup=markup)
 
-@bot.message_handler(func=lambda message: message.text == "📞 ဆက်သွယ်ရန်")
+@text_button(BUTTON_CONTACT)
 def handle_contact(message):
     """Handle Contact button"""
     try:
@@ -1106,12 +1057,10 @@ def handle_contact(message):
         fallback_text = "📞 **ဆက်သွယ်ရန်နှင့် ဝန်ဆောင်မှု**\n\nဆက်သွယ်ရန်အချက်အလက်များကို ဖွင့်ရာတွင် ပြဿနာတစ်ခုရှိပါတယ်။ ကျေးဇူးပြု၍ နောက်မှ ပြန်လည်ကြိုးစားပါ သို့မဟုတ် ဝန်ဆောင်မှုကို တိုက်ရိုက်ဆက်သွယ်ပါ။"
         bot.send_message(message.chat.id, fallback_text, reply_markup=create_main_menu())
 
-@bot.message_handler(func=lambda message: message.text == "📱 Download APK")
+@text_button(BUTTON_DOWNLOAD_APK)
 def handle_download_apk(message):
     """Handle Download APK button"""
-    import os
-    
-    apk_file_path = "apk_files/latest.apk"
+    apk_file_path = APK_FILE_PATH
     
     if os.path.exists(apk_file_path):
         try:
@@ -1136,15 +1085,8 @@ APK ဖိုင်ရှိပါသည် (Size: {file_size_mb:.1f} MB)
                 bot.send_message(message.chat.id, large_file_text, reply_markup=create_main_menu())
                 return
             
-            # Send file with timeout handling
-            with open(apk_file_path, 'rb') as apk_file:
-                # Send with longer timeout
-                bot.send_document(
-                    message.chat.id, 
-                    apk_file, 
-                    caption="📱 VPN APK File\n\nဤဖိုင်ကို သင့်ဖုန်းတွင် ထည့်သွင်းပါ။",
-                    timeout=60  # 60 seconds timeout
-                )
+            # Sent by cached file_id; uploaded only once per APK version
+            send_apk(bot, message.chat.id)
                 
         except Exception as e:
             error_message = f"""❌ APK ဖိုင်ကို ပို့ပေးရာတွင် ပြဿနာရှိပါသည်
@@ -1171,123 +1113,133 @@ Error: {str(e)}
         bot.send_message(message.chat.id, no_apk_text, reply_markup=create_main_menu())
 
 # Handle inline keyboard callbacks
-@bot.callback_query_handler(func=lambda call: True)
-def handle_callback(call):
-    """Handle all callback queries from inline keyboards"""
-    
-    # Top-up callbacks
-    if call.data.startswith('topup_'):
-        credits = call.data.split('_')[1]
-        
-        # Get the MMK price from database
-        topup_options = get_topup_options()
-        mmk_price = None
-        for option_credits, option_mmk in topup_options:
-            if str(option_credits) == credits:
-                mmk_price = option_mmk
-                break
-        
-        if mmk_price:
-            bot.answer_callback_query(call.id, f"Top-up {credits} credits selected!")
-            
-            # Delete the original topup message
-            try:
-                bot.delete_message(call.message.chat.id, call.message.message_id)
-            except Exception as e:
-                print(f"Could not delete message: {e}")
-            
-            # Create pending payment record
-            payment_id = create_pending_payment(call.from_user.id, int(credits), mmk_price)
-            
-            # Get payment methods
-            payment_methods = get_payment_methods()
-            
-            payment_details = f"""💳 ငွေပေးချေမှုအသေးစိတ်
+# Inline keyboard callbacks: one function per callback_data route, dispatched by
+# handle_callback() below through a CallbackRouter (see callback_router.py)
+callback_router = CallbackRouter()
+callback_route = callback_router.route
+
+@callback_route('topup_', credits=int)
+def handle_topup_callback(call, credits):
+    """Top-up amount selected: create a pending payment and show payment methods"""
+    # Get the MMK price from database
+    topup_options = get_topup_options()
+    mmk_price = None
+    for option_credits, option_mmk in topup_options:
+        if option_credits == credits:
+            mmk_price = option_mmk
+            break
+
+    if mmk_price:
+        bot.answer_callback_query(call.id, f"Top-up {credits} credits selected!")
+
+        # Delete the original topup message
+        try:
+            bot.delete_message(call.message.chat.id, call.message.message_id)
+        except Exception as e:
+            print(f"Could not delete message: {e}")
+
+        # Create pending payment record
+        payment_id = create_pending_payment(call.from_user.id, int(credits), mmk_price)
+
+        # Get payment methods
+        payment_methods = get_payment_methods()
+
+        payment_details = f"""💳 ငွေပေးချေမှုအသေးစိတ်
 
 ငွေဖြည့်ပမာဏ: {credits} Credits
 ဈေးနှုန်း: {mmk_price:,} ကျပ်
 
 💳 ရရှိနိုင်သောငွေပေးချေမှုနည်းလမ်းများ:
 """
-            for name, description, account_number in payment_methods:
-                payment_details += f"• **{name}**\n"
-                if description:
-                    payment_details += f"  {description}\n"
-                if account_number:
-                    payment_details += f"  📋 Account: `{account_number}`\n"
-                payment_details += "\n"
-            
-            payment_details += f"""
+        for name, description, account_number in payment_methods:
+            payment_details += f"• **{name}**\n"
+            if description:
+                payment_details += f"  {description}\n"
+            if account_number:
+                payment_details += f"  📋 Account: `{account_number}`\n"
+            payment_details += "\n"
+
+        payment_details += f"""
 ငွေပေးချေရန် အောက်ပါအတိုင်းလုပ်ဆောင်ပါ
 1. ငွေလွှဲထားသော screenshot ပို့ပေးထားပါ
 2. အက်မင်အတည်ပြုချက်ကို စောင့်ပါ(Admin ဘက်မှအတည်ပြုပြီးသည်နှင့် Credit များထည့်သွင်းပေးထားပါမည်)
 
 ငွေပေးချေမှု ID: #{payment_id}"""
-            
-            bot.send_message(call.message.chat.id, payment_details, parse_mode='Markdown', reply_markup=create_main_menu())
-        else:
-            bot.answer_callback_query(call.id, "Topup option not found!")
-            bot.send_message(call.message.chat.id, "❌ Topup option not available. Please try again.", 
-                            reply_markup=create_main_menu())
-    
-    # Order callbacks
-    elif call.data.startswith('order_'):
-        period = call.data.split('_')[1]
-        prices = {'1month': '$5.00', '3months': '$12.00', '6months': '$20.00', '12months': '$35.00'}
-        price = prices.get(period, 'N/A')
-        bot.answer_callback_query(call.id, f"Order {period} selected!")
-        bot.send_message(call.message.chat.id, f"🆕 **New Order: {period.title()}**\n\nPrice: {price}\n\nProcessing your order...", 
-                        parse_mode='Markdown', reply_markup=create_main_menu())
-    
-    # VPN package callbacks
-    elif call.data.startswith('vpn_'):
-        package = call.data.split('_')[1]
-        packages = {'single': 'Single Key - $5.00', 'family': 'Family Pack - $12.00', 'business': 'Business Pack - $35.00'}
-        package_name = packages.get(package, 'Unknown Package')
-        bot.answer_callback_query(call.id, f"VPN package selected!")
-        bot.send_message(call.message.chat.id, f"🔐 **VPN Package Selected**\n\n{package_name}\n\nProcessing your purchase...", 
-                        parse_mode='Markdown', reply_markup=create_main_menu())
-    
-    # Order list callbacks
-    elif call.data == 'view_all_orders':
-        bot.answer_callback_query(call.id, "Loading all orders...")
-        bot.send_message(call.message.chat.id, "📋 **All Orders**\n\nLoading your complete order history...", 
-                        parse_mode='Markdown', reply_markup=create_main_menu())
-    
-    elif call.data == 'download_keys':
-        bot.answer_callback_query(call.id, "Preparing download...")
-        bot.send_message(call.message.chat.id, "🔐 **VPN Keys Download**\n\nPreparing your VPN keys for download...", 
-                        parse_mode='Markdown', reply_markup=create_main_menu())
-    
-    elif call.data == 'order_support':
-        bot.answer_callback_query(call.id, "Connecting to support...")
-        bot.send_message(call.message.chat.id, "📞 **Order Support**\n\nConnecting you with our order support team...", 
-                        parse_mode='Markdown', reply_markup=create_main_menu())
-    
-    # Support callbacks
-    elif call.data.startswith('support_'):
-        support_type = call.data.split('_')[1]
-        support_types = {'technical': 'Technical Support', 'billing': 'Billing Support', 'account': 'Account Support', 'general': 'General Inquiry'}
-        support_name = support_types.get(support_type, 'Support')
-        bot.answer_callback_query(call.id, f"{support_name} selected!")
-        bot.send_message(call.message.chat.id, f"📞 **{support_name}**\n\nConnecting you with our {support_name.lower()} team...", 
-                        parse_mode='Markdown', reply_markup=create_main_menu())
-    
-    # Legacy callbacks (keeping for compatibility)
-    elif call.data == "option_a_selected":
-        bot.answer_callback_query(call.id, "Option A selected!")
-        bot.send_message(call.message.chat.id, "✅ You selected Option A! This is a callback button example.", 
-                        reply_markup=create_inline_menu())
-    
-    elif call.data == "inline_random":
-        import random
-        random_num = random.randint(1, 100)
-        bot.answer_callback_query(call.id, f"Generated: {random_num}")
-        bot.send_message(call.message.chat.id, f"🎲 Your random number is: **{random_num}**", 
-                        parse_mode='Markdown', reply_markup=create_inline_menu())
-    
-    elif call.data == "get_user_info":
-        info_text = f"""
+
+        bot.send_message(call.message.chat.id, payment_details, parse_mode='Markdown', reply_markup=create_main_menu())
+    else:
+        bot.answer_callback_query(call.id, "Topup option not found!")
+        bot.send_message(call.message.chat.id, "❌ Topup option not available. Please try again.", 
+                        reply_markup=create_main_menu())
+
+@callback_route('order_', period=str)
+def handle_order_callback(call, period):
+    """New Order period selected"""
+    prices = {'1month': '$5.00', '3months': '$12.00', '6months': '$20.00', '12months': '$35.00'}
+    price = prices.get(period, 'N/A')
+    bot.answer_callback_query(call.id, f"Order {period} selected!")
+    bot.send_message(call.message.chat.id, f"🆕 **New Order: {period.title()}**\n\nPrice: {price}\n\nProcessing your order...", 
+                    parse_mode='Markdown', reply_markup=create_main_menu())
+
+@callback_route('vpn_', package=str)
+def handle_vpn_package_callback(call, package):
+    """VPN package selected"""
+    packages = {'single': 'Single Key - $5.00', 'family': 'Family Pack - $12.00', 'business': 'Business Pack - $35.00'}
+    package_name = packages.get(package, 'Unknown Package')
+    bot.answer_callback_query(call.id, f"VPN package selected!")
+    bot.send_message(call.message.chat.id, f"🔐 **VPN Package Selected**\n\n{package_name}\n\nProcessing your purchase...", 
+                    parse_mode='Markdown', reply_markup=create_main_menu())
+
+@callback_route('view_all_orders')
+def handle_view_all_orders(call):
+    """Order list: view all orders"""
+    bot.answer_callback_query(call.id, "Loading all orders...")
+    bot.send_message(call.message.chat.id, "📋 **All Orders**\n\nLoading your complete order history...", 
+                    parse_mode='Markdown', reply_markup=create_main_menu())
+
+@callback_route('download_keys')
+def handle_download_keys(call):
+    """Order list: download keys"""
+    bot.answer_callback_query(call.id, "Preparing download...")
+    bot.send_message(call.message.chat.id, "🔐 **VPN Keys Download**\n\nPreparing your VPN keys for download...", 
+                    parse_mode='Markdown', reply_markup=create_main_menu())
+
+@callback_route('order_support')
+def handle_order_support(call):
+    """Order list: order support"""
+    bot.answer_callback_query(call.id, "Connecting to support...")
+    bot.send_message(call.message.chat.id, "📞 **Order Support**\n\nConnecting you with our order support team...", 
+                    parse_mode='Markdown', reply_markup=create_main_menu())
+
+@callback_route('support_', support_type=str)
+def handle_support_callback(call, support_type):
+    """Support topic selected"""
+    support_types = {'technical': 'Technical Support', 'billing': 'Billing Support', 'account': 'Account Support', 'general': 'General Inquiry'}
+    support_name = support_types.get(support_type, 'Support')
+    bot.answer_callback_query(call.id, f"{support_name} selected!")
+    bot.send_message(call.message.chat.id, f"📞 **{support_name}**\n\nConnecting you with our {support_name.lower()} team...", 
+                    parse_mode='Markdown', reply_markup=create_main_menu())
+
+@callback_route('option_a_selected')
+def handle_option_a_selected(call):
+    """Legacy callback (keeping for compatibility)"""
+    bot.answer_callback_query(call.id, "Option A selected!")
+    bot.send_message(call.message.chat.id, "✅ You selected Option A! This is a callback button example.", 
+                    reply_markup=create_inline_menu())
+
+@callback_route('inline_random')
+def handle_inline_random(call):
+    """Legacy callback (keeping for compatibility)"""
+    import random
+    random_num = random.randint(1, 100)
+    bot.answer_callback_query(call.id, f"Generated: {random_num}")
+    bot.send_message(call.message.chat.id, f"🎲 Your random number is: **{random_num}**", 
+                    parse_mode='Markdown', reply_markup=create_inline_menu())
+
+@callback_route('get_user_info')
+def handle_get_user_info(call):
+    """Legacy callback (keeping for compatibility)"""
+    info_text = f"""
 📊 **Your Information:**
 
 • Name: {call.from_user.first_name} {call.from_user.last_name or ''}
@@ -1295,40 +1247,42 @@ def handle_callback(call):
 • User ID: {call.from_user.id}
 • Language: {call.from_user.language_code or 'Not set'}
         """
-        bot.answer_callback_query(call.id)
-        bot.send_message(call.message.chat.id, info_text, parse_mode='Markdown', 
-                        reply_markup=create_info_inline_menu())
-    
-    elif call.data == "back_to_main":
-        welcome_text = f"Welcome back, {call.from_user.first_name}! 👋\n\nChoose an option below:"
-        bot.answer_callback_query(call.id)
-        bot.send_message(call.message.chat.id, welcome_text, reply_markup=create_inline_menu())
-    
-    # Admin approval callbacks
-    elif call.data.startswith('admin_approve_'):
-        print(f"Admin approval attempt by user {call.from_user.id}, expected admin {ADMIN_TELEGRAM_ID}")
-        
-        if str(call.from_user.id) == str(ADMIN_TELEGRAM_ID):
-            payment_id = call.data.split('_')[2]
-            print(f"Processing approval for payment ID: {payment_id}")
-            
-            payment = get_pending_payment(payment_id)
-            print(f"Payment data: {payment}")
-            
-            if payment:
-                # payment structure: (id, user_id, credits, mmk_price, payment_proof_file_id, status, created_at, processed_at)
-                payment_status = payment[5] if len(payment) > 5 else 'unknown'
-                print(f"Payment status: {payment_status}")
-                
-                if payment_status == 'pending':
-                    # Update payment status
-                    update_payment_status(payment_id, 'approved')
-                    
-                    # Add balance to user
-                    add_user_balance(payment[1], payment[2])  # user_id, credits
-                    
-                    # Notify user
-                    user_message = f"""✅ Payment Approved!
+    bot.answer_callback_query(call.id)
+    bot.send_message(call.message.chat.id, info_text, parse_mode='Markdown', 
+                    reply_markup=create_info_inline_menu())
+
+@callback_route('back_to_main')
+def handle_back_to_main(call):
+    """Legacy callback (keeping for compatibility)"""
+    welcome_text = f"Welcome back, {call.from_user.first_name}! 👋\n\nChoose an option below:"
+    bot.answer_callback_query(call.id)
+    bot.send_message(call.message.chat.id, welcome_text, reply_markup=create_inline_menu())
+
+@callback_route('admin_approve_', payment_id=int)
+def handle_admin_approve(call, payment_id):
+    """Admin approves a pending payment"""
+    print(f"Admin approval attempt by user {call.from_user.id}, expected admin {ADMIN_TELEGRAM_ID}")
+
+    if str(call.from_user.id) == str(ADMIN_TELEGRAM_ID):
+        print(f"Processing approval for payment ID: {payment_id}")
+
+        payment = get_pending_payment(payment_id)
+        print(f"Payment data: {payment}")
+
+        if payment:
+            # payment structure: (id, user_id, credits, mmk_price, payment_proof_file_id, status, created_at, processed_at)
+            payment_status = payment[5] if len(payment) > 5 else 'unknown'
+            print(f"Payment status: {payment_status}")
+
+            if payment_status == 'pending':
+                # Update payment status
+                update_payment_status(payment_id, 'approved')
+
+                # Add balance to user
+                add_user_balance(payment[1], payment[2])  # user_id, credits
+
+                # Notify user
+                user_message = f"""✅ Payment Approved!
 
 ✅  Credits ထပ်ပေါင်းထည့်ပြီးပါပြီဗျ
 
@@ -1339,42 +1293,43 @@ Amount Paid: {payment[3]:,} MMK
 👤ကျွန်ုပ်၏ Credit ကိုနှိပ်၍ Credit လက်ကျန်စစ်ဆေးနိုင်ပါသည်
 
 ❤️ဝယ်ယူအားပေးမှုအတွက် ကျေးဇူးပါဗျ"""
-                    
-                    bot.send_message(payment[1], user_message, reply_markup=create_main_menu())
-                    
-                    # Notify admin
-                    bot.answer_callback_query(call.id, f"Payment #{payment_id} approved!")
-                    bot.send_message(call.from_user.id, f"✅ Payment #{payment_id} has been approved and {payment[2]} credits added to user's account.")
-                else:
-                    bot.answer_callback_query(call.id, f"Payment already processed! Status: {payment_status}")
+
+                bot.send_message(payment[1], user_message, reply_markup=create_main_menu())
+
+                # Notify admin
+                bot.answer_callback_query(call.id, f"Payment #{payment_id} approved!")
+                bot.send_message(call.from_user.id, f"✅ Payment #{payment_id} has been approved and {payment[2]} credits added to user's account.")
             else:
-                bot.answer_callback_query(call.id, "Payment not found!")
-                print(f"Payment with ID {payment_id} not found in database")
+                bot.answer_callback_query(call.id, f"Payment already processed! Status: {payment_status}")
         else:
-            bot.answer_callback_query(call.id, "Unauthorized!")
-            print(f"Unauthorized access attempt by user {call.from_user.id}")
-    
-    elif call.data.startswith('admin_deny_'):
-        print(f"Admin denial attempt by user {call.from_user.id}, expected admin {ADMIN_TELEGRAM_ID}")
-        
-        if str(call.from_user.id) == str(ADMIN_TELEGRAM_ID):
-            payment_id = call.data.split('_')[2]
-            print(f"Processing denial for payment ID: {payment_id}")
-            
-            payment = get_pending_payment(payment_id)
-            print(f"Payment data: {payment}")
-            
-            if payment:
-                # payment structure: (id, user_id, credits, mmk_price, payment_proof_file_id, status, created_at, processed_at)
-                payment_status = payment[5] if len(payment) > 5 else 'unknown'
-                print(f"Payment status: {payment_status}")
-                
-                if payment_status == 'pending':
-                    # Update payment status
-                    update_payment_status(payment_id, 'denied')
-                    
-                    # Notify user
-                    user_message = f"""❌ Payment Denied
+            bot.answer_callback_query(call.id, "Payment not found!")
+            print(f"Payment with ID {payment_id} not found in database")
+    else:
+        bot.answer_callback_query(call.id, "Unauthorized!")
+        print(f"Unauthorized access attempt by user {call.from_user.id}")
+
+@callback_route('admin_deny_', payment_id=int)
+def handle_admin_deny(call, payment_id):
+    """Admin denies a pending payment"""
+    print(f"Admin denial attempt by user {call.from_user.id}, expected admin {ADMIN_TELEGRAM_ID}")
+
+    if str(call.from_user.id) == str(ADMIN_TELEGRAM_ID):
+        print(f"Processing denial for payment ID: {payment_id}")
+
+        payment = get_pending_payment(payment_id)
+        print(f"Payment data: {payment}")
+
+        if payment:
+            # payment structure: (id, user_id, credits, mmk_price, payment_proof_file_id, status, created_at, processed_at)
+            payment_status = payment[5] if len(payment) > 5 else 'unknown'
+            print(f"Payment status: {payment_status}")
+
+            if payment_status == 'pending':
+                # Update payment status
+                update_payment_status(payment_id, 'denied')
+
+                # Notify user
+                user_message = f"""❌ Payment Denied
 
 Payment ID: #{payment_id}
 Amount: {payment[2]} Credits ({payment[3]:,} MMK)
@@ -1382,46 +1337,46 @@ Amount: {payment[2]} Credits ({payment[3]:,} MMK)
 Your payment has been denied. Please contact support if you believe this is an error.
 
 You can try making a new payment with a clearer payment proof."""
-                    
-                    bot.send_message(payment[1], user_message, reply_markup=create_main_menu())
-                    
-                    # Notify admin
-                    bot.answer_callback_query(call.id, f"Payment #{payment_id} denied!")
-                    bot.send_message(call.from_user.id, f"❌ Payment #{payment_id} has been denied.")
-                else:
-                    bot.answer_callback_query(call.id, f"Payment already processed! Status: {payment_status}")
+
+                bot.send_message(payment[1], user_message, reply_markup=create_main_menu())
+
+                # Notify admin
+                bot.answer_callback_query(call.id, f"Payment #{payment_id} denied!")
+                bot.send_message(call.from_user.id, f"❌ Payment #{payment_id} has been denied.")
             else:
-                bot.answer_callback_query(call.id, "Payment not found!")
-                print(f"Payment with ID {payment_id} not found in database")
+                bot.answer_callback_query(call.id, f"Payment already processed! Status: {payment_status}")
         else:
-            bot.answer_callback_query(call.id, "Unauthorized!")
-            print(f"Unauthorized access attempt by user {call.from_user.id}")
-    
-    # Plan purchase callbacks
-    elif call.data.startswith('buy_plan_'):
-        plan_id = call.data.split('_')[2]
-        plan = get_plan(plan_id)
-        
-        if plan:
-            plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
-            
-            # Check if user has enough balance
-            user_balance = get_user_balance(call.from_user.id)
-            user_credits = int(user_balance)  # 1 dollar = 1 credit (1:1 conversion)
-            
-            if user_credits >= credits_required:
-                # Check if keys are available
-                available_keys = get_available_keys(plan_id)
-                
-                if available_keys:
-                    # Delete the original plans message
-                    try:
-                        bot.delete_message(call.message.chat.id, call.message.message_id)
-                    except Exception as e:
-                        print(f"Could not delete message: {e}")
-                    
-                    # Show confirmation dialog
-                    confirmation_message = f"""🛒 **Key ဝယ်ယူမှု အတည်ပြုခြင်း!**
+            bot.answer_callback_query(call.id, "Payment not found!")
+            print(f"Payment with ID {payment_id} not found in database")
+    else:
+        bot.answer_callback_query(call.id, "Unauthorized!")
+        print(f"Unauthorized access attempt by user {call.from_user.id}")
+
+@callback_route('buy_plan_', plan_id=int)
+def handle_buy_plan(call, plan_id):
+    """VPN plan selected: check balance and stock, then ask for confirmation"""
+    plan = get_plan(plan_id)
+
+    if plan:
+        plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+
+        # Check if user has enough balance
+        user_balance = get_user_balance(call.from_user.id)
+        user_credits = int(user_balance)  # 1 dollar = 1 credit (1:1 conversion)
+
+        if user_credits >= credits_required:
+            # Check if keys are available
+            available_keys = get_available_key_count(plan_id)
+
+            if available_keys > 0:
+                # Delete the original plans message
+                try:
+                    bot.delete_message(call.message.chat.id, call.message.message_id)
+                except Exception as e:
+                    print(f"Could not delete message: {e}")
+
+                # Show confirmation dialog
+                confirmation_message = f"""🛒 **Key ဝယ်ယူမှု အတည်ပြုခြင်း!**
 
 • ပက်ကေ့ချ် ID: {plan_id_number}
 • Key အမျိုးအစား : {name}
@@ -1432,61 +1387,53 @@ You can try making a new payment with a clearer payment proof."""
 **သင့်အကောင့်:**
 • လက်ကျန် Credit : {user_credits} Credits
 
-Key Avaliable: {len(available_keys)} Keys
+Key Avaliable: {available_keys} Keys
 
 ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ:"""
-                    
-                    # Create confirmation keyboard
-                    confirmation_keyboard = InlineKeyboardMarkup()
-                    confirm_btn = InlineKeyboardButton("✅ ဝယ်ယူအတည်ပြုပါ", callback_data=f'confirm_purchase_{plan_id}')
-                    cancel_btn = InlineKeyboardButton("❌ ပယ်ဖျက်ပါ", callback_data='cancel_purchase')
-                    confirmation_keyboard.row(confirm_btn, cancel_btn)
-                    
-                    bot.answer_callback_query(call.id, "ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ")
-                    bot.send_message(call.message.chat.id, confirmation_message, 
-                                   parse_mode='Markdown', reply_markup=confirmation_keyboard)
-                else:
-                    bot.answer_callback_query(call.id, "No keys available!")
-                    bot.send_message(call.message.chat.id, f"❌ Sorry, no VPN keys are available for {name} at the moment. Please try again later.", 
-                                   reply_markup=create_main_menu())
+
+                # Create confirmation keyboard
+                confirmation_keyboard = InlineKeyboardMarkup()
+                confirm_btn = InlineKeyboardButton("✅ ဝယ်ယူအတည်ပြုပါ", callback_data=f'confirm_purchase_{plan_id}')
+                cancel_btn = InlineKeyboardButton("❌ ပယ်ဖျက်ပါ", callback_data='cancel_purchase')
+                confirmation_keyboard.row(confirm_btn, cancel_btn)
+
+                bot.answer_callback_query(call.id, "ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ")
+                bot.send_message(call.message.chat.id, confirmation_message, 
+                               parse_mode='Markdown', reply_markup=confirmation_keyboard)
             else:
-                bot.answer_callback_query(call.id, "Insufficient balance!")
-                bot.send_message(call.message.chat.id, f"❌ Insufficient balance!\n\nYou need {credits_required} credits but only have {user_credits} credits.\n\nUse '💳 Topup' to add more credits.", 
+                bot.answer_callback_query(call.id, "No keys available!")
+                bot.send_message(call.message.chat.id, f"❌ Sorry, no VPN keys are available for {name} at the moment. Please try again later.", 
                                reply_markup=create_main_menu())
         else:
-            bot.answer_callback_query(call.id, "Plan not found!")
-            bot.send_message(call.message.chat.id, "❌ Plan not found. Please try again.", 
+            bot.answer_callback_query(call.id, "Insufficient balance!")
+            bot.send_message(call.message.chat.id, f"❌ Insufficient balance!\n\nYou need {credits_required} credits but only have {user_credits} credits.\n\nUse '💳 Topup' to add more credits.", 
                            reply_markup=create_main_menu())
-    
-    # Plan purchase confirmation callbacks
-    elif call.data.startswith('confirm_purchase_'):
-        plan_id = call.data.split('_')[2]
-        plan = get_plan(plan_id)
-        
-        if plan:
-            plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
-            
-            # Double-check balance and key availability
-            user_balance = get_user_balance(call.from_user.id)
-            user_credits = int(user_balance)  # 1 dollar = 1 credit (1:1 conversion)
-            available_keys = get_available_keys(plan_id)
-            
-            if user_credits >= credits_required and available_keys:
-                # Assign key to user
-                vpn_key = assign_key_to_user(plan_id, call.from_user.id)
-                
-                if vpn_key:
-                    # Deduct credits from user balance
-                    add_user_balance(call.from_user.id, -credits_required)
-                    
-                    # Delete the original confirmation message
-                    try:
-                        bot.delete_message(call.message.chat.id, call.message.message_id)
-                    except Exception as e:
-                        print(f"Could not delete message: {e}")
-                    
-                    # Notify user
-                    success_message = f"""✅ **Key ဝယ်ယူမှု အောင်မြင်ပါသည်!!**
+    else:
+        bot.answer_callback_query(call.id, "Plan not found!")
+        bot.send_message(call.message.chat.id, "❌ Plan not found. Please try again.", 
+                       reply_markup=create_main_menu())
+
+@callback_route('confirm_purchase_', plan_id=int)
+def handle_confirm_purchase(call, plan_id):
+    """VPN plan purchase confirmed"""
+    plan = get_plan(plan_id)
+
+    if plan:
+        plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+
+        # Claim a key, debit credits and record the purchase in one transaction
+        result = purchase_vpn_key(plan_id, call.from_user.id)
+
+        if result.status == PURCHASE_SUCCESS:
+            vpn_key = result.vpn_key
+            # Delete the original confirmation message
+            try:
+                bot.delete_message(call.message.chat.id, call.message.message_id)
+            except Exception as e:
+                print(f"Could not delete message: {e}")
+
+            # Notify user
+            success_message = f"""✅ **Key ဝယ်ယူမှု အောင်မြင်ပါသည်!!**
 
 **ပက်ကေ့ချ် ID:** {plan_id_number}
 **Key အမျိုးအစား :** {name}
@@ -1495,14 +1442,14 @@ Key Avaliable: {len(available_keys)} Keys
 **VPN Key ⬇️** 
 
 `{vpn_key}`"""
-                    
-                    bot.answer_callback_query(call.id, "Key ဝယ်ယူမှု အောင်မြင်ပါသည်!!")
-                    bot.send_message(call.message.chat.id, success_message, 
-                                   parse_mode='Markdown', reply_markup=create_main_menu())
-                    
-                    # Notify admin
-                    if ADMIN_TELEGRAM_ID:
-                        admin_message = f"""🔔 **New Plan Purchase**
+
+            bot.answer_callback_query(call.id, "Key ဝယ်ယူမှု အောင်မြင်ပါသည်!!")
+            bot.send_message(call.message.chat.id, success_message, 
+                           parse_mode='Markdown', reply_markup=create_main_menu())
+
+            # Notify admin
+            if ADMIN_TELEGRAM_ID:
+                admin_message = f"""🔔 **New Plan Purchase**
 
 User: {call.from_user.first_name} {call.from_user.last_name or ''}
 Username: @{call.from_user.username or 'Not set'}
@@ -1511,80 +1458,103 @@ Plan ID: {plan_id_number}
 Plan: {name}
 VPN Key: {vpn_key}
 Credits Used: {credits_required}"""
-                        
-                        bot.send_message(ADMIN_TELEGRAM_ID, admin_message)
-                    
-                    # Check for low keys after successful purchase
-                    check_and_notify_low_keys()
-                else:
-                    bot.answer_callback_query(call.id, "Error assigning VPN key!")
-                    bot.send_message(call.message.chat.id, "❌ Error processing your purchase. Please try again.", 
-                                   reply_markup=create_main_menu())
-            else:
-                bot.answer_callback_query(call.id, "Plan no longer available!")
-                bot.send_message(call.message.chat.id, "❌ Sorry, this plan is no longer available or you don't have enough credits. Please try again.", 
-                               reply_markup=create_main_menu())
+
+                notify_admin(NOTIFY_PURCHASE, admin_message, [(name, credits_required, None)])
+
+            # Alert the admin only if this sale took the plan below its threshold
+            record_stock_level(plan_id, result.available_keys)
+        elif result.status == PURCHASE_INSUFFICIENT_FUNDS:
+            user_credits = int(get_user_balance(call.from_user.id))
+            bot.answer_callback_query(call.id, "Insufficient balance!")
+            bot.send_message(call.message.chat.id, f"❌ Insufficient balance!\n\nYou need {credits_required} credits but only have {user_credits} credits.\n\nUse '💳 ငွေဖြည့်' to add more credits.", 
+                           reply_markup=create_main_menu())
+        elif result.status == PURCHASE_OUT_OF_STOCK:
+            bot.answer_callback_query(call.id, "No keys available!")
+            bot.send_message(call.message.chat.id, f"❌ Sorry, no VPN keys are available for {name} at the moment. Please try again later.", 
+                           reply_markup=create_main_menu())
         else:
-            bot.answer_callback_query(call.id, "Plan not found!")
-            bot.send_message(call.message.chat.id, "❌ Plan not found. Please try again.", 
+            bot.answer_callback_query(call.id, "Plan no longer available!")
+            bot.send_message(call.message.chat.id, "❌ Sorry, this plan is no longer available. Please try again.", 
                            reply_markup=create_main_menu())
-    
-    # Cancel purchase callback
-    elif call.data == 'cancel_purchase':
-        bot.answer_callback_query(call.id, "ဝယ်ယူမှုပယ်ဖျက်ပြီး")
-        bot.send_message(call.message.chat.id, "❌ ဝယ်ယူမှုပယ်ဖျက်ပြီးပါပြီ။ မည်သည့်အချိန်တွင်မဆို အခြားပက်ကေ့ချ်များကို ကြည့်ရှုနိုင်ပါတယ်။", 
+    else:
+        bot.answer_callback_query(call.id, "Plan not found!")
+        bot.send_message(call.message.chat.id, "❌ Plan not found. Please try again.", 
                        reply_markup=create_main_menu())
-    
-    # QITO plan callbacks
-    elif call.data.startswith('qito_plan_'):
-        print("=" * 60)
-        print(f"🎯 QITO PLAN CALLBACK RECEIVED!")
-        print(f"📞 Callback Data: {call.data}")
-        print(f"👤 User: {call.from_user.first_name} {call.from_user.last_name or ''}")
-        print(f"🆔 User ID: {call.from_user.id}")
-        print(f"📱 Username: @{call.from_user.username or 'Not set'}")
-        print(f"💬 Chat ID: {call.message.chat.id}")
-        print(f"📝 Message ID: {call.message.message_id}")
-        
-        plan_id = call.data.split('_')[2]
-        print(f"🔍 Extracted Plan ID: {plan_id}")
-        
-        plan = get_plan(plan_id)
-        if plan:
-            print(f"✅ Plan Found: {plan[2]} (ID: {plan[0]})")
-            print(f"💰 Credits Required: {plan[4]}")
-            print(f"⏰ Duration: {plan[5]} days")
-        else:
-            print(f"❌ Plan NOT Found for ID: {plan_id}")
-        print("=" * 60)
-        
-        if plan:
-            plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
-            
-            print(f"🔧 Device Limit: {device_limit}")
-            
-            # Check if user has enough balance
-            user_balance = get_user_balance(call.from_user.id)
-            user_credits = int(user_balance)  # 1 dollar = 1 credit (1:1 conversion)
-            
-            print(f"💰 User Balance Check:")
-            print(f"   💵 User Balance: {user_balance}")
-            print(f"   🪙 User Credits: {user_credits}")
-            print(f"   💰 Required Credits: {credits_required}")
-            print(f"   ✅ Sufficient Balance: {user_credits >= credits_required}")
-            
-            if user_credits >= credits_required:
-                # Delete the original QITO plans message
-                print(f"🗑️ Deleting original QITO plans message...")
-                try:
-                    bot.delete_message(call.message.chat.id, call.message.message_id)
-                    print(f"✅ Message deleted successfully!")
-                except Exception as e:
-                    print(f"❌ Could not delete message: {e}")
-                
-                # Show QITO confirmation dialog
-                print(f"📝 Showing QITO confirmation dialog...")
-                confirmation_message = f"""🗝 **QITO ပက်ကေ့ချ် ဝယ်ယူမှု အတည်ပြုခြင်း!**
+
+@callback_route('cancel_purchase')
+def handle_cancel_purchase(call):
+    """VPN plan purchase cancelled"""
+    bot.answer_callback_query(call.id, "ဝယ်ယူမှုပယ်ဖျက်ပြီး")
+    bot.send_message(call.message.chat.id, "❌ ဝယ်ယူမှုပယ်ဖျက်ပြီးပါပြီ။ မည်သည့်အချိန်တွင်မဆို အခြားပက်ကေ့ချ်များကို ကြည့်ရှုနိုင်ပါတယ်။", 
+                   reply_markup=create_main_menu())
+
+@callback_route('my_plans_', direction=str, user_plan_id=int)
+def handle_my_plans_page(call, direction, user_plan_id):
+    """Newer / Older on My Plans: show the next page in the same message"""
+    if direction not in ('newer', 'older'):
+        bot.answer_callback_query(call.id, "Invalid request!")
+        return
+
+    page = {'after_id': user_plan_id} if direction == 'newer' else {'before_id': user_plan_id}
+    plans_text, page_buttons = build_my_plans_page(call.from_user.id, **page)
+    if plans_text is None:
+        bot.answer_callback_query(call.id, "No more plans")
+        return
+
+    bot.answer_callback_query(call.id)
+    bot.edit_message_text(plans_text, call.message.chat.id, call.message.message_id,
+                          parse_mode='Markdown', reply_markup=page_buttons)
+
+@callback_route('qito_plan_', plan_id=int)
+def handle_qito_plan(call, plan_id):
+    """QITO plan selected: check balance, then ask for confirmation"""
+    print("=" * 60)
+    print(f"🎯 QITO PLAN CALLBACK RECEIVED!")
+    print(f"📞 Callback Data: {call.data}")
+    print(f"👤 User: {call.from_user.first_name} {call.from_user.last_name or ''}")
+    print(f"🆔 User ID: {call.from_user.id}")
+    print(f"📱 Username: @{call.from_user.username or 'Not set'}")
+    print(f"💬 Chat ID: {call.message.chat.id}")
+    print(f"📝 Message ID: {call.message.message_id}")
+
+    print(f"🔍 Extracted Plan ID: {plan_id}")
+
+    plan = get_plan(plan_id)
+    if plan:
+        print(f"✅ Plan Found: {plan[2]} (ID: {plan[0]})")
+        print(f"💰 Credits Required: {plan[4]}")
+        print(f"⏰ Duration: {plan[5]} days")
+    else:
+        print(f"❌ Plan NOT Found for ID: {plan_id}")
+    print("=" * 60)
+
+    if plan:
+        plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+
+        print(f"🔧 Device Limit: {device_limit}")
+
+        # Check if user has enough balance
+        user_balance = get_user_balance(call.from_user.id)
+        user_credits = int(user_balance)  # 1 dollar = 1 credit (1:1 conversion)
+
+        print(f"💰 User Balance Check:")
+        print(f"   💵 User Balance: {user_balance}")
+        print(f"   🪙 User Credits: {user_credits}")
+        print(f"   💰 Required Credits: {credits_required}")
+        print(f"   ✅ Sufficient Balance: {user_credits >= credits_required}")
+
+        if user_credits >= credits_required:
+            # Delete the original QITO plans message
+            print(f"🗑️ Deleting original QITO plans message...")
+            try:
+                bot.delete_message(call.message.chat.id, call.message.message_id)
+                print(f"✅ Message deleted successfully!")
+            except Exception as e:
+                print(f"❌ Could not delete message: {e}")
+
+            # Show QITO confirmation dialog
+            print(f"📝 Showing QITO confirmation dialog...")
+            confirmation_message = f"""🗝 **QITO ပက်ကေ့ချ် ဝယ်ယူမှု အတည်ပြုခြင်း!**
 
 • ပက်ကေ့ချ် ID: {plan_id_number}
 • QITO ပက်ကေ့ချ် : {name}
@@ -1599,195 +1569,198 @@ Credits Used: {credits_required}"""
 QITO ပက်ကေ့ချ်သည် subscription-based ဖြစ်ပြီး သီးခြား key မလိုအပ်ပါ။
 
 ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ:"""
-                
-                # Create confirmation keyboard
-                confirmation_keyboard = InlineKeyboardMarkup()
-                confirm_btn = InlineKeyboardButton("✅ QITO ပက်ကေ့ချ် ဝယ်ယူအတည်ပြုပါ", callback_data=f'confirm_qito_purchase_{plan_id}')
-                cancel_btn = InlineKeyboardButton("❌ ပယ်ဖျက်ပါ", callback_data='cancel_qito_purchase')
-                confirmation_keyboard.row(confirm_btn, cancel_btn)
-                
-                print(f"📤 Sending confirmation message...")
-                bot.answer_callback_query(call.id, "ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ")
-                bot.send_message(call.message.chat.id, confirmation_message, 
-                               parse_mode='Markdown', reply_markup=confirmation_keyboard)
-                print(f"✅ QITO confirmation message sent successfully!")
-            else:
-                bot.answer_callback_query(call.id, "Insufficient balance!")
-                bot.send_message(call.message.chat.id, f"❌ Insufficient balance!\n\nYou need {credits_required} credits but only have {user_credits} credits.\n\nUse '💳 ငွေဖြည့်' to add more credits.", 
-                               reply_markup=create_main_menu())
+
+            # Create confirmation keyboard
+            confirmation_keyboard = InlineKeyboardMarkup()
+            confirm_btn = InlineKeyboardButton("✅ QITO ပက်ကေ့ချ် ဝယ်ယူအတည်ပြုပါ", callback_data=f'confirm_qito_purchase_{plan_id}')
+            cancel_btn = InlineKeyboardButton("❌ ပယ်ဖျက်ပါ", callback_data='cancel_qito_purchase')
+            confirmation_keyboard.row(confirm_btn, cancel_btn)
+
+            print(f"📤 Sending confirmation message...")
+            bot.answer_callback_query(call.id, "ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ")
+            bot.send_message(call.message.chat.id, confirmation_message, 
+                           parse_mode='Markdown', reply_markup=confirmation_keyboard)
+            print(f"✅ QITO confirmation message sent successfully!")
         else:
-            bot.answer_callback_query(call.id, "QITO plan not found!")
-            bot.send_message(call.message.chat.id, "❌ QITO plan not found. Please try again.", 
+            bot.answer_callback_query(call.id, "Insufficient balance!")
+            bot.send_message(call.message.chat.id, f"❌ Insufficient balance!\n\nYou need {credits_required} credits but only have {user_credits} credits.\n\nUse '💳 ငွေဖြည့်' to add more credits.", 
                            reply_markup=create_main_menu())
-    
-    # QITO purchase confirmation callbacks
-    elif call.data.startswith('confirm_qito_purchase_'):
-        plan_id = call.data.split('_')[3]
-        plan = get_plan(plan_id)
-        
-        if plan:
-            plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
-            
-            # Get device limit from database
-            from database import get_db_connection_with_retry
-            conn = get_db_connection_with_retry()
-            cursor = conn.cursor()
-            cursor.execute('SELECT COALESCE(device_limit, 1) FROM plans WHERE id = ?', (plan_id,))
-            device_limit = cursor.fetchone()[0]
-            conn.close()
-            
-            # Double-check balance
-            user_balance = get_user_balance(call.from_user.id)
-            user_credits = int(user_balance)  # 1 dollar = 1 credit (1:1 conversion)
-            
-            if user_credits >= credits_required:
-                # Create QITO user via API
-                api_response = create_qito_user_api(device_limit, duration_days)
-                
-                if api_response:
-                    # API call successful, store the response data
-                    from datetime import datetime, timedelta
-                    purchase_date = datetime.now()
-                    expiry_date = purchase_date + timedelta(days=duration_days)
-                    
-                    # Create user plan record with API response data
-                    conn2 = get_db_connection_with_retry()
-                    cursor2 = conn2.cursor()
-                    cursor2.execute('''
-                        INSERT INTO user_plans (user_id, plan_id, purchase_date, expiry_date, status, vpn_key, api_response)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (call.from_user.id, plan_id, purchase_date, expiry_date, 'active', 
-                          f"{api_response.get('username', '')}|{api_response.get('password', '')}", 
-                          json.dumps(api_response)))
-                    conn2.commit()
-                    conn2.close()
-                    
-                    # Deduct credits from user balance
-                    add_user_balance(call.from_user.id, -credits_required)
-                    
-                    # Delete the original confirmation message
-                    try:
-                        bot.delete_message(call.message.chat.id, call.message.message_id)
-                    except Exception as e:
-                        print(f"Could not delete message: {e}")
-                    
-                    # Get QITO Net redirect link from database
-                    qito_redirect_link = get_account_setup_config('qito_net_redirect_link') or 'https://qito.net'
-                    
-                    # Notify user with credentials
-                    success_message = f"""✅ **QITO ပက်ကေ့ချ် ဝယ်ယူမှု အောင်မြင်ပါသည်!!**
+    else:
+        bot.answer_callback_query(call.id, "QITO plan not found!")
+        bot.send_message(call.message.chat.id, "❌ QITO plan not found. Please try again.", 
+                       reply_markup=create_main_menu())
+
+# Wording for the QITO / ByPass purchase messages sent by the purchase workers
+PROVIDER_PURCHASE_TEXTS = {
+    PLAN_TYPE_QITO: {
+        'label': 'QITO',
+        'title': 'QITO ပက်ကေ့ချ်',
+        'setup_label': 'QITO Net Account',
+        'redirect_key': 'qito_net_redirect_link',
+    },
+    PLAN_TYPE_BYPASS: {
+        'label': 'ByPass',
+        'title': 'ByPass Plan',
+        'setup_label': 'ByPass Account',
+        'redirect_key': 'bypass_redirect_link',
+    },
+}
+
+def start_purchases():
+    """Start the purchase workers (also resumes purchases cut off by a restart)"""
+    start_purchase_workers(deliver_provider_purchase, report_provider_purchase_failure)
+
+def confirm_provider_purchase(call, provider, plan_id):
+    """Answer a QITO / ByPass confirmation at once and queue the purchase for the workers"""
+    label = PROVIDER_PURCHASE_TEXTS[provider]['label']
+    bot.answer_callback_query(call.id, f"⏳ Processing your {label} purchase...")
+    start_purchases()
+    job_id = queue_purchase(call.from_user, provider, plan_id, call.message.chat.id, call.message.message_id)
+    if job_id is None:
+        # Another tap on a confirmation that is already being processed
+        return
+
+    try:
+        bot.edit_message_text(f"⏳ **Processing your {label} purchase...**\n\nYour account details will appear here in a moment.",
+                              call.message.chat.id, call.message.message_id, parse_mode='Markdown')
+    except Exception as e:
+        print(f"Could not edit confirmation message: {e}")
+    submit_purchase_job(job_id)
+
+def _show_purchase_result(job, text, parse_mode=None):
+    """Replace the purchase's confirmation message with text, or send it if the message is gone"""
+    try:
+        bot.edit_message_text(text, job.chat_id, job.message_id, parse_mode=parse_mode)
+    except telebot.apihelper.ApiTelegramException as e:
+        if 'message is not modified' in e.description:
+            return
+        print(f"Could not edit purchase message: {e.description}")
+        bot.send_message(job.chat_id, text, parse_mode=parse_mode, reply_markup=create_main_menu())
+
+def deliver_provider_purchase(job, plan, api_response, expiry_date):
+    """Purchase worker callback: show the new account's credentials and notify the admin"""
+    texts = PROVIDER_PURCHASE_TEXTS[job.provider]
+    plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+    device_limit = device_limit or 1
+    username = api_response.get('username', 'N/A')
+    password = api_response.get('password', 'N/A')
+
+    # Get the account setup redirect link from database
+    redirect_link = get_account_setup_config(texts['redirect_key']) or 'https://qito.net'
+
+    success_message = f"""✅ **{texts['title']} ဝယ်ယူမှု အောင်မြင်ပါသည်!!**
 
 **ပက်ကေ့ချ် ID:** {plan_id_number}
-**QITO ပက်ကေ့ချ် :** {name}
+**{texts['title']} :** {name}
 **သက်တမ်း:** {duration_days} ရက်
 **ကုန်ကျစရိတ်:** {credits_required} Credits
 **စက်အရေအတွက်:** {device_limit} စက်
 **သက်တမ်းကုန်ဆုံးရက်:** {expiry_date.strftime('%Y-%m-%d')}
 
-**QITO အကောင့်အသေးစိတ် ⬇️**
+**{texts['label']} အကောင့်အသေးစိတ် ⬇️**
 
-**Username:** `{api_response.get('username', 'N/A')}`
-**Password:** `{api_response.get('password', 'N/A')}`
+**Username:** `{username}`
+**Password:** `{password}`
 
-**QITO Net Account ထည့်နည်း:**
-[နှိပ်ပါ]({qito_redirect_link})
+**{texts['setup_label']} ထည့်နည်း:**
+[နှိပ်ပါ]({redirect_link})
 
 **အကူအညီလိုအပ်ပါက ဆက်သွယ်ပါ:**
 📞 ဆက်သွယ်ရန် ခလုတ်ကို နှိပ်ပါ"""
-                    
-                    bot.answer_callback_query(call.id, "QITO ပက်ကေ့ချ် ဝယ်ယူမှု အောင်မြင်ပါသည်!!")
-                    bot.send_message(call.message.chat.id, success_message, 
-                                   parse_mode='Markdown', reply_markup=create_main_menu())
-                    
-                    # Notify admin
-                    if ADMIN_TELEGRAM_ID:
-                        admin_message = f"""🔔 **New QITO Plan Purchase**
 
-User: {call.from_user.first_name} {call.from_user.last_name or ''}
-Username: @{call.from_user.username or 'Not set'}
-User ID: {call.from_user.id}
+    _show_purchase_result(job, success_message, parse_mode='Markdown')
+
+    # Notify admin
+    if ADMIN_TELEGRAM_ID:
+        admin_message = f"""🔔 **New {texts['label']} Plan Purchase**
+
+User: {job.first_name} {job.last_name or ''}
+Username: @{job.username or 'Not set'}
+User ID: {job.user_id}
 Plan ID: {plan_id_number}
 Plan: {name}
 Device Limit: {device_limit} devices
 Duration: {duration_days} days
 Expiry Date: {expiry_date.strftime('%Y-%m-%d')}
 Credits Used: {credits_required}
-QITO Username: {api_response.get('username', 'N/A')}
-QITO Password: {api_response.get('password', 'N/A')}"""
-                        
-                        bot.send_message(ADMIN_TELEGRAM_ID, admin_message)
-                else:
-                    # API call failed
-                    conn.close()
-                    bot.answer_callback_query(call.id, "API Error!")
-                    bot.send_message(call.message.chat.id, "❌ QITO service is temporarily unavailable. Please try again later.", 
-                                   reply_markup=create_main_menu())
-            else:
-                conn.close()
-                bot.answer_callback_query(call.id, "Insufficient balance!")
-                bot.send_message(call.message.chat.id, "❌ Sorry, you don't have enough credits. Please top up your account.", 
-                               reply_markup=create_main_menu())
-        else:
-            bot.answer_callback_query(call.id, "QITO plan not found!")
-            bot.send_message(call.message.chat.id, "❌ QITO plan not found. Please try again.", 
-                           reply_markup=create_main_menu())
-    
-    # Cancel QITO purchase callback
-    elif call.data == 'cancel_qito_purchase':
-        bot.answer_callback_query(call.id, "QITO ဝယ်ယူမှုပယ်ဖျက်ပြီး")
-        bot.send_message(call.message.chat.id, "❌ QITO ဝယ်ယူမှုပယ်ဖျက်ပြီးပါပြီ။ မည်သည့်အချိန်တွင်မဆို အခြားပက်ကေ့ချ်များကို ကြည့်ရှုနိုင်ပါတယ်။", 
-                       reply_markup=create_main_menu())
-    
-    # ByPass plan callbacks
-    elif call.data.startswith('bypass_plan_'):
-        print("=" * 60)
-        print(f"🎯 BYPASS PLAN CALLBACK RECEIVED!")
-        print(f"📞 Callback Data: {call.data}")
-        print(f"👤 User: {call.from_user.first_name} {call.from_user.last_name or ''}")
-        print(f"🆔 User ID: {call.from_user.id}")
-        print(f"📱 Username: @{call.from_user.username or 'Not set'}")
-        print(f"💬 Chat ID: {call.message.chat.id}")
-        print(f"📝 Message ID: {call.message.message_id}")
-        
-        plan_id = call.data.split('_')[2]
-        print(f"🔍 Extracted Plan ID: {plan_id}")
-        
-        plan = get_plan(plan_id)
-        if plan:
-            print(f"✅ Plan Found: {plan[2]} (ID: {plan[0]})")
-            print(f"💰 Credits Required: {plan[4]}")
-            print(f"⏰ Duration: {plan[5]} days")
-        else:
-            print(f"❌ Plan NOT Found for ID: {plan_id}")
-        print("=" * 60)
-        
-        if plan:
-            plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
-            
-            print(f"🔧 Device Limit: {device_limit}")
-            
-            # Check if user has enough balance
-            user_balance = get_user_balance(call.from_user.id)
-            user_credits = int(user_balance)  # 1 dollar = 1 credit (1:1 conversion)
-            
-            print(f"💰 User Balance Check:")
-            print(f"   💵 User Balance: {user_balance}")
-            print(f"   🪙 User Credits: {user_credits}")
-            print(f"   💰 Required Credits: {credits_required}")
-            print(f"   ✅ Sufficient Balance: {user_credits >= credits_required}")
-            
-            if user_credits >= credits_required:
-                # Delete the original plans message
-                print(f"🗑️ Deleting original ByPass plans message...")
-                try:
-                    bot.delete_message(call.message.chat.id, call.message.message_id)
-                    print(f"✅ Message deleted successfully!")
-                except Exception as e:
-                    print(f"❌ Could not delete message: {e}")
-                
-                # Show ByPass confirmation dialog
-                print(f"📝 Showing ByPass confirmation dialog...")
-                confirmation_message = f"""🔓 **ByPass Plan ဝယ်ယူမှု အတည်ပြုခြင်း!**
+{texts['label']} Username: {username}
+{texts['label']} Password: {password}"""
+
+        notify_admin(NOTIFY_PURCHASE, admin_message, [(name, credits_required, None)])
+
+def report_provider_purchase_failure(job, reason):
+    """Purchase worker callback: the purchase failed before the buyer was charged"""
+    label = PROVIDER_PURCHASE_TEXTS[job.provider]['label']
+    messages = {
+        PURCHASE_INSUFFICIENT_FUNDS: "❌ Sorry, you don't have enough credits. Please top up your account.",
+        PURCHASE_PLAN_NOT_FOUND: f"❌ {label} plan not found. Please try again.",
+        PURCHASE_PROVIDER_UNAVAILABLE: f"❌ {label} service is temporarily unavailable. Please try again later.",
+    }
+    _show_purchase_result(job, messages.get(
+        reason, f"❌ Your {label} purchase could not be completed. You have not been charged; please try again later."))
+
+@callback_route('confirm_qito_purchase_', plan_id=int)
+def handle_confirm_qito_purchase(call, plan_id):
+    """QITO purchase confirmed: queue it; a purchase worker creates the account"""
+    confirm_provider_purchase(call, PLAN_TYPE_QITO, plan_id)
+
+@callback_route('cancel_qito_purchase')
+def handle_cancel_qito_purchase(call):
+    """QITO purchase cancelled"""
+    bot.answer_callback_query(call.id, "QITO ဝယ်ယူမှုပယ်ဖျက်ပြီး")
+    bot.send_message(call.message.chat.id, "❌ QITO ဝယ်ယူမှုပယ်ဖျက်ပြီးပါပြီ။ မည်သည့်အချိန်တွင်မဆို အခြားပက်ကေ့ချ်များကို ကြည့်ရှုနိုင်ပါတယ်။", 
+                   reply_markup=create_main_menu())
+
+@callback_route('bypass_plan_', plan_id=int)
+def handle_bypass_plan_callback(call, plan_id):
+    """ByPass plan selected: check balance, then ask for confirmation"""
+    print("=" * 60)
+    print(f"🎯 BYPASS PLAN CALLBACK RECEIVED!")
+    print(f"📞 Callback Data: {call.data}")
+    print(f"👤 User: {call.from_user.first_name} {call.from_user.last_name or ''}")
+    print(f"🆔 User ID: {call.from_user.id}")
+    print(f"📱 Username: @{call.from_user.username or 'Not set'}")
+    print(f"💬 Chat ID: {call.message.chat.id}")
+    print(f"📝 Message ID: {call.message.message_id}")
+
+    print(f"🔍 Extracted Plan ID: {plan_id}")
+
+    plan = get_plan(plan_id)
+    if plan:
+        print(f"✅ Plan Found: {plan[2]} (ID: {plan[0]})")
+        print(f"💰 Credits Required: {plan[4]}")
+        print(f"⏰ Duration: {plan[5]} days")
+    else:
+        print(f"❌ Plan NOT Found for ID: {plan_id}")
+    print("=" * 60)
+
+    if plan:
+        plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+
+        print(f"🔧 Device Limit: {device_limit}")
+
+        # Check if user has enough balance
+        user_balance = get_user_balance(call.from_user.id)
+        user_credits = int(user_balance)  # 1 dollar = 1 credit (1:1 conversion)
+
+        print(f"💰 User Balance Check:")
+        print(f"   💵 User Balance: {user_balance}")
+        print(f"   🪙 User Credits: {user_credits}")
+        print(f"   💰 Required Credits: {credits_required}")
+        print(f"   ✅ Sufficient Balance: {user_credits >= credits_required}")
+
+        if user_credits >= credits_required:
+            # Delete the original plans message
+            print(f"🗑️ Deleting original ByPass plans message...")
+            try:
+                bot.delete_message(call.message.chat.id, call.message.message_id)
+                print(f"✅ Message deleted successfully!")
+            except Exception as e:
+                print(f"❌ Could not delete message: {e}")
+
+            # Show ByPass confirmation dialog
+            print(f"📝 Showing ByPass confirmation dialog...")
+            confirmation_message = f"""🔓 **ByPass Plan ဝယ်ယူမှု အတည်ပြုခြင်း!**
 
 • ပက်ကေ့ချ် ID: {plan_id_number}
 • ByPass Plan : {name}
@@ -1802,213 +1775,118 @@ QITO Password: {api_response.get('password', 'N/A')}"""
 ByPass Plan သည် subscription-based ဖြစ်ပြီး သီးခြား key မလိုအပ်ပါ။
 
 ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ:"""
-                
-                # Create confirmation keyboard
-                confirmation_keyboard = InlineKeyboardMarkup()
-                confirm_btn = InlineKeyboardButton("✅ ByPass Plan ဝယ်ယူအတည်ပြုပါ", callback_data=f'confirm_bypass_purchase_{plan_id}')
-                cancel_btn = InlineKeyboardButton("❌ ပယ်ဖျက်ပါ", callback_data='cancel_bypass_purchase')
-                confirmation_keyboard.row(confirm_btn, cancel_btn)
-                
-                print(f"📤 Sending confirmation message...")
-                bot.answer_callback_query(call.id, "ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ")
-                bot.send_message(call.message.chat.id, confirmation_message, 
-                               parse_mode='Markdown', reply_markup=confirmation_keyboard)
-                print(f"✅ ByPass confirmation message sent successfully!")
-            else:
-                bot.answer_callback_query(call.id, "Insufficient balance!")
-                bot.send_message(call.message.chat.id, f"❌ Insufficient balance!\n\nYou need {credits_required} credits but only have {user_credits} credits.\n\nUse '💳 ငွေဖြည့်' to add more credits.", 
-                               reply_markup=create_main_menu())
+
+            # Create confirmation keyboard
+            confirmation_keyboard = InlineKeyboardMarkup()
+            confirm_btn = InlineKeyboardButton("✅ ByPass Plan ဝယ်ယူအတည်ပြုပါ", callback_data=f'confirm_bypass_purchase_{plan_id}')
+            cancel_btn = InlineKeyboardButton("❌ ပယ်ဖျက်ပါ", callback_data='cancel_bypass_purchase')
+            confirmation_keyboard.row(confirm_btn, cancel_btn)
+
+            print(f"📤 Sending confirmation message...")
+            bot.answer_callback_query(call.id, "ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ")
+            bot.send_message(call.message.chat.id, confirmation_message, 
+                           parse_mode='Markdown', reply_markup=confirmation_keyboard)
+            print(f"✅ ByPass confirmation message sent successfully!")
         else:
-            bot.answer_callback_query(call.id, "ByPass plan not found!")
-            bot.send_message(call.message.chat.id, "❌ ByPass plan not found. Please try again.", 
+            bot.answer_callback_query(call.id, "Insufficient balance!")
+            bot.send_message(call.message.chat.id, f"❌ Insufficient balance!\n\nYou need {credits_required} credits but only have {user_credits} credits.\n\nUse '💳 ငွေဖြည့်' to add more credits.", 
                            reply_markup=create_main_menu())
-    
-    # ByPass purchase confirmation callbacks
-    elif call.data.startswith('confirm_bypass_purchase_'):
-        plan_id = call.data.split('_')[3]
-        plan = get_plan(plan_id)
-        
-        if plan:
-            plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
-            
-            # Get device limit from database
-            from database import get_db_connection_with_retry
-            conn = get_db_connection_with_retry()
-            cursor = conn.cursor()
-            cursor.execute('SELECT COALESCE(device_limit, 1) FROM plans WHERE id = ?', (plan_id,))
-            device_limit = cursor.fetchone()[0]
-            conn.close()
-            
-            # Double-check balance
-            user_balance = get_user_balance(call.from_user.id)
-            user_credits = int(user_balance)  # 1 dollar = 1 credit (1:1 conversion)
-            
-            if user_credits >= credits_required:
-                # Create ByPass user via API
-                api_response = create_bypass_user_api(device_limit, duration_days)
-                
-                if api_response:
-                    # API call successful, store the response data
-                    from datetime import datetime, timedelta
-                    purchase_date = datetime.now()
-                    expiry_date = purchase_date + timedelta(days=duration_days)
-                    
-                    # Create user plan record with API response data
-                    conn2 = get_db_connection_with_retry()
-                    cursor2 = conn2.cursor()
-                    cursor2.execute('''
-                        INSERT INTO user_plans (user_id, plan_id, purchase_date, expiry_date, status, vpn_key, api_response)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (call.from_user.id, plan_id, purchase_date, expiry_date, 'active', 
-                          f"{api_response.get('username', '')}|{api_response.get('password', '')}", 
-                          json.dumps(api_response)))
-                    conn2.commit()
-                    conn2.close()
-                    
-                    # Deduct credits from user balance
-                    add_user_balance(call.from_user.id, -credits_required)
-                    
-                    # Delete the original confirmation message
-                    try:
-                        bot.delete_message(call.message.chat.id, call.message.message_id)
-                    except Exception as e:
-                        print(f"Could not delete message: {e}")
-                    
-                    # Get ByPass redirect link from database
-                    bypass_redirect_link = get_account_setup_config('bypass_redirect_link') or 'https://qito.net'
-                    
-                    # Notify user with credentials
-                    success_message = f"""✅ **ByPass Plan ဝယ်ယူမှု အောင်မြင်ပါသည်!!**
+    else:
+        bot.answer_callback_query(call.id, "ByPass plan not found!")
+        bot.send_message(call.message.chat.id, "❌ ByPass plan not found. Please try again.", 
+                       reply_markup=create_main_menu())
 
-**ပက်ကေ့ချ် ID:** {plan_id_number}
-**ByPass Plan :** {name}
-**သက်တမ်း:** {duration_days} ရက်
-**ကုန်ကျစရိတ်:** {credits_required} Credits
-**စက်အရေအတွက်:** {device_limit} စက်
-**သက်တမ်းကုန်ဆုံးရက်:** {expiry_date.strftime('%Y-%m-%d')}
+@callback_route('confirm_bypass_purchase_', plan_id=int)
+def handle_confirm_bypass_purchase(call, plan_id):
+    """ByPass purchase confirmed: queue it; a purchase worker creates the account"""
+    confirm_provider_purchase(call, PLAN_TYPE_BYPASS, plan_id)
+
+@callback_route('cancel_bypass_purchase')
+def handle_cancel_bypass_purchase(call):
+    """ByPass purchase cancelled"""
+    bot.answer_callback_query(call.id, "ByPass ဝယ်ယူမှုပယ်ဖျက်ပြီး")
+    bot.send_message(call.message.chat.id, "❌ ByPass ဝယ်ယူမှုပယ်ဖျက်ပြီးပါပြီ။ မည်သည့်အချိန်တွင်မဆို အခြားပက်ကေ့ချ်များကို ကြည့်ရှုနိုင်ပါတယ်။", 
+                   reply_markup=create_main_menu())
+
+@callback_route('confirm_custom_notification')
+def handle_confirm_custom_notification(call):
+    """Admin confirmed the custom notification: send it to all users"""
+    # Check if admin is in confirming state
+    if call.from_user.id in admin_custom_notification_state:
+        state = admin_custom_notification_state[call.from_user.id]
+        if state.startswith('confirming:'):
+            custom_text = state.split(':', 1)[1]
+
+            if not get_all_users():
+                bot.answer_callback_query(call.id, "No users found!")
+                bot.send_message(call.message.chat.id, "❌ No users found to send notification.", 
+                               reply_markup=create_admin_menu())
+                del admin_custom_notification_state[call.from_user.id]
+                return
 
-**ByPass အကောင့်အသေးစိတ် ⬇️**
+            # Sent in the background by broadcast.py; the admin gets a live progress message
+            bot.answer_callback_query(call.id, "Sending custom notification...")
+            bot.send_message(call.message.chat.id, "📤 Custom notification queued. You can keep using the bot while it is sent.", 
+                           reply_markup=create_admin_menu())
+            start_broadcasts()
+            queue_broadcast('custom', custom_text, call.message.chat.id)
 
-**Username:** `{api_response.get('username', 'N/A')}`
-**Password:** `{api_response.get('password', 'N/A')}`
+            # Clear state
+            del admin_custom_notification_state[call.from_user.id]
+        else:
+            bot.answer_callback_query(call.id, "Invalid state!")
+    else:
+        bot.answer_callback_query(call.id, "No custom notification in progress!")
+
+@callback_route('cancel_custom_notification')
+def handle_cancel_custom_notification(call):
+    """Admin cancelled the custom notification"""
+    # Cancel custom notification
+    if call.from_user.id in admin_custom_notification_state:
+        del admin_custom_notification_state[call.from_user.id]
+
+    bot.answer_callback_query(call.id, "Custom notification cancelled!")
+    bot.send_message(call.message.chat.id, "❌ Custom notification cancelled.", 
+                   reply_markup=create_admin_menu())
+
+@callback_route('broadcast_', action=str, broadcast_id=int)
+def handle_broadcast_control(call, action, broadcast_id):
+    """Admin pressed Pause / Resume / Cancel on a broadcast progress message"""
+    if not is_admin(call.from_user.id):
+        bot.answer_callback_query(call.id, "❌ Admin only!")
+        return
 
-**ByPass Account ထည့်နည်း:**
-[နှိပ်ပါ]({bypass_redirect_link})
+    controls = {
+        'pause': (pause_broadcast, "⏸ Broadcast paused"),
+        'resume': (resume_broadcast, "▶️ Broadcast resumed"),
+        'cancel': (cancel_broadcast, "🛑 Broadcast cancelled"),
+    }
+    if action not in controls:
+        bot.answer_callback_query(call.id, "Invalid request!")
+        return
 
-**အကူအညီလိုအပ်ပါက ဆက်သွယ်ပါ:**
-📞 ဆက်သွယ်ရန် ခလုတ်ကို နှိပ်ပါ"""
-                    
-                    bot.answer_callback_query(call.id, "ByPass Plan ဝယ်ယူမှု အောင်မြင်ပါသည်!!")
-                    bot.send_message(call.message.chat.id, success_message, 
-                                   parse_mode='Markdown', reply_markup=create_main_menu())
-                    
-                    # Notify admin
-                    if ADMIN_TELEGRAM_ID:
-                        admin_message = f"""🔔 **New ByPass Plan Purchase**
+    control, done_text = controls[action]
+    if control(broadcast_id):
+        bot.answer_callback_query(call.id, done_text)
+    else:
+        bot.answer_callback_query(call.id, "Broadcast already finished or in that state.")
+    refresh_broadcast_progress(broadcast_id)
 
-User: {call.from_user.first_name} {call.from_user.last_name or ''}
-Username: @{call.from_user.username or 'Not set'}
-User ID: {call.from_user.id}
-Plan ID: {plan_id_number}
-Plan: {name}
-Device Limit: {device_limit} devices
-Duration: {duration_days} days
-Expiry Date: {expiry_date.strftime('%Y-%m-%d')}
-Credits Used: {credits_required}
-ByPass Username: {api_response.get('username', 'N/A')}
-ByPass Password: {api_response.get('password', 'N/A')}"""
-                        
-                        bot.send_message(ADMIN_TELEGRAM_ID, admin_message)
-                else:
-                    # API call failed
-                    conn.close()
-                    bot.answer_callback_query(call.id, "API Error!")
-                    bot.send_message(call.message.chat.id, "❌ ByPass service is temporarily unavailable. Please try again later.", 
-                                   reply_markup=create_main_menu())
-            else:
-                conn.close()
-                bot.answer_callback_query(call.id, "Insufficient balance!")
-                bot.send_message(call.message.chat.id, "❌ Sorry, you don't have enough credits. Please top up your account.", 
-                               reply_markup=create_main_menu())
-        else:
-            bot.answer_callback_query(call.id, "ByPass plan not found!")
-            bot.send_message(call.message.chat.id, "❌ ByPass plan not found. Please try again.", 
-                           reply_markup=create_main_menu())
-    
-    # Cancel ByPass purchase callback
-    elif call.data == 'cancel_bypass_purchase':
-        bot.answer_callback_query(call.id, "ByPass ဝယ်ယူမှုပယ်ဖျက်ပြီး")
-        bot.send_message(call.message.chat.id, "❌ ByPass ဝယ်ယူမှုပယ်ဖျက်ပြီးပါပြီ။ မည်သည့်အချိန်တွင်မဆို အခြားပက်ကေ့ချ်များကို ကြည့်ရှုနိုင်ပါတယ်။", 
-                       reply_markup=create_main_menu())
+@bot.callback_query_handler(func=lambda call: True)
+def handle_callback(call):
+    """Handle all callback queries from inline keyboards"""
+    try:
+        handler, payload = callback_router.resolve(call.data)
+    except ValueError as e:
+        print(f"⚠️ Malformed callback data {call.data!r}: {e}")
+        bot.answer_callback_query(call.id, "Invalid request!")
+        return
     
-    # Custom notification callbacks
-    elif call.data == 'confirm_custom_notification':
-        # Check if admin is in confirming state
-        if call.from_user.id in admin_custom_notification_state:
-            state = admin_custom_notification_state[call.from_user.id]
-            if state.startswith('confirming:'):
-                custom_text = state.split(':', 1)[1]
-                
-                # Get all users
-                users = get_all_users()
-                
-                if not users:
-                    bot.answer_callback_query(call.id, "No users found!")
-                    bot.send_message(call.message.chat.id, "❌ No users found to send notification.", 
-                                   reply_markup=create_admin_menu())
-                    del admin_custom_notification_state[call.from_user.id]
-                    return
-                
-                # Send custom notification to all users
-                sent_count = 0
-                failed_count = 0
-                
-                bot.answer_callback_query(call.id, "Sending custom notification...")
-                bot.send_message(call.message.chat.id, f"📤 Sending custom notification to {len(users)} users...", 
-                               reply_markup=create_admin_menu())
-                
-                for user in users:
-                    telegram_id, username, first_name, last_name = user
-                    try:
-                        # Determine which menu to use based on admin status
-                        if is_admin(telegram_id):
-                            menu = create_admin_menu()
-                        else:
-                            menu = create_main_menu()
-                        
-                        bot.send_message(telegram_id, custom_text, parse_mode='Markdown', reply_markup=menu)
-                        sent_count += 1
-                        print(f"✅ Custom notification sent to user {telegram_id} ({first_name})")
-                    except Exception as e:
-                        failed_count += 1
-                        print(f"❌ Failed to send custom notification to user {telegram_id}: {e}")
-                
-                # Send summary to admin
-                summary_text = f"""📊 **Custom Notification Summary**
-
-✅ Successfully sent: {sent_count} users
-❌ Failed to send: {failed_count} users
-📤 Total users: {len(users)}
-
-Custom notification sent at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
-                
-                bot.send_message(call.message.chat.id, summary_text, reply_markup=create_admin_menu())
-                
-                # Clear state
-                del admin_custom_notification_state[call.from_user.id]
-            else:
-                bot.answer_callback_query(call.id, "Invalid state!")
-        else:
-            bot.answer_callback_query(call.id, "No custom notification in progress!")
+    if handler is None:
+        print(f"⚠️ No handler for callback data {call.data!r}")
+        return
     
-    elif call.data == 'cancel_custom_notification':
-        # Cancel custom notification
-        if call.from_user.id in admin_custom_notification_state:
-            del admin_custom_notification_state[call.from_user.id]
-        
-        bot.answer_callback_query(call.id, "Custom notification cancelled!")
-        bot.send_message(call.message.chat.id, "❌ Custom notification cancelled.", 
-                       reply_markup=create_admin_menu())
+    handler(call, **payload)
 
 @bot.message_handler(content_types=['photo'])
 def handle_payment_proof(message):
@@ -2026,7 +1904,7 @@ def handle_payment_proof(message):
     file_id = photo.file_id
     
     # Get user's latest pending payment
-    conn = sqlite3.connect('bot_database.db')
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT id, credits, mmk_price FROM pending_payments 
@@ -2040,12 +1918,7 @@ def handle_payment_proof(message):
         payment_id, credits, mmk_price = payment
         
         # Update payment with file ID
-        conn = sqlite3.connect('bot_database.db')
-        cursor = conn.cursor()
-        cursor.execute('UPDATE pending_payments SET payment_proof_file_id = ? WHERE id = ?', 
-                      (file_id, payment_id))
-        conn.commit()
-        conn.close()
+        set_payment_proof(payment_id, file_id)
         
         # Notify user
         bot.send_message(message.chat.id, 
@@ -2073,7 +1946,7 @@ Please review the payment proof and approve or deny the payment."""
             
             print(f"Sending payment proof to admin {ADMIN_TELEGRAM_ID} for payment #{payment_id}")
             
-            # Send to admin with photo
+            # Send to admin with photo; interactive lane, since the buyer is waiting on Approve / Deny
             bot.send_photo(ADMIN_TELEGRAM_ID, file_id, caption=admin_message, reply_markup=admin_keyboard)
         else:
             print(f"⚠️ Admin Telegram ID not set! Payment proof received for payment #{payment_id}")
@@ -2094,7 +1967,12 @@ if __name__ == '__main__':
     print("Press Ctrl+C to stop the bot")
     
     try:
-        bot.infinity_polling(none_stop=True)
+        start_background_workers()
+        if get_bot_mode() == BOT_MODE_WEBHOOK:
+            print(f"🌐 Webhook mode: listening on port {WEBHOOK_PORT}")
+            run_webhook_server(bot)
+        else:
+            bot.infinity_polling(none_stop=True)
     except KeyboardInterrupt:
         print("\n🛑 Bot stopped by user")
     except Exception as e:
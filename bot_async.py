@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+"""
+Asyncio edition of the bot, built on AsyncTeleBot.
+
+Handlers are coroutines: database calls go through the executor-backed
+facade in db_async.py, so a slow query costs a suspended coroutine, not a
+thread.
+
+The synchronous bot (python bot.py / run_both.py) stays the default while
+handlers are ported. This edition handles the customer flows natively:
+/start, balance, top-up, the plan menus, My Plans, VPN key purchases and
+the QITO / ByPass plan confirmations. Reply keyboard buttons and callbacks
+are dispatched through the same kind of tables as bot.py (a label dict and
+a CallbackRouter). Everything else is handled by bot.py's own handlers,
+run inline under the chat's lock so a user's updates stay in order:
+admin commands and callbacks, notifications, payment proofs, contact, APK,
+My Plans paging and the QITO / ByPass purchase confirmations, which queue
+a persisted purchase job (purchase_jobs.py) like the sync edition does.
+
+Not ported yet, so these still cost a thread each:
+- Updates handled by bot.py run on a pool of SYNC_HANDLER_WORKERS threads
+  (default 8). A chat waits for a free thread, other chats do not.
+- QITO / ByPass provider calls are blocking requests calls, made by the
+  purchase job workers (purchase_jobs.py) and the account pool refill
+  thread. This edition never calls a provider API itself.
+
+    python bot_async.py
+"""
+
+import asyncio
+import contextlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, Update
+
+# Sync edition: menus, provider settings and the handlers not ported yet
+import bot as sync_bot
+from bot import (create_main_menu, create_admin_menu, is_admin, ADMIN_TELEGRAM_ID,
+                 BUTTON_MY_CREDIT, BUTTON_TOPUP, BUTTON_BUY_VPN_KEY, BUTTON_MY_PLANS,
+                 BUTTON_QITO_NET, BUTTON_BYPASS_VIP)
+from database import (PURCHASE_SUCCESS, PURCHASE_INSUFFICIENT_FUNDS, PURCHASE_OUT_OF_STOCK,
+                      PLAN_TYPE_VPN, PLAN_TYPE_QITO, PLAN_TYPE_BYPASS)
+from db_async import adb, run_in_db_executor, shutdown_db_executor
+from callback_router import CallbackRouter
+from stock_alerts import record_stock_level
+from admin_notifications import notify_admin, NOTIFY_PURCHASE
+
+abot = AsyncTeleBot(os.getenv('TELEGRAM_BOT_TOKEN'))
+
+SYNC_HANDLER_WORKERS = int(os.getenv('SYNC_HANDLER_WORKERS', '8'))
+
+# bot.py's handlers block, so they get their own threads instead of asyncio's default pool
+_sync_handler_executor = ThreadPoolExecutor(max_workers=SYNC_HANDLER_WORKERS, thread_name_prefix='sync-handlers')
+
+# Provider-backed plan types: menu texts that differ between QITO and ByPass
+PROVIDER_PLANS = {
+    'qito': {
+        'plan_type': PLAN_TYPE_QITO,
+        'label': 'QITO',
+        'title': 'QITO ပက်ကေ့ချ်',
+        'icon': '🗝',
+        'menu_title': 'QITO ပက်ကေ့ချ်များ',
+        'menu_prompt': 'QITO ပက်ကေ့ချ်များကို ကြည့်ရှုပြီး ရွေးချယ်ပါ:',
+        'subscription_note': 'QITO ပက်ကေ့ချ်သည် subscription-based ဖြစ်ပြီး သီးခြား key မလိုအပ်ပါ။',
+    },
+    'bypass': {
+        'plan_type': PLAN_TYPE_BYPASS,
+        'label': 'ByPass',
+        'title': 'ByPass Plan',
+        'icon': '🔓',
+        'menu_title': 'ByPass Plan များ',
+        'menu_prompt': 'ByPass Plan များကို ကြည့်ရှုပြီး ရွေးချယ်ပါ:',
+        'subscription_note': 'ByPass Plan သည် subscription-based ဖြစ်ပြီး သီးခြား key မလိုအပ်ပါ။',
+    },
+}
+
+class _ChatLocks:
+    """One asyncio.Lock per chat, dropped when nobody holds or waits for it"""
+
+    def __init__(self):
+        self._locks = {}  # chat_id -> [lock, holders]
+
+    @contextlib.asynccontextmanager
+    async def hold(self, chat_id):
+        entry = self._locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[chat_id]
+
+_chat_locks = _ChatLocks()
+
+def chat_id_for(event):
+    """Chat a message or callback query belongs to, used as the lock key"""
+    if hasattr(event, 'data'):
+        return event.message.chat.id if event.message is not None else event.from_user.id
+    return event.chat.id
+
+async def run_sync_handlers(update_field, event):
+    """Handle an update with the handlers in bot.py; the caller holds the chat's lock.
+
+    The update is handled on a sync handler thread rather than queued on the
+    sync bot's shard workers, so it is finished before the chat's next one.
+    """
+    update = Update.de_json({'update_id': 0, update_field: event.json})
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_sync_handler_executor, sync_bot.bot.process_update_now, update)
+
+# Reply keyboard buttons and inline callbacks handled here, filled in by
+# @text_button / @callback_route below; anything else goes to bot.py
+text_button_handlers = {}
+callback_router = CallbackRouter()
+callback_route = callback_router.route
+
+def text_button(label):
+    """Decorator: register a coroutine for the reply keyboard button with this label"""
+    def decorator(handler):
+        if label in text_button_handlers:
+            raise ValueError(f"Button '{label}' is already registered")
+        text_button_handlers[label] = handler
+        return handler
+    return decorator
+
+async def ensure_user(from_user):
+    return await adb.ensure_user_exists(
+        telegram_id=from_user.id,
+        username=from_user.username,
+        first_name=from_user.first_name,
+        last_name=from_user.last_name
+    )
+
+async def delete_message_quietly(message):
+    try:
+        await abot.delete_message(message.chat.id, message.message_id)
+    except Exception as e:
+        print(f"Could not delete message: {e}")
+
+@abot.message_handler(commands=['start'])
+async def handle_start(message):
+    async with _chat_locks.hold(message.chat.id):
+        await send_welcome(message)
+
+async def send_welcome(message):
+    """Handle /start command"""
+    user_existed = await ensure_user(message.from_user)
+    await adb.clear_user_blocked(message.from_user.id)
+
+    if user_existed:
+        welcome_text = f"ပြန်လည်ကြိုဆိုပါတယ်၊ {message.from_user.first_name}! 👋\n\nကျွန်ုပ်တို့၏ VPN ဝန်ဆောင်မှုဘော့သို့ ကြိုဆိုပါတယ်! အောက်ပါမီနူးမှ ရွေးချယ်ပါ။"
+    else:
+        welcome_text = f"မင်္ဂလာပါ {message.from_user.first_name}! 👋\n\nကျွန်ုပ်တို့၏ VPN ဝန်ဆောင်မှုဘော့သို့ ကြိုဆိုပါတယ်! သင့်အကောင့်ကို ငွေလက်ကျန် $0.00 ဖြင့် ဖန်တီးပေးပါပြီ။ အောက်ပါမီနူးမှ ရွေးချယ်ပါ။"
+
+    if is_admin(message.from_user.id):
+        welcome_text += "\n\n🔧 **Admin Mode Activated** - You have access to admin features."
+        await abot.reply_to(message, welcome_text, reply_markup=create_admin_menu())
+    else:
+        await abot.reply_to(message, welcome_text, reply_markup=create_main_menu())
+
+@text_button(BUTTON_MY_CREDIT)
+async def handle_my_balance(message):
+    """Handle My Balance button"""
+    await ensure_user(message.from_user)
+    credits = int(await adb.get_user_balance(message.from_user.id))  # 1 dollar = 1 credit
+
+    balance_text = f"""👤 သင့်အကောင့်ငွေလက်ကျန်
+
+• လက်ကျန် Credits: {credits:,}
+• အကောင့်အခြေအနေ: ✅ လုပ်ဆောင်နေ
+
+အကောင့်အချက်အလက်:
+• အသုံးပြုသူ ID: {message.from_user.id}
+• အသုံးပြုသူအမည်: @{message.from_user.username or 'မသတ်မှတ်ထား'}
+
+သင့်အကောင့်သို့ ငွေထပ်ထည့်ရန် 💳 ငွေဖြည့် ကို အသုံးပြုပါ။"""
+
+    await abot.send_message(message.chat.id, balance_text, reply_markup=create_main_menu())
+
+@text_button(BUTTON_TOPUP)
+async def handle_topup(message):
+    """Handle Topup button"""
+    topup_options = await adb.get_topup_options()
+
+    if not topup_options:
+        await abot.send_message(message.chat.id, "❌ လက်ရှိတွင် ငွေဖြည့်ရွေးချယ်စရာများ မရှိပါ။ ကျေးဇူးပြု၍ ဝန်ဆောင်မှုကို ဆက်သွယ်ပါ။",
+                                reply_markup=create_main_menu())
+        return
+
+    topup_text = """💳 အကောင့်ငွေဖြည့်ရန်
+
+သင့်ငွေဖြည့်မှုပမာဏကို ရွေးချယ်ပါ:
+
+သင့်ငွေဖြည့်မှုကို ဆက်လက်လုပ်ဆောင်ရန် အောက်ပါခလုတ်များကို နှိပ်ပါ:"""
+
+    markup = InlineKeyboardMarkup()
+    for credits, mmk_price in topup_options:
+        markup.add(InlineKeyboardButton(f"💎 {credits} Credits - {mmk_price:,} MMK", callback_data=f'topup_{credits}'))
+
+    await abot.send_message(message.chat.id, topup_text, reply_markup=markup)
+
+@text_button(BUTTON_BUY_VPN_KEY)
+async def handle_buy_plans(message):
+    """Handle Buy Plans button"""
+    await ensure_user(message.from_user)
+    plans = await adb.get_active_plans(PLAN_TYPE_VPN)
+
+    if not plans:
+        await abot.send_message(message.chat.id, "❌ လက်ရှိတွင် VPN ပက်ကေ့ချ်များ မရှိပါ။ ကျေးဇူးပြု၍ ဝန်ဆောင်မှုကို ဆက်သွယ်ပါ။",
+                                reply_markup=create_main_menu())
+        return
+
+    plans_text = """🛒 **ရရှိနိုင်သော VPN ပက်ကေ့ချ်များ**
+
+ဝယ်ယူရန် ပက်ကေ့ချ်တစ်ခုကို ရွေးချယ်ပါ:"""
+
+    markup = InlineKeyboardMarkup()
+    for plan in plans:
+        plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+        markup.add(InlineKeyboardButton(f"{name} - {credits_required} Credits ({duration_days} days)",
+                                        callback_data=f'buy_plan_{plan_id}'))
+
+    await abot.send_message(message.chat.id, plans_text, parse_mode='Markdown', reply_markup=markup)
+
+@text_button(BUTTON_MY_PLANS)
+async def handle_my_plans(message):
+    """Handle My Plans button"""
+    await ensure_user(message.from_user)
+    # Page navigation (my_plans_ callbacks) is handled by bot.py
+    plans_text, page_buttons = await run_in_db_executor(sync_bot.build_my_plans_page, message.from_user.id)
+
+    if plans_text is None:
+        await abot.send_message(message.chat.id, "📋 **ကျွန်ုပ်၏ပက်ကေ့ချ်များ**\n\nသင်သည် မည်သည့်ပက်ကေ့ချ်ကိုမှ မဝယ်ယူရသေးပါ။\n\nရရှိနိုင်သောပက်ကေ့ချ်များကို ကြည့်ရှုရန် 'VPN Key ဝယ်ရန်' ကို အသုံးပြုပါ။",
+                                parse_mode='Markdown', reply_markup=create_main_menu())
+        return
+
+    await abot.send_message(message.chat.id, plans_text, parse_mode='Markdown',
+                            reply_markup=page_buttons or create_main_menu())
+
+async def send_provider_plan_menu(message, provider_key):
+    """QITO Net / Bypass VIP buttons: list the active plans of that type"""
+    provider = PROVIDER_PLANS[provider_key]
+    await ensure_user(message.from_user)
+    plans = await adb.get_active_plans(provider['plan_type'])
+
+    if not plans:
+        await abot.send_message(message.chat.id, f"❌ လက်ရှိတွင် {provider['label']} ပက်ကေ့ချ်များ မရှိပါ။ ကျေးဇူးပြု၍ ဝန်ဆောင်မှုကို ဆက်သွယ်ပါ။",
+                                reply_markup=create_main_menu())
+        return
+
+    menu_text = f"""{provider['icon']} **{provider['menu_title']}**
+
+{provider['menu_prompt']}"""
+
+    markup = InlineKeyboardMarkup()
+    for plan in plans:
+        plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+        button_text = f"{name} - {credits_required} Credits ({duration_days} days, {device_limit or 1} devices)"
+        markup.add(InlineKeyboardButton(button_text, callback_data=f'{provider_key}_plan_{plan_id}'))
+
+    await abot.send_message(message.chat.id, menu_text, parse_mode='Markdown', reply_markup=markup)
+
+@text_button(BUTTON_QITO_NET)
+async def handle_qito_key(message):
+    """Handle QITO Key button"""
+    await send_provider_plan_menu(message, 'qito')
+
+@text_button(BUTTON_BYPASS_VIP)
+async def handle_bypass_plan(message):
+    """Handle ByPass Plan button"""
+    await send_provider_plan_menu(message, 'bypass')
+
+@abot.message_handler(func=lambda message: True, content_types=['text', 'photo'])
+async def handle_message(message):
+    """Reply keyboard buttons; admin commands, notifications, payment proofs, contact, APK and the rest go to bot.py"""
+    handler = text_button_handlers.get(message.text)
+    async with _chat_locks.hold(message.chat.id):
+        if handler is not None:
+            await handler(message)
+        else:
+            await run_sync_handlers('message', message)
+
+# Callback queries
+@callback_route('topup_', credits=int)
+async def handle_topup_callback(call, credits):
+    """Top-up amount selected: create the pending payment and show payment methods"""
+    mmk_price = None
+    for option_credits, option_mmk in await adb.get_topup_options():
+        if option_credits == credits:
+            mmk_price = option_mmk
+            break
+
+    if not mmk_price:
+        await abot.answer_callback_query(call.id, "Topup option not found!")
+        await abot.send_message(call.message.chat.id, "❌ Topup option not available. Please try again.",
+                                reply_markup=create_main_menu())
+        return
+
+    await abot.answer_callback_query(call.id, f"Top-up {credits} credits selected!")
+    await delete_message_quietly(call.message)
+
+    payment_id = await adb.create_pending_payment(call.from_user.id, credits, mmk_price)
+    payment_methods = await adb.get_payment_methods()
+
+    payment_details = f"""💳 ငွေပေးချေမှုအသေးစိတ်
+
+ငွေဖြည့်ပမာဏ: {credits} Credits
+ဈေးနှုန်း: {mmk_price:,} ကျပ်
+
+💳 ရရှိနိုင်သောငွေပေးချေမှုနည်းလမ်းများ:
+"""
+    for name, description, account_number in payment_methods:
+        payment_details += f"• **{name}**\n"
+        if description:
+            payment_details += f"  {description}\n"
+        if account_number:
+            payment_details += f"  📋 Account: `{account_number}`\n"
+        payment_details += "\n"
+
+    payment_details += f"""
+ငွေပေးချေရန် အောက်ပါအတိုင်းလုပ်ဆောင်ပါ
+1. ငွေလွှဲထားသော screenshot ပို့ပေးထားပါ
+2. အက်မင်အတည်ပြုချက်ကို စောင့်ပါ(Admin ဘက်မှအတည်ပြုပြီးသည်နှင့် Credit များထည့်သွင်းပေးထားပါမည်)
+
+ငွေပေးချေမှု ID: #{payment_id}"""
+
+    await abot.send_message(call.message.chat.id, payment_details, parse_mode='Markdown', reply_markup=create_main_menu())
+
+@callback_route('buy_plan_', plan_id=int)
+async def handle_buy_plan_callback(call, plan_id):
+    """VPN plan selected: check balance and stock, then ask for confirmation"""
+    plan = await adb.get_plan(plan_id)
+    if not plan:
+        await abot.answer_callback_query(call.id, "Plan not found!")
+        await abot.send_message(call.message.chat.id, "❌ Plan not found. Please try again.",
+                                reply_markup=create_main_menu())
+        return
+
+    plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+    user_credits = int(await adb.get_user_balance(call.from_user.id))
+
+    if user_credits < credits_required:
+        await abot.answer_callback_query(call.id, "Insufficient balance!")
+        await abot.send_message(call.message.chat.id, f"❌ Insufficient balance!\n\nYou need {credits_required} credits but only have {user_credits} credits.\n\nUse '💳 Topup' to add more credits.",
+                                reply_markup=create_main_menu())
+        return
+
+    available_keys = await adb.get_available_key_count(plan_id)
+    if available_keys <= 0:
+        await abot.answer_callback_query(call.id, "No keys available!")
+        await abot.send_message(call.message.chat.id, f"❌ Sorry, no VPN keys are available for {name} at the moment. Please try again later.",
+                                reply_markup=create_main_menu())
+        return
+
+    await delete_message_quietly(call.message)
+
+    confirmation_message = f"""🛒 **Key ဝယ်ယူမှု အတည်ပြုခြင်း!**
+
+• ပက်ကေ့ချ် ID: {plan_id_number}
+• Key အမျိုးအစား : {name}
+• ဖော်ပြချက်     : {description or 'ဖော်ပြချက်မရှိ'}
+• သက်တမ်း      : {duration_days} ရက်
+• ကုန်ကျစရိတ်: {credits_required} Credits
+
+**သင့်အကောင့်:**
+• လက်ကျန် Credit : {user_credits} Credits
+
+Key Avaliable: {available_keys} Keys
+
+ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ:"""
+
+    confirmation_keyboard = InlineKeyboardMarkup()
+    confirmation_keyboard.row(InlineKeyboardButton("✅ ဝယ်ယူအတည်ပြုပါ", callback_data=f'confirm_purchase_{plan_id}'),
+                              InlineKeyboardButton("❌ ပယ်ဖျက်ပါ", callback_data='cancel_purchase'))
+
+    await abot.answer_callback_query(call.id, "ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ")
+    await abot.send_message(call.message.chat.id, confirmation_message,
+                            parse_mode='Markdown', reply_markup=confirmation_keyboard)
+
+@callback_route('confirm_purchase_', plan_id=int)
+async def handle_confirm_purchase(call, plan_id):
+    """VPN plan purchase confirmed: claim a key and debit the balance in one transaction"""
+    plan = await adb.get_plan(plan_id)
+    if not plan:
+        await abot.answer_callback_query(call.id, "Plan not found!")
+        await abot.send_message(call.message.chat.id, "❌ Plan not found. Please try again.",
+                                reply_markup=create_main_menu())
+        return
+
+    plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+    result = await adb.purchase_vpn_key(plan_id, call.from_user.id)
+
+    if result.status == PURCHASE_SUCCESS:
+        vpn_key = result.vpn_key
+        await delete_message_quietly(call.message)
+
+        success_message = f"""✅ **Key ဝယ်ယူမှု အောင်မြင်ပါသည်!!**
+
+**ပက်ကေ့ချ် ID:** {plan_id_number}
+**Key အမျိုးအစား :** {name}
+**သက်တမ်း:** {duration_days} ရက်
+**ကုန်ကျစရိတ်:** {credits_required} Credits
+**VPN Key ⬇️**
+
+`{vpn_key}`"""
+
+        await abot.answer_callback_query(call.id, "Key ဝယ်ယူမှု အောင်မြင်ပါသည်!!")
+        await abot.send_message(call.message.chat.id, success_message,
+                                parse_mode='Markdown', reply_markup=create_main_menu())
+
+        if ADMIN_TELEGRAM_ID:
+            admin_message = f"""🔔 **New Plan Purchase**
+
+User: {call.from_user.first_name} {call.from_user.last_name or ''}
+Username: @{call.from_user.username or 'Not set'}
+User ID: {call.from_user.id}
+Plan ID: {plan_id_number}
+Plan: {name}
+VPN Key: {vpn_key}
+Credits Used: {credits_required}"""
+            await asyncio.to_thread(notify_admin, NOTIFY_PURCHASE, admin_message, [(name, credits_required, None)])
+
+        await run_in_db_executor(record_stock_level, plan_id, result.available_keys)
+    elif result.status == PURCHASE_INSUFFICIENT_FUNDS:
+        user_credits = int(await adb.get_user_balance(call.from_user.id))
+        await abot.answer_callback_query(call.id, "Insufficient balance!")
+        await abot.send_message(call.message.chat.id, f"❌ Insufficient balance!\n\nYou need {credits_required} credits but only have {user_credits} credits.\n\nUse '💳 ငွေဖြည့်' to add more credits.",
+                                reply_markup=create_main_menu())
+    elif result.status == PURCHASE_OUT_OF_STOCK:
+        await abot.answer_callback_query(call.id, "No keys available!")
+        await abot.send_message(call.message.chat.id, f"❌ Sorry, no VPN keys are available for {name} at the moment. Please try again later.",
+                                reply_markup=create_main_menu())
+    else:
+        await abot.answer_callback_query(call.id, "Plan no longer available!")
+        await abot.send_message(call.message.chat.id, "❌ Sorry, this plan is no longer available. Please try again.",
+                                reply_markup=create_main_menu())
+
+@callback_route('cancel_purchase')
+async def handle_cancel_purchase(call):
+    await abot.answer_callback_query(call.id, "ဝယ်ယူမှုပယ်ဖျက်ပြီး")
+    await abot.send_message(call.message.chat.id, "❌ ဝယ်ယူမှုပယ်ဖျက်ပြီးပါပြီ။ မည်သည့်အချိန်တွင်မဆို အခြားပက်ကေ့ချ်များကို ကြည့်ရှုနိုင်ပါတယ်။",
+                            reply_markup=create_main_menu())
+
+async def send_provider_plan_confirmation(call, provider_key, plan_id):
+    """QITO / ByPass plan selected: check balance, then ask for confirmation"""
+    provider = PROVIDER_PLANS[provider_key]
+    plan = await adb.get_plan(plan_id)
+    if not plan:
+        await abot.answer_callback_query(call.id, f"{provider['label']} plan not found!")
+        await abot.send_message(call.message.chat.id, f"❌ {provider['label']} plan not found. Please try again.",
+                                reply_markup=create_main_menu())
+        return
+
+    plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+    user_credits = int(await adb.get_user_balance(call.from_user.id))
+
+    if user_credits < credits_required:
+        await abot.answer_callback_query(call.id, "Insufficient balance!")
+        await abot.send_message(call.message.chat.id, f"❌ Insufficient balance!\n\nYou need {credits_required} credits but only have {user_credits} credits.\n\nUse '💳 ငွေဖြည့်' to add more credits.",
+                                reply_markup=create_main_menu())
+        return
+
+    await delete_message_quietly(call.message)
+
+    confirmation_message = f"""{provider['icon']} **{provider['title']} ဝယ်ယူမှု အတည်ပြုခြင်း!**
+
+• ပက်ကေ့ချ် ID: {plan_id_number}
+• {provider['title']} : {name}
+• ဖော်ပြချက်     : {description or 'ဖော်ပြချက်မရှိ'}
+• သက်တမ်း      : {duration_days} ရက်
+• ကုန်ကျစရိတ်: {credits_required} Credits
+• စက်အရေအတွက်: {device_limit} စက်
+
+**သင့်အကောင့်:**
+• လက်ကျန် Credit : {user_credits} Credits
+
+{provider['subscription_note']}
+
+ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ:"""
+
+    confirmation_keyboard = InlineKeyboardMarkup()
+    confirmation_keyboard.row(
+        InlineKeyboardButton(f"✅ {provider['title']} ဝယ်ယူအတည်ပြုပါ", callback_data=f'confirm_{provider_key}_purchase_{plan_id}'),
+        InlineKeyboardButton("❌ ပယ်ဖျက်ပါ", callback_data=f'cancel_{provider_key}_purchase'))
+
+    await abot.answer_callback_query(call.id, "ကျေးဇူးပြု၍ သင့်ဝယ်ယူမှုကို အတည်ပြုပါ")
+    await abot.send_message(call.message.chat.id, confirmation_message,
+                            parse_mode='Markdown', reply_markup=confirmation_keyboard)
+
+# confirm_qito_purchase_ / confirm_bypass_purchase_ are not routed here: bot.py's
+# handlers queue a purchase job, which the purchase workers complete
+@callback_route('qito_plan_', plan_id=int)
+async def handle_qito_plan_callback(call, plan_id):
+    await send_provider_plan_confirmation(call, 'qito', plan_id)
+
+@callback_route('bypass_plan_', plan_id=int)
+async def handle_bypass_plan_callback(call, plan_id):
+    await send_provider_plan_confirmation(call, 'bypass', plan_id)
+
+async def send_provider_purchase_cancelled(call, provider_key):
+    label = PROVIDER_PLANS[provider_key]['label']
+    await abot.answer_callback_query(call.id, f"{label} ဝယ်ယူမှုပယ်ဖျက်ပြီး")
+    await abot.send_message(call.message.chat.id, f"❌ {label} ဝယ်ယူမှုပယ်ဖျက်ပြီးပါပြီ။ မည်သည့်အချိန်တွင်မဆို အခြားပက်ကေ့ချ်များကို ကြည့်ရှုနိုင်ပါတယ်။",
+                            reply_markup=create_main_menu())
+
+@callback_route('cancel_qito_purchase')
+async def handle_cancel_qito_purchase(call):
+    await send_provider_purchase_cancelled(call, 'qito')
+
+@callback_route('cancel_bypass_purchase')
+async def handle_cancel_bypass_purchase(call):
+    await send_provider_purchase_cancelled(call, 'bypass')
+
+@abot.callback_query_handler(func=lambda call: True)
+async def handle_callback(call):
+    """Callbacks routed above; admin approvals, notifications, purchase confirmations and the rest go to bot.py"""
+    try:
+        handler, payload = callback_router.resolve(call.data)
+    except ValueError:
+        # Let bot.py's router report the malformed data
+        handler = None
+    async with _chat_locks.hold(chat_id_for(call)):
+        if handler is not None:
+            await handler(call, **payload)
+        else:
+            await run_sync_handlers('callback_query', call)
+
+async def main():
+    # Broadcasts, purchase jobs, alerts and account pool refills run on the sync bot's background threads
+    sync_bot.start_background_workers()
+    try:
+        await abot.infinity_polling(skip_pending=False)
+    finally:
+        await abot.close_session()
+        _sync_handler_executor.shutdown(wait=True)
+        shutdown_db_executor()
+
+if __name__ == '__main__':
+    print("🤖 Starting Telegram Bot (asyncio edition)...")
+    print("Press Ctrl+C to stop the bot")
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n🛑 Bot stopped by user")
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Webhook mode for the Telegram bot.
+
+Instead of long polling, Telegram POSTs each update to a Flask route. The
+route checks the X-Telegram-Bot-Api-Secret-Token header, puts the update on
+a bounded queue and answers at once; a dispatcher thread feeds the queue to
+bot.process_new_updates(), so handlers run exactly as they do when polling.
+When the queue is full the route answers 503 and Telegram redelivers later.
+
+BOT_MODE=polling (default) or BOT_MODE=webhook chooses the mode. Webhook
+settings:
+
+    WEBHOOK_URL           public https base URL, e.g. https://bot.example.com
+                          (empty: no setWebhook call, for local testing)
+    WEBHOOK_PATH          route path, default /telegram/webhook
+    WEBHOOK_SECRET_TOKEN  secret Telegram sends back in the header; requests
+                          without it get 403. When unset a random one is
+                          generated at start and passed to setWebhook
+    WEBHOOK_QUEUE_SIZE    updates waiting for the dispatcher, default 1000
+    WEBHOOK_PORT          port for `python bot.py` in webhook mode, default 8080
+
+Recorded updates can be replayed against a running server:
+
+    python bot_webhook.py post update.json [--url http://localhost:5000/telegram/webhook]
+
+(replaying needs WEBHOOK_SECRET_TOKEN set, the same for both processes)
+"""
+
+import atexit
+import hmac
+import json
+import os
+import queue
+import secrets
+import sys
+import threading
+from dotenv import load_dotenv
+
+from metrics import Counters, report
+
+# Same .env as bot.py; this module can be imported before bot.py
+load_dotenv()
+
+BOT_MODE_POLLING = 'polling'
+BOT_MODE_WEBHOOK = 'webhook'
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+# The route is public, so it never runs without a secret
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN') or secrets.token_urlsafe(32)
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Updates handed to process_new_updates() in one call
+DISPATCH_BATCH_SIZE = 100
+
+_update_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+_dispatcher_thread = None
+_dispatcher_lock = threading.Lock()
+_stats = Counters(
+    received=0,
+    dispatched=0,
+    rejected_secret=0,
+    rejected_invalid=0,
+    rejected_queue_full=0,
+    dispatch_errors=0,
+    max_queue_depth=0,
+)
+
+def get_bot_mode():
+    """Return BOT_MODE from the environment (polling or webhook)"""
+    mode = os.getenv('BOT_MODE', BOT_MODE_POLLING).strip().lower()
+    if mode not in (BOT_MODE_POLLING, BOT_MODE_WEBHOOK):
+        print(f"⚠️ Unknown BOT_MODE '{mode}', falling back to {BOT_MODE_POLLING}")
+        return BOT_MODE_POLLING
+    return mode
+
+def _dispatch_loop(bot):
+    while True:
+        updates = [_update_queue.get()]
+        while len(updates) < DISPATCH_BATCH_SIZE:
+            try:
+                updates.append(_update_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            bot.process_new_updates(updates)
+            _stats.bump('dispatched', len(updates))
+        except Exception as e:
+            _stats.bump('dispatch_errors')
+            print(f"❌ Error processing webhook updates: {e}")
+
+def _ensure_dispatcher(bot):
+    global _dispatcher_thread
+    with _dispatcher_lock:
+        if _dispatcher_thread is None or not _dispatcher_thread.is_alive():
+            _dispatcher_thread = threading.Thread(target=_dispatch_loop, args=(bot,),
+                                                  name='webhook-dispatcher', daemon=True)
+            _dispatcher_thread.start()
+
+def enqueue_update(bot, payload):
+    """Parse one update JSON string and queue it; returns an HTTP status code"""
+    from telebot.types import Update
+
+    try:
+        update = Update.de_json(payload)
+    except Exception as e:
+        _stats.bump('rejected_invalid')
+        print(f"⚠️ Invalid webhook update: {e}")
+        return 400
+    if update is None:
+        _stats.bump('rejected_invalid')
+        return 400
+
+    try:
+        _update_queue.put_nowait(update)
+    except queue.Full:
+        # Telegram retries non-2xx answers, so nothing is lost
+        _stats.bump('rejected_queue_full')
+        return 503
+
+    _stats.bump('received')
+    _stats.peak(max_queue_depth=_update_queue.qsize())
+    return 200
+
+def register_webhook_route(app, bot, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET_TOKEN):
+    """Add the webhook route to a Flask app and start the dispatcher thread"""
+    from flask import request, abort
+
+    if not secret_token:
+        raise ValueError("The Telegram webhook route needs a secret token")
+
+    def telegram_webhook():
+        received = request.headers.get(SECRET_TOKEN_HEADER, '')
+        if not hmac.compare_digest(received, secret_token):
+            _stats.bump('rejected_secret')
+            abort(403)
+        if not request.is_json:
+            _stats.bump('rejected_invalid')
+            abort(415)
+
+        status = enqueue_update(bot, request.get_data(as_text=True))
+        if status != 200:
+            abort(status)
+        return ''
+
+    app.add_url_rule(path, 'telegram_webhook', telegram_webhook, methods=['POST'])
+    _ensure_dispatcher(bot)
+    print(f"✅ Telegram webhook route registered at {path}")
+
+def start_webhook(bot, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET_TOKEN):
+    """Point Telegram at WEBHOOK_URL + path (setWebhook) and remove it again on exit"""
+    if not WEBHOOK_URL:
+        print("⚠️ WEBHOOK_URL is not set; not calling setWebhook (local testing only)")
+        return False
+
+    url = WEBHOOK_URL + path
+    bot.remove_webhook()
+    if not secret_token:
+        raise ValueError("The Telegram webhook needs a secret token")
+    bot.set_webhook(url=url, secret_token=secret_token,
+                    max_connections=40, drop_pending_updates=False)
+    atexit.register(stop_webhook, bot)
+    print(f"✅ Telegram webhook set to {url}")
+    return True
+
+def stop_webhook(bot):
+    """Remove the webhook (deleteWebhook) so polling can be used again"""
+    try:
+        bot.delete_webhook()
+        print("✅ Telegram webhook removed")
+    except Exception as e:
+        print(f"⚠️ Could not remove Telegram webhook: {e}")
+
+def get_webhook_stats():
+    """Return received/dispatched/rejected update counts and queue depth"""
+    stats = _stats.snapshot()
+    stats['queue_depth'] = _update_queue.qsize()
+    stats['queue_capacity'] = WEBHOOK_QUEUE_SIZE
+    stats['dispatcher_alive'] = _dispatcher_thread is not None and _dispatcher_thread.is_alive()
+    return stats
+
+def run_webhook_server(bot, host='0.0.0.0', port=WEBHOOK_PORT):
+    """Serve only the webhook route (used by `python bot.py` in webhook mode)"""
+    from flask import Flask, jsonify
+
+    app = Flask(__name__)
+    register_webhook_route(app, bot)
+    app.add_url_rule('/telegram/webhook-stats', 'webhook_stats', lambda: jsonify(report(get_webhook_stats)))
+    start_webhook(bot)
+    app.run(host=host, port=port, debug=False, use_reloader=False)
+
+def post_recorded_update(file_path, url):
+    """POST a recorded update (or a JSON list of updates) to a running webhook"""
+    import requests
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    updates = data if isinstance(data, list) else [data]
+
+    if not os.getenv('WEBHOOK_SECRET_TOKEN'):
+        print("⚠️ WEBHOOK_SECRET_TOKEN is not set; the server will answer 403")
+    headers = {SECRET_TOKEN_HEADER: WEBHOOK_SECRET_TOKEN}
+    for update in updates:
+        response = requests.post(url, json=update, headers=headers, timeout=10)
+        print(f"update_id={update.get('update_id')}: HTTP {response.status_code}")
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'post':
+        print(f"Usage: python {sys.argv[0]} post <update.json> [--url URL]")
+        sys.exit(2)
+
+    target_url = f"http://localhost:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    if '--url' in sys.argv:
+        target_url = sys.argv[sys.argv.index('--url') + 1]
+    post_recorded_update(sys.argv[2], target_url)
@@ -0,0 +1,266 @@
+"""
+Background sender for admin broadcasts (plan notifications, custom notifications).
+
+The admin handlers only queue a job (database.create_broadcast) and return.
+One background thread delivers it:
+
+- messages go through the bulk lane of the send scheduler
+  (send_scheduler.py), so they share the bot's rate limits and always give
+  way to interactive replies, and are never sent faster than
+  BROADCAST_RATE_PER_SECOND;
+- a 429 that outlasts the scheduler's own retries is retried here, so no
+  recipient is marked failed for it;
+- a 403 (bot blocked, account deleted) marks the user blocked, and later
+  broadcasts skip them until they send /start again;
+- results are written after every batch, so after a restart the job carries
+  on with the recipients still pending (at most one batch is sent twice);
+- the admin's progress message is edited every few seconds, with Pause /
+  Resume / Cancel buttons, and a summary is sent when the job ends.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from metrics import Counters
+from send_scheduler import send_lane, LANE_BULK
+
+from database import (create_broadcast, get_broadcast, get_next_broadcast, get_recent_broadcasts,
+                      get_pending_broadcast_recipients, record_broadcast_results, set_broadcast_status,
+                      set_broadcast_progress_message,
+                      BROADCAST_QUEUED, BROADCAST_RUNNING, BROADCAST_PAUSED,
+                      BROADCAST_COMPLETED, BROADCAST_CANCELLED,
+                      RECIPIENT_SENT, RECIPIENT_FAILED, RECIPIENT_BLOCKED)
+
+# Upper bound for broadcasts alone; the send scheduler's global limit also applies
+BROADCAST_RATE_PER_SECOND = float(os.getenv('BROADCAST_RATE_PER_SECOND', '25'))
+# Recipients sent between two result writes / pause checks
+BROADCAST_BATCH_SIZE = 25
+# Attempts per recipient for network errors (429s are always retried)
+BROADCAST_MAX_ATTEMPTS = 3
+# Seconds between edits of the admin's progress message
+BROADCAST_PROGRESS_INTERVAL = 5.0
+# How often an idle worker looks for jobs queued by another process
+BROADCAST_IDLE_POLL_SECONDS = 30.0
+
+BROADCAST_TITLES = {'plans': 'Notification', 'custom': 'Custom Notification'}
+
+_min_send_interval = 1 / BROADCAST_RATE_PER_SECOND
+_bot = None
+_reply_markup_for = None
+_worker_thread = None
+_worker_lock = threading.Lock()
+_wake = threading.Event()
+_stats = Counters(
+    sent=0,
+    failed=0,
+    blocked=0,
+    rate_limited=0,
+    retried=0,
+    jobs_finished=0,
+)
+
+def start_broadcast_worker(bot, reply_markup_for):
+    """Start the sender thread if it is not running; it also resumes jobs cut off by a restart.
+
+    reply_markup_for(telegram_id) returns the reply keyboard sent with each
+    message; it is called per recipient, so it should return a prebuilt markup.
+    """
+    global _bot, _reply_markup_for, _worker_thread
+    with _worker_lock:
+        _bot = bot
+        _reply_markup_for = reply_markup_for
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(target=_worker_loop, name='broadcast-sender', daemon=True)
+            _worker_thread.start()
+    _wake.set()
+
+def queue_broadcast(kind, text, created_by, parse_mode='Markdown'):
+    """Queue a broadcast to all users, post its progress message to the admin, and return its id"""
+    broadcast_id = create_broadcast(kind, text, created_by, parse_mode)
+    job = get_broadcast(broadcast_id)
+    try:
+        progress = _bot.send_message(created_by, format_broadcast_progress(job),
+                                     parse_mode='Markdown', reply_markup=broadcast_controls(job))
+        set_broadcast_progress_message(broadcast_id, progress.message_id)
+    except Exception as e:
+        print(f"⚠️ Could not post progress for broadcast #{broadcast_id}: {e}")
+    _wake.set()
+    return broadcast_id
+
+def pause_broadcast(broadcast_id):
+    """Stop sending after the current batch; returns False if the job cannot be paused"""
+    return set_broadcast_status(broadcast_id, BROADCAST_PAUSED, (BROADCAST_QUEUED, BROADCAST_RUNNING))
+
+def resume_broadcast(broadcast_id):
+    """Put a paused job back in the queue; returns False if it was not paused"""
+    resumed = set_broadcast_status(broadcast_id, BROADCAST_QUEUED, (BROADCAST_PAUSED,))
+    _wake.set()
+    return resumed
+
+def cancel_broadcast(broadcast_id):
+    """Stop a job for good; recipients not reached yet are left pending"""
+    return set_broadcast_status(broadcast_id, BROADCAST_CANCELLED,
+                                (BROADCAST_QUEUED, BROADCAST_RUNNING, BROADCAST_PAUSED))
+
+def format_broadcast_progress(job):
+    """Progress message text for a job"""
+    done = job.sent + job.failed + job.blocked
+    percent = int(done * 100 / job.total) if job.total else 100
+    status_icons = {
+        BROADCAST_QUEUED: '⏳ Queued',
+        BROADCAST_RUNNING: '📤 Sending',
+        BROADCAST_PAUSED: '⏸ Paused',
+        BROADCAST_COMPLETED: '✅ Completed',
+        BROADCAST_CANCELLED: '🛑 Cancelled',
+    }
+    return f"""📢 **{BROADCAST_TITLES.get(job.kind, 'Broadcast')} #{job.id}**
+
+{status_icons.get(job.status, job.status)}: {done}/{job.total} ({percent}%)
+✅ Sent: {job.sent}
+❌ Failed: {job.failed}
+🚫 Blocked the bot: {job.blocked}
+
+Updated at: {datetime.now().strftime('%H:%M:%S')}"""
+
+def broadcast_controls(job):
+    """Pause / Resume / Cancel buttons for a job that has not finished"""
+    if job.status in (BROADCAST_COMPLETED, BROADCAST_CANCELLED):
+        return None
+    markup = InlineKeyboardMarkup()
+    if job.status == BROADCAST_PAUSED:
+        toggle = InlineKeyboardButton("▶️ Resume", callback_data=f'broadcast_resume_{job.id}')
+    else:
+        toggle = InlineKeyboardButton("⏸ Pause", callback_data=f'broadcast_pause_{job.id}')
+    cancel = InlineKeyboardButton("🛑 Cancel", callback_data=f'broadcast_cancel_{job.id}')
+    markup.add(toggle, cancel)
+    return markup
+
+def refresh_broadcast_progress(broadcast_id):
+    """Edit the admin's progress message to show the job's current counters"""
+    job = get_broadcast(broadcast_id)
+    if job is None or job.progress_message_id is None:
+        return
+    try:
+        _bot.edit_message_text(format_broadcast_progress(job), chat_id=job.created_by,
+                               message_id=job.progress_message_id, parse_mode='Markdown',
+                               reply_markup=broadcast_controls(job))
+    except ApiTelegramException as e:
+        if 'message is not modified' not in e.description:
+            print(f"⚠️ Could not update progress for broadcast #{broadcast_id}: {e.description}")
+    except Exception as e:
+        print(f"⚠️ Could not update progress for broadcast #{broadcast_id}: {e}")
+
+def _send_to(telegram_id, job):
+    """Deliver one message; returns (recipient status, error text)"""
+    parse_mode = job.parse_mode
+    attempts = 0
+    while True:
+        try:
+            _bot.send_message(telegram_id, job.text, parse_mode=parse_mode,
+                              reply_markup=_reply_markup_for(telegram_id))
+            return RECIPIENT_SENT, None
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                # The scheduler already waited and retried; keep this recipient pending
+                retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                print(f"⏳ Broadcast #{job.id} rate limited, waiting {retry_after}s")
+                _stats.bump('rate_limited')
+                time.sleep(retry_after)
+                continue
+            if e.error_code == 403 or 'chat not found' in e.description.lower():
+                return RECIPIENT_BLOCKED, e.description
+            if e.error_code == 400 and "can't parse entities" in e.description and parse_mode:
+                # Bad Markdown in the text: send it as plain text rather than failing everyone
+                parse_mode = None
+                continue
+            return RECIPIENT_FAILED, e.description
+        except Exception as e:
+            attempts += 1
+            if attempts >= BROADCAST_MAX_ATTEMPTS:
+                return RECIPIENT_FAILED, str(e)
+            _stats.bump('retried')
+            time.sleep(attempts)
+
+def _send_summary(job):
+    """Final report to the admin who started the job"""
+    title = BROADCAST_TITLES.get(job.kind, 'Broadcast')
+    ended = 'sent' if job.status == BROADCAST_COMPLETED else 'cancelled'
+    summary_text = f"""📊 **{title} Summary**
+
+✅ Successfully sent: {job.sent} users
+❌ Failed to send: {job.failed} users
+🚫 Blocked the bot: {job.blocked} users
+📤 Total users: {job.total}
+
+{title} {ended} at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
+    try:
+        _bot.send_message(job.created_by, summary_text, reply_markup=_reply_markup_for(job.created_by))
+    except Exception as e:
+        print(f"⚠️ Could not send summary for broadcast #{job.id}: {e}")
+
+def _run_job(job):
+    """Send a job batch by batch until it is finished, paused or cancelled"""
+    if not set_broadcast_status(job.id, BROADCAST_RUNNING, (BROADCAST_QUEUED, BROADCAST_RUNNING)):
+        return
+    print(f"📢 Broadcast #{job.id} started ({job.total} recipients, {job.sent + job.failed + job.blocked} done)")
+    last_progress = time.monotonic()
+    while True:
+        job = get_broadcast(job.id)
+        if job.status != BROADCAST_RUNNING:
+            break
+        recipients = get_pending_broadcast_recipients(job.id, BROADCAST_BATCH_SIZE)
+        if not recipients:
+            set_broadcast_status(job.id, BROADCAST_COMPLETED, (BROADCAST_RUNNING,))
+            break
+
+        results = []
+        for telegram_id in recipients:
+            started = time.monotonic()
+            status, error = _send_to(telegram_id, job)
+            results.append((telegram_id, status, error))
+            _stats.bump(status)
+            spare = _min_send_interval - (time.monotonic() - started)
+            if spare > 0:
+                time.sleep(spare)
+        record_broadcast_results(job.id, results)
+
+        if time.monotonic() - last_progress >= BROADCAST_PROGRESS_INTERVAL:
+            refresh_broadcast_progress(job.id)
+            last_progress = time.monotonic()
+
+    job = get_broadcast(job.id)
+    refresh_broadcast_progress(job.id)
+    print(f"📢 Broadcast #{job.id} {job.status}: {job.sent} sent, {job.failed} failed, {job.blocked} blocked")
+    if job.status in (BROADCAST_COMPLETED, BROADCAST_CANCELLED):
+        _stats.bump('jobs_finished')
+        _send_summary(job)
+
+def _worker_loop():
+    with send_lane(LANE_BULK):
+        _sender_loop()
+
+def _sender_loop():
+    while True:
+        try:
+            job = get_next_broadcast()
+            if job is None:
+                _wake.wait(BROADCAST_IDLE_POLL_SECONDS)
+                _wake.clear()
+                continue
+            _run_job(job)
+        except Exception as e:
+            print(f"❌ Broadcast worker error: {e}")
+            time.sleep(5)
+
+def get_broadcast_stats(limit=10):
+    """Sender counters for this process plus the most recent jobs"""
+    stats = _stats.snapshot()
+    stats['worker_alive'] = _worker_thread is not None and _worker_thread.is_alive()
+    stats['rate_per_second'] = BROADCAST_RATE_PER_SECOND
+    stats['jobs'] = [job._asdict() for job in get_recent_broadcasts(limit)]
+    return stats
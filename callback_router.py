@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Table-driven router for inline keyboard callbacks.
+
+Each callback handler is registered for either an exact callback_data value
+or a prefix plus typed payload fields:
+
+    router = CallbackRouter()
+
+    @router.route('cancel_purchase')
+    def handle_cancel_purchase(call): ...
+
+    @router.route('buy_plan_', plan_id=int)
+    def handle_buy_plan(call, plan_id): ...
+
+Buttons keep the existing "prefix_payload" wire format, so keyboards that
+are already in users' chats keep working. Dispatch is a dict lookup on the
+exact value, then one lookup per '_' in the data, longest prefix first.
+That makes 'confirm_qito_purchase_' and 'qito_plan_' independent of
+registration order, and late entries cost no more than early ones.
+
+    python callback_router.py    # dispatch micro-benchmark vs an if/elif chain
+"""
+
+import time
+
+class CallbackRouter:
+    """Maps callback_data to handler functions by exact value or longest prefix"""
+
+    def __init__(self):
+        self._exact = {}     # data -> handler
+        self._prefixes = {}  # 'prefix_' -> (handler, ((field, type), ...))
+
+    def route(self, pattern, **fields):
+        """Decorator: register a handler for an exact value or, with fields, a prefix.
+
+        Prefix routes must end with '_'. The rest of the data is split on '_'
+        into one value per field (the last field takes any remainder) and
+        each value is converted with its type before the handler is called
+        as handler(call, **payload).
+        """
+        def decorator(handler):
+            if fields:
+                if not pattern.endswith('_'):
+                    raise ValueError(f"Prefix route '{pattern}' must end with '_'")
+                if pattern in self._prefixes:
+                    raise ValueError(f"Callback prefix '{pattern}' is already registered")
+                self._prefixes[pattern] = (handler, tuple(fields.items()))
+            else:
+                if pattern in self._exact:
+                    raise ValueError(f"Callback '{pattern}' is already registered")
+                self._exact[pattern] = handler
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """Return (handler, payload) for callback data, or (None, None) if nothing matches.
+
+        Raises ValueError when a prefix matches but its payload does not parse.
+        """
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, {}
+
+        # Try 'a_b_c_', then 'a_b_', then 'a_' (longest first); callback_data is
+        # at most 64 bytes, so this is a handful of dict lookups at worst
+        prefixes = self._prefixes
+        end = data.rfind('_')
+        while end >= 0:
+            route = prefixes.get(data[:end + 1])
+            if route is not None:
+                return route[0], self._parse_payload(data[end + 1:], route[1])
+            end = data.rfind('_', 0, end)
+        return None, None
+
+    @staticmethod
+    def _parse_payload(raw, fields):
+        if len(fields) == 1:
+            # Most routes have a single field, which takes the rest as is
+            if not raw:
+                raise ValueError("Empty callback payload")
+            name, field_type = fields[0]
+            return {name: field_type(raw)}
+        values = raw.split('_', len(fields) - 1)
+        if len(values) != len(fields) or not all(values):
+            raise ValueError(f"Expected {len(fields)} payload value(s) in '{raw}'")
+        return {name: field_type(value) for (name, field_type), value in zip(fields, values)}
+
+    def routes(self):
+        """All registered patterns, for diagnostics"""
+        return sorted(self._exact) + sorted(self._prefixes)
+
+def _benchmark(iterations=200000):
+    """Compare dispatch cost with a startswith if/elif chain over the same callbacks"""
+    # The callback_data shapes used by bot.py, in the order the old chain tested them
+    # (True = startswith prefix, False = exact match)
+    old_chain = [
+        ('topup_', True), ('order_', True), ('vpn_', True), ('view_all_orders', False),
+        ('download_keys', False), ('order_support', False), ('support_', True),
+        ('option_a_selected', False), ('inline_random', False), ('get_user_info', False),
+        ('back_to_main', False), ('admin_approve_', True), ('admin_deny_', True), ('buy_plan_', True),
+        ('confirm_purchase_', True), ('cancel_purchase', False), ('qito_plan_', True),
+        ('confirm_qito_purchase_', True), ('cancel_qito_purchase', False), ('bypass_plan_', True),
+        ('confirm_bypass_purchase_', True), ('cancel_bypass_purchase', False),
+        ('confirm_custom_notification', False), ('cancel_custom_notification', False),
+    ]
+
+    router = CallbackRouter()
+    noop = lambda call, **payload: None
+    for pattern, is_prefix in old_chain:
+        if is_prefix:
+            router.route(pattern, value=str)(noop)
+        else:
+            router.route(pattern)(noop)
+
+    def chain(data):
+        for pattern, is_prefix in old_chain:
+            if data.startswith(pattern) if is_prefix else data == pattern:
+                return data.split('_')[-1]
+        return None
+
+    samples = {
+        'first prefix (topup_100)': 'topup_100',
+        'late prefix (confirm_bypass_purchase_42)': 'confirm_bypass_purchase_42',
+        'late exact (cancel_custom_notification)': 'cancel_custom_notification',
+        'unknown (nothing_matches)': 'nothing_matches',
+    }
+    print(f"{'callback':45} {'if/elif chain':>15} {'router':>12}")
+    for label, data in samples.items():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            chain(data)
+        chain_ns = (time.perf_counter() - start) / iterations * 1e9
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            router.resolve(data)
+        router_ns = (time.perf_counter() - start) / iterations * 1e9
+        print(f"{label:45} {chain_ns:12.0f} ns {router_ns:9.0f} ns")
+
+if __name__ == '__main__':
+    _benchmark()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Verify or rebuild the per-plan key counters in the plan_inventory table.
+
+plan_inventory is kept exact by triggers on vpn_keys; this script checks it
+against a full count of vpn_keys and can recompute it if they ever disagree
+(e.g. after editing the database by hand with triggers disabled).
+
+Usage:
+    python check_inventory.py              # verify only, exit code 1 on mismatch
+    python check_inventory.py --rebuild    # recompute the counters, then verify
+"""
+
+import os
+import sys
+from datetime import datetime
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import init_database, verify_plan_inventory, rebuild_plan_inventory
+
+def main():
+    """Verify (and optionally rebuild) plan_inventory"""
+    init_database()
+
+    if '--rebuild' in sys.argv[1:]:
+        print(f"[{datetime.now()}] Rebuilding plan inventory...")
+        rebuild_plan_inventory()
+
+    print(f"[{datetime.now()}] Verifying plan inventory...")
+    mismatches = verify_plan_inventory()
+
+    if not mismatches:
+        print(f"[{datetime.now()}] ✅ Plan inventory matches vpn_keys")
+        return
+
+    for mismatch in mismatches:
+        stored_total, stored_available, stored_used = mismatch['stored']
+        actual_total, actual_available, actual_used = mismatch['actual']
+        print(f"  - Plan ID {mismatch['plan_id']}: "
+              f"stored {stored_total}/{stored_available}/{stored_used}, "
+              f"actual {actual_total}/{actual_available}/{actual_used} (total/available/used)")
+    print(f"[{datetime.now()}] ❌ {len(mismatches)} plans out of sync; run with --rebuild to fix")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,101 @@
 import sqlite3
 import os
 import time
+import functools
+import threading
+from collections import namedtuple, OrderedDict
 from datetime import datetime
-
-# Database file path
-DB_FILE = 'bot_database.db'
+from db_pool import get_connection, transaction
+from db_writer import serialized_write, run_write, submit_write
+from migrations import run_migrations, vpn_key_hash, REBUILD_PLAN_INVENTORY_SQL
 
 def get_db_connection_with_retry(max_retries=3, timeout=5):
-    """Get database connection with retry logic for handling locked database"""
-    for attempt in range(max_retries):
-        try:
-            conn = sqlite3.connect(DB_FILE, timeout=timeout)
-            conn.execute('PRAGMA journal_mode=WAL')  # Use WAL mode for better concurrency
-            return conn
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e) and attempt < max_retries - 1:
-                print(f"⚠️ Database locked, retrying in 1 second... (attempt {attempt + 1}/{max_retries})")
-                time.sleep(1)
-                continue
-            else:
-                raise e
-    return None
+    """Get database connection (kept for old callers; arguments are ignored)"""
+    # Lock waits are handled by busy_timeout, and this process's writes go
+    # through the single writer thread in db_writer.py, so there is no retry loop
+    return get_connection()
+
+@serialized_write
+def execute_write(sql, parameters=()):
+    """Run one INSERT / UPDATE / DELETE on the writer thread; returns the number of rows changed"""
+    with transaction() as conn:
+        return conn.execute(sql, parameters).rowcount
 
 def init_database():
     """Initialize the database and create tables if they don't exist"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE NOT NULL,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            balance REAL DEFAULT 0.0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    # All schema changes live in migrations.py and are applied once per database
+    run_migrations()
     print("✅ Database initialized successfully")
 
+# Read-through cache for catalog and configuration reads (plans, topup
+# options, payment methods, contacts, account setup config). Triggers change
+# cache_version on every write to those tables, from any process, so a cached
+# value is served only while the version it was read under is still current.
+_catalog_cache = {}
+_catalog_cache_lock = threading.Lock()
+_catalog_cache_version = None
+_catalog_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+def get_catalog_version():
+    """Return the current catalog version token"""
+    conn = get_connection()
+    result = conn.execute('SELECT version FROM cache_version WHERE id = 1').fetchone()
+    conn.close()
+    return result[0] if result else None
+
+@serialized_write
+def bump_catalog_version():
+    """Force every process to drop its catalog cache (e.g. after restoring a backup)"""
+    with transaction() as conn:
+        conn.execute('INSERT OR REPLACE INTO cache_version (id, version) VALUES (1, random())')
+
+def _cache_copy(value):
+    """Shallow copy of a cached list or dict, so callers cannot change the cached value"""
+    if isinstance(value, (list, dict)):
+        return type(value)(value)
+    return value
+
+def catalog_cached(func):
+    """Cache a catalog read per arguments until the catalog version changes"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _catalog_cache_version
+        key = (func.__name__,) + args + tuple(sorted(kwargs.items()))
+        version = get_catalog_version()
+        
+        with _catalog_cache_lock:
+            if version != _catalog_cache_version:
+                if _catalog_cache:
+                    _catalog_cache_stats['invalidations'] += 1
+                _catalog_cache.clear()
+                _catalog_cache_version = version
+            if key in _catalog_cache:
+                _catalog_cache_stats['hits'] += 1
+                return _cache_copy(_catalog_cache[key])
+            _catalog_cache_stats['misses'] += 1
+        
+        # Read after the version, so the value is never older than the version it is stored under
+        value = func(*args, **kwargs)
+        with _catalog_cache_lock:
+            if _catalog_cache_version == version:
+                _catalog_cache[key] = value
+        return _cache_copy(value)
+    return wrapper
+
+def get_cache_stats():
+    """Return catalog cache (and known-user cache) hit/miss counters for this process"""
+    with _catalog_cache_lock:
+        stats = dict(_catalog_cache_stats)
+        stats['entries'] = len(_catalog_cache)
+        stats['version'] = _catalog_cache_version
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    stats['known_users'] = get_known_user_stats()
+    return stats
+
 def user_exists(telegram_id):
     """Check if user exists in database"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('SELECT telegram_id FROM users WHERE telegram_id = ?', (telegram_id,))
@@ -58,16 +106,8 @@ def user_exists(telegram_id):
 
 def create_user(telegram_id, username=None, first_name=None, last_name=None):
     """Create a new user with balance 0"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('''
-            INSERT INTO users (telegram_id, username, first_name, last_name, balance)
-            VALUES (?, ?, ?, ?, 0.0)
-        ''', (telegram_id, username, first_name, last_name))
-        
-        conn.commit()
+        _insert_user(telegram_id, username, first_name, last_name)
         print(f"✅ New user created: {telegram_id}")
         return True
     except sqlite3.IntegrityError:
@@ -76,12 +116,18 @@ def create_user(telegram_id, username=None, first_name=None, last_name=None):
     except Exception as e:
         print(f"❌ Error creating user: {e}")
         return False
-    finally:
-        conn.close()
+
+@serialized_write
+def _insert_user(telegram_id, username, first_name, last_name):
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO users (telegram_id, username, first_name, last_name, balance)
+            VALUES (?, ?, ?, ?, 0.0)
+        ''', (telegram_id, username, first_name, last_name))
 
 def get_user_balance(telegram_id):
     """Get user's current balance"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     # Round to 0 decimal places to ensure whole numbers (no floating-point precision issues)
@@ -91,16 +137,129 @@ def get_user_balance(telegram_id):
     conn.close()
     return float(result[0]) if result else 0.0
 
+# Users this process has already written, with the profile (username,
+# first_name, last_name) stored for them, so ensure_user_exists() skips the
+# database for them. Profile changes of known users are collected for
+# USER_PROFILE_FLUSH_SECONDS and written in one batch.
+KNOWN_USER_CACHE_SIZE = int(os.getenv('KNOWN_USER_CACHE_SIZE', '10000'))
+USER_PROFILE_FLUSH_SECONDS = 2.0
+
+# Creates the user if missing; the rowcount tells whether it did
+USER_INSERT_SQL = '''
+    INSERT INTO users (telegram_id, username, first_name, last_name, balance)
+    VALUES (?, ?, ?, ?, 0.0)
+    ON CONFLICT (telegram_id) DO NOTHING
+'''
+
+# Creates the user, or refreshes a profile that changed
+USER_UPSERT_SQL = '''
+    INSERT INTO users (telegram_id, username, first_name, last_name, balance)
+    VALUES (?, ?, ?, ?, 0.0)
+    ON CONFLICT (telegram_id) DO UPDATE
+    SET username = excluded.username, first_name = excluded.first_name, last_name = excluded.last_name,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE users.username IS NOT excluded.username
+       OR users.first_name IS NOT excluded.first_name
+       OR users.last_name IS NOT excluded.last_name
+'''
+
+_known_users = OrderedDict()
+_known_users_lock = threading.Lock()
+_pending_profiles = {}
+_profile_flush_timer = None
+_known_user_stats = {'hits': 0, 'misses': 0, 'created': 0, 'profile_updates': 0, 'profile_flushes': 0}
+
 def ensure_user_exists(telegram_id, username=None, first_name=None, last_name=None):
-    """Check if user exists, if not create with balance 0"""
-    if not user_exists(telegram_id):
-        create_user(telegram_id, username, first_name, last_name)
-        return False  # User was created
-    return True  # User already existed
+    """Create the user with balance 0 if needed and keep their profile current; returns False if just created"""
+    profile = (username, first_name, last_name)
+    with _known_users_lock:
+        known_profile = _known_users.get(telegram_id)
+        if known_profile is not None:
+            _known_users.move_to_end(telegram_id)
+            _known_user_stats['hits'] += 1
+            if known_profile != profile:
+                _known_users[telegram_id] = profile
+                _queue_profile_refresh(telegram_id, profile)
+            return True
+        _known_user_stats['misses'] += 1
+
+    created = _upsert_user(telegram_id, username, first_name, last_name)
+    if created:
+        print(f"✅ New user created: {telegram_id}")
+    with _known_users_lock:
+        if created:
+            _known_user_stats['created'] += 1
+        _known_users[telegram_id] = profile
+        if len(_known_users) > KNOWN_USER_CACHE_SIZE:
+            _known_users.popitem(last=False)
+    return not created
+
+@serialized_write
+def _upsert_user(telegram_id, username, first_name, last_name):
+    """Create the user or refresh their profile; returns True if the row was created"""
+    parameters = (telegram_id, username, first_name, last_name)
+    with transaction() as conn:
+        if conn.execute(USER_INSERT_SQL, parameters).rowcount:
+            return True
+        conn.execute(USER_UPSERT_SQL, parameters)
+        return False
 
+def _queue_profile_refresh(telegram_id, profile):
+    """Queue a known user's new profile for the next batched write (caller holds _known_users_lock)"""
+    global _profile_flush_timer
+    _pending_profiles[telegram_id] = profile
+    _known_user_stats['profile_updates'] += 1
+    if _profile_flush_timer is None:
+        _profile_flush_timer = threading.Timer(USER_PROFILE_FLUSH_SECONDS, flush_user_profiles)
+        _profile_flush_timer.daemon = True
+        _profile_flush_timer.start()
+
+def flush_user_profiles():
+    """Write queued profile changes in one transaction, without waiting for it"""
+    global _profile_flush_timer
+    with _known_users_lock:
+        profiles = dict(_pending_profiles)
+        _pending_profiles.clear()
+        _profile_flush_timer = None
+        if profiles:
+            _known_user_stats['profile_flushes'] += 1
+    if not profiles:
+        return
+
+    def forget_on_error(future):
+        if future.exception() is not None:
+            print(f"❌ Error saving {len(profiles)} user profile(s): {future.exception()}")
+            # Written again the next time these users are seen
+            with _known_users_lock:
+                for telegram_id in profiles:
+                    _known_users.pop(telegram_id, None)
+
+    submit_write(_write_user_profiles, profiles).add_done_callback(forget_on_error)
+
+def _write_user_profiles(profiles):
+    with transaction() as conn:
+        conn.executemany(USER_UPSERT_SQL, [(telegram_id,) + profile for telegram_id, profile in profiles.items()])
+
+def clear_known_users():
+    """Forget every known user and queued profile (after the database file is replaced)"""
+    with _known_users_lock:
+        _known_users.clear()
+        _pending_profiles.clear()
+
+def get_known_user_stats():
+    """Return known-user cache counters for this process"""
+    with _known_users_lock:
+        stats = dict(_known_user_stats)
+        stats['entries'] = len(_known_users)
+        stats['pending_profiles'] = len(_pending_profiles)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    return stats
+
+@catalog_cached
 def get_topup_options():
     """Get all active topup options from database"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('SELECT credits, mmk_price FROM topup_options WHERE is_active = 1 ORDER BY credits')
@@ -109,9 +268,10 @@ def get_topup_options():
     conn.close()
     return options
 
+@catalog_cached
 def get_payment_methods():
     """Get all active payment methods from database"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('SELECT name, description, account_number FROM payment_methods WHERE is_active = 1 ORDER BY name')
@@ -122,7 +282,7 @@ def get_payment_methods():
 
 def get_all_payment_methods():
     """Get all payment methods (active and inactive) for admin purposes"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('SELECT id, name, description, is_active, created_at FROM payment_methods ORDER BY name')
@@ -131,9 +291,10 @@ def get_all_payment_methods():
     conn.close()
     return methods
 
+@catalog_cached
 def get_active_payment_methods_count():
     """Get count of active payment methods"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('SELECT COUNT(*) FROM payment_methods WHERE is_active = 1')
@@ -144,46 +305,23 @@ def get_active_payment_methods_count():
 
 def init_payment_tables():
     """Initialize payment-related tables"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Create pending_payments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS pending_payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            credits INTEGER NOT NULL,
-            mmk_price INTEGER NOT NULL,
-            payment_proof_file_id TEXT,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            processed_at TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (telegram_id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    run_migrations()
 
+@serialized_write
 def create_pending_payment(user_id, credits, mmk_price, payment_proof_file_id=None):
     """Create a pending payment record"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO pending_payments (user_id, credits, mmk_price, payment_proof_file_id)
-        VALUES (?, ?, ?, ?)
-    ''', (user_id, credits, mmk_price, payment_proof_file_id))
-    
-    payment_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        cursor = conn.execute('''
+            INSERT INTO pending_payments (user_id, credits, mmk_price, payment_proof_file_id)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, credits, mmk_price, payment_proof_file_id))
+        payment_id = cursor.lastrowid
     
     return payment_id
 
 def get_pending_payment(payment_id):
     """Get pending payment by ID"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('SELECT * FROM pending_payments WHERE id = ?', (payment_id,))
@@ -192,25 +330,25 @@ def get_pending_payment(payment_id):
     conn.close()
     return payment
 
+@serialized_write
+def set_payment_proof(payment_id, file_id):
+    """Attach the Telegram file_id of the payment screenshot to a pending payment"""
+    with transaction() as conn:
+        conn.execute('UPDATE pending_payments SET payment_proof_file_id = ? WHERE id = ?', (file_id, payment_id))
+
+@serialized_write
 def update_payment_status(payment_id, status):
     """Update payment status"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE pending_payments 
-        SET status = ?, processed_at = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    ''', (status, payment_id))
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE pending_payments 
+            SET status = ?, processed_at = CURRENT_TIMESTAMP 
+            WHERE id = ?
+        ''', (status, payment_id))
 
+@serialized_write
 def add_user_balance(telegram_id, credits):
     """Add credits to user balance"""
-    conn = get_db_connection_with_retry()
-    cursor = conn.cursor()
-    
     try:
         # 1 dollar = 1 credit (1:1 conversion)
         # Credits are stored directly as dollars in balance
@@ -218,217 +356,188 @@ def add_user_balance(telegram_id, credits):
         # Round to 0 decimal places since credits are whole numbers
         credits_value = float(credits)  # Ensure it's a number
         
-        cursor.execute('''
-            UPDATE users 
-            SET balance = ROUND(balance + ?, 0), updated_at = CURRENT_TIMESTAMP 
-            WHERE telegram_id = ?
-        ''', (credits_value, telegram_id))
-        
-        conn.commit()
+        with transaction() as conn:
+            conn.execute('''
+                UPDATE users 
+                SET balance = ROUND(balance + ?, 0), updated_at = CURRENT_TIMESTAMP 
+                WHERE telegram_id = ?
+            ''', (credits_value, telegram_id))
     except Exception as e:
         print(f"❌ Error in add_user_balance: {e}")
         raise
-    finally:
-        conn.close()
 
 def init_plan_tables():
     """Initialize plan and key management tables"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Create plans table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS plans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            plan_id_number TEXT UNIQUE NOT NULL,
-            name TEXT NOT NULL,
-            description TEXT,
-            credits_required INTEGER NOT NULL,
-            duration_days INTEGER NOT NULL,
-            device_limit INTEGER DEFAULT 1,
-            is_active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Add plan_id_number column if it doesn't exist (for existing databases)
-    cursor.execute("PRAGMA table_info(plans)")
-    columns = [column[1] for column in cursor.fetchall()]
-    if 'plan_id_number' not in columns:
-        # First add the column without UNIQUE constraint
-        cursor.execute('ALTER TABLE plans ADD COLUMN plan_id_number TEXT')
-        # Set default values for existing plans
-        cursor.execute('UPDATE plans SET plan_id_number = CAST(id AS TEXT) WHERE plan_id_number IS NULL')
-        
-        # Create a new table with the UNIQUE constraint
-        cursor.execute('''
-            CREATE TABLE plans_new (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                plan_id_number TEXT UNIQUE NOT NULL,
-                name TEXT NOT NULL,
-                description TEXT,
-                credits_required INTEGER NOT NULL,
-                duration_days INTEGER NOT NULL,
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Copy data from old table to new table
-        cursor.execute('''
-            INSERT INTO plans_new (id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at)
-            SELECT id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at
-            FROM plans
-        ''')
-        
-        # Drop old table and rename new table
-        cursor.execute('DROP TABLE plans')
-        cursor.execute('ALTER TABLE plans_new RENAME TO plans')
-    
-    # Add device_limit column if it doesn't exist (for existing databases)
-    cursor.execute("PRAGMA table_info(plans)")
-    columns = [column[1] for column in cursor.fetchall()]
-    if 'device_limit' not in columns:
-        cursor.execute('ALTER TABLE plans ADD COLUMN device_limit INTEGER DEFAULT 1')
-    
-    # Add api_response column to user_plans table if it doesn't exist
-    cursor.execute("PRAGMA table_info(user_plans)")
-    columns = [column[1] for column in cursor.fetchall()]
-    if 'api_response' not in columns:
-        cursor.execute('ALTER TABLE user_plans ADD COLUMN api_response TEXT')
-    
-    # Add vpn_key column to user_plans table if it doesn't exist
-    if 'vpn_key' not in columns:
-        cursor.execute('ALTER TABLE user_plans ADD COLUMN vpn_key TEXT')
-    
-    # Create vpn_keys table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS vpn_keys (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            plan_id INTEGER NOT NULL,
-            key_value TEXT NOT NULL,
-            is_used BOOLEAN DEFAULT 0,
-            used_by_user_id INTEGER,
-            used_at TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (plan_id) REFERENCES plans (id),
-            FOREIGN KEY (used_by_user_id) REFERENCES users (telegram_id)
-        )
-    ''')
-    
-    # Create user_plans table (to track user purchases)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_plans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            plan_id INTEGER NOT NULL,
-            vpn_key_id INTEGER,
-            purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expiry_date TIMESTAMP,
-            status TEXT DEFAULT 'active',
-            FOREIGN KEY (user_id) REFERENCES users (telegram_id),
-            FOREIGN KEY (plan_id) REFERENCES plans (id),
-            FOREIGN KEY (vpn_key_id) REFERENCES vpn_keys (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    run_migrations()
 
 # Plan management functions
-def create_plan(plan_id_number, name, description, credits_required, duration_days, device_limit=1):
+
+# Plan categories stored in plans.plan_type
+PLAN_TYPE_VPN = 'vpn'
+PLAN_TYPE_QITO = 'qito'
+PLAN_TYPE_BYPASS = 'bypass'
+PLAN_TYPES = (PLAN_TYPE_VPN, PLAN_TYPE_QITO, PLAN_TYPE_BYPASS)
+
+# Columns of a plan row as returned by the functions below. plan_type is left
+# out so callers unpacking the original ten columns keep working.
+PLAN_COLUMNS = ('id, plan_id_number, name, description, credits_required, duration_days, '
+                'is_active, created_at, updated_at, device_limit')
+
+@serialized_write
+def create_plan(plan_id_number, name, description, credits_required, duration_days, device_limit=1, plan_type=PLAN_TYPE_VPN):
     """Create a new plan"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO plans (plan_id_number, name, description, credits_required, duration_days, device_limit)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (plan_id_number, name, description, credits_required, duration_days, device_limit))
-    
-    plan_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        cursor = conn.execute('''
+            INSERT INTO plans (plan_id_number, name, description, credits_required, duration_days, device_limit, plan_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (plan_id_number, name, description, credits_required, duration_days, device_limit, plan_type))
     
-    return plan_id
+    return cursor.lastrowid
 
-def get_all_plans():
-    """Get all plans"""
-    conn = sqlite3.connect(DB_FILE)
+@catalog_cached
+def get_all_plans(plan_type=None):
+    """Get all plans, optionally only those of one plan type"""
+    conn = get_connection()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM plans ORDER BY plan_id_number')
+    if plan_type:
+        cursor.execute(f'SELECT {PLAN_COLUMNS} FROM plans WHERE plan_type = ? ORDER BY plan_id_number', (plan_type,))
+    else:
+        cursor.execute(f'SELECT {PLAN_COLUMNS} FROM plans ORDER BY plan_id_number')
     plans = cursor.fetchall()
     
     conn.close()
     return plans
 
-def get_active_plans():
-    """Get active plans"""
-    conn = sqlite3.connect(DB_FILE)
+@catalog_cached
+def get_active_plans(plan_type=None):
+    """Get active plans, optionally only those of one plan type"""
+    conn = get_connection()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM plans WHERE is_active = 1 ORDER BY plan_id_number')
+    if plan_type:
+        cursor.execute(f'''
+            SELECT {PLAN_COLUMNS} FROM plans 
+            WHERE plan_type = ? AND is_active = 1 
+            ORDER BY plan_id_number
+        ''', (plan_type,))
+    else:
+        cursor.execute(f'SELECT {PLAN_COLUMNS} FROM plans WHERE is_active = 1 ORDER BY plan_id_number')
     plans = cursor.fetchall()
     
     conn.close()
     return plans
 
-def get_plan(plan_id):
-    """Get plan by ID"""
-    conn = sqlite3.connect(DB_FILE)
+@catalog_cached
+def get_plan(plan_id, plan_type=None):
+    """Get plan by ID, optionally only if it is of one plan type"""
+    conn = get_connection()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM plans WHERE id = ?', (plan_id,))
+    if plan_type:
+        cursor.execute(f'SELECT {PLAN_COLUMNS} FROM plans WHERE id = ? AND plan_type = ?', (plan_id, plan_type))
+    else:
+        cursor.execute(f'SELECT {PLAN_COLUMNS} FROM plans WHERE id = ?', (plan_id,))
     plan = cursor.fetchone()
     
     conn.close()
     return plan
 
-def update_plan(plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, device_limit=1):
-    """Update plan"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE plans 
-        SET plan_id_number = ?, name = ?, description = ?, credits_required = ?, duration_days = ?, 
-            device_limit = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    ''', (plan_id_number, name, description, credits_required, duration_days, device_limit, is_active, plan_id))
-    
-    conn.commit()
+@serialized_write
+def update_plan(plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, device_limit=1, plan_type=None):
+    """Update plan; plan_type None keeps the stored type"""
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE plans 
+            SET plan_id_number = ?, name = ?, description = ?, credits_required = ?, duration_days = ?, 
+                device_limit = ?, is_active = ?, plan_type = COALESCE(?, plan_type), updated_at = CURRENT_TIMESTAMP 
+            WHERE id = ?
+        ''', (plan_id_number, name, description, credits_required, duration_days, device_limit, is_active,
+              plan_type, plan_id))
+
+@catalog_cached
+def get_low_stock_thresholds():
+    """Return {plan id: low stock threshold} for the plans that have their own threshold"""
+    conn = get_connection()
+    thresholds = dict(conn.execute('''
+        SELECT id, low_stock_threshold FROM plans 
+        WHERE low_stock_threshold IS NOT NULL
+    ''').fetchall())
     conn.close()
+    return thresholds
 
+@serialized_write
+def set_plan_low_stock_threshold(plan_id, threshold):
+    """Set a plan's low stock alert threshold (None: use the default)"""
+    with transaction() as conn:
+        conn.execute('UPDATE plans SET low_stock_threshold = ? WHERE id = ?', (threshold, plan_id))
+
+@serialized_write
 def delete_plan(plan_id):
     """Delete plan"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM plans WHERE id = ?', (plan_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM plans WHERE id = ?', (plan_id,))
 
 # VPN Key management functions
+# Rows per executemany/transaction during bulk key imports; each chunk commits
+# separately so purchases are never blocked for the whole import
+KEY_IMPORT_CHUNK_SIZE = 1000
+MAX_KEY_LENGTH = 4096
+
+def is_valid_key_value(key_value):
+    """Check that a stripped key value can be stored and sent to users"""
+    if not key_value or len(key_value) > MAX_KEY_LENGTH:
+        return False
+    # Control characters and undecodable bytes mean a corrupted upload
+    return not any(ord(char) < 32 or char == '\ufffd' for char in key_value)
+
+@serialized_write
+def _insert_key_chunk(chunk):
+    """Insert one chunk of (plan_id, key_value, key_hash) rows; returns how many were new"""
+    with transaction() as conn:
+        # The unique key_hash index rejects keys that already exist; rowcount
+        # (unlike total_changes) ignores the plan_inventory trigger updates
+        cursor = conn.executemany('''
+            INSERT OR IGNORE INTO vpn_keys (plan_id, key_value, key_hash)
+            VALUES (?, ?, ?)
+        ''', chunk)
+        return cursor.rowcount
+
+def import_vpn_keys(plan_id, key_values, chunk_size=KEY_IMPORT_CHUNK_SIZE):
+    """Bulk insert keys from any iterable (e.g. a streamed upload) in chunked transactions"""
+    counts = {'inserted': 0, 'duplicates': 0, 'invalid': 0}
+
+    def flush(chunk):
+        inserted = _insert_key_chunk(chunk)
+        counts['inserted'] += inserted
+        counts['duplicates'] += len(chunk) - inserted
+
+    chunk = []
+    for raw_value in key_values:
+        key_value = (raw_value or '').strip()
+        if not key_value:
+            continue  # blank lines are not rows
+        if not is_valid_key_value(key_value):
+            counts['invalid'] += 1
+            continue
+        chunk.append((plan_id, key_value, vpn_key_hash(key_value)))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    print(f"✅ Imported keys for plan {plan_id}: {counts['inserted']} inserted, "
+          f"{counts['duplicates']} duplicates, {counts['invalid']} invalid")
+    return counts
+
 def add_vpn_keys(plan_id, keys_list):
-    """Add multiple VPN keys for a plan"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    for key_value in keys_list:
-        cursor.execute('''
-            INSERT INTO vpn_keys (plan_id, key_value)
-            VALUES (?, ?)
-        ''', (plan_id, key_value.strip()))
-    
-    conn.commit()
-    conn.close()
+    """Add multiple VPN keys for a plan, skipping duplicates"""
+    return import_vpn_keys(plan_id, keys_list)
 
 def get_available_keys(plan_id):
     """Get available (unused) keys for a plan"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -443,7 +552,7 @@ def get_available_keys(plan_id):
 
 def get_all_keys_for_plan(plan_id):
     """Get all keys for a plan (used and unused)"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -457,51 +566,266 @@ def get_all_keys_for_plan(plan_id):
     conn.close()
     return keys
 
-def assign_key_to_user(plan_id, user_id):
-    """Assign an available key to a user"""
-    conn = sqlite3.connect(DB_FILE)
+# Key stock counters; plan_inventory is kept exact by triggers on vpn_keys
+
+def get_plan_inventory(plan_id):
+    """Get (total_keys, available_keys, used_keys) for a plan"""
+    conn = get_connection()
     cursor = conn.cursor()
     
-    # Get an available key
     cursor.execute('''
-        SELECT id, key_value FROM vpn_keys 
-        WHERE plan_id = ? AND is_used = 0 
-        ORDER BY created_at ASC LIMIT 1
+        SELECT total_keys, available_keys, used_keys 
+        FROM plan_inventory 
+        WHERE plan_id = ?
     ''', (plan_id,))
-    key = cursor.fetchone()
+    inventory = cursor.fetchone()
+    
+    conn.close()
+    return inventory or (0, 0, 0)
+
+def get_available_key_count(plan_id):
+    """Get the number of unused keys for a plan"""
+    return get_plan_inventory(plan_id)[1]
+
+def verify_plan_inventory():
+    """Compare plan_inventory with a full count of vpn_keys and return the plans that differ"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT plan_id, total_keys, available_keys, used_keys FROM plan_inventory')
+    stored = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+    
+    cursor.execute('''
+        SELECT plan_id,
+               COUNT(*),
+               SUM(CASE WHEN is_used THEN 0 ELSE 1 END),
+               SUM(CASE WHEN is_used THEN 1 ELSE 0 END)
+        FROM vpn_keys
+        GROUP BY plan_id
+    ''')
+    actual = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+    
+    conn.close()
     
-    if key:
-        key_id, key_value = key
+    mismatches = []
+    for plan_id in sorted(set(stored) | set(actual)):
+        stored_counts = stored.get(plan_id, (0, 0, 0))
+        actual_counts = actual.get(plan_id, (0, 0, 0))
+        if stored_counts != actual_counts:
+            mismatches.append({
+                'plan_id': plan_id,
+                'stored': stored_counts,
+                'actual': actual_counts
+            })
+    return mismatches
+
+@serialized_write
+def rebuild_plan_inventory():
+    """Recompute plan_inventory from vpn_keys"""
+    with transaction() as conn:
+        conn.execute('DELETE FROM plan_inventory')
+        conn.execute(REBUILD_PLAN_INVENTORY_SQL)
+        plan_count = conn.execute('SELECT COUNT(*) FROM plan_inventory').fetchone()[0]
+    print(f"✅ Rebuilt key inventory for {plan_count} plans")
+    return plan_count
+
+# Purchase outcomes returned by purchase_vpn_key()
+PURCHASE_SUCCESS = 'success'
+PURCHASE_OUT_OF_STOCK = 'out_of_stock'
+PURCHASE_INSUFFICIENT_FUNDS = 'insufficient_funds'
+PURCHASE_PLAN_NOT_FOUND = 'plan_not_found'
+
+PurchaseResult = namedtuple('PurchaseResult', ['status', 'vpn_key', 'user_plan_id', 'balance', 'available_keys'])
+
+@serialized_write
+def purchase_vpn_key(plan_id, user_id):
+    """Claim a key, debit the plan price and record the purchase in one transaction.
+
+    Returns a PurchaseResult whose status is one of PURCHASE_SUCCESS,
+    PURCHASE_OUT_OF_STOCK, PURCHASE_INSUFFICIENT_FUNDS or PURCHASE_PLAN_NOT_FOUND.
+    On success available_keys is the plan's stock left after this purchase.
+    Nothing is written unless every step succeeds.
+    """
+    with transaction() as conn:
+        plan = conn.execute(
+            'SELECT credits_required, duration_days FROM plans WHERE id = ? AND is_active = 1',
+            (plan_id,)
+        ).fetchone()
+        if not plan:
+            return PurchaseResult(PURCHASE_PLAN_NOT_FOUND, None, None, None, None)
+        credits_required, duration_days = plan
+        
+        # The write lock is already held, so nothing can change between these
+        # checks and the writes below; failing early means nothing to roll back
+        balance = conn.execute('SELECT balance FROM users WHERE telegram_id = ?', (user_id,)).fetchone()
+        if not balance or balance[0] < credits_required:
+            return PurchaseResult(PURCHASE_INSUFFICIENT_FUNDS, None, None, None, None)
+        
+        key = conn.execute('''
+            SELECT id FROM vpn_keys 
+            WHERE plan_id = ? AND is_used = 0 
+            ORDER BY created_at ASC LIMIT 1
+        ''', (plan_id,)).fetchone()
+        if not key:
+            return PurchaseResult(PURCHASE_OUT_OF_STOCK, None, None, None, None)
         
-        # Mark key as used
-        cursor.execute('''
+        # Conditional writes as a second line of defence; raising rolls back this purchase only
+        debited = conn.execute('''
+            UPDATE users 
+            SET balance = ROUND(balance - ?, 0), updated_at = CURRENT_TIMESTAMP 
+            WHERE telegram_id = ? AND balance >= ?
+            RETURNING balance
+        ''', (credits_required, user_id, credits_required)).fetchall()
+        claimed = conn.execute('''
             UPDATE vpn_keys 
             SET is_used = 1, used_by_user_id = ?, used_at = CURRENT_TIMESTAMP 
-            WHERE id = ?
-        ''', (user_id, key_id))
-        
-        # Get plan details
-        cursor.execute('SELECT duration_days FROM plans WHERE id = ?', (plan_id,))
-        plan = cursor.fetchone()
-        duration_days = plan[0] if plan else 30
+            WHERE id = ? AND is_used = 0
+            RETURNING id, key_value
+        ''', (user_id, key[0])).fetchall()
+        if not debited or not claimed:
+            raise sqlite3.OperationalError("Balance or key changed during purchase")
+        key_id, key_value = claimed[0]
         
-        # Create user plan record
-        cursor.execute('''
+        cursor = conn.execute('''
             INSERT INTO user_plans (user_id, plan_id, vpn_key_id, expiry_date)
-            VALUES (?, ?, ?, datetime('now', '+{} days'))
-        '''.format(duration_days), (user_id, plan_id, key_id))
-        
-        conn.commit()
-        conn.close()
+            VALUES (?, ?, ?, datetime('now', '+' || ? || ' days'))
+        ''', (user_id, plan_id, key_id, duration_days))
+        available_keys = conn.execute('SELECT available_keys FROM plan_inventory WHERE plan_id = ?',
+                                      (plan_id,)).fetchone()[0]
         
-        return key_value
-    else:
-        conn.close()
+        return PurchaseResult(PURCHASE_SUCCESS, key_value, cursor.lastrowid, float(debited[0][0]), available_keys)
+
+@serialized_write
+def record_provider_purchase(user_id, plan_id, credits_required, purchase_date, expiry_date, vpn_key, api_response):
+    """Record a QITO / ByPass account purchase and debit its price in one transaction.
+
+    Returns the user_plans id, or None (nothing written) if the balance does not cover the price.
+    """
+    with transaction() as conn:
+        return _insert_provider_purchase(conn, user_id, plan_id, credits_required, purchase_date, expiry_date,
+                                         vpn_key, api_response)
+
+def _insert_provider_purchase(conn, user_id, plan_id, credits_required, purchase_date, expiry_date, vpn_key, api_response):
+    """Debit the balance and insert the user_plans row; returns the user_plans id.
+
+    The debit only applies if the balance still covers the price, whatever
+    the caller checked before. If it does not, nothing is written and None
+    is returned, so callers must call this before their own writes (or
+    raise to roll them back).
+    """
+    debited = conn.execute('''
+        UPDATE users 
+        SET balance = ROUND(balance - ?, 0), updated_at = CURRENT_TIMESTAMP 
+        WHERE telegram_id = ? AND balance >= ?
+    ''', (float(credits_required), user_id, credits_required)).rowcount
+    if not debited:
         return None
+    cursor = conn.execute('''
+        INSERT INTO user_plans (user_id, plan_id, purchase_date, expiry_date, status, vpn_key, api_response,
+                                account_username, account_password)
+        VALUES (?, ?, ?, ?, 'active', ?, ?, json_extract(?, '$.username'), json_extract(?, '$.password'))
+    ''', (user_id, plan_id, purchase_date, expiry_date, vpn_key, api_response, api_response, api_response))
+    return cursor.lastrowid
+
+# Pre-created QITO / ByPass accounts (see account_pool.py)
+PROVIDER_ACCOUNT_AVAILABLE = 'available'
+PROVIDER_ACCOUNT_CLAIMED = 'claimed'
+PROVIDER_ACCOUNT_STALE = 'stale'
+
+ProviderClaim = namedtuple('ProviderClaim', ['status', 'vpn_key', 'api_response', 'expiry_date', 'user_plan_id'])
+
+@serialized_write
+def add_provider_account(provider, device_limit, duration_days, vpn_key, api_response, expire_at):
+    """Store a newly created provider account as available stock"""
+    with transaction() as conn:
+        cursor = conn.execute('''
+            INSERT INTO provider_accounts (provider, device_limit, duration_days, vpn_key, api_response, expire_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (provider, device_limit, duration_days, vpn_key, api_response, expire_at))
+        return cursor.lastrowid
+
+@serialized_write
+def claim_provider_account(user_id, plan_id, provider, device_limit, duration_days, credits_required, fresh_after,
+                           purchase_job_id=None):
+    """Hand a pooled account created after fresh_after to the user and debit the plan price in one transaction.
+
+    Returns a ProviderClaim whose status is PURCHASE_SUCCESS,
+    PURCHASE_OUT_OF_STOCK or PURCHASE_INSUFFICIENT_FUNDS. A purchase job
+    given as purchase_job_id is marked recorded in the same transaction.
+    """
+    with transaction() as conn:
+        balance = conn.execute('SELECT balance FROM users WHERE telegram_id = ?', (user_id,)).fetchone()
+        if not balance or balance[0] < credits_required:
+            return ProviderClaim(PURCHASE_INSUFFICIENT_FUNDS, None, None, None, None)
+        
+        account = conn.execute('''
+            SELECT id, vpn_key, api_response, expire_at FROM provider_accounts 
+            WHERE provider = ? AND device_limit = ? AND duration_days = ? 
+              AND status = 'available' AND created_at >= ? 
+            ORDER BY created_at LIMIT 1
+        ''', (provider, device_limit, duration_days, fresh_after)).fetchone()
+        if not account:
+            return ProviderClaim(PURCHASE_OUT_OF_STOCK, None, None, None, None)
+        account_id, vpn_key, api_response, expire_at = account
+        
+        # Debit first: if the balance no longer covers the price nothing has been written yet
+        user_plan_id = _insert_provider_purchase(conn, user_id, plan_id, credits_required, datetime.now(),
+                                                 expire_at, vpn_key, api_response)
+        if user_plan_id is None:
+            return ProviderClaim(PURCHASE_INSUFFICIENT_FUNDS, None, None, None, None)
+        claimed = conn.execute('''
+            UPDATE provider_accounts 
+            SET status = 'claimed', claimed_by = ?, claimed_at = CURRENT_TIMESTAMP, user_plan_id = ? 
+            WHERE id = ? AND status = 'available'
+        ''', (user_id, user_plan_id, account_id)).rowcount
+        if not claimed:
+            # The write lock is held, so this cannot happen; raising rolls back the debit
+            raise sqlite3.OperationalError("Pooled account claimed during purchase")
+        if purchase_job_id is not None:
+            conn.execute('''
+                UPDATE purchase_jobs 
+                SET status = 'recorded', api_response = ?, expiry_date = ?, user_plan_id = ?, 
+                    updated_at = CURRENT_TIMESTAMP 
+                WHERE id = ?
+            ''', (api_response, expire_at, user_plan_id, purchase_job_id))
+
+        return ProviderClaim(PURCHASE_SUCCESS, vpn_key, api_response, expire_at, user_plan_id)
+
+@serialized_write
+def mark_stale_provider_accounts(created_before):
+    """Retire available accounts created before the cutoff; returns how many"""
+    with transaction() as conn:
+        return conn.execute('''
+            UPDATE provider_accounts SET status = 'stale' 
+            WHERE status = 'available' AND created_at < ?
+        ''', (created_before,)).rowcount
+
+def count_provider_accounts(provider, device_limit, duration_days, fresh_after):
+    """Count fresh available accounts for one (provider, devices, duration) combination"""
+    conn = get_connection()
+    result = conn.execute('''
+        SELECT COUNT(*) FROM provider_accounts 
+        WHERE provider = ? AND device_limit = ? AND duration_days = ? 
+          AND status = 'available' AND created_at >= ?
+    ''', (provider, device_limit, duration_days, fresh_after)).fetchone()
+    conn.close()
+    return result[0]
+
+def get_provider_account_summary():
+    """Account counts per provider, devices, duration and status"""
+    conn = get_connection()
+    rows = conn.execute('''
+        SELECT provider, device_limit, duration_days, status, COUNT(*) 
+        FROM provider_accounts 
+        GROUP BY provider, device_limit, duration_days, status 
+        ORDER BY provider, device_limit, duration_days, status
+    ''').fetchall()
+    conn.close()
+    return rows
 
 def get_user_plans(user_id):
     """Get user's purchased plans"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -519,54 +843,98 @@ def get_user_plans(user_id):
     conn.close()
     return plans
 
+def get_user_plans_page(user_id, limit, before_id=None, after_id=None):
+    """One page of a user's plans, newest first, by keyset pagination on (purchase_date, id).
+
+    before_id / after_id: the user_plans id at the edge of the current page;
+    the page returned holds the plans just older / newer than it. If that
+    plan no longer exists, the first (newest) page is returned. Returns
+    (plans, has_older, has_newer). Each plan is (id, name, description,
+    key_value, purchase_date, expiry_date, status, plan_type,
+    account_username, account_password).
+    """
+    conn = get_connection()
+    boundary = after_id if after_id is not None else before_id
+    edge_row = None
+    if boundary is not None:
+        edge_row = conn.execute('SELECT purchase_date, id FROM user_plans WHERE id = ? AND user_id = ?',
+                                (boundary, user_id)).fetchone()
+        if edge_row is None:
+            # Deleted since the Newer / Older buttons were sent
+            before_id = after_id = None
+
+    if after_id is not None:
+        edge, order = '>', 'ASC'
+    else:
+        edge, order = '<', 'DESC'
+    keyset = f'AND (up.purchase_date, up.id) {edge} (?, ?)' if edge_row is not None else ''
+
+    plans = conn.execute(f'''
+        SELECT up.id, p.name, p.description,
+               COALESCE(up.vpn_key, vk.key_value) as key_value,
+               up.purchase_date, up.expiry_date, up.status, p.plan_type,
+               up.account_username, up.account_password
+        FROM user_plans up
+        JOIN plans p ON up.plan_id = p.id
+        LEFT JOIN vpn_keys vk ON up.vpn_key_id = vk.id
+        WHERE up.user_id = ? {keyset}
+        ORDER BY up.purchase_date {order}, up.id {order}
+        LIMIT ?
+    ''', (user_id,) + (tuple(edge_row) if edge_row is not None else ()) + (limit + 1,)).fetchall()
+    conn.close()
+
+    has_more = len(plans) > limit
+    plans = plans[:limit]
+    if after_id is not None:
+        plans.reverse()
+        return plans, True, has_more
+    return plans, has_more, before_id is not None
+
+@serialized_write
 def delete_vpn_key(key_id):
     """Delete a VPN key"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM vpn_keys WHERE id = ?', (key_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM vpn_keys WHERE id = ?', (key_id,))
 
-def check_low_key_plans(min_keys=10):
-    """Check for plans with low key availability"""
-    conn = sqlite3.connect(DB_FILE)
+def check_low_key_plans(min_keys=10, plan_type=None):
+    """Check for plans with fewer available keys than their low stock threshold (min_keys if not set)"""
+    conn = get_connection()
     cursor = conn.cursor()
     
     # Get all active plans with their available key counts
-    cursor.execute('''
-        SELECT p.id, p.name, COUNT(vk.id) as available_keys
+    type_filter = 'AND p.plan_type = ?' if plan_type else ''
+    cursor.execute(f'''
+        SELECT p.id, p.name, COALESCE(pi.available_keys, 0) as available_keys
         FROM plans p
-        LEFT JOIN vpn_keys vk ON p.id = vk.plan_id AND vk.is_used = 0
-        WHERE p.is_active = 1
-        GROUP BY p.id, p.name
-        HAVING available_keys < ?
+        LEFT JOIN plan_inventory pi ON pi.plan_id = p.id
+        WHERE p.is_active = 1 {type_filter}
+        AND COALESCE(pi.available_keys, 0) < COALESCE(p.low_stock_threshold, ?)
         ORDER BY available_keys ASC
-    ''', (min_keys,))
+    ''', ((plan_type,) if plan_type else ()) + (min_keys,))
     
     low_key_plans = cursor.fetchall()
     conn.close()
     
     return low_key_plans
 
-def get_plan_key_statistics():
+def get_plan_key_statistics(plan_type=None):
     """Get key statistics for all plans"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
+    type_filter = 'AND p.plan_type = ?' if plan_type else ''
+    cursor.execute(f'''
         SELECT 
             p.id,
             p.name,
-            COUNT(vk.id) as total_keys,
-            COUNT(CASE WHEN vk.is_used = 0 THEN 1 END) as available_keys,
-            COUNT(CASE WHEN vk.is_used = 1 THEN 1 END) as used_keys
+            COALESCE(pi.total_keys, 0) as total_keys,
+            COALESCE(pi.available_keys, 0) as available_keys,
+            COALESCE(pi.used_keys, 0) as used_keys
         FROM plans p
-        LEFT JOIN vpn_keys vk ON p.id = vk.plan_id
-        WHERE p.is_active = 1
-        GROUP BY p.id, p.name
+        LEFT JOIN plan_inventory pi ON pi.plan_id = p.id
+        WHERE p.is_active = 1 {type_filter}
         ORDER BY available_keys ASC
-    ''')
+    ''', (plan_type,) if plan_type else ())
     
     stats = cursor.fetchall()
     conn.close()
@@ -575,21 +943,10 @@ def get_plan_key_statistics():
 
 def init_contact_tables():
     """Initialize contact configuration table"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    run_migrations()
     
-    # Create contact_config table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS contact_config (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            contact_type TEXT NOT NULL UNIQUE,
-            contact_value TEXT NOT NULL,
-            is_active BOOLEAN DEFAULT 1,
-            display_order INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    conn = get_connection()
+    cursor = conn.cursor()
     
     # Insert default contact configurations if table is empty
     cursor.execute('SELECT COUNT(*) FROM contact_config')
@@ -614,7 +971,7 @@ def init_contact_tables():
 # Contact configuration functions
 def get_contact_config():
     """Get all contact configurations"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -627,9 +984,10 @@ def get_contact_config():
     conn.close()
     return contacts
 
+@catalog_cached
 def get_active_contact_config():
     """Get active contact configurations"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -643,23 +1001,19 @@ def get_active_contact_config():
     conn.close()
     return contacts
 
+@serialized_write
 def update_contact_config(contact_id, contact_value, is_active, display_order):
     """Update contact configuration"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE contact_config 
-        SET contact_value = ?, is_active = ?, display_order = ?, updated_at = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    ''', (contact_value, is_active, display_order, contact_id))
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE contact_config 
+            SET contact_value = ?, is_active = ?, display_order = ?, updated_at = CURRENT_TIMESTAMP 
+            WHERE id = ?
+        ''', (contact_value, is_active, display_order, contact_id))
 
 def get_contact_by_type(contact_type):
     """Get contact value by type"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -672,55 +1026,62 @@ def get_contact_by_type(contact_type):
     return result[0] if result else None
 
 # Expired key management functions
-def check_and_delete_expired_keys():
+# Expired plans deleted per transaction; also keeps the IN (...) lists well
+# under SQLite's bound-parameter limit
+EXPIRY_SWEEP_BATCH_SIZE = 500
+
+@serialized_write
+def _delete_expired_batch(now, batch_size):
+    """Delete one batch of expired plans and their keys; returns the deleted rows"""
+    with transaction() as conn:
+        # Uses idx_user_plans_status_expiry_epoch; expiry_epoch is kept in sync by triggers
+        expired_plans = conn.execute('''
+            SELECT up.id, up.user_id, up.vpn_key_id, p.name, up.expiry_date, vk.key_value
+            FROM user_plans up
+            JOIN plans p ON up.plan_id = p.id
+            LEFT JOIN vpn_keys vk ON vk.id = up.vpn_key_id
+            WHERE up.status = 'active' 
+            AND up.expiry_epoch < ?
+            ORDER BY up.expiry_epoch
+            LIMIT ?
+        ''', (now, batch_size)).fetchall()
+
+        if not expired_plans:
+            return expired_plans
+
+        user_plan_ids = [plan[0] for plan in expired_plans]
+        vpn_key_ids = [plan[2] for plan in expired_plans if plan[2]]
+
+        conn.execute(f'''
+            DELETE FROM user_plans WHERE id IN ({','.join('?' * len(user_plan_ids))})
+        ''', user_plan_ids)
+        if vpn_key_ids:
+            conn.execute(f'''
+                DELETE FROM vpn_keys WHERE id IN ({','.join('?' * len(vpn_key_ids))})
+            ''', vpn_key_ids)
+
+    return expired_plans
+
+def check_and_delete_expired_keys(batch_size=EXPIRY_SWEEP_BATCH_SIZE):
     """Check for expired keys and delete them completely"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Get all active user plans that have expired
-    cursor.execute('''
-        SELECT up.id, up.user_id, up.plan_id, up.vpn_key_id, p.name, up.expiry_date
-        FROM user_plans up
-        JOIN plans p ON up.plan_id = p.id
-        WHERE up.status = 'active' 
-        AND up.expiry_date IS NOT NULL 
-        AND datetime(up.expiry_date) < datetime('now')
-    ''')
-    expired_plans = cursor.fetchall()
-    
-    deleted_count = 0
+    now = int(time.time())
     deleted_details = []
-    
-    for plan in expired_plans:
-        plan_id, user_id, plan_id_num, vpn_key_id, plan_name, expiry_date = plan
-        
-        # Get VPN key details before deletion
-        key_details = None
-        if vpn_key_id:
-            cursor.execute('SELECT key_value FROM vpn_keys WHERE id = ?', (vpn_key_id,))
-            key_result = cursor.fetchone()
-            if key_result:
-                key_details = key_result[0]
-        
-        # Delete the user plan record
-        cursor.execute('DELETE FROM user_plans WHERE id = ?', (plan_id,))
-        
-        # Delete the VPN key if it exists
-        if vpn_key_id:
-            cursor.execute('DELETE FROM vpn_keys WHERE id = ?', (vpn_key_id,))
-        
-        deleted_count += 1
-        deleted_details.append({
-            'user_id': user_id,
-            'plan_name': plan_name,
-            'vpn_key': key_details,
-            'expiry_date': expiry_date
-        })
-    
-    conn.commit()
-    conn.close()
-    
-    return deleted_count, deleted_details
+
+    while True:
+        expired_plans = _delete_expired_batch(now, batch_size)
+
+        for user_plan_id, user_id, vpn_key_id, plan_name, expiry_date, key_value in expired_plans:
+            deleted_details.append({
+                'user_id': user_id,
+                'plan_name': plan_name,
+                'vpn_key': key_value,
+                'expiry_date': expiry_date
+            })
+
+        if len(expired_plans) < batch_size:
+            break
+
+    return len(deleted_details), deleted_details
 
 def check_and_update_expired_keys():
     """Legacy function - now calls the delete function"""
@@ -728,7 +1089,8 @@ def check_and_update_expired_keys():
 
 def get_expiring_soon_keys(days_ahead=3):
     """Get keys that will expire soon"""
-    conn = sqlite3.connect(DB_FILE)
+    now = int(time.time())
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -737,68 +1099,85 @@ def get_expiring_soon_keys(days_ahead=3):
         JOIN plans p ON up.plan_id = p.id
         JOIN users u ON up.user_id = u.telegram_id
         WHERE up.status = 'active' 
-        AND up.expiry_date IS NOT NULL 
-        AND datetime(up.expiry_date) BETWEEN datetime('now') AND datetime('now', '+{} days')
-        ORDER BY up.expiry_date ASC
-    '''.format(days_ahead))
+        AND up.expiry_epoch BETWEEN ? AND ?
+        ORDER BY up.expiry_epoch ASC
+    ''', (now, now + days_ahead * 86400))
     
     expiring_plans = cursor.fetchall()
     conn.close()
     
     return expiring_plans
 
-def cleanup_orphaned_keys():
-    """Clean up VPN keys that are not assigned to any user plan"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Find VPN keys that are not referenced by any user plan
-    cursor.execute('''
-        SELECT vk.id, vk.key_value, vk.plan_id
-        FROM vpn_keys vk
-        LEFT JOIN user_plans up ON vk.id = up.vpn_key_id
-        WHERE up.vpn_key_id IS NULL
-    ''')
-    orphaned_keys = cursor.fetchall()
-    
-    deleted_count = 0
+# Orphaned keys deleted per transaction, and how long one cleanup run may take
+# before it stops and leaves the rest for the next cron run
+ORPHAN_CLEANUP_BATCH_SIZE = 500
+ORPHAN_CLEANUP_TIME_BUDGET = 10.0
+
+ORPHANED_KEY_BATCH_SQL = '''
+    SELECT vk.id, vk.key_value, vk.plan_id
+    FROM vpn_keys vk
+    WHERE vk.is_used = 1 AND vk.id > ?
+    AND NOT EXISTS (SELECT 1 FROM user_plans up WHERE up.vpn_key_id = vk.id)
+    ORDER BY vk.id
+    LIMIT ?
+'''
+
+def _orphaned_key_batch(last_key_id, batch_size, delete):
+    """Find (and optionally delete) the next batch of orphaned keys after last_key_id"""
+    if not delete:
+        # A dry run only reads, so it does not take the write lock
+        conn = get_connection()
+        orphaned_keys = conn.execute(ORPHANED_KEY_BATCH_SQL, (last_key_id, batch_size)).fetchall()
+        conn.close()
+        return orphaned_keys
+
+    with transaction() as conn:
+        orphaned_keys = conn.execute(ORPHANED_KEY_BATCH_SQL, (last_key_id, batch_size)).fetchall()
+
+        if orphaned_keys:
+            key_ids = [key[0] for key in orphaned_keys]
+            conn.execute(f'''
+                DELETE FROM vpn_keys WHERE id IN ({','.join('?' * len(key_ids))})
+            ''', key_ids)
+
+    return orphaned_keys
+
+def cleanup_orphaned_keys(dry_run=False, batch_size=ORPHAN_CLEANUP_BATCH_SIZE,
+                          time_budget=ORPHAN_CLEANUP_TIME_BUDGET):
+    """Clean up sold VPN keys (is_used = 1) that no user plan refers to any more"""
+    # Unsold keys (is_used = 0) are stock, never orphans
+    deadline = time.monotonic() + time_budget
     deleted_keys = []
-    
-    for key in orphaned_keys:
-        key_id, key_value, plan_id = key
-        
-        # Delete the orphaned key
-        cursor.execute('DELETE FROM vpn_keys WHERE id = ?', (key_id,))
-        
-        deleted_count += 1
-        deleted_keys.append({
-            'key_id': key_id,
-            'key_value': key_value,
-            'plan_id': plan_id
-        })
-    
-    conn.commit()
-    conn.close()
-    
-    return deleted_count, deleted_keys
+    last_key_id = 0
+
+    while True:
+        if dry_run:
+            orphaned_keys = _orphaned_key_batch(last_key_id, batch_size, False)
+        else:
+            orphaned_keys = run_write(_orphaned_key_batch, last_key_id, batch_size, True)
+
+        for key_id, key_value, plan_id in orphaned_keys:
+            deleted_keys.append({
+                'key_id': key_id,
+                'key_value': key_value,
+                'plan_id': plan_id
+            })
+
+        if len(orphaned_keys) < batch_size:
+            break
+        last_key_id = orphaned_keys[-1][0]
+        if time.monotonic() >= deadline:
+            print(f"⚠️ Orphaned key cleanup stopped after {len(deleted_keys)} keys (time budget reached)")
+            break
+
+    return len(deleted_keys), deleted_keys
 
 def init_account_setup_tables():
     """Initialize account setup configuration table"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    run_migrations()
     
-    # Create account_setup_config table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS account_setup_config (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            config_key TEXT UNIQUE NOT NULL,
-            config_value TEXT NOT NULL,
-            description TEXT,
-            is_active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    conn = get_connection()
+    cursor = conn.cursor()
     
     # Insert default QITO Net redirect link if not exists
     cursor.execute('''
@@ -812,13 +1191,20 @@ def init_account_setup_tables():
         VALUES ('bypass_redirect_link', 'https://qito.net', 'ByPass Plan Account Setup Redirect Link')
     ''')
     
+    # Pre-created provider accounts kept per device limit / duration (account_pool.py)
+    cursor.execute('''
+        INSERT OR IGNORE INTO account_setup_config (config_key, config_value, description)
+        VALUES ('provider_account_pool_size', '0', 'QITO / ByPass accounts created ahead of demand per device limit and duration (0 = off)')
+    ''')
+    
     conn.commit()
     conn.close()
     print("✅ Account setup configuration table initialized successfully")
 
+@catalog_cached
 def get_account_setup_config(config_key):
     """Get account setup configuration value"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -831,31 +1217,27 @@ def get_account_setup_config(config_key):
     
     return result[0] if result else None
 
+@serialized_write
 def update_account_setup_config(config_key, config_value, description=None):
     """Update account setup configuration"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE account_setup_config 
-        SET config_value = ?, description = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE config_key = ?
-    ''', (config_value, description, config_key))
-    
-    if cursor.rowcount == 0:
-        # Insert if not exists
-        cursor.execute('''
-            INSERT INTO account_setup_config (config_key, config_value, description)
-            VALUES (?, ?, ?)
-        ''', (config_key, config_value, description))
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        cursor = conn.execute('''
+            UPDATE account_setup_config 
+            SET config_value = ?, description = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE config_key = ?
+        ''', (config_value, description, config_key))
+        
+        if cursor.rowcount == 0:
+            # Insert if not exists
+            conn.execute('''
+                INSERT INTO account_setup_config (config_key, config_value, description)
+                VALUES (?, ?, ?)
+            ''', (config_key, config_value, description))
     return True
 
 def get_all_account_setup_configs():
     """Get all account setup configurations"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -870,7 +1252,7 @@ def get_all_account_setup_configs():
 
 def get_all_users():
     """Get all users from database"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -884,22 +1266,21 @@ def get_all_users():
     
     return users
 
-def get_all_active_plans_for_notification():
-    """Get all active plans for notification (both VPN and QITO)"""
-    conn = sqlite3.connect(DB_FILE)
+def get_all_active_plans_for_notification(plan_type=None):
+    """Get all active plans for notification, optionally only those of one plan type"""
+    conn = get_connection()
     cursor = conn.cursor()
     
-    # Get all active plans
-    cursor.execute('''
+    type_filter = 'AND p.plan_type = ?' if plan_type else ''
+    cursor.execute(f'''
         SELECT p.plan_id_number, p.name, p.description, p.credits_required, 
                p.duration_days, p.device_limit,
-               COUNT(CASE WHEN vk.is_used = 0 THEN 1 END) as available_keys
+               COALESCE(pi.available_keys, 0) as available_keys
         FROM plans p
-        LEFT JOIN vpn_keys vk ON p.id = vk.plan_id
-        WHERE p.is_active = 1
-        GROUP BY p.id, p.plan_id_number, p.name, p.description, p.credits_required, p.duration_days, p.device_limit
+        LEFT JOIN plan_inventory pi ON pi.plan_id = p.id
+        WHERE p.is_active = 1 {type_filter}
         ORDER BY p.plan_id_number
-    ''')
+    ''', (plan_type,) if plan_type else ())
     
     plans = cursor.fetchall()
     conn.close()
@@ -908,7 +1289,7 @@ def get_all_active_plans_for_notification():
 
 def get_expired_keys_stats():
     """Get statistics about expired keys"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
     
     # Get count of active user plans
@@ -918,25 +1299,12 @@ def get_expired_keys_stats():
     ''')
     active_count = cursor.fetchone()[0]
     
-    # Get count of total VPN keys
+    # Get total, used and available VPN key counts from the per-plan counters
     cursor.execute('''
-        SELECT COUNT(*) FROM vpn_keys
+        SELECT COALESCE(SUM(total_keys), 0), COALESCE(SUM(used_keys), 0), COALESCE(SUM(available_keys), 0)
+        FROM plan_inventory
     ''')
-    total_keys = cursor.fetchone()[0]
-    
-    # Get count of used VPN keys
-    cursor.execute('''
-        SELECT COUNT(*) FROM vpn_keys 
-        WHERE is_used = 1
-    ''')
-    used_keys = cursor.fetchone()[0]
-    
-    # Get count of available VPN keys
-    cursor.execute('''
-        SELECT COUNT(*) FROM vpn_keys 
-        WHERE is_used = 0
-    ''')
-    available_keys = cursor.fetchone()[0]
+    total_keys, used_keys, available_keys = cursor.fetchone()
     
     conn.close()
     
@@ -946,3 +1314,262 @@ def get_expired_keys_stats():
         'used_keys': used_keys,
         'available_keys': available_keys
     }
+
+# Broadcast jobs (see broadcast.py). A job moves queued -> running ->
+# completed, and can be paused (back to queued on resume) or cancelled.
+BROADCAST_QUEUED = 'queued'
+BROADCAST_RUNNING = 'running'
+BROADCAST_PAUSED = 'paused'
+BROADCAST_COMPLETED = 'completed'
+BROADCAST_CANCELLED = 'cancelled'
+
+# Recipient outcomes
+RECIPIENT_PENDING = 'pending'
+RECIPIENT_SENT = 'sent'
+RECIPIENT_FAILED = 'failed'
+RECIPIENT_BLOCKED = 'blocked'
+
+Broadcast = namedtuple('Broadcast', ['id', 'kind', 'text', 'parse_mode', 'status', 'created_by',
+                                     'progress_message_id', 'total', 'sent', 'failed', 'blocked',
+                                     'created_at', 'started_at', 'finished_at'])
+
+BROADCAST_COLUMNS = ', '.join(Broadcast._fields)
+
+@serialized_write
+def create_broadcast(kind, text, created_by, parse_mode='Markdown'):
+    """Queue a broadcast to every user who has not blocked the bot and return its id"""
+    with transaction() as conn:
+        cursor = conn.execute('''
+            INSERT INTO broadcasts (kind, text, parse_mode, created_by)
+            VALUES (?, ?, ?, ?)
+        ''', (kind, text, parse_mode, created_by))
+        broadcast_id = cursor.lastrowid
+        
+        recipients = conn.execute('''
+            INSERT INTO broadcast_recipients (broadcast_id, telegram_id)
+            SELECT ?, telegram_id FROM users WHERE blocked_at IS NULL
+        ''', (broadcast_id,)).rowcount
+        conn.execute('UPDATE broadcasts SET total = ? WHERE id = ?', (recipients, broadcast_id))
+        return broadcast_id
+
+def get_broadcast(broadcast_id):
+    """Get one broadcast job as a Broadcast tuple, or None"""
+    conn = get_connection()
+    row = conn.execute(f'SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone()
+    conn.close()
+    return Broadcast(*row) if row else None
+
+def get_recent_broadcasts(limit=20):
+    """Get the most recent broadcast jobs, newest first"""
+    conn = get_connection()
+    rows = conn.execute(f'SELECT {BROADCAST_COLUMNS} FROM broadcasts ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+    conn.close()
+    return [Broadcast(*row) for row in rows]
+
+def get_next_broadcast():
+    """Get the oldest job that is queued or was interrupted while running"""
+    conn = get_connection()
+    row = conn.execute(f'''
+        SELECT {BROADCAST_COLUMNS} FROM broadcasts 
+        WHERE status IN (?, ?) 
+        ORDER BY id LIMIT 1
+    ''', (BROADCAST_RUNNING, BROADCAST_QUEUED)).fetchone()
+    conn.close()
+    return Broadcast(*row) if row else None
+
+def get_pending_broadcast_recipients(broadcast_id, limit):
+    """Get the next telegram ids a broadcast still has to be sent to"""
+    conn = get_connection()
+    rows = conn.execute('''
+        SELECT telegram_id FROM broadcast_recipients 
+        WHERE broadcast_id = ? AND status = ? 
+        ORDER BY telegram_id LIMIT ?
+    ''', (broadcast_id, RECIPIENT_PENDING, limit)).fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+@serialized_write
+def record_broadcast_results(broadcast_id, results):
+    """Store (telegram_id, status, error) outcomes for a batch and update the job's counters"""
+    counts = {RECIPIENT_SENT: 0, RECIPIENT_FAILED: 0, RECIPIENT_BLOCKED: 0}
+    with transaction() as conn:
+        for telegram_id, status, error in results:
+            updated = conn.execute('''
+                UPDATE broadcast_recipients 
+                SET status = ?, error = ?, sent_at = CASE WHEN ? = 'sent' THEN CURRENT_TIMESTAMP END 
+                WHERE broadcast_id = ? AND telegram_id = ? AND status = 'pending'
+            ''', (status, error, status, broadcast_id, telegram_id)).rowcount
+            if not updated:
+                continue
+            counts[status] += 1
+            if status == RECIPIENT_BLOCKED:
+                conn.execute('UPDATE users SET blocked_at = CURRENT_TIMESTAMP WHERE telegram_id = ?',
+                             (telegram_id,))
+        
+        conn.execute('''
+            UPDATE broadcasts 
+            SET sent = sent + ?, failed = failed + ?, blocked = blocked + ? 
+            WHERE id = ?
+        ''', (counts[RECIPIENT_SENT], counts[RECIPIENT_FAILED], counts[RECIPIENT_BLOCKED], broadcast_id))
+
+@serialized_write
+def set_broadcast_status(broadcast_id, status, from_statuses=None):
+    """Change a job's status, optionally only from one of from_statuses; returns True if it changed"""
+    status_filter = f"AND status IN ({', '.join('?' * len(from_statuses))})" if from_statuses else ''
+    with transaction() as conn:
+        cursor = conn.execute(f'''
+            UPDATE broadcasts 
+            SET status = ?,
+                started_at = CASE WHEN ? = 'running' THEN COALESCE(started_at, CURRENT_TIMESTAMP) ELSE started_at END,
+                finished_at = CASE WHEN ? IN ('completed', 'cancelled') THEN CURRENT_TIMESTAMP ELSE finished_at END
+            WHERE id = ? {status_filter}
+        ''', (status, status, status, broadcast_id) + tuple(from_statuses or ()))
+        return cursor.rowcount > 0
+
+@serialized_write
+def set_broadcast_progress_message(broadcast_id, message_id):
+    """Remember the admin's progress message so the sender can keep it updated"""
+    with transaction() as conn:
+        conn.execute('UPDATE broadcasts SET progress_message_id = ? WHERE id = ?', (message_id, broadcast_id))
+
+@serialized_write
+def clear_user_blocked(telegram_id):
+    """Include a user in broadcasts again (they pressed /start after blocking the bot)"""
+    with transaction() as conn:
+        conn.execute('UPDATE users SET blocked_at = NULL WHERE telegram_id = ? AND blocked_at IS NOT NULL',
+                     (telegram_id,))
+
+# QITO / ByPass purchase jobs (see purchase_jobs.py). A job moves
+# queued -> provisioned (account created) -> recorded (user_plans written,
+# balance debited) -> delivered, or to failed before anything is charged.
+PURCHASE_JOB_QUEUED = 'queued'
+PURCHASE_JOB_PROVISIONED = 'provisioned'
+PURCHASE_JOB_RECORDED = 'recorded'
+PURCHASE_JOB_DELIVERED = 'delivered'
+PURCHASE_JOB_FAILED = 'failed'
+PURCHASE_JOB_UNFINISHED = (PURCHASE_JOB_QUEUED, PURCHASE_JOB_PROVISIONED, PURCHASE_JOB_RECORDED)
+
+PurchaseJob = namedtuple('PurchaseJob', ['id', 'user_id', 'provider', 'plan_id', 'chat_id', 'message_id',
+                                         'first_name', 'last_name', 'username', 'status', 'api_response',
+                                         'expiry_date', 'user_plan_id', 'error', 'attempts',
+                                         'created_at', 'updated_at'])
+
+PURCHASE_JOB_COLUMNS = ', '.join(PurchaseJob._fields)
+
+@serialized_write
+def create_purchase_job(user_id, provider, plan_id, chat_id, message_id, first_name=None, last_name=None, username=None):
+    """Persist a confirmed purchase; returns its id, or None if that confirmation message already has a job"""
+    with transaction() as conn:
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO purchase_jobs 
+                (user_id, provider, plan_id, chat_id, message_id, first_name, last_name, username)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, provider, plan_id, chat_id, message_id, first_name, last_name, username))
+        return cursor.lastrowid if cursor.rowcount else None
+
+def get_purchase_job(job_id):
+    """Get one purchase job as a PurchaseJob tuple, or None"""
+    conn = get_connection()
+    row = conn.execute(f'SELECT {PURCHASE_JOB_COLUMNS} FROM purchase_jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    return PurchaseJob(*row) if row else None
+
+def get_unfinished_purchase_job_ids():
+    """Ids of jobs not yet delivered or failed, oldest first"""
+    conn = get_connection()
+    rows = conn.execute('''
+        SELECT id FROM purchase_jobs 
+        WHERE status IN (?, ?, ?) 
+        ORDER BY id
+    ''', PURCHASE_JOB_UNFINISHED).fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+@serialized_write
+def set_purchase_job_account(job_id, api_response, expiry_date):
+    """Store the account created for a queued job (queued -> provisioned); returns True if it changed"""
+    with transaction() as conn:
+        return conn.execute('''
+            UPDATE purchase_jobs 
+            SET status = 'provisioned', api_response = ?, expiry_date = ?, updated_at = CURRENT_TIMESTAMP 
+            WHERE id = ? AND status = 'queued'
+        ''', (api_response, expiry_date, job_id)).rowcount > 0
+
+@serialized_write
+def record_purchase_job(job_id, credits_required, vpn_key):
+    """Write user_plans and debit the buyer for a provisioned job in one transaction (provisioned -> recorded).
+
+    Returns PURCHASE_SUCCESS, PURCHASE_INSUFFICIENT_FUNDS if the balance no
+    longer covers the price (nothing is written; the job stays provisioned),
+    or None if the job is not provisioned.
+    """
+    with transaction() as conn:
+        job = conn.execute('''
+            SELECT user_id, plan_id, expiry_date, api_response FROM purchase_jobs 
+            WHERE id = ? AND status = 'provisioned'
+        ''', (job_id,)).fetchone()
+        if not job:
+            return None
+        user_id, plan_id, expiry_date, api_response = job
+        user_plan_id = _insert_provider_purchase(conn, user_id, plan_id, credits_required, datetime.now(),
+                                                 expiry_date, vpn_key, api_response)
+        if user_plan_id is None:
+            return PURCHASE_INSUFFICIENT_FUNDS
+        conn.execute('''
+            UPDATE purchase_jobs 
+            SET status = 'recorded', user_plan_id = ?, updated_at = CURRENT_TIMESTAMP 
+            WHERE id = ?
+        ''', (user_plan_id, job_id))
+        return PURCHASE_SUCCESS
+
+@serialized_write
+def set_purchase_job_status(job_id, status, from_statuses, error=None):
+    """Move a job to another status from one of from_statuses; returns True if it changed"""
+    with transaction() as conn:
+        return conn.execute(f'''
+            UPDATE purchase_jobs 
+            SET status = ?, error = COALESCE(?, error), updated_at = CURRENT_TIMESTAMP 
+            WHERE id = ? AND status IN ({', '.join('?' * len(from_statuses))})
+        ''', (status, error, job_id) + tuple(from_statuses)).rowcount > 0
+
+@serialized_write
+def record_purchase_job_error(job_id, error):
+    """Note a failed attempt at a job's current step; returns the attempt count"""
+    with transaction() as conn:
+        row = conn.execute('''
+            UPDATE purchase_jobs 
+            SET attempts = attempts + 1, error = ?, updated_at = CURRENT_TIMESTAMP 
+            WHERE id = ? 
+            RETURNING attempts
+        ''', (error, job_id)).fetchall()
+        return row[0][0] if row else 0
+
+def get_purchase_job_counts():
+    """Number of purchase jobs per status"""
+    conn = get_connection()
+    rows = conn.execute('SELECT status, COUNT(*) FROM purchase_jobs GROUP BY status').fetchall()
+    conn.close()
+    return dict(rows)
+
+# Telegram file_ids of uploaded files (see apk_delivery.py)
+def get_telegram_file_id(file_hash):
+    """file_id of a file the bot has already uploaded, by content hash, or None"""
+    conn = get_connection()
+    row = conn.execute('SELECT file_id FROM telegram_files WHERE file_hash = ?', (file_hash,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+@serialized_write
+def save_telegram_file_id(file_hash, file_id, file_size):
+    """Remember the file_id Telegram returned for an uploaded file"""
+    with transaction() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO telegram_files (file_hash, file_id, file_size) 
+            VALUES (?, ?, ?)
+        ''', (file_hash, file_id, file_size))
+
+@serialized_write
+def delete_telegram_file_id(file_hash):
+    """Forget a file_id Telegram no longer accepts"""
+    with transaction() as conn:
+        conn.execute('DELETE FROM telegram_files WHERE file_hash = ?', (file_hash,))
@@ -0,0 +1,54 @@
+"""
+Async facade over database.py for the asyncio edition of the bot (bot_async.py).
+
+database.py stays synchronous. Each call is run on a small thread pool, so
+the event loop never blocks on SQLite:
+
+    from db_async import adb
+    balance = await adb.get_user_balance(user_id)
+
+Executor threads get their own pooled connection from db_pool, and writes
+still go through the single writer thread (db_writer.py), so the facade adds
+no new locking rules.
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '8'))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db-async')
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """Run a blocking database function on the DB thread pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+class AsyncDatabase:
+    """Exposes every function of a module as a coroutine function run on the DB thread pool"""
+
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name):
+        func = getattr(self._module, name)
+        if not callable(func):
+            return func
+
+        @functools.wraps(func)
+        async def call(*args, **kwargs):
+            return await run_in_db_executor(func, *args, **kwargs)
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, call)
+        return call
+
+adb = AsyncDatabase(database)
+
+def shutdown_db_executor():
+    """Wait for running database calls and stop the thread pool"""
+    _executor.shutdown(wait=True)
@@ -0,0 +1,280 @@
+"""
+Shared SQLite connection manager for the bot, the web admin and the cron scripts.
+
+Each thread keeps one persistent connection to DB_FILE. Pragmas are applied
+once when that connection is opened, instead of on every query. Callers get a
+lightweight lease from get_connection(); calling close() on the lease returns
+the connection to the thread instead of closing it, so existing
+"connect / execute / commit / close" code keeps working unchanged.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from metrics import Counters
+
+# Database file path
+DB_FILE = 'bot_database.db'
+
+# Pragmas applied once per physical connection
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),        # readers never block the writer
+    ('synchronous', 'NORMAL'),      # safe with WAL, avoids an fsync per commit
+    ('cache_size', -20000),         # ~20 MB page cache per connection
+    ('mmap_size', 134217728),       # 128 MB memory-mapped reads
+    ('busy_timeout', 5000),         # wait up to 5s for a lock instead of failing
+    ('temp_store', 'MEMORY'),
+)
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_generation = 0
+_thread_connections = set()  # idents of threads holding a connection, for stats
+_stats = Counters(
+    connections_opened=0,
+    connections_closed=0,
+    acquisitions=0,
+    reuses=0,
+    transactions=0,
+    rollbacks=0,
+    reopened_after_file_change=0,
+)
+
+
+def _file_identity():
+    """Return (device, inode) of the database file, or None if it does not exist"""
+    try:
+        stat = os.stat(DB_FILE)
+        return (stat.st_dev, stat.st_ino)
+    except OSError:
+        return None
+
+
+def _open_connection():
+    """Open a new physical connection and apply the tuned pragmas"""
+    conn = sqlite3.connect(DB_FILE, timeout=5)
+    for name, value in CONNECTION_PRAGMAS:
+        conn.execute(f'PRAGMA {name}={value}')
+    _stats.bump('connections_opened')
+    return conn
+
+
+def _close_physical(state):
+    try:
+        state['conn'].close()
+    except sqlite3.Error:
+        pass
+    _stats.bump('connections_closed')
+
+
+def _thread_state():
+    """Return this thread's connection state, (re)opening the connection if needed"""
+    state = getattr(_local, 'state', None)
+
+    if state is not None and state['depth'] == 0:
+        # A restore replaces the database file; a connection still pointing at
+        # the old file (or opened before invalidate_connections()) is dropped.
+        stale = state['generation'] != _generation or state['identity'] != _file_identity()
+        if stale:
+            _close_physical(state)
+            _stats.bump('reopened_after_file_change')
+            state = None
+
+    if state is None:
+        conn = _open_connection()
+        state = {
+            'conn': conn,
+            'depth': 0,
+            'generation': _generation,
+            'identity': _file_identity(),
+        }
+        _local.state = state
+        with _stats_lock:
+            _thread_connections.add(threading.get_ident())
+    else:
+        _stats.bump('reuses')
+
+    return state
+
+
+class PooledConnection:
+    """Lease on the calling thread's persistent connection.
+
+    Behaves like a sqlite3.Connection for the methods this project uses.
+    close() releases the lease; any transaction left open by the outermost
+    lease is rolled back, matching what closing a real connection would do.
+    While a lease owns the transaction (own_transaction()), other leases on
+    the thread join it: their commit() / rollback() raise, and a with block
+    on them neither commits nor rolls back.
+    """
+
+    def __init__(self, state, row_factory=None):
+        self._state = state
+        self._conn = state['conn']
+        self._released = False
+        self.row_factory = row_factory
+        state['depth'] += 1
+
+    def cursor(self):
+        cursor = self._conn.cursor()
+        cursor.row_factory = self.row_factory
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        # executescript() commits any open transaction before it runs
+        self._check_not_joined('executescript()')
+        return self.cursor().executescript(sql_script)
+
+    def own_transaction(self, owned=True):
+        """Claim (or give back) the thread's open transaction for this lease"""
+        self._state['owner'] = self if owned else None
+
+    def _joins_owned_transaction(self):
+        owner = self._state.get('owner')
+        return owner is not None and owner is not self
+
+    def _check_not_joined(self, action):
+        if self._joins_owned_transaction():
+            raise sqlite3.ProgrammingError(f"{action} inside a transaction owned by another lease; "
+                                           f"use db_pool.transaction()")
+
+    def commit(self):
+        self._check_not_joined('commit()')
+        self._conn.commit()
+
+    def rollback(self):
+        self._check_not_joined('rollback()')
+        self._conn.rollback()
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    @property
+    def total_changes(self):
+        return self._conn.total_changes
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._state['depth'] -= 1
+        if self._state['depth'] == 0 and self._conn.in_transaction:
+            self._conn.rollback()
+            _stats.bump('rollbacks')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._joins_owned_transaction():
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        self.close()
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def get_connection(row_factory=None):
+    """Get a lease on this thread's persistent database connection"""
+    _stats.bump('acquisitions')
+    return PooledConnection(_thread_state(), row_factory=row_factory)
+
+
+@contextmanager
+def transaction(immediate=True, row_factory=None):
+    """Run a block inside one transaction on this thread's connection.
+
+    Commits on success and rolls back on any exception. BEGIN IMMEDIATE takes
+    the write lock up front so two writers never deadlock on lock upgrade.
+    Nested calls join the outer transaction.
+    """
+    conn = get_connection(row_factory=row_factory)
+    owns_transaction = not conn.in_transaction
+    try:
+        if owns_transaction:
+            conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            _stats.bump('transactions')
+        yield conn
+        if owns_transaction:
+            conn.commit()
+    except BaseException:
+        if owns_transaction and conn.in_transaction:
+            conn.rollback()
+            _stats.bump('rollbacks')
+        raise
+    finally:
+        conn.close()
+
+
+def invalidate_connections():
+    """Force every thread to reopen its connection on next use (e.g. after a restore)"""
+    global _generation
+    with _stats_lock:
+        _generation += 1
+
+
+def close_thread_connection():
+    """Close the calling thread's connection, if it has one and it is idle"""
+    state = getattr(_local, 'state', None)
+    if state is not None and state['depth'] == 0:
+        _close_physical(state)
+        _local.state = None
+        with _stats_lock:
+            _thread_connections.discard(threading.get_ident())
+
+
+def backup_to(path):
+    """Write a consistent copy of the database, including pages still in the WAL, to path"""
+    target = sqlite3.connect(path)
+    conn = get_connection()
+    try:
+        conn.backup(target)
+    finally:
+        conn.close()
+        target.close()
+
+
+def restore_from(path):
+    """Replace the database contents with the database at path, in place.
+
+    The pages are copied through the SQLite backup API into the live file, so
+    connections held by other threads (and processes) stay valid and see the
+    restored data on their next transaction. Copying the file over DB_FILE
+    instead would leave the old -wal / -shm files behind it. Pause the writer
+    thread around this (db_writer.writes_paused()).
+    """
+    source = sqlite3.connect(path)
+    conn = get_connection()
+    try:
+        if conn.in_transaction:
+            raise sqlite3.ProgrammingError("restore_from() inside an open transaction")
+        source.backup(conn._conn)
+    finally:
+        conn.close()
+        source.close()
+
+
+def get_pool_stats():
+    """Return connection reuse statistics for this process"""
+    live_threads = {thread.ident for thread in threading.enumerate()}
+    stats = _stats.snapshot()
+    with _stats_lock:
+        _thread_connections.intersection_update(live_threads)
+        stats['open_connections'] = len(_thread_connections)
+    acquisitions = stats['acquisitions']
+    stats['reuse_rate'] = round(stats['reuses'] / acquisitions, 4) if acquisitions else 0.0
+    stats['db_file'] = DB_FILE
+    return stats
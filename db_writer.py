@@ -0,0 +1,240 @@
+"""
+Single writer thread for database writes made by this process.
+
+Write functions decorated with @serialized_write are not run by the calling
+thread. They are queued, and one writer thread runs them in order on its own
+connection. Jobs that are already waiting are group-committed: they share
+one BEGIN IMMEDIATE ... COMMIT, and each job runs inside its own SAVEPOINT,
+so a failing job is rolled back without affecting the others. Callers get
+their result (or exception) once the group has committed. A job cannot
+commit() or rollback() the group through its own lease; if its SQL ends the
+group transaction anyway, the jobs before it get the outcome that was
+actually written and the rest run in a new group.
+
+Reads are unaffected and keep running concurrently on each thread's own WAL
+connection (see db_pool.py). Other processes (web admin, cron) still
+coordinate through SQLite's busy_timeout.
+"""
+
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from contextlib import contextmanager
+
+from db_pool import get_connection
+from metrics import Counters
+
+# Jobs that may wait in the queue before submit_write() blocks the caller
+WRITE_QUEUE_SIZE = 1000
+# How long a caller waits for room in a full queue, and for its job to start
+WRITE_QUEUE_PUT_TIMEOUT = 5.0
+WRITE_RESULT_TIMEOUT = 30.0
+# Most jobs committed together in one transaction
+GROUP_COMMIT_MAX_JOBS = 64
+
+_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+_writer_thread = None
+_writer_lock = threading.Lock()
+# Held by the writer thread while it runs a group; see writes_paused()
+_pause_lock = threading.Lock()
+_stats = Counters(
+    submitted=0,
+    completed=0,
+    failed=0,
+    rejected=0,
+    cancelled=0,
+    batches=0,
+    max_queue_depth=0,
+    max_batch_size=0,
+    total_wait_ms=0.0,
+    max_wait_ms=0.0,
+    total_batch_ms=0.0,
+)
+
+class WriteQueueFull(Exception):
+    """Raised when the write queue stays full for WRITE_QUEUE_PUT_TIMEOUT seconds"""
+
+class _WriteJob:
+    __slots__ = ('func', 'args', 'kwargs', 'future', 'enqueued_at')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+def is_writer_thread():
+    """True when called from the writer thread itself"""
+    return _writer_thread is not None and threading.current_thread() is _writer_thread
+
+def _ensure_writer():
+    global _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name='db-writer', daemon=True)
+            _writer_thread.start()
+
+def _next_batch():
+    """Block for one job, then take whatever else is already queued (up to the group limit)"""
+    batch = [_queue.get()]
+    while len(batch) < GROUP_COMMIT_MAX_JOBS:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+class GroupTransactionEnded(Exception):
+    """A job's SQL ended the group transaction, and the group's writes were rolled back"""
+
+def _ended_group(conn, outcomes, job, result, error):
+    """Outcomes once job's SQL has ended the group transaction (e.g. a raw COMMIT)"""
+    # The marker row is rolled back with the group, so it tells whether the
+    # writes of the jobs before this one were committed or discarded
+    committed = conn.execute('SELECT COUNT(*) FROM temp.write_group').fetchone()[0] > 0
+    conn.execute('DELETE FROM temp.write_group')
+    print(f"⚠️ Write job {getattr(job.func, '__name__', job.func)} ended the group transaction "
+          f"({'committed' if committed else 'rolled back'})")
+    if committed:
+        return outcomes + [(job, result, error)]
+    lost = GroupTransactionEnded("Rolled back by another job in the same group; nothing was written")
+    return ([(done, None, done_error or lost) for done, _, done_error in outcomes]
+            + [(job, None, error or lost)])
+
+def _run_batch(batch):
+    """Run a batch of jobs in one transaction; returns [(job, result, exception)]"""
+    outcomes = []
+    conn = get_connection()
+    try:
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS write_group (marker INTEGER)')
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('INSERT INTO temp.write_group VALUES (1)')
+        conn.own_transaction()
+        for index, job in enumerate(batch):
+            conn.execute('SAVEPOINT write_job')
+            try:
+                result, error = job.func(*job.args, **job.kwargs), None
+            except BaseException as e:
+                result, error = None, e
+            if not conn.in_transaction:
+                # Whatever this group wrote so far is final: never report it as
+                # failed (the caller would apply it twice); start a new group
+                conn.own_transaction(False)
+                outcomes = _ended_group(conn, outcomes, job, result, error)
+                conn.close()
+                return outcomes + (_run_batch(batch[index + 1:]) if index + 1 < len(batch) else [])
+            if error is not None:
+                conn.execute('ROLLBACK TO write_job')
+            conn.execute('RELEASE write_job')
+            outcomes.append((job, result, error))
+        conn.execute('DELETE FROM temp.write_group')
+        conn.own_transaction(False)
+        conn.commit()
+    except BaseException as e:
+        # BEGIN/COMMIT itself failed: the group is rolled back, nothing in this batch was written
+        conn.own_transaction(False)
+        if conn.in_transaction:
+            conn.rollback()
+        outcomes = [(job, None, e) for job in batch]
+    finally:
+        conn.close()
+    return outcomes
+
+def _writer_loop():
+    while True:
+        batch = _next_batch()
+        with _pause_lock:
+            # Skip jobs whose caller gave up waiting (see run_write())
+            running = [job for job in batch if job.future.set_running_or_notify_cancel()]
+            if len(running) < len(batch):
+                _stats.bump('cancelled', len(batch) - len(running))
+            batch = running
+            if not batch:
+                continue
+            started = time.perf_counter()
+            waits_ms = [(started - job.enqueued_at) * 1000 for job in batch]
+            outcomes = _run_batch(batch)
+        batch_ms = (time.perf_counter() - started) * 1000
+
+        failed = 0
+        for job, result, error in outcomes:
+            if error is None:
+                job.future.set_result(result)
+            else:
+                failed += 1
+                job.future.set_exception(error)
+
+        _stats.add(batches=1, completed=len(batch) - failed, failed=failed,
+                   total_wait_ms=sum(waits_ms), total_batch_ms=batch_ms)
+        _stats.peak(max_batch_size=len(batch), max_wait_ms=max(waits_ms))
+
+def submit_write(func, *args, **kwargs):
+    """Queue func(*args, **kwargs) for the writer thread and return a Future"""
+    _ensure_writer()
+    job = _WriteJob(func, args, kwargs)
+    try:
+        _queue.put(job, timeout=WRITE_QUEUE_PUT_TIMEOUT)
+    except queue.Full:
+        _stats.bump('rejected')
+        raise WriteQueueFull(f"Database write queue is full ({WRITE_QUEUE_SIZE} jobs)")
+    _stats.bump('submitted')
+    _stats.peak(max_queue_depth=_queue.qsize())
+    return job.future
+
+def run_write(func, *args, **kwargs):
+    """Run func on the writer thread and wait for its result.
+
+    Raises TimeoutError if the job has not started after WRITE_RESULT_TIMEOUT
+    seconds; it is then cancelled and never runs. A job that has started is
+    always waited for, since it may already be committed.
+    """
+    if is_writer_thread():
+        # Already inside a batch (a write function calling another one)
+        return func(*args, **kwargs)
+    future = submit_write(func, *args, **kwargs)
+    try:
+        return future.result(timeout=WRITE_RESULT_TIMEOUT)
+    except TimeoutError:
+        if future.cancel():
+            raise
+    return future.result()
+
+def serialized_write(func):
+    """Decorator: every call of func runs on the writer thread.
+
+    func must not call commit() itself; use db_pool.transaction(), which
+    joins the writer's group transaction.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return run_write(func, *args, **kwargs)
+    return wrapper
+
+@contextmanager
+def writes_paused():
+    """Keep the writer thread between groups for the duration of the block.
+
+    Queued jobs wait until the block ends; calling a serialized write inside
+    the block would wait forever.
+    """
+    if is_writer_thread():
+        raise RuntimeError("writes_paused() called from the writer thread")
+    with _pause_lock:
+        yield
+
+def get_writer_stats():
+    """Return queue depth, wait time and group commit statistics for this process"""
+    stats = _stats.snapshot()
+    jobs = stats['completed'] + stats['failed']
+    stats['queue_depth'] = _queue.qsize()
+    stats['queue_capacity'] = WRITE_QUEUE_SIZE
+    stats['writer_alive'] = _writer_thread is not None and _writer_thread.is_alive()
+    stats['avg_wait_ms'] = round(stats['total_wait_ms'] / jobs, 3) if jobs else 0.0
+    stats['avg_batch_size'] = round(jobs / stats['batches'], 2) if stats['batches'] else 0.0
+    stats['avg_batch_ms'] = round(stats['total_batch_ms'] / stats['batches'], 3) if stats['batches'] else 0.0
+    return stats
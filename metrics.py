@@ -0,0 +1,48 @@
+"""
+Runtime counters shared by the bot's background components.
+
+Each component keeps its counters in a Counters object and reports them,
+together with its live state, from a get_*_stats() function. The web admin
+serves all of those at /api/stats/<name> (see STATS_SOURCES in web_admin.py).
+"""
+
+import threading
+import time
+
+
+class Counters:
+    """Named counters that several threads update"""
+
+    def __init__(self, **initial):
+        self._lock = threading.Lock()
+        self._values = dict(initial)
+
+    def bump(self, key, amount=1):
+        with self._lock:
+            self._values[key] += amount
+
+    def add(self, **amounts):
+        """Add several amounts in one step, e.g. add(batches=1, completed=len(batch))"""
+        with self._lock:
+            for key, amount in amounts.items():
+                self._values[key] += amount
+
+    def peak(self, **values):
+        """Keep the largest value seen for each key"""
+        with self._lock:
+            for key, value in values.items():
+                if value > self._values[key]:
+                    self._values[key] = value
+
+    def snapshot(self):
+        """Copy of the current values"""
+        with self._lock:
+            return dict(self._values)
+
+
+def report(get_stats):
+    """Call a get_*_stats() function and stamp its result with the time (None if it has nothing)"""
+    stats = get_stats()
+    if stats is not None:
+        stats['timestamp'] = time.time()
+    return stats
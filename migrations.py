@@ -0,0 +1,700 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for bot_database.db.
+
+Every schema change is a numbered migration recorded in the schema_version
+table, so it runs exactly once per database. Add new migrations to the end
+of MIGRATIONS; never renumber or edit one that has already shipped.
+
+Usage:
+    python migrations.py                 # apply pending migrations
+    python migrations.py --status        # show applied / pending migrations
+    python migrations.py --dry-run       # apply to a temporary copy of the DB and report
+    python migrations.py --dry-run path/to/production.db
+"""
+
+import hashlib
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from db_pool import DB_FILE, get_connection
+
+_migrated_lock = threading.Lock()
+_migrated = False
+
+def _columns(conn, table):
+    """Return the column names of a table (empty list if it does not exist)"""
+    return [column[1] for column in conn.execute(f'PRAGMA table_info({table})').fetchall()]
+
+def vpn_key_hash(key_value):
+    """Return the hash stored in vpn_keys.key_hash for a (stripped) key value"""
+    return hashlib.sha256(key_value.encode('utf-8')).hexdigest()
+
+def _migration_001_baseline_schema(conn):
+    """Create every table the bot and the web admin use"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            balance REAL DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pending_payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            credits INTEGER NOT NULL,
+            mmk_price INTEGER NOT NULL,
+            payment_proof_file_id TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_id_number TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            credits_required INTEGER NOT NULL,
+            duration_days INTEGER NOT NULL,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            device_limit INTEGER DEFAULT 1
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS vpn_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_id INTEGER NOT NULL,
+            key_value TEXT NOT NULL,
+            is_used BOOLEAN DEFAULT 0,
+            used_by_user_id INTEGER,
+            used_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (plan_id) REFERENCES plans (id),
+            FOREIGN KEY (used_by_user_id) REFERENCES users (telegram_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            plan_id INTEGER NOT NULL,
+            vpn_key_id INTEGER,
+            purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expiry_date TIMESTAMP,
+            status TEXT DEFAULT 'active',
+            api_response TEXT,
+            vpn_key TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id),
+            FOREIGN KEY (plan_id) REFERENCES plans (id),
+            FOREIGN KEY (vpn_key_id) REFERENCES vpn_keys (id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS contact_config (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            contact_type TEXT NOT NULL UNIQUE,
+            contact_value TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT 1,
+            display_order INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS account_setup_config (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            config_key TEXT UNIQUE NOT NULL,
+            config_value TEXT NOT NULL,
+            description TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS topup_options (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            credits INTEGER NOT NULL,
+            mmk_price INTEGER NOT NULL,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS payment_methods (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            account_number TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_002_legacy_columns(conn):
+    """Bring databases created by older releases up to the baseline columns"""
+    # plans.plan_id_number was added later and needs a UNIQUE constraint,
+    # which SQLite can only add by rebuilding the table
+    plan_columns = _columns(conn, 'plans')
+    if 'plan_id_number' not in plan_columns:
+        device_limit_expr = 'COALESCE(device_limit, 1)' if 'device_limit' in plan_columns else '1'
+        conn.execute('''
+            CREATE TABLE plans_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                plan_id_number TEXT UNIQUE NOT NULL,
+                name TEXT NOT NULL,
+                description TEXT,
+                credits_required INTEGER NOT NULL,
+                duration_days INTEGER NOT NULL,
+                is_active BOOLEAN DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                device_limit INTEGER DEFAULT 1
+            )
+        ''')
+        conn.execute(f'''
+            INSERT INTO plans_new (id, plan_id_number, name, description, credits_required, duration_days,
+                                   is_active, created_at, updated_at, device_limit)
+            SELECT id, CAST(id AS TEXT), name, description, credits_required, duration_days,
+                   is_active, created_at, updated_at, {device_limit_expr}
+            FROM plans
+        ''')
+        conn.execute('DROP TABLE plans')
+        conn.execute('ALTER TABLE plans_new RENAME TO plans')
+    elif 'device_limit' not in plan_columns:
+        conn.execute('ALTER TABLE plans ADD COLUMN device_limit INTEGER DEFAULT 1')
+
+    user_plan_columns = _columns(conn, 'user_plans')
+    if 'api_response' not in user_plan_columns:
+        conn.execute('ALTER TABLE user_plans ADD COLUMN api_response TEXT')
+    if 'vpn_key' not in user_plan_columns:
+        conn.execute('ALTER TABLE user_plans ADD COLUMN vpn_key TEXT')
+
+    if 'account_number' not in _columns(conn, 'payment_methods'):
+        conn.execute('ALTER TABLE payment_methods ADD COLUMN account_number TEXT')
+
+def _migration_003_hot_path_indexes(conn):
+    """Indexes for the bot's hot queries, which previously scanned whole tables"""
+    # Key claim / stock check: WHERE plan_id = ? AND is_used = 0 ORDER BY created_at
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_vpn_keys_plan_available
+        ON vpn_keys (plan_id, is_used, created_at)
+    ''')
+    # My Plans: WHERE user_id = ? ORDER BY purchase_date DESC
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_plans_user_purchase
+        ON user_plans (user_id, purchase_date)
+    ''')
+    # Expiry sweep and expiring-soon report: WHERE status = 'active' AND expiry_date ...
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_plans_status_expiry
+        ON user_plans (status, expiry_date)
+    ''')
+    # Orphaned key cleanup and key lookups from user_plans
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_plans_vpn_key
+        ON user_plans (vpn_key_id)
+    ''')
+    # Per-plan purchase counts on the dashboard and statistics pages
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_plans_plan
+        ON user_plans (plan_id, purchase_date)
+    ''')
+    # Payment proof: WHERE user_id = ? AND status = 'pending' ORDER BY created_at DESC
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_pending_payments_user_status
+        ON pending_payments (user_id, status, created_at)
+    ''')
+    # /admin pending list: WHERE status = 'pending' ORDER BY created_at DESC
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_pending_payments_status
+        ON pending_payments (status, created_at)
+    ''')
+
+def _migration_004_vpn_key_hash(conn):
+    """Unique hash of each key value so bulk imports can reject duplicates"""
+    if 'key_hash' not in _columns(conn, 'vpn_keys'):
+        conn.execute('ALTER TABLE vpn_keys ADD COLUMN key_hash TEXT')
+
+    # Older databases already contain duplicate keys; only the oldest copy of
+    # each value gets a hash, the others keep NULL (allowed by the index)
+    seen = set()
+    updates = []
+    for key_id, key_value in conn.execute('SELECT id, key_value FROM vpn_keys ORDER BY id'):
+        key_hash = vpn_key_hash(key_value.strip())
+        if key_hash not in seen:
+            seen.add(key_hash)
+            updates.append((key_hash, key_id))
+    conn.executemany('UPDATE vpn_keys SET key_hash = ? WHERE id = ?', updates)
+
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_vpn_keys_key_hash
+        ON vpn_keys (key_hash)
+    ''')
+
+def _migration_005_expiry_epoch(conn):
+    """Integer expiry column so the expiry sweep can use an index instead of datetime() on every row"""
+    if 'expiry_epoch' not in _columns(conn, 'user_plans'):
+        conn.execute('ALTER TABLE user_plans ADD COLUMN expiry_epoch INTEGER')
+
+    # expiry_date text is read as UTC, exactly as the old datetime() comparison did
+    conn.execute('''
+        UPDATE user_plans
+        SET expiry_epoch = CAST(strftime('%s', expiry_date) AS INTEGER)
+        WHERE expiry_date IS NOT NULL
+    ''')
+
+    # Keep expiry_epoch in sync for every writer (bot, web admin, scripts)
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_user_plans_expiry_epoch_insert
+        AFTER INSERT ON user_plans
+        WHEN NEW.expiry_date IS NOT NULL
+        BEGIN
+            UPDATE user_plans SET expiry_epoch = CAST(strftime('%s', NEW.expiry_date) AS INTEGER)
+            WHERE id = NEW.id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_user_plans_expiry_epoch_update
+        AFTER UPDATE OF expiry_date ON user_plans
+        BEGIN
+            UPDATE user_plans SET expiry_epoch = CAST(strftime('%s', NEW.expiry_date) AS INTEGER)
+            WHERE id = NEW.id;
+        END
+    ''')
+
+    # Replaces idx_user_plans_status_expiry, which no query can use any more
+    conn.execute('DROP INDEX IF EXISTS idx_user_plans_status_expiry')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_plans_status_expiry_epoch
+        ON user_plans (status, expiry_epoch)
+    ''')
+
+def _migration_006_used_keys_index(conn):
+    """Index sold keys so orphan cleanup never scans unsold inventory"""
+    # Orphan cleanup: WHERE is_used = 1 AND id > ? ORDER BY id, anti-joined
+    # against user_plans through idx_user_plans_vpn_key
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_vpn_keys_used
+        ON vpn_keys (is_used)
+    ''')
+
+def _migration_007_plan_type(conn):
+    """Store the plan category instead of inferring it from the plan name"""
+    if 'plan_type' not in _columns(conn, 'plans'):
+        conn.execute("ALTER TABLE plans ADD COLUMN plan_type TEXT NOT NULL DEFAULT 'vpn'")
+
+    # Same case-sensitive rule the bot applied in Python ('ByPass' / 'QITO' are
+    # the prefixes the web admin adds); GLOB is case-sensitive, LIKE is not
+    conn.execute('''
+        UPDATE plans
+        SET plan_type = CASE
+            WHEN name GLOB '*ByPass*' THEN 'bypass'
+            WHEN name GLOB '*QITO*' THEN 'qito'
+            ELSE 'vpn'
+        END
+    ''')
+
+    # Menus: WHERE plan_type = ? AND is_active = 1 ORDER BY plan_id_number
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_plans_type_active
+        ON plans (plan_type, is_active, plan_id_number)
+    ''')
+
+# Recomputes plan_inventory from vpn_keys; also used by check_inventory.py --rebuild
+REBUILD_PLAN_INVENTORY_SQL = '''
+    INSERT INTO plan_inventory (plan_id, total_keys, available_keys, used_keys)
+    SELECT plan_id,
+           COUNT(*),
+           SUM(CASE WHEN is_used THEN 0 ELSE 1 END),
+           SUM(CASE WHEN is_used THEN 1 ELSE 0 END)
+    FROM vpn_keys
+    GROUP BY plan_id
+'''
+
+def _migration_008_plan_inventory(conn):
+    """Per-plan key counters kept exact by triggers, so stock reads are O(plans)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS plan_inventory (
+            plan_id INTEGER PRIMARY KEY,
+            total_keys INTEGER NOT NULL DEFAULT 0,
+            available_keys INTEGER NOT NULL DEFAULT 0,
+            used_keys INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('DELETE FROM plan_inventory')
+    conn.execute(REBUILD_PLAN_INVENTORY_SQL)
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_vpn_keys_inventory_insert
+        AFTER INSERT ON vpn_keys
+        BEGIN
+            INSERT OR IGNORE INTO plan_inventory (plan_id) VALUES (NEW.plan_id);
+            UPDATE plan_inventory
+            SET total_keys = total_keys + 1,
+                available_keys = available_keys + (CASE WHEN NEW.is_used THEN 0 ELSE 1 END),
+                used_keys = used_keys + (CASE WHEN NEW.is_used THEN 1 ELSE 0 END)
+            WHERE plan_id = NEW.plan_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_vpn_keys_inventory_delete
+        AFTER DELETE ON vpn_keys
+        BEGIN
+            UPDATE plan_inventory
+            SET total_keys = total_keys - 1,
+                available_keys = available_keys - (CASE WHEN OLD.is_used THEN 0 ELSE 1 END),
+                used_keys = used_keys - (CASE WHEN OLD.is_used THEN 1 ELSE 0 END)
+            WHERE plan_id = OLD.plan_id;
+        END
+    ''')
+    # A key moving between plans or being claimed: take the old row out, add the new one
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_vpn_keys_inventory_update
+        AFTER UPDATE OF plan_id, is_used ON vpn_keys
+        BEGIN
+            UPDATE plan_inventory
+            SET total_keys = total_keys - 1,
+                available_keys = available_keys - (CASE WHEN OLD.is_used THEN 0 ELSE 1 END),
+                used_keys = used_keys - (CASE WHEN OLD.is_used THEN 1 ELSE 0 END)
+            WHERE plan_id = OLD.plan_id;
+            INSERT OR IGNORE INTO plan_inventory (plan_id) VALUES (NEW.plan_id);
+            UPDATE plan_inventory
+            SET total_keys = total_keys + 1,
+                available_keys = available_keys + (CASE WHEN NEW.is_used THEN 0 ELSE 1 END),
+                used_keys = used_keys + (CASE WHEN NEW.is_used THEN 1 ELSE 0 END)
+            WHERE plan_id = NEW.plan_id;
+        END
+    ''')
+
+# Tables whose reads database.py caches; any write to them changes cache_version
+CATALOG_TABLES = ('plans', 'topup_options', 'payment_methods', 'contact_config', 'account_setup_config')
+
+def _migration_009_cache_version(conn):
+    """Single-row version token that changes on every catalog/config write"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO cache_version (id, version) VALUES (1, random())')
+
+    # random() rather than +1, so a restored backup can never bring back a
+    # version some process has already cached
+    for table in CATALOG_TABLES:
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_cache_version_{operation.lower()}
+                AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE cache_version SET version = random() WHERE id = 1;
+                END
+            ''')
+
+def _migration_010_broadcasts(conn):
+    """Persisted broadcast jobs, their per-recipient progress, and users.blocked_at"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            created_by INTEGER NOT NULL,
+            progress_message_id INTEGER,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            telegram_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            sent_at TIMESTAMP,
+            PRIMARY KEY (broadcast_id, telegram_id),
+            FOREIGN KEY (broadcast_id) REFERENCES broadcasts (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_pending
+        ON broadcast_recipients (broadcast_id, status, telegram_id)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status, id)')
+
+    # Set when Telegram reports the user blocked the bot; cleared on /start
+    if 'blocked_at' not in _columns(conn, 'users'):
+        conn.execute('ALTER TABLE users ADD COLUMN blocked_at TIMESTAMP')
+
+def _migration_011_provider_accounts(conn):
+    """Pool of QITO / ByPass accounts created ahead of demand"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS provider_accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            provider TEXT NOT NULL,
+            device_limit INTEGER NOT NULL,
+            duration_days INTEGER NOT NULL,
+            vpn_key TEXT NOT NULL,
+            api_response TEXT,
+            expire_at TIMESTAMP NOT NULL,
+            status TEXT NOT NULL DEFAULT 'available',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            claimed_by INTEGER,
+            claimed_at TIMESTAMP,
+            user_plan_id INTEGER
+        )
+    ''')
+    # Claim: the oldest fresh available account for one (provider, devices, duration)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_provider_accounts_claim
+        ON provider_accounts (provider, device_limit, duration_days, status, created_at)
+    ''')
+
+def _migration_012_purchase_jobs(conn):
+    """Persisted QITO / ByPass purchases, finished by the purchase workers"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS purchase_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            provider TEXT NOT NULL,
+            plan_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            first_name TEXT,
+            last_name TEXT,
+            username TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            api_response TEXT,
+            expiry_date TIMESTAMP,
+            user_plan_id INTEGER,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (chat_id, message_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_purchase_jobs_status ON purchase_jobs (status, id)')
+
+def _migration_013_telegram_files(conn):
+    """Telegram file_id of files already uploaded by the bot, keyed by content hash"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS telegram_files (
+            file_hash TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            file_size INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_014_plan_credentials(conn):
+    """QITO / ByPass account username and password as columns instead of only inside api_response"""
+    user_plan_columns = _columns(conn, 'user_plans')
+    if 'account_username' not in user_plan_columns:
+        conn.execute('ALTER TABLE user_plans ADD COLUMN account_username TEXT')
+    if 'account_password' not in user_plan_columns:
+        conn.execute('ALTER TABLE user_plans ADD COLUMN account_password TEXT')
+
+    conn.execute('''
+        UPDATE user_plans
+        SET account_username = json_extract(api_response, '$.username'),
+            account_password = json_extract(api_response, '$.password')
+        WHERE api_response IS NOT NULL AND json_valid(api_response)
+    ''')
+
+def _migration_015_low_stock_threshold(conn):
+    """Per-plan low stock alert threshold (NULL: the LOW_STOCK_THRESHOLD default)"""
+    if 'low_stock_threshold' not in _columns(conn, 'plans'):
+        conn.execute('ALTER TABLE plans ADD COLUMN low_stock_threshold INTEGER')
+
+# (version, name, function) - append only
+MIGRATIONS = [
+    (1, 'baseline_schema', _migration_001_baseline_schema),
+    (2, 'legacy_columns', _migration_002_legacy_columns),
+    (3, 'hot_path_indexes', _migration_003_hot_path_indexes),
+    (4, 'vpn_key_hash', _migration_004_vpn_key_hash),
+    (5, 'expiry_epoch', _migration_005_expiry_epoch),
+    (6, 'used_keys_index', _migration_006_used_keys_index),
+    (7, 'plan_type', _migration_007_plan_type),
+    (8, 'plan_inventory', _migration_008_plan_inventory),
+    (9, 'cache_version', _migration_009_cache_version),
+    (10, 'broadcasts', _migration_010_broadcasts),
+    (11, 'provider_accounts', _migration_011_provider_accounts),
+    (12, 'purchase_jobs', _migration_012_purchase_jobs),
+    (13, 'telegram_files', _migration_013_telegram_files),
+    (14, 'plan_credentials', _migration_014_plan_credentials),
+    (15, 'low_stock_threshold', _migration_015_low_stock_threshold),
+]
+
+# Hot queries checked by --dry-run to confirm they use an index
+HOT_QUERIES = [
+    ('available key claim', "SELECT id, key_value FROM vpn_keys WHERE plan_id = 1 AND is_used = 0 ORDER BY created_at ASC LIMIT 1"),
+    ('plan menu', "SELECT id FROM plans WHERE plan_type = 'qito' AND is_active = 1 ORDER BY plan_id_number"),
+    ('user plans', "SELECT id FROM user_plans WHERE user_id = 1 ORDER BY purchase_date DESC"),
+    ('my plans page', "SELECT id FROM user_plans WHERE user_id = 1 AND (purchase_date, id) < ('2030-01-01', 1) ORDER BY purchase_date DESC, id DESC LIMIT 6"),
+    ('pending payment', "SELECT id FROM pending_payments WHERE user_id = 1 AND status = 'pending' ORDER BY created_at DESC LIMIT 1"),
+    ('expiry sweep', "SELECT id FROM user_plans WHERE status = 'active' AND expiry_epoch < 0 ORDER BY expiry_epoch LIMIT 500"),
+    ('orphaned key cleanup', "SELECT vk.id FROM vpn_keys vk WHERE vk.is_used = 1 AND vk.id > 0 AND NOT EXISTS (SELECT 1 FROM user_plans up WHERE up.vpn_key_id = vk.id) ORDER BY vk.id LIMIT 500"),
+    ('admin pending list', "SELECT id FROM pending_payments WHERE status = 'pending' ORDER BY created_at DESC"),
+    ('provider account claim', "SELECT id FROM provider_accounts WHERE provider = 'qito' AND device_limit = 1 AND duration_days = 30 AND status = 'available' AND created_at >= '2000-01-01' ORDER BY created_at LIMIT 1"),
+    ('unfinished purchases', "SELECT id FROM purchase_jobs WHERE status IN ('queued', 'provisioned', 'recorded') ORDER BY id"),
+    ('broadcast batch', "SELECT telegram_id FROM broadcast_recipients WHERE broadcast_id = 1 AND status = 'pending' ORDER BY telegram_id LIMIT 25"),
+]
+
+def _ensure_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+def get_schema_version(conn):
+    """Return the highest applied migration version (0 for a fresh database)"""
+    _ensure_version_table(conn)
+    result = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return result[0] or 0
+
+def apply_migrations(conn, verbose=True):
+    """Apply all pending migrations on the given connection, one transaction each"""
+    applied = []
+    _ensure_version_table(conn)
+
+    for version, name, migrate in MIGRATIONS:
+        # BEGIN IMMEDIATE serialises concurrent starters (bot, web admin, cron);
+        # the version is re-checked once the write lock is held
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            already_applied = conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone()
+            if already_applied:
+                conn.rollback()
+                continue
+
+            started = time.perf_counter()
+            migrate(conn)
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            print(f"❌ Migration {version:03d}_{name} failed")
+            raise
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        applied.append((version, name, elapsed_ms))
+        if verbose:
+            print(f"✅ Applied migration {version:03d}_{name} ({elapsed_ms:.1f} ms)")
+
+    return applied
+
+def run_migrations(force=False):
+    """Apply pending migrations to DB_FILE (once per process unless forced)"""
+    global _migrated
+    with _migrated_lock:
+        if _migrated and not force:
+            return []
+        conn = get_connection()
+        try:
+            applied = apply_migrations(conn)
+        finally:
+            conn.close()
+        _migrated = True
+        return applied
+
+def migration_status(conn):
+    """Return [(version, name, applied_at or None)] for every known migration"""
+    _ensure_version_table(conn)
+    applied = dict(conn.execute('SELECT version, applied_at FROM schema_version').fetchall())
+    return [(version, name, applied.get(version)) for version, name, _ in MIGRATIONS]
+
+def dry_run(source_db=None):
+    """Apply pending migrations to a temporary copy of a database and report the result"""
+    source_db = source_db or DB_FILE
+    if not os.path.exists(source_db):
+        print(f"❌ Database file not found: {source_db}")
+        return None
+
+    fd, copy_path = tempfile.mkstemp(suffix='.db', prefix='migration_dry_run_')
+    os.close(fd)
+    try:
+        # The backup API gives a consistent snapshot even while the bot is writing
+        source = sqlite3.connect(source_db)
+        copy = sqlite3.connect(copy_path)
+        source.backup(copy)
+        source.close()
+
+        print(f"[{datetime.now()}] Dry run against a copy of {source_db}")
+        print(f"  - Current schema version: {get_schema_version(copy)}")
+
+        applied = apply_migrations(copy)
+        if not applied:
+            print("  - No pending migrations")
+
+        print(f"  - Schema version after migrating: {get_schema_version(copy)}")
+        print("  - Query plans:")
+        for label, sql in HOT_QUERIES:
+            details = [row[3] for row in copy.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()]
+            print(f"    • {label}: {'; '.join(details)}")
+
+        integrity = copy.execute('PRAGMA integrity_check').fetchone()[0]
+        print(f"  - Integrity check: {integrity}")
+        copy.close()
+        return applied
+    finally:
+        os.remove(copy_path)
+
+def main():
+    """Command line entry point"""
+    args = sys.argv[1:]
+    if '--dry-run' in args:
+        args.remove('--dry-run')
+        dry_run(args[0] if args else None)
+    elif '--status' in args:
+        conn = get_connection()
+        for version, name, applied_at in migration_status(conn):
+            state = f"applied {applied_at}" if applied_at else "pending"
+            print(f"{version:03d}_{name}: {state}")
+        conn.close()
+    else:
+        applied = run_migrations()
+        conn = get_connection()
+        print(f"✅ Database is at schema version {get_schema_version(conn)} ({len(applied)} applied now)")
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+HTTP client for the QITO and ByPass user provisioning APIs.
+
+Both providers are called through one keep-alive requests.Session, so a
+purchase reuses a pooled connection instead of paying a new TCP/TLS
+handshake. Each provider has:
+
+- split timeouts: PROVIDER_CONNECT_TIMEOUT to connect, PROVIDER_READ_TIMEOUT
+  for the response;
+- bounded retries with jittered exponential backoff, only for failures
+  where the provider cannot have created the user (connection refused or
+  timed out while connecting, HTTP 429 / 503). A read timeout or another
+  5xx is never retried, since the account may already exist;
+- a circuit breaker: after PROVIDER_BREAKER_THRESHOLD consecutive failures,
+  calls fail fast for PROVIDER_BREAKER_RESET_SECONDS, then a single trial
+  call decides whether to close it again;
+- per-call latency and outcome metrics (get_provider_stats()).
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from dotenv import load_dotenv
+
+from metrics import Counters
+
+load_dotenv()
+
+# QITO API Configuration
+QITO_API_URL = os.getenv('QITO_API_URL', 'http://localhost:3000/api/users')
+
+# ByPass API Configuration
+BYPASS_API_URL = os.getenv('BYPASS_API_URL', 'http://localhost:3000/api/users')
+
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv('PROVIDER_CONNECT_TIMEOUT', '5'))
+PROVIDER_READ_TIMEOUT = float(os.getenv('PROVIDER_READ_TIMEOUT', '25'))
+PROVIDER_POOL_SIZE = int(os.getenv('PROVIDER_POOL_SIZE', '10'))
+PROVIDER_MAX_RETRIES = 2
+PROVIDER_BACKOFF_BASE = 0.5
+PROVIDER_BACKOFF_MAX = 4.0
+PROVIDER_BREAKER_THRESHOLD = 5
+PROVIDER_BREAKER_RESET_SECONDS = 30.0
+# Latency samples kept per provider for the percentiles in get_stats()
+LATENCY_SAMPLES = 500
+
+# Status codes that mean the request was turned away before any work was done
+RETRYABLE_STATUS_CODES = (429, 503)
+
+# Headers sent to the QITO / ByPass user APIs
+PROVIDER_HEADERS = {
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Connection': 'keep-alive',
+    'Content-Type': 'application/json',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-origin',
+    'User-Agent': 'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Mobile Safari/537.36',
+    'sec-ch-ua': '"Google Chrome";v="137", "Chromium";v="137", "Not/A)Brand";v="24"',
+    'sec-ch-ua-mobile': '?1',
+}
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+def provider_request_body(device_limit, duration_days, expires_at=None):
+    """Build the JSON body for creating a QITO / ByPass user"""
+    # Calculate expiry date
+    expiry_date = expires_at or datetime.now() + timedelta(days=duration_days)
+    return {
+        "expire_date": expiry_date.strftime('%Y-%m-%dT%H:%M'),
+        "device_limit": device_limit
+    }
+
+def account_credentials(api_response):
+    """The 'username|password' string stored as user_plans.vpn_key for a created account"""
+    return f"{api_response.get('username', '')}|{api_response.get('password', '')}"
+
+def _create_session():
+    session = requests.Session()
+    session.headers.update(PROVIDER_HEADERS)
+    # Retries are done by ProviderClient, which knows which failures are safe to repeat
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=PROVIDER_POOL_SIZE, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+_session = _create_session()
+
+class CircuitBreaker:
+    """Opens after consecutive failures; lets one trial call through after a cool-down"""
+
+    def __init__(self, threshold=PROVIDER_BREAKER_THRESHOLD, reset_seconds=PROVIDER_BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go ahead now"""
+        with self._lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+            if self.state == BREAKER_OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                # One trial call; everyone else keeps failing fast until it reports back
+                self.state = BREAKER_HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == BREAKER_HALF_OPEN or self.failures >= self.threshold:
+                if self.state != BREAKER_OPEN:
+                    self.times_opened += 1
+                self.state = BREAKER_OPEN
+                self.opened_at = time.monotonic()
+
+    def seconds_until_retry(self):
+        with self._lock:
+            if self.state != BREAKER_OPEN:
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+class ProviderClient:
+    """Creates users on one provider's API through the shared session"""
+
+    def __init__(self, name, url, session=None):
+        self.name = name
+        self.url = url
+        self.session = session or _session
+        self.breaker = CircuitBreaker()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._stats = Counters(
+            calls=0,
+            succeeded=0,
+            failed=0,
+            retries=0,
+            short_circuited=0,
+            total_ms=0.0,
+            max_ms=0.0,
+        )
+
+    def _post(self, payload):
+        """One POST; returns (response or None, retryable, provider_failure, error text)"""
+        try:
+            response = self.session.post(self.url, json=payload,
+                                         timeout=(PROVIDER_CONNECT_TIMEOUT, PROVIDER_READ_TIMEOUT))
+        except requests.exceptions.ConnectTimeout as e:
+            return None, True, True, f"connect timed out: {e}"
+        except requests.exceptions.ConnectionError as e:
+            # Refused / unreachable: nothing was sent. A connection dropped after
+            # sending may have created the user, so that one is not retried
+            reason = getattr(e.args[0], 'reason', None) if e.args else None
+            return None, isinstance(reason, NewConnectionError), True, f"connection failed: {e}"
+        except requests.exceptions.Timeout as e:
+            return None, False, True, f"timed out waiting for the response: {e}"
+        except requests.exceptions.RequestException as e:
+            return None, False, True, str(e)
+
+        if response.status_code in (200, 201):
+            return response, False, False, None
+        error = f"status {response.status_code}: {response.text[:200]}"
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            return response, True, True, error
+        # 4xx is a problem with our request, not a sign the provider is down
+        return response, False, response.status_code >= 500, error
+
+    def create_user(self, device_limit, duration_days, expires_at=None):
+        """Create a user; returns the API's JSON response, or None if it failed.
+
+        The account expires duration_days from now, or at expires_at if given.
+        """
+        self._stats.bump('calls')
+        if not self.breaker.allow():
+            self._stats.bump('short_circuited')
+            print(f"⚡ {self.name} API circuit open, failing fast "
+                  f"(retry in {self.breaker.seconds_until_retry():.0f}s)")
+            return None
+
+        payload = provider_request_body(device_limit, duration_days, expires_at)
+        started = time.perf_counter()
+        for attempt in range(PROVIDER_MAX_RETRIES + 1):
+            response, retryable, provider_failure, error = self._post(payload)
+            if error is None or not retryable or attempt == PROVIDER_MAX_RETRIES:
+                break
+            # Full jitter: sleep a random time up to the exponential backoff
+            delay = random.uniform(0, min(PROVIDER_BACKOFF_MAX, PROVIDER_BACKOFF_BASE * 2 ** attempt))
+            print(f"🔁 {self.name} API {error}; retrying in {delay:.2f}s")
+            self._stats.bump('retries')
+            time.sleep(delay)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        self._stats.add(total_ms=elapsed_ms)
+        self._stats.peak(max_ms=elapsed_ms)
+        with self._lock:
+            self._latencies.append(elapsed_ms)
+
+        if error is None:
+            try:
+                result = response.json()
+            except ValueError:
+                error, provider_failure = f"invalid JSON in response: {response.text[:200]}", True
+            else:
+                self.breaker.record_success()
+                self._stats.bump('succeeded')
+                return result
+
+        if provider_failure:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        self._stats.bump('failed')
+        print(f"❌ {self.name} API request failed ({elapsed_ms:.0f} ms): {error}")
+        return None
+
+    def get_stats(self):
+        """Call counts, latency (avg, p50, p95, max in ms) and breaker state"""
+        stats = self._stats.snapshot()
+        with self._lock:
+            samples = sorted(self._latencies)
+        timed = stats['calls'] - stats['short_circuited']
+        stats['avg_ms'] = round(stats.pop('total_ms') / timed, 3) if timed else 0.0
+        stats['max_ms'] = round(stats['max_ms'], 3)
+        stats['p50_ms'] = round(samples[len(samples) // 2], 3) if samples else 0.0
+        stats['p95_ms'] = round(samples[int(len(samples) * 0.95)], 3) if samples else 0.0
+        stats['breaker'] = self.breaker.state
+        stats['breaker_opened'] = self.breaker.times_opened
+        stats['breaker_retry_in'] = round(self.breaker.seconds_until_retry(), 3)
+        stats['url'] = self.url
+        return stats
+
+qito_client = ProviderClient('QITO', QITO_API_URL)
+bypass_client = ProviderClient('ByPass', BYPASS_API_URL)
+
+def get_provider_stats():
+    """Return per-provider call statistics for this process"""
+    return {
+        'qito': qito_client.get_stats(),
+        'bypass': bypass_client.get_stats(),
+    }
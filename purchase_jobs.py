@@ -0,0 +1,211 @@
+"""
+Background completion of QITO / ByPass purchases.
+
+The confirm callback only answers the button, persists a job
+(database.create_purchase_job) and edits the confirmation message to say
+the purchase is being processed. PURCHASE_WORKERS threads finish it:
+
+- queued: check the balance, take a pre-created account (account_pool.py)
+  or create one through the provider API, and store it on the job
+  (provisioned). A pooled account is charged and recorded in the same
+  write, so the job goes straight to recorded;
+- provisioned: write user_plans and debit the buyer in one transaction,
+  together with the status change (recorded), so a job is charged once.
+  The debit only applies while the balance covers the price; if other
+  purchases spent it in the meantime the job fails unpaid and the account
+  created for it is logged as unused;
+- recorded: edit the confirmation message with the credentials, notify the
+  admin (delivered).
+
+Every step is persisted, so after a restart unfinished jobs carry on from
+the step they reached. Only a job interrupted during the provider call is
+repeated from the start: the buyer is still charged once, but the provider
+may be left with an unused account.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import (create_purchase_job, get_purchase_job, get_unfinished_purchase_job_ids, get_plan,
+                      get_user_balance, set_purchase_job_account, record_purchase_job, set_purchase_job_status,
+                      record_purchase_job_error, get_purchase_job_counts,
+                      PURCHASE_JOB_QUEUED, PURCHASE_JOB_PROVISIONED, PURCHASE_JOB_RECORDED,
+                      PURCHASE_JOB_DELIVERED, PURCHASE_JOB_FAILED, PURCHASE_JOB_UNFINISHED,
+                      PURCHASE_SUCCESS, PURCHASE_INSUFFICIENT_FUNDS, PURCHASE_PLAN_NOT_FOUND)
+from metrics import Counters
+from account_pool import PROVIDER_CLIENTS, claim_pooled_account
+from provider_client import account_credentials
+
+PURCHASE_WORKERS = int(os.getenv('PURCHASE_WORKERS', '4'))
+# Attempts per step for unexpected errors (database, Telegram) before giving up
+PURCHASE_MAX_ATTEMPTS = 3
+PURCHASE_RETRY_DELAY = 5.0
+
+# Failure reasons passed to the report_failure callback
+PURCHASE_PROVIDER_UNAVAILABLE = 'provider_unavailable'
+PURCHASE_ERROR = 'error'
+
+_deliver = None
+_report_failure = None
+_jobs = queue.Queue()
+_active = set()
+_active_lock = threading.Lock()
+_workers = []
+_workers_lock = threading.Lock()
+_stats = Counters(
+    delivered=0,
+    failed=0,
+    pooled=0,
+    retried=0,
+    unsold_accounts=0,
+    total_ms=0.0,
+    max_ms=0.0,
+)
+
+def start_purchase_workers(deliver, report_failure):
+    """Start the worker threads if they are not running, and queue jobs left unfinished by a restart.
+
+    deliver(job, plan, api_response, expiry_date) shows the credentials to the
+    buyer; report_failure(job, reason) tells them nothing was charged. reason
+    is PURCHASE_PLAN_NOT_FOUND, PURCHASE_INSUFFICIENT_FUNDS,
+    PURCHASE_PROVIDER_UNAVAILABLE or PURCHASE_ERROR.
+    """
+    global _deliver, _report_failure
+    with _workers_lock:
+        _deliver = deliver
+        _report_failure = report_failure
+        _workers[:] = [worker for worker in _workers if worker.is_alive()]
+        if len(_workers) == PURCHASE_WORKERS:
+            return
+        while len(_workers) < PURCHASE_WORKERS:
+            worker = threading.Thread(target=_worker_loop, name=f'purchase-{len(_workers)}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+    for job_id in get_unfinished_purchase_job_ids():
+        submit_purchase_job(job_id)
+
+def queue_purchase(from_user, provider, plan_id, chat_id, message_id):
+    """Persist a purchase confirmed on message_id; returns the job id, or None if it was already confirmed.
+
+    The job is not started until submit_purchase_job(), so the caller can
+    edit the confirmation message first without racing the worker.
+    """
+    return create_purchase_job(from_user.id, provider, plan_id, chat_id, message_id,
+                               from_user.first_name, from_user.last_name, from_user.username)
+
+def submit_purchase_job(job_id):
+    """Hand a job to the workers (no-op if it is already waiting or running)"""
+    with _active_lock:
+        if job_id in _active:
+            return
+        _active.add(job_id)
+    _jobs.put(job_id)
+
+def _fail(job, reason):
+    """Mark a job that has not charged the buyer as failed and tell them"""
+    if set_purchase_job_status(job.id, PURCHASE_JOB_FAILED, (PURCHASE_JOB_QUEUED, PURCHASE_JOB_PROVISIONED), reason):
+        _stats.bump('failed')
+        print(f"❌ Purchase #{job.id} failed: {reason}")
+        _report_failure(job, reason)
+
+def _provision(job, plan):
+    """queued -> provisioned (new account) or recorded (pooled account)"""
+    plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, created_at, updated_at, device_limit = plan
+    device_limit = device_limit or 1
+
+    if int(get_user_balance(job.user_id)) < credits_required:
+        _fail(job, PURCHASE_INSUFFICIENT_FUNDS)
+        return
+
+    status, _, _ = claim_pooled_account(job.provider, job.user_id, plan_id, device_limit, duration_days,
+                                        credits_required, purchase_job_id=job.id)
+    if status == PURCHASE_SUCCESS:
+        _stats.bump('pooled')
+        return
+    if status == PURCHASE_INSUFFICIENT_FUNDS:
+        # Spent by another purchase since the check above; do not buy an account for it
+        _fail(job, PURCHASE_INSUFFICIENT_FUNDS)
+        return
+
+    api_response = PROVIDER_CLIENTS[job.provider].create_user(device_limit, duration_days)
+    if not api_response:
+        _fail(job, PURCHASE_PROVIDER_UNAVAILABLE)
+        return
+    expiry_date = datetime.now() + timedelta(days=duration_days)
+    set_purchase_job_account(job.id, json.dumps(api_response), expiry_date.strftime('%Y-%m-%d %H:%M:%S'))
+
+def _run_job(job_id):
+    """Take a job through its remaining steps"""
+    started = time.perf_counter()
+    job = get_purchase_job(job_id)
+    while job is not None and job.status in PURCHASE_JOB_UNFINISHED:
+        plan = get_plan(job.plan_id)
+        if plan is None and job.status != PURCHASE_JOB_RECORDED:
+            _fail(job, PURCHASE_PLAN_NOT_FOUND)
+        elif job.status == PURCHASE_JOB_QUEUED:
+            _provision(job, plan)
+        elif job.status == PURCHASE_JOB_PROVISIONED:
+            api_response = json.loads(job.api_response)
+            if record_purchase_job(job.id, plan[4], account_credentials(api_response)) == PURCHASE_INSUFFICIENT_FUNDS:
+                print(f"⚠️ Purchase #{job.id}: {job.provider} account {api_response.get('username', 'N/A')} "
+                      f"was created but not sold (balance spent meanwhile)")
+                _stats.bump('unsold_accounts')
+                _fail(job, PURCHASE_INSUFFICIENT_FUNDS)
+        else:
+            expiry_date = datetime.strptime(job.expiry_date[:19], '%Y-%m-%d %H:%M:%S')
+            _deliver(job, plan, json.loads(job.api_response), expiry_date)
+            set_purchase_job_status(job.id, PURCHASE_JOB_DELIVERED, (PURCHASE_JOB_RECORDED,))
+            _stats.bump('delivered')
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            _stats.add(total_ms=elapsed_ms)
+            _stats.peak(max_ms=elapsed_ms)
+        job = get_purchase_job(job_id)
+
+def _retry_later(job_id, error):
+    """Count a failed attempt; retry after a delay, or give up on the job"""
+    attempts = record_purchase_job_error(job_id, error)
+    job = get_purchase_job(job_id)
+    if attempts < PURCHASE_MAX_ATTEMPTS:
+        _stats.bump('retried')
+        timer = threading.Timer(PURCHASE_RETRY_DELAY * attempts, submit_purchase_job, (job_id,))
+        timer.daemon = True
+        timer.start()
+    elif job.status == PURCHASE_JOB_RECORDED:
+        # Already charged and listed in My Plans; delivery is tried again after a restart
+        print(f"⚠️ Purchase #{job_id} recorded but not delivered: {error}")
+    else:
+        _fail(job, PURCHASE_ERROR)
+
+def _worker_loop():
+    while True:
+        job_id = _jobs.get()
+        try:
+            _run_job(job_id)
+        except Exception as e:
+            print(f"❌ Purchase #{job_id} error: {e}")
+            error = str(e)
+        else:
+            error = None
+        finally:
+            with _active_lock:
+                _active.discard(job_id)
+        if error is not None:
+            try:
+                _retry_later(job_id, error)
+            except Exception as retry_error:
+                print(f"❌ Purchase #{job_id} could not be rescheduled: {retry_error}")
+
+def get_purchase_stats():
+    """Worker counters for this process plus job counts per status"""
+    stats = _stats.snapshot()
+    delivered = stats['delivered']
+    stats['avg_ms'] = round(stats.pop('total_ms') / delivered, 3) if delivered else 0.0
+    stats['max_ms'] = round(stats['max_ms'], 3)
+    stats['workers_alive'] = sum(1 for worker in _workers if worker.is_alive())
+    stats['waiting'] = _jobs.qsize()
+    stats['jobs'] = get_purchase_job_counts()
+    return stats
@@ -9,6 +9,7 @@ import os
 import sys
 from web_admin import app, init_admin_tables
 from database import init_database
+from bot_webhook import get_bot_mode, register_webhook_route, start_webhook, BOT_MODE_WEBHOOK, WEBHOOK_PATH
 
 def run_bot():
     """Run the Telegram bot"""
@@ -16,6 +17,7 @@ def run_bot():
     try:
         # Import and run the bot
         import bot
+        bot.start_background_workers()
         print("✅ Telegram Bot started successfully!")
         print("📱 Bot is now running and listening for messages...")
         
@@ -26,6 +28,14 @@ def run_bot():
         import traceback
         traceback.print_exc()
 
+def attach_webhook():
+    """Serve Telegram updates from the web admin's Flask app (BOT_MODE=webhook)"""
+    import bot
+    register_webhook_route(app, bot.bot)
+    start_webhook(bot.bot)
+    bot.start_background_workers()
+    print("✅ Telegram Bot started in webhook mode!")
+
 def run_web_admin():
     """Run the web admin panel"""
     print("🌐 Starting Web Admin Panel...")
@@ -55,18 +65,23 @@ if __name__ == '__main__':
     print("\nPress Ctrl+C to stop both services")
     
     try:
-        # Start bot in a separate thread
-        bot_thread = threading.Thread(target=run_bot, daemon=True)
-        bot_thread.start()
-        
-        # Give bot time to start
-        time.sleep(3)
-        
-        # Check if bot thread is still alive
-        if bot_thread.is_alive():
-            print("✅ Bot thread is running successfully!")
+        if get_bot_mode() == BOT_MODE_WEBHOOK:
+            # Telegram POSTs updates to the web admin server; no polling thread
+            print(f"🔗 Webhook endpoint: http://localhost:5000{WEBHOOK_PATH}")
+            attach_webhook()
         else:
-            print("❌ Bot thread failed to start!")
+            # Start bot in a separate thread
+            bot_thread = threading.Thread(target=run_bot, daemon=True)
+            bot_thread.start()
+            
+            # Give bot time to start
+            time.sleep(3)
+            
+            # Check if bot thread is still alive
+            if bot_thread.is_alive():
+                print("✅ Bot thread is running successfully!")
+            else:
+                print("❌ Bot thread failed to start!")
         
         # Run web admin in main thread
         print("🌐 Starting web admin panel...")
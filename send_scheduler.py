@@ -0,0 +1,223 @@
+"""
+Outbound Telegram send scheduler.
+
+Every send_message / send_photo / send_document / edit_message_text /
+answer_callback_query made through the bot first takes a slot from one
+SendScheduler, then calls the API on the caller's own thread:
+
+- a global token bucket (SEND_RATE_PER_SECOND) and one per chat
+  (SEND_PER_CHAT_RATE, bursts of SEND_PER_CHAT_BURST). Only bulk sends wait
+  for their chat's bucket. Interactive replies are sent from the update
+  workers, where a wait would also hold up every other chat on the same
+  shard, so they only use up the chat's tokens;
+- two priority lanes. Interactive replies (the default) go first. Bulk
+  traffic (broadcasts, admin notices, low-key alerts) waits while an
+  interactive send is ready, and never takes the last SEND_BULK_RESERVE
+  global tokens;
+- a 429 holds every lane for the retry_after Telegram asks for, and the
+  call is retried (up to SEND_MAX_RATE_LIMIT_RETRIES times).
+
+Mark bulk sends with the send_lane() context manager:
+
+    with send_lane(LANE_BULK):
+        bot.send_message(ADMIN_TELEGRAM_ID, text)
+
+Queue latency (time spent waiting for a slot) is reported per lane by
+get_send_stats().
+"""
+
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+
+from telebot.apihelper import ApiTelegramException
+
+SEND_RATE_PER_SECOND = float(os.getenv('SEND_RATE_PER_SECOND', '30'))
+SEND_PER_CHAT_RATE = float(os.getenv('SEND_PER_CHAT_RATE', '1'))
+SEND_PER_CHAT_BURST = int(os.getenv('SEND_PER_CHAT_BURST', '3'))
+# Global tokens bulk sends leave for interactive replies
+SEND_BULK_RESERVE = 5
+SEND_MAX_RATE_LIMIT_RETRIES = 5
+# Latency samples kept per lane for the percentiles in get_send_stats()
+LATENCY_SAMPLES = 1000
+
+LANE_INTERACTIVE = 'interactive'
+LANE_BULK = 'bulk'
+# Highest priority first
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+_current_lane = contextvars.ContextVar('send_lane', default=LANE_INTERACTIVE)
+
+@contextlib.contextmanager
+def send_lane(lane):
+    """Send every API call made inside the block through the given lane"""
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+class SendScheduler:
+    """Hands out send slots by lane priority under global and per-chat token buckets"""
+
+    def __init__(self, rate=SEND_RATE_PER_SECOND, per_chat_rate=SEND_PER_CHAT_RATE,
+                 per_chat_burst=SEND_PER_CHAT_BURST, bulk_reserve=SEND_BULK_RESERVE):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.bulk_reserve = min(bulk_reserve, self.capacity - 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._chat_buckets = {}  # chat_id -> (tokens, updated)
+        self._waiting = {}       # waiter id -> (lane, chat_id)
+        self._next_waiter = 0
+        self._cond = threading.Condition()
+        self._stats = {lane: {
+            'sent': 0,
+            'waited': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+            'samples': deque(maxlen=LATENCY_SAMPLES),
+        } for lane in LANES}
+        self._rate_limited = 0
+
+    def _chat_delay(self, chat_id, now, lane=LANE_BULK):
+        """Seconds a send in this lane waits for chat_id's bucket (0 if it may go now)"""
+        if chat_id is None or lane == LANE_INTERACTIVE:
+            return 0.0
+        tokens, updated = self._chat_buckets.get(chat_id, (self.per_chat_burst, now))
+        tokens = min(self.per_chat_burst, tokens + (now - updated) * self.per_chat_rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.per_chat_rate
+
+    def _take_chat_token(self, chat_id, now):
+        if chat_id is None:
+            return
+        tokens, updated = self._chat_buckets.get(chat_id, (self.per_chat_burst, now))
+        tokens = min(self.per_chat_burst, tokens + (now - updated) * self.per_chat_rate)
+        # Interactive sends may find the bucket empty; bulk sends to the chat then wait for a refill
+        self._chat_buckets[chat_id] = (max(0.0, tokens - 1), now)
+        if len(self._chat_buckets) > 10000:
+            # Drop buckets that have refilled completely; they start full anyway
+            full_after = self.per_chat_burst / self.per_chat_rate
+            self._chat_buckets = {chat: bucket for chat, bucket in self._chat_buckets.items()
+                                  if now - bucket[1] < full_after}
+
+    def _higher_lane_ready(self, lane, now):
+        """True if a waiter in a higher-priority lane could send right now"""
+        rank = LANES.index(lane)
+        return any(LANES.index(other_lane) < rank and self._chat_delay(chat_id, now, other_lane) <= 0
+                   for other_lane, chat_id in self._waiting.values())
+
+    def acquire(self, chat_id, lane=LANE_INTERACTIVE):
+        """Block until a message to chat_id (None = no chat) may be sent in this lane"""
+        enqueued = time.monotonic()
+        reserve = self.bulk_reserve if lane != LANE_INTERACTIVE else 0
+        with self._cond:
+            waiter = self._next_waiter
+            self._next_waiter += 1
+            self._waiting[waiter] = (lane, chat_id)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    delay = max(
+                        self._blocked_until - now,
+                        self._chat_delay(chat_id, now, lane),
+                        (1 + reserve - self._tokens) / self.rate,
+                    )
+                    if delay <= 0 and not self._higher_lane_ready(lane, now):
+                        self._tokens -= 1
+                        self._take_chat_token(chat_id, now)
+                        break
+                    # Woken early when another waiter leaves or a 429 arrives
+                    self._cond.wait(delay if delay > 0 else 1 / self.rate)
+            finally:
+                del self._waiting[waiter]
+                self._cond.notify_all()
+
+            wait_ms = (time.monotonic() - enqueued) * 1000
+            stats = self._stats[lane]
+            stats['sent'] += 1
+            stats['total_wait_ms'] += wait_ms
+            stats['max_wait_ms'] = max(stats['max_wait_ms'], wait_ms)
+            stats['samples'].append(wait_ms)
+            if wait_ms >= 1:
+                stats['waited'] += 1
+
+    def back_off(self, seconds):
+        """Hold every lane for the given time (Telegram answered 429)"""
+        with self._cond:
+            self._rate_limited += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def get_stats(self):
+        """Per-lane send counts and queue latency (avg, p50, p95, max in ms)"""
+        with self._cond:
+            lanes = {}
+            for lane, stats in self._stats.items():
+                samples = sorted(stats['samples'])
+                sent = stats['sent']
+                lanes[lane] = {
+                    'sent': sent,
+                    'waited': stats['waited'],
+                    'waiting_now': sum(1 for waiting_lane, _ in self._waiting.values() if waiting_lane == lane),
+                    'avg_wait_ms': round(stats['total_wait_ms'] / sent, 3) if sent else 0.0,
+                    'p50_wait_ms': round(samples[len(samples) // 2], 3) if samples else 0.0,
+                    'p95_wait_ms': round(samples[int(len(samples) * 0.95)], 3) if samples else 0.0,
+                    'max_wait_ms': round(stats['max_wait_ms'], 3),
+                }
+            return {
+                'rate_per_second': self.rate,
+                'per_chat_rate': self.per_chat_rate,
+                'per_chat_burst': self.per_chat_burst,
+                'bulk_reserve': self.bulk_reserve,
+                'rate_limited': self._rate_limited,
+                'blocked_for_seconds': round(max(0.0, self._blocked_until - time.monotonic()), 3),
+                'lanes': lanes,
+            }
+
+_scheduler = SendScheduler()
+
+def scheduled_call(chat_id, func, *args, **kwargs):
+    """Call a Bot API method once the scheduler allows it, retrying on 429"""
+    lane = _current_lane.get()
+    for attempt in range(SEND_MAX_RATE_LIMIT_RETRIES + 1):
+        _scheduler.acquire(chat_id, lane)
+        try:
+            return func(*args, **kwargs)
+        except ApiTelegramException as e:
+            if e.error_code != 429 or attempt == SEND_MAX_RATE_LIMIT_RETRIES:
+                raise
+            retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+            print(f"⏳ Telegram rate limit hit ({lane} lane), waiting {retry_after}s")
+            _scheduler.back_off(retry_after)
+
+class ScheduledSendMixin:
+    """TeleBot mixin routing the send methods through the shared SendScheduler"""
+
+    def send_message(self, chat_id, *args, **kwargs):
+        return scheduled_call(chat_id, super().send_message, chat_id, *args, **kwargs)
+
+    def send_photo(self, chat_id, *args, **kwargs):
+        return scheduled_call(chat_id, super().send_photo, chat_id, *args, **kwargs)
+
+    def send_document(self, chat_id, *args, **kwargs):
+        return scheduled_call(chat_id, super().send_document, chat_id, *args, **kwargs)
+
+    def edit_message_text(self, text, chat_id=None, *args, **kwargs):
+        return scheduled_call(chat_id, super().edit_message_text, text, chat_id, *args, **kwargs)
+
+    def answer_callback_query(self, callback_query_id, *args, **kwargs):
+        # Not a chat message, so only the global bucket applies
+        return scheduled_call(None, super().answer_callback_query, callback_query_id, *args, **kwargs)
+
+def get_send_stats():
+    """Return the scheduler's per-lane statistics"""
+    return _scheduler.get_stats()
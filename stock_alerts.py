@@ -0,0 +1,163 @@
+"""
+Low key stock alerts for VPN key plans.
+
+purchase_vpn_key() returns the plan's stock left after the sale (read from
+plan_inventory in the purchase transaction) and the handler passes it to
+record_stock_level(). That only compares one number with the plan's
+threshold, so a sale no longer scans every plan, and the admin hears about
+a plan when it crosses its threshold, not on every sale after that:
+
+- threshold: plans.low_stock_threshold, or LOW_STOCK_THRESHOLD when unset;
+- hysteresis: once alerted, a plan is re-armed only after a sale leaves it
+  at threshold + LOW_STOCK_HYSTERESIS keys or more (i.e. keys were added),
+  so sales around the threshold do not alert again;
+- debounce: at most one low stock alert per plan per LOW_STOCK_ALERT_INTERVAL.
+  Selling out is always reported, even if the plan was already low.
+
+Alerts are queued and handed over by one background thread, which puts
+the crossings of LOW_STOCK_BATCH_SECONDS into a single message (bot.py
+passes it to admin_notifications.py, which may fold it into a digest).
+
+Levels are kept per process and start armed, so after a restart a plan
+that is still low is reported again on its next sale.
+"""
+
+import os
+import queue
+import threading
+import time
+
+from metrics import Counters
+from database import get_low_stock_thresholds, get_plan
+
+LOW_STOCK_THRESHOLD = int(os.getenv('LOW_STOCK_THRESHOLD', '10'))
+LOW_STOCK_HYSTERESIS = int(os.getenv('LOW_STOCK_HYSTERESIS', '5'))
+LOW_STOCK_ALERT_INTERVAL = float(os.getenv('LOW_STOCK_ALERT_INTERVAL', '1800'))
+LOW_STOCK_BATCH_SECONDS = 5.0
+
+STOCK_OK = 'ok'
+STOCK_LOW = 'low'
+STOCK_OUT = 'out'
+
+_send = None
+_events = queue.Queue()
+_levels = {}      # plan id -> STOCK_LOW / STOCK_OUT (absent: STOCK_OK)
+_alerted_at = {}  # plan id -> time.monotonic() of its last low stock alert
+_levels_lock = threading.Lock()
+_worker_thread = None
+_worker_lock = threading.Lock()
+_stats = Counters(
+    sales_seen=0,
+    alerts_queued=0,
+    debounced=0,
+    rearmed=0,
+    messages_sent=0,
+    send_errors=0,
+)
+
+def get_low_stock_threshold(plan_id):
+    """Available keys below which the plan counts as low"""
+    return get_low_stock_thresholds().get(plan_id, LOW_STOCK_THRESHOLD)
+
+def start_stock_alerts(send):
+    """Start the alert sender thread if it is not running.
+
+    send(text, items) delivers one alert; items are (plan name, 0, detail)
+    tuples, one per plan, for the admin digest.
+    """
+    global _send, _worker_thread
+    with _worker_lock:
+        _send = send
+        if _worker_thread is not None and _worker_thread.is_alive():
+            return
+        _worker_thread = threading.Thread(target=_worker_loop, name='stock-alerts', daemon=True)
+        _worker_thread.start()
+
+def record_stock_level(plan_id, available_keys):
+    """Note a plan's stock after a sale; queues an alert and returns True if it just crossed its threshold"""
+    threshold = get_low_stock_threshold(plan_id)
+    if available_keys <= 0:
+        level = STOCK_OUT
+    elif available_keys < threshold:
+        level = STOCK_LOW
+    elif available_keys >= threshold + LOW_STOCK_HYSTERESIS:
+        level = STOCK_OK
+    else:
+        level = None  # between the two: keep the current level
+    _stats.bump('sales_seen')
+
+    with _levels_lock:
+        previous = _levels.get(plan_id, STOCK_OK)
+        if level is None and previous == STOCK_OUT:
+            level = STOCK_LOW
+        if level is None or level == previous:
+            return False
+        if level == STOCK_OK:
+            del _levels[plan_id]
+            _stats.bump('rearmed')
+            return False
+        _levels[plan_id] = level
+        if previous == STOCK_OUT:
+            # Restocked a little but still low; selling out was already reported
+            return False
+        now = time.monotonic()
+        last_alert = _alerted_at.get(plan_id)
+        if level == STOCK_LOW and last_alert is not None and now - last_alert < LOW_STOCK_ALERT_INTERVAL:
+            _stats.bump('debounced')
+            return False
+        _alerted_at[plan_id] = now
+
+    _stats.bump('alerts_queued')
+    _events.put((plan_id, level, available_keys, threshold))
+    return True
+
+def format_stock_alert(events):
+    """Admin message and digest items for a batch of (plan_id, level, available_keys, threshold) crossings"""
+    latest = {}
+    for event in events:
+        latest[event[0]] = event
+    text = "⚠️ **LOW KEY ALERT**\n\n"
+    items = []
+    for plan_id, level, available_keys, threshold in latest.values():
+        plan = get_plan(plan_id)
+        name = plan[2] if plan else f"Plan #{plan_id}"
+        if level == STOCK_OUT:
+            text += f"❌ **{name}**\nOut of stock!\n\n"
+            items.append((name, 0, "Out of stock!"))
+        else:
+            text += f"🔑 **{name}**\nAvailable Keys: {available_keys} (threshold {threshold})\n\n"
+            items.append((name, 0, f"{available_keys} keys left"))
+    text += "Please add more keys to these plans to avoid service interruption."
+    return text, items
+
+def _next_batch():
+    """Block for the next crossing, then collect the others queued within LOW_STOCK_BATCH_SECONDS"""
+    batch = [_events.get()]
+    deadline = time.monotonic() + LOW_STOCK_BATCH_SECONDS
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return batch
+        try:
+            batch.append(_events.get(timeout=remaining))
+        except queue.Empty:
+            return batch
+
+def _worker_loop():
+    while True:
+        batch = _next_batch()
+        try:
+            _send(*format_stock_alert(batch))
+            _stats.bump('messages_sent')
+        except Exception as e:
+            _stats.bump('send_errors')
+            print(f"❌ Failed to send low key alert: {e}")
+
+def get_stock_alert_stats():
+    """Alert counters for this process and the plans currently reported low"""
+    stats = _stats.snapshot()
+    with _levels_lock:
+        stats['low_plans'] = {str(plan_id): level for plan_id, level in _levels.items()}
+    stats['waiting'] = _events.qsize()
+    stats['worker_alive'] = _worker_thread is not None and _worker_thread.is_alive()
+    return stats
@@ -0,0 +1,24 @@
+"""Shared fixtures: every test gets its own migrated database file"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:test')
+
+import pytest
+
+import database
+import db_pool
+import migrations
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    """Point every connection (including the writer thread's) at a fresh database"""
+    monkeypatch.setattr(db_pool, 'DB_FILE', str(tmp_path / 'bot_database.db'))
+    db_pool.invalidate_connections()
+    database.clear_known_users()
+    migrations.run_migrations(force=True)
+    yield db_pool.DB_FILE
+    db_pool.invalidate_connections()
+    database.clear_known_users()
@@ -0,0 +1,102 @@
+from datetime import datetime
+
+import pytest
+
+import admin_notifications
+from admin_notifications import NOTIFY_PURCHASE, NOTIFY_LOW_STOCK
+
+class FakeTimer:
+    """threading.Timer that never fires; the tests flush by hand"""
+    started = 0
+
+    def __init__(self, interval, function):
+        self.daemon = False
+
+    def start(self):
+        FakeTimer.started += 1
+
+    def cancel(self):
+        pass
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Messages delivered to the admin, with digests for both categories and a fresh window"""
+    messages = []
+    monkeypatch.setattr(admin_notifications, '_pending', {})
+    monkeypatch.setattr(admin_notifications, '_flush_timer', None)
+    monkeypatch.setattr(admin_notifications, '_window_started', None)
+    monkeypatch.setattr(admin_notifications, 'ADMIN_DIGEST_CATEGORIES', frozenset({NOTIFY_PURCHASE, NOTIFY_LOW_STOCK}))
+    monkeypatch.setattr(admin_notifications.threading, 'Timer', FakeTimer)
+    FakeTimer.started = 0
+    admin_notifications.start_admin_notifications(lambda text, parse_mode: messages.append((text, parse_mode)))
+    yield messages
+    admin_notifications.start_admin_notifications(None)
+
+def test_digested_events_wait_for_one_flush(sent):
+    admin_notifications.notify_admin(NOTIFY_PURCHASE, 'Bought', [('VPN 30 days', 10, None)])
+    admin_notifications.notify_admin(NOTIFY_PURCHASE, 'Bought', [('VPN 30 days', 10, None)])
+    admin_notifications.notify_admin(NOTIFY_PURCHASE, 'Bought', [('QITO 30 days', 25, None)])
+
+    assert sent == []
+    assert FakeTimer.started == 1
+    assert admin_notifications.flush_admin_digest() is True
+    assert len(sent) == 1
+    # Nothing left for the next window
+    assert admin_notifications.flush_admin_digest() is False
+
+def test_digest_text_totals_and_breakdown(sent):
+    admin_notifications.notify_admin(NOTIFY_PURCHASE, 'Bought', [('VPN 30 days', 10, None)])
+    admin_notifications.notify_admin(NOTIFY_PURCHASE, 'Bought', [('QITO 30 days', 25, None)])
+    admin_notifications.notify_admin(NOTIFY_PURCHASE, 'Bought', [('VPN 30 days', 10, None)])
+    admin_notifications.notify_admin(NOTIFY_LOW_STOCK, 'Low', [('VPN 30 days', 0, '9 keys left')])
+    admin_notifications.notify_admin(NOTIFY_LOW_STOCK, 'Out', [('VPN 30 days', 0, 'Out of stock!')])
+    admin_notifications.flush_admin_digest()
+
+    text, parse_mode = sent[0]
+    assert parse_mode is None
+    assert text.startswith('📊 Admin digest ')
+    assert text.split('\n\n')[1:] == [
+        '🛒 Purchases: 3 (45 Credits)\n'
+        '• VPN 30 days: 2 (20 Credits)\n'
+        '• QITO 30 days: 1 (25 Credits)',
+        '⚠️ Low key alerts: 2\n'
+        '• VPN 30 days: Out of stock!',
+    ]
+
+def test_format_admin_digest_window_times():
+    text = admin_notifications.format_admin_digest(
+        {NOTIFY_PURCHASE: {'VPN 30 days': [1, 10, None]}},
+        datetime(2026, 1, 1, 9, 5), datetime(2026, 1, 1, 9, 10))
+    assert text == '📊 Admin digest 09:05 - 09:10\n\n🛒 Purchases: 1 (10 Credits)\n• VPN 30 days: 1 (10 Credits)'
+
+def test_categories_not_digested_are_sent_at_once(sent, monkeypatch):
+    monkeypatch.setattr(admin_notifications, 'ADMIN_DIGEST_CATEGORIES', frozenset({NOTIFY_LOW_STOCK}))
+    admin_notifications.notify_admin(NOTIFY_PURCHASE, '🔔 **New Plan Purchase**', [('VPN 30 days', 10, None)],
+                                     parse_mode='Markdown')
+
+    assert sent == [('🔔 **New Plan Purchase**', 'Markdown')]
+    assert admin_notifications.flush_admin_digest() is False
+
+def test_failed_digest_is_kept_for_the_next_window(sent):
+    def unreachable(text, parse_mode):
+        raise ConnectionError('Telegram is down')
+
+    admin_notifications.notify_admin(NOTIFY_PURCHASE, 'Bought', [('VPN 30 days', 10, None)])
+    admin_notifications.notify_admin(NOTIFY_LOW_STOCK, 'Low', [('VPN 30 days', 0, '9 keys left')])
+    admin_notifications.start_admin_notifications(unreachable)
+    assert admin_notifications.flush_admin_digest() is False
+    # The window is re-armed, and events keep adding up
+    assert FakeTimer.started == 2
+    admin_notifications.notify_admin(NOTIFY_PURCHASE, 'Bought', [('VPN 30 days', 10, None)])
+    admin_notifications.notify_admin(NOTIFY_LOW_STOCK, 'Out', [('VPN 30 days', 0, 'Out of stock!')])
+    assert FakeTimer.started == 2
+
+    admin_notifications.start_admin_notifications(lambda text, parse_mode: sent.append((text, parse_mode)))
+    assert admin_notifications.flush_admin_digest() is True
+    assert sent[0][0].split('\n\n')[1:] == [
+        '🛒 Purchases: 2 (20 Credits)\n'
+        '• VPN 30 days: 2 (20 Credits)',
+        '⚠️ Low key alerts: 2\n'
+        '• VPN 30 days: Out of stock!',
+    ]
+    assert admin_notifications.flush_admin_digest() is False
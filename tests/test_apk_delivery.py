@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+import apk_delivery
+import database
+
+CHAT_ID = 7
+
+def _telegram_error(code, description):
+    return ApiTelegramException('sendDocument', None, {'ok': False, 'error_code': code, 'description': description})
+
+class FakeBot:
+    """Records what send_document was given; file_ids in errors raise instead"""
+
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+
+    def send_document(self, chat_id, document, caption=None, timeout=None):
+        if isinstance(document, str):
+            self.sent.append(document)
+            if document in self.errors:
+                raise self.errors[document]
+            return SimpleNamespace(document=SimpleNamespace(file_id=document, file_size=4))
+        self.sent.append('upload')
+        return SimpleNamespace(document=SimpleNamespace(file_id=f'file-{len(self.sent)}', file_size=4))
+
+@pytest.fixture
+def apk(db_file, tmp_path, monkeypatch):
+    """A small apk_files/latest.apk in a scratch directory, and its content hash"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'apk_files').mkdir()
+    (tmp_path / apk_delivery.APK_FILE_PATH).write_bytes(b'apk1')
+    monkeypatch.setattr(apk_delivery, '_hash_cache', {})
+    return apk_delivery.apk_file_hash()
+
+def test_apk_is_uploaded_once_then_sent_by_file_id(apk):
+    bot = FakeBot()
+    apk_delivery.send_apk(bot, CHAT_ID)
+    apk_delivery.send_apk(bot, CHAT_ID)
+
+    assert bot.sent == ['upload', 'file-1']
+    assert database.get_telegram_file_id(apk) == 'file-1'
+
+def test_stale_file_id_is_dropped_and_the_file_uploaded_again(apk):
+    database.save_telegram_file_id(apk, 'expired-id', 4)
+    stale_before = apk_delivery.get_apk_delivery_stats()['stale_file_ids']
+    bot = FakeBot({'expired-id': _telegram_error(400, 'Bad Request: wrong file identifier/HTTP URL specified')})
+
+    message = apk_delivery.send_apk(bot, CHAT_ID)
+
+    assert bot.sent == ['expired-id', 'upload']
+    assert message.document.file_id == 'file-2'
+    assert database.get_telegram_file_id(apk) == 'file-2'
+    assert apk_delivery.get_apk_delivery_stats()['stale_file_ids'] == stale_before + 1
+
+    # The next user gets the new file_id
+    apk_delivery.send_apk(bot, CHAT_ID)
+    assert bot.sent[-1] == 'file-2'
+
+def test_other_errors_keep_the_file_id(apk):
+    database.save_telegram_file_id(apk, 'good-id', 4)
+    bot = FakeBot({'good-id': _telegram_error(403, 'Forbidden: bot was blocked by the user')})
+
+    with pytest.raises(ApiTelegramException):
+        apk_delivery.send_apk(bot, CHAT_ID)
+    assert bot.sent == ['good-id']
+    assert database.get_telegram_file_id(apk) == 'good-id'
+
+def test_new_file_content_gets_a_new_upload(apk):
+    bot = FakeBot()
+    apk_delivery.send_apk(bot, CHAT_ID)
+    with open(apk_delivery.APK_FILE_PATH, 'wb') as apk_file:
+        apk_file.write(b'apk2-longer')
+    apk_delivery.send_apk(bot, CHAT_ID)
+
+    assert bot.sent == ['upload', 'upload']
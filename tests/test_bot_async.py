@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+import pytest
+from telebot.types import Message
+
+# AsyncTeleBot needs aiohttp
+pytest.importorskip('aiohttp')
+
+MESSAGE = {
+    'message_id': 1,
+    'date': 0,
+    'chat': {'id': 100, 'type': 'private'},
+    'from': {'id': 100, 'is_bot': False, 'first_name': 'Test'},
+    'text': '/admin',
+}
+
+@pytest.fixture
+def bot_async(db_file):
+    # Imported here so bot.py's start-up migrations run on the test database
+    import bot_async
+    return bot_async
+
+def test_one_chat_is_handled_in_order_and_others_in_parallel(bot_async):
+    events = []
+
+    async def handle(chat_id, name, delay):
+        async with bot_async._chat_locks.hold(chat_id):
+            events.append(('start', name))
+            await asyncio.sleep(delay)
+            events.append(('end', name))
+
+    async def main():
+        await asyncio.gather(handle(1, 'a1', 0.05), handle(1, 'a2', 0), handle(2, 'b1', 0))
+
+    asyncio.run(main())
+    assert events.index(('end', 'a1')) < events.index(('start', 'a2'))
+    assert events.index(('end', 'b1')) < events.index(('end', 'a1'))
+    # Locks are dropped once nobody holds them
+    assert bot_async._chat_locks._locks == {}
+
+def test_sync_handlers_run_on_their_own_threads(bot_async, monkeypatch):
+    handled = []
+    monkeypatch.setattr(bot_async.sync_bot.bot, 'process_update_now',
+                        lambda update: handled.append((update.message.text, threading.current_thread().name)))
+
+    asyncio.run(bot_async.run_sync_handlers('message', Message.de_json(MESSAGE)))
+
+    assert len(handled) == 1
+    text, thread_name = handled[0]
+    assert text == '/admin'
+    assert thread_name.startswith('sync-handlers')
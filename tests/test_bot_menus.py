@@ -0,0 +1,67 @@
+import json
+
+import pytest
+from telebot.types import Update
+
+ADMIN_ID = 1
+USER_ID = 2
+
+@pytest.fixture
+def bot(db_file, monkeypatch):
+    """bot.py with a fresh notification state; imported here so its start-up migrations run on the test database"""
+    import bot
+    monkeypatch.setattr(bot, 'ADMIN_TELEGRAM_ID', str(ADMIN_ID))
+    monkeypatch.setattr(bot, 'admin_custom_notification_state', {})
+    return bot
+
+@pytest.fixture
+def sent(bot, monkeypatch):
+    """(chat_id, text) of every message the bot sends"""
+    messages = []
+    monkeypatch.setattr(bot.bot, 'send_message', lambda chat_id, text, **kwargs: messages.append((chat_id, text)))
+    return messages
+
+def _labels(markup):
+    return [button['text'] for row in json.loads(markup.to_json())['keyboard'] for button in row]
+
+def _send_text(bot, user_id, text):
+    bot.bot.process_update_now(Update.de_json({
+        'update_id': 1,
+        'message': {
+            'message_id': 1,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': text,
+        },
+    }))
+
+def test_every_menu_button_has_a_handler(bot):
+    labels = _labels(bot.create_main_menu()) + _labels(bot.create_admin_menu())
+    assert len(labels) == 18
+    assert [label for label in labels if label not in bot.text_button_handlers] == []
+
+def test_menu_button_is_dispatched_by_its_label(bot, sent, monkeypatch):
+    pressed = []
+    monkeypatch.setitem(bot.text_button_handlers, bot.BUTTON_OUR_CHANNEL, lambda message: pressed.append(message.text))
+
+    _send_text(bot, USER_ID, bot.BUTTON_OUR_CHANNEL)
+    assert pressed == [bot.BUTTON_OUR_CHANNEL]
+    assert sent == []
+
+def test_admin_typing_a_custom_notification_gets_a_preview(bot, sent):
+    bot.admin_custom_notification_state[ADMIN_ID] = 'waiting_for_text'
+
+    _send_text(bot, ADMIN_ID, 'Maintenance tonight')
+    assert bot.admin_custom_notification_state[ADMIN_ID] == 'confirming:Maintenance tonight'
+    assert len(sent) == 1
+    assert 'Custom Notification Preview' in sent[0][1]
+
+def test_other_text_reaches_the_catch_all(bot, sent):
+    _send_text(bot, USER_ID, 'hello')
+    # Only the admin waiting for notification text is routed to the preview
+    _send_text(bot, ADMIN_ID, 'hello')
+
+    assert [chat_id for chat_id, _ in sent] == [USER_ID, ADMIN_ID]
+    assert all("I received your message: 'hello'" in text for _, text in sent)
+    assert bot.admin_custom_notification_state == {}
@@ -0,0 +1,52 @@
+import json
+import os
+
+import pytest
+from flask import Flask
+
+import bot_webhook
+
+UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': 1, 'type': 'private'},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'Test'},
+        'text': '/start',
+    },
+}
+
+class RecordingBot:
+    def __init__(self):
+        self.updates = []
+
+    def process_new_updates(self, updates):
+        self.updates.extend(updates)
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    bot_webhook.register_webhook_route(app, RecordingBot(), secret_token='s3cret')
+    return app.test_client()
+
+def _post(client, headers=None):
+    return client.post(bot_webhook.WEBHOOK_PATH, data=json.dumps(UPDATE),
+                       content_type='application/json', headers=headers or {})
+
+def test_update_without_secret_header_is_rejected(client):
+    assert _post(client).status_code == 403
+
+def test_update_with_wrong_secret_is_rejected(client):
+    assert _post(client, {bot_webhook.SECRET_TOKEN_HEADER: 'guess'}).status_code == 403
+
+def test_update_with_secret_is_accepted(client):
+    assert _post(client, {bot_webhook.SECRET_TOKEN_HEADER: 's3cret'}).status_code == 200
+
+def test_route_is_not_registered_without_a_secret():
+    with pytest.raises(ValueError):
+        bot_webhook.register_webhook_route(Flask(__name__), RecordingBot(), secret_token='')
+
+@pytest.mark.skipif(bool(os.getenv('WEBHOOK_SECRET_TOKEN')), reason="WEBHOOK_SECRET_TOKEN is configured")
+def test_a_secret_is_generated_when_none_is_configured():
+    assert len(bot_webhook.WEBHOOK_SECRET_TOKEN) >= 32
@@ -0,0 +1,93 @@
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+import db_pool
+import database
+import broadcast
+
+ADMIN_ID = 1
+
+def _telegram_error(code, description, retry_after=None):
+    result_json = {'ok': False, 'error_code': code, 'description': description}
+    if retry_after is not None:
+        result_json['parameters'] = {'retry_after': retry_after}
+    return ApiTelegramException('sendMessage', None, result_json)
+
+class FakeBot:
+    """Records sends; errors[telegram_id] is a list of exceptions raised by its next sends"""
+
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+
+    def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        pending = self.errors.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.sent.append(chat_id)
+
+    def edit_message_text(self, *args, **kwargs):
+        pass
+
+@pytest.fixture
+def sleeps(db_file, monkeypatch):
+    """time.sleep calls made by the sender, instead of sleeping"""
+    calls = []
+    monkeypatch.setattr(broadcast.time, 'sleep', calls.append)
+    return calls
+
+def _users(*telegram_ids):
+    conn = db_pool.get_connection()
+    conn.executemany('INSERT INTO users (telegram_id) VALUES (?)', [(telegram_id,) for telegram_id in telegram_ids])
+    conn.commit()
+    conn.close()
+
+def _run(bot, monkeypatch):
+    monkeypatch.setattr(broadcast, '_bot', bot)
+    monkeypatch.setattr(broadcast, '_reply_markup_for', lambda telegram_id: None)
+    job = database.get_next_broadcast()
+    broadcast._run_job(job)
+    return database.get_broadcast(job.id)
+
+def test_results_are_counted_and_blocked_users_skipped_later(sleeps, monkeypatch):
+    _users(10, 11, 12)
+    database.create_broadcast('custom', 'Hello', ADMIN_ID)
+    bot = FakeBot({11: [_telegram_error(403, 'Forbidden: bot was blocked by the user')],
+                   12: [_telegram_error(400, 'Bad Request: message is too long')]})
+
+    job = _run(bot, monkeypatch)
+    assert (job.status, job.sent, job.failed, job.blocked, job.total) == (database.BROADCAST_COMPLETED, 1, 1, 1, 3)
+    # The recipient and then the summary to the admin
+    assert bot.sent == [10, ADMIN_ID]
+
+    second_id = database.create_broadcast('custom', 'Again', ADMIN_ID)
+    assert database.get_broadcast(second_id).total == 2
+
+def test_rate_limited_recipient_is_retried_not_failed(sleeps, monkeypatch):
+    _users(10)
+    database.create_broadcast('custom', 'Hello', ADMIN_ID)
+    bot = FakeBot({10: [_telegram_error(429, 'Too Many Requests: retry after 7', retry_after=7)]})
+
+    job = _run(bot, monkeypatch)
+    assert (job.sent, job.failed) == (1, 0)
+    assert 7 in sleeps
+
+def test_sends_are_spaced_by_the_broadcast_rate(sleeps, monkeypatch):
+    _users(10, 11, 12, 13)
+    database.create_broadcast('custom', 'Hello', ADMIN_ID)
+
+    _run(FakeBot(), monkeypatch)
+    assert len(sleeps) == 4
+    assert all(0 < seconds <= broadcast._min_send_interval for seconds in sleeps)
+
+def test_restarted_job_only_sends_to_pending_recipients(sleeps, monkeypatch):
+    _users(10, 11, 12)
+    broadcast_id = database.create_broadcast('custom', 'Hello', ADMIN_ID)
+    # Interrupted after the first batch was written
+    database.set_broadcast_status(broadcast_id, database.BROADCAST_RUNNING)
+    database.record_broadcast_results(broadcast_id, [(10, database.RECIPIENT_SENT, None)])
+
+    bot = FakeBot()
+    job = _run(bot, monkeypatch)
+    assert bot.sent == [11, 12, ADMIN_ID]
+    assert (job.status, job.sent) == (database.BROADCAST_COMPLETED, 3)
@@ -0,0 +1,68 @@
+import pytest
+
+from callback_router import CallbackRouter
+
+def _handler(name):
+    def handler(call, **payload):
+        return name, payload
+    return handler
+
+@pytest.fixture
+def router():
+    """The route shapes bot.py uses, registered in an order that would trip a startswith chain"""
+    router = CallbackRouter()
+    router.route('qito_plan_', plan_id=int)(_handler('qito_plan'))
+    router.route('confirm_qito_purchase_', plan_id=int)(_handler('confirm_qito'))
+    router.route('cancel_purchase')(_handler('cancel'))
+    router.route('order_', period=str)(_handler('order'))
+    router.route('my_plans_', direction=str, user_plan_id=int)(_handler('my_plans'))
+    router.route('broadcast_', action=str, broadcast_id=int)(_handler('broadcast'))
+    return router
+
+def _resolve(router, data):
+    handler, payload = router.resolve(data)
+    return handler(None, **payload) if handler else None
+
+def test_exact_routes_take_no_payload(router):
+    assert _resolve(router, 'cancel_purchase') == ('cancel', {})
+
+def test_longest_prefix_wins(router):
+    assert _resolve(router, 'qito_plan_7') == ('qito_plan', {'plan_id': 7})
+    assert _resolve(router, 'confirm_qito_purchase_7') == ('confirm_qito', {'plan_id': 7})
+
+def test_payload_fields_are_typed(router):
+    assert _resolve(router, 'my_plans_older_12') == ('my_plans', {'direction': 'older', 'user_plan_id': 12})
+    assert _resolve(router, 'broadcast_pause_3') == ('broadcast', {'action': 'pause', 'broadcast_id': 3})
+
+def test_single_field_keeps_underscores(router):
+    assert _resolve(router, 'order_1_month') == ('order', {'period': '1_month'})
+
+def test_unknown_data_has_no_handler(router):
+    assert router.resolve('nothing_matches') == (None, None)
+    assert router.resolve('') == (None, None)
+    # An exact route is not a prefix
+    assert router.resolve('cancel_purchase_1') == (None, None)
+
+@pytest.mark.parametrize('data', [
+    'qito_plan_',              # empty payload
+    'qito_plan_abc',           # not an int
+    'my_plans_older',          # one value for two fields
+    'my_plans_older_',         # empty last value
+    'my_plans__12',            # empty first value
+    'broadcast_pause_3x',
+])
+def test_malformed_payloads_raise(router, data):
+    with pytest.raises(ValueError):
+        router.resolve(data)
+
+def test_duplicate_and_invalid_routes_are_refused(router):
+    with pytest.raises(ValueError):
+        router.route('cancel_purchase')(_handler('again'))
+    with pytest.raises(ValueError):
+        router.route('qito_plan_', plan_id=int)(_handler('again'))
+    with pytest.raises(ValueError):
+        router.route('no_trailing_underscore', plan_id=int)(_handler('bad'))
+
+def test_routes_lists_exact_then_prefixes(router):
+    assert router.routes() == ['cancel_purchase', 'broadcast_', 'confirm_qito_purchase_', 'my_plans_',
+                               'order_', 'qito_plan_']
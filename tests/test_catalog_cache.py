@@ -0,0 +1,43 @@
+import sqlite3
+
+import database
+
+def _stats():
+    stats = database.get_cache_stats()
+    return stats['hits'], stats['misses'], stats['invalidations']
+
+def test_keyword_arguments_are_part_of_the_key(db_file):
+    database.create_plan('1', 'VPN 30 days', '', 10, 30)
+    database.create_plan('2', 'QITO 1 device', '', 10, 30, 1, database.PLAN_TYPE_QITO)
+
+    qito_plans = database.get_active_plans(plan_type=database.PLAN_TYPE_QITO)
+    assert [plan[2] for plan in qito_plans] == ['QITO 1 device']
+    assert len(database.get_active_plans()) == 2
+    assert database.get_active_plans(plan_type=database.PLAN_TYPE_QITO) == qito_plans
+
+def test_callers_get_a_copy_of_cached_values(db_file):
+    plan_id = database.create_plan('1', 'VPN 30 days', '', 10, 30)
+    database.set_plan_low_stock_threshold(plan_id, 3)
+
+    database.get_low_stock_thresholds()[plan_id] = 100
+    database.get_active_plans().clear()
+
+    assert database.get_low_stock_thresholds() == {plan_id: 3}
+    assert len(database.get_active_plans()) == 1
+
+def test_write_from_another_connection_invalidates_the_cache(db_file):
+    database.create_plan('1', 'VPN 30 days', '', 10, 30)
+    assert len(database.get_all_plans()) == 1
+    hits, misses, invalidations = _stats()
+    assert len(database.get_all_plans()) == 1
+    assert _stats() == (hits + 1, misses, invalidations)
+
+    # Like the web admin or a cron script in another process
+    other = sqlite3.connect(db_file)
+    other.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days) "
+                  "VALUES ('2', 'VPN 90 days', 25, 90)")
+    other.commit()
+    other.close()
+
+    assert [plan[2] for plan in database.get_all_plans()] == ['VPN 30 days', 'VPN 90 days']
+    assert _stats() == (hits + 1, misses + 1, invalidations + 1)
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import database
+from db_async import adb, run_in_db_executor
+
+def test_database_calls_run_on_the_db_threads(db_file):
+    async def main():
+        await adb.ensure_user_exists(telegram_id=42, username=None, first_name='Test', last_name=None)
+        thread_name = await run_in_db_executor(lambda: threading.current_thread().name)
+        return await adb.get_user_balance(42), thread_name
+
+    balance, thread_name = asyncio.run(main())
+    assert balance == 0
+    assert thread_name.startswith('db-async')
+
+def test_wrappers_are_cached_and_constants_passed_through():
+    assert adb.get_user_balance is adb.get_user_balance
+    assert asyncio.iscoroutinefunction(adb.get_user_balance)
+    assert adb.PLAN_TYPE_QITO == database.PLAN_TYPE_QITO
+
+def test_slow_calls_do_not_block_the_event_loop():
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        started = time.perf_counter()
+        await asyncio.gather(run_in_db_executor(time.sleep, 0.2), run_in_db_executor(time.sleep, 0.2), ticker())
+        return started, time.perf_counter()
+
+    started, finished = asyncio.run(main())
+    # Both sleeps ran side by side on the pool while the loop kept ticking
+    assert finished - started < 0.35
+    assert len(ticks) == 5 and ticks[-1] - started < 0.15
+
+def test_errors_reach_the_awaiting_coroutine():
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError, match='boom'):
+        asyncio.run(run_in_db_executor(fail))
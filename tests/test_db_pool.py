@@ -0,0 +1,77 @@
+import sqlite3
+import threading
+
+import db_pool
+import db_writer
+
+def _depth():
+    return db_pool._local.state['depth']
+
+def test_with_block_commits_and_releases_the_lease(db_file):
+    with db_pool.get_connection() as conn:
+        conn.execute('CREATE TABLE scratch (value INTEGER)')
+        conn.execute('INSERT INTO scratch VALUES (1)')
+        assert _depth() == 1
+    assert _depth() == 0
+
+    conn = db_pool.get_connection()
+    assert conn.execute('SELECT value FROM scratch').fetchall() == [(1,)]
+    conn.close()
+
+def test_with_block_rolls_back_on_error(db_file):
+    with db_pool.get_connection() as conn:
+        conn.execute('CREATE TABLE scratch (value INTEGER)')
+    try:
+        with db_pool.get_connection() as conn:
+            conn.execute('INSERT INTO scratch VALUES (1)')
+            raise ValueError
+    except ValueError:
+        pass
+    assert _depth() == 0
+
+    conn = db_pool.get_connection()
+    assert conn.execute('SELECT COUNT(*) FROM scratch').fetchone() == (0,)
+    conn.close()
+
+def _insert(value):
+    with db_pool.get_connection() as conn:
+        conn.execute('INSERT INTO scratch VALUES (?)', (value,))
+
+def _scratch_values(conn):
+    return [row[0] for row in conn.execute('SELECT value FROM scratch ORDER BY value').fetchall()]
+
+def test_restore_replaces_the_database_under_an_open_lease(db_file, tmp_path):
+    with db_pool.get_connection() as conn:
+        conn.execute('CREATE TABLE scratch (value INTEGER)')
+    _insert(1)
+    snapshot = str(tmp_path / 'snapshot.db')
+    db_pool.backup_to(snapshot)
+    # Committed to the WAL after the snapshot, so a file copy would keep it alive
+    _insert(2)
+
+    lease_open, restored, seen = threading.Event(), threading.Event(), []
+
+    def reader():
+        conn = db_pool.get_connection()
+        seen.append(_scratch_values(conn))
+        lease_open.set()
+        restored.wait(5)
+        seen.append(_scratch_values(conn))
+        conn.close()
+        db_pool.close_thread_connection()
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    lease_open.wait(5)
+    with db_writer.writes_paused():
+        db_pool.restore_from(snapshot)
+    restored.set()
+    thread.join()
+
+    assert seen == [[1, 2], [1]]
+    conn = db_pool.get_connection()
+    assert _scratch_values(conn) == [1]
+    conn.close()
+    raw = sqlite3.connect(db_file)
+    assert _scratch_values(raw) == [1]
+    raw.close()
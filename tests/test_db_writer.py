@@ -0,0 +1,86 @@
+import sqlite3
+import time
+
+import pytest
+
+import db_pool
+import db_writer
+
+def _insert(value):
+    with db_pool.transaction() as conn:
+        conn.execute('INSERT INTO scratch VALUES (?)', (value,))
+    return value
+
+def _insert_and_commit(value):
+    conn = db_pool.get_connection()
+    try:
+        conn.execute('INSERT INTO scratch VALUES (?)', (value,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _insert_and_end_transaction(value, statement):
+    conn = db_pool.get_connection()
+    conn.execute('INSERT INTO scratch VALUES (?)', (value,))
+    conn.execute(statement)
+    conn.close()
+    return value
+
+def _values():
+    conn = db_pool.get_connection()
+    values = [row[0] for row in conn.execute('SELECT value FROM scratch ORDER BY value').fetchall()]
+    conn.close()
+    return values
+
+@pytest.fixture
+def scratch(db_file):
+    conn = db_pool.get_connection()
+    conn.execute('CREATE TABLE scratch (value INTEGER)')
+    conn.commit()
+    conn.close()
+
+def _run(*jobs):
+    return db_writer._run_batch([db_writer._WriteJob(func, args, {}) for func, *args in jobs])
+
+def test_commit_inside_a_write_fails_only_that_job(scratch):
+    outcomes = _run((_insert, 1), (_insert_and_commit, 2), (_insert, 3))
+    errors = [error for _, _, error in outcomes]
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], sqlite3.ProgrammingError)
+    assert _values() == [1, 3]
+
+def test_jobs_committed_by_a_raw_commit_are_not_reported_failed(scratch):
+    outcomes = _run((_insert, 1), (_insert_and_end_transaction, 2, 'COMMIT'), (_insert, 3))
+    assert [(result, error) for _, result, error in outcomes] == [(1, None), (2, None), (3, None)]
+    assert _values() == [1, 2, 3]
+
+def test_jobs_lost_to_a_raw_rollback_are_reported_failed(scratch):
+    outcomes = _run((_insert, 1), (_insert_and_end_transaction, 2, 'ROLLBACK'), (_insert, 3))
+    assert isinstance(outcomes[0][2], db_writer.GroupTransactionEnded)
+    assert isinstance(outcomes[1][2], db_writer.GroupTransactionEnded)
+    assert outcomes[2][1:] == (3, None)
+    assert _values() == [3]
+
+def test_serialized_writes_run_on_the_writer_thread(scratch):
+    assert db_writer.run_write(_insert, 7) == 7
+    assert _values() == [7]
+
+def _slow_insert(value, seconds):
+    time.sleep(seconds)
+    return _insert(value)
+
+def test_write_that_never_started_is_cancelled_on_timeout(scratch, monkeypatch):
+    monkeypatch.setattr(db_writer, 'WRITE_RESULT_TIMEOUT', 0.05)
+    cancelled = db_writer.get_writer_stats()['cancelled']
+    with db_writer.writes_paused():
+        with pytest.raises(TimeoutError):
+            db_writer.run_write(_insert, 1)
+
+    assert db_writer.run_write(_insert, 2) == 2
+    assert _values() == [2]
+    assert db_writer.get_writer_stats()['cancelled'] == cancelled + 1
+
+def test_write_that_started_is_waited_for_past_the_timeout(scratch, monkeypatch):
+    monkeypatch.setattr(db_writer, 'WRITE_RESULT_TIMEOUT', 0.05)
+    assert db_writer.run_write(_slow_insert, 3, 0.2) == 3
+    assert _values() == [3]
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import db_pool
+import database
+
+@pytest.fixture
+def plan_id(db_file):
+    conn = db_pool.get_connection()
+    plan_id = conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days) "
+                           "VALUES (1, 'VPN 30 days', 10, 30)").lastrowid
+    conn.commit()
+    conn.close()
+    return plan_id
+
+def _sell(plan_id, expiry_date, user_id=42):
+    """A sold key and its user_plans row expiring at expiry_date; returns the user_plans id"""
+    conn = db_pool.get_connection()
+    key_id = conn.execute('INSERT INTO vpn_keys (plan_id, key_value, is_used) VALUES (?, ?, 1)',
+                          (plan_id, f'key-{expiry_date}')).lastrowid
+    user_plan_id = conn.execute('INSERT INTO user_plans (user_id, plan_id, vpn_key_id, expiry_date) '
+                                'VALUES (?, ?, ?, ?)', (user_id, plan_id, key_id, expiry_date)).lastrowid
+    conn.commit()
+    conn.close()
+    return user_plan_id
+
+def _query(sql, parameters=()):
+    conn = db_pool.get_connection()
+    rows = conn.execute(sql, parameters).fetchall()
+    conn.close()
+    return rows
+
+def _epoch(user_plan_id):
+    return _query('SELECT expiry_epoch FROM user_plans WHERE id = ?', (user_plan_id,))[0][0]
+
+def _utc(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+def test_insert_trigger_reads_every_stored_format_as_utc(plan_id):
+    assert _epoch(_sell(plan_id, '2030-01-01 00:00:00')) == _utc(2030, 1, 1)
+    assert _epoch(_sell(plan_id, '2030-01-01T12:30:00')) == _utc(2030, 1, 1, 12, 30)
+    # str(datetime) as stored for provider plans
+    assert _epoch(_sell(plan_id, str(datetime(2030, 1, 2, 8, 0, 0, 123456)))) == _utc(2030, 1, 2, 8)
+    assert _epoch(_sell(plan_id, '2030-01-03')) == _utc(2030, 1, 3)
+    assert _epoch(_sell(plan_id, None)) is None
+
+def test_update_trigger_follows_expiry_date(plan_id):
+    user_plan_id = _sell(plan_id, '2030-01-01 00:00:00')
+    conn = db_pool.get_connection()
+    conn.execute("UPDATE user_plans SET expiry_date = '2031-06-01 00:00:00' WHERE id = ?", (user_plan_id,))
+    conn.commit()
+    assert _epoch(user_plan_id) == _utc(2031, 6, 1)
+
+    conn.execute('UPDATE user_plans SET expiry_date = NULL WHERE id = ?', (user_plan_id,))
+    conn.commit()
+    conn.close()
+    assert _epoch(user_plan_id) is None
+
+def test_sweep_runs_until_every_batch_is_done(plan_id, monkeypatch):
+    expired = [_sell(plan_id, f'2020-01-{day:02d} 00:00:00') for day in range(1, 8)]
+    active = [_sell(plan_id, f'2099-01-{day:02d} 00:00:00') for day in range(1, 4)]
+    batches = []
+    delete_batch = database._delete_expired_batch
+
+    def recording_delete(now, batch_size):
+        rows = delete_batch(now, batch_size)
+        batches.append(len(rows))
+        return rows
+
+    monkeypatch.setattr(database, '_delete_expired_batch', recording_delete)
+    count, details = database.check_and_delete_expired_keys(batch_size=3)
+
+    assert batches == [3, 3, 1]
+    assert count == len(expired) == len(details)
+    assert details[0]['expiry_date'] == '2020-01-01 00:00:00'
+    assert [row[0] for row in _query('SELECT id FROM user_plans ORDER BY id')] == active
+    # Sold keys of the expired plans go with them
+    assert _query('SELECT COUNT(*) FROM vpn_keys') == [(len(active),)]
+
+def test_sweep_matches_the_old_datetime_rule(plan_id):
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    for offset in (-400 * 86400, -3600, -5, 5, 3600, 400 * 86400):
+        moment = now + timedelta(seconds=offset)
+        _sell(plan_id, moment.strftime('%Y-%m-%d %H:%M:%S'))
+        _sell(plan_id, moment.strftime('%Y-%m-%dT%H:%M:%S'))
+        _sell(plan_id, str(moment.replace(microsecond=500000)))
+        _sell(plan_id, moment.strftime('%Y-%m-%d %H:%M:%S') + '+00:00')
+    _sell(plan_id, (now - timedelta(days=2)).strftime('%Y-%m-%d'))
+    _sell(plan_id, (now + timedelta(days=2)).strftime('%Y-%m-%d'))
+    old_rule = {row[0] for row in _query("SELECT id FROM user_plans WHERE status = 'active' "
+                                         "AND datetime(expiry_date) < datetime('now')")}
+
+    database.check_and_delete_expired_keys()
+
+    remaining = {row[0] for row in _query('SELECT id FROM user_plans')}
+    assert old_rule and remaining
+    assert not old_rule & remaining
+    assert len(old_rule) + len(remaining) == 26
@@ -0,0 +1,70 @@
+import io
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import db_pool
+import database
+import web_admin
+
+@pytest.fixture
+def plan_id(db_file):
+    conn = db_pool.get_connection()
+    plan_id = conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days) "
+                           "VALUES (1, 'VPN 30 days', 10, 30)").lastrowid
+    conn.commit()
+    conn.close()
+    return plan_id
+
+def _keys(plan_id):
+    conn = db_pool.get_connection()
+    keys = [row[0] for row in conn.execute('SELECT key_value FROM vpn_keys WHERE plan_id = ? ORDER BY id',
+                                           (plan_id,)).fetchall()]
+    conn.close()
+    return keys
+
+def _upload(filename, text):
+    return FileStorage(stream=io.BytesIO(text.encode('utf-8')), filename=filename)
+
+def test_keys_are_written_in_chunks(plan_id, monkeypatch):
+    chunks = []
+    insert_chunk = database._insert_key_chunk
+
+    def recording_insert(chunk):
+        chunks.append(len(chunk))
+        return insert_chunk(chunk)
+
+    monkeypatch.setattr(database, '_insert_key_chunk', recording_insert)
+    counts = database.import_vpn_keys(plan_id, (f'key{number}' for number in range(5)), chunk_size=2)
+
+    assert chunks == [2, 2, 1]
+    assert counts == {'inserted': 5, 'duplicates': 0, 'invalid': 0}
+    assert database.get_plan_inventory(plan_id) == (5, 5, 0)
+
+def test_duplicates_within_a_chunk_and_against_the_database(plan_id):
+    assert database.import_vpn_keys(plan_id, ['a', 'a', ' b ']) == {'inserted': 2, 'duplicates': 1, 'invalid': 0}
+    # Stripped before hashing, so 'b\n' is the key already stored
+    assert database.import_vpn_keys(plan_id, ['b\n', 'c']) == {'inserted': 1, 'duplicates': 1, 'invalid': 0}
+    assert _keys(plan_id) == ['a', 'b', 'c']
+
+def test_invalid_rows_are_counted_and_blank_lines_skipped(plan_id):
+    rows = ['good', '', '   ', None, 'bad\x00key', 'x' * (database.MAX_KEY_LENGTH + 1), 'broken\ufffd']
+    assert database.import_vpn_keys(plan_id, rows) == {'inserted': 1, 'duplicates': 0, 'invalid': 3}
+    assert _keys(plan_id) == ['good']
+
+def test_text_upload_yields_every_line():
+    assert list(web_admin.iter_uploaded_keys(_upload('keys.txt', 'k1\nk2\r\n\nk3'))) == ['k1\n', 'k2\r\n', '\n', 'k3']
+
+def test_csv_key_column_is_found_by_its_header():
+    upload = _upload('keys.CSV', '\ufeffid,Key_Value,note\n1,k1,x\n2,k2\n3\n')
+    assert list(web_admin.iter_uploaded_keys(upload)) == ['k1', 'k2', None]
+
+def test_csv_without_a_header_uses_the_first_column():
+    upload = _upload('keys.csv', 'k1,first\nk2,second\n')
+    assert list(web_admin.iter_uploaded_keys(upload)) == ['k1', 'k2']
+
+def test_csv_upload_is_imported(plan_id):
+    upload = _upload('keys.csv', 'vpn_key\nk1\nk1\n\nk2\n')
+    counts = database.import_vpn_keys(plan_id, web_admin.iter_uploaded_keys(upload))
+    assert counts == {'inserted': 2, 'duplicates': 1, 'invalid': 0}
+    assert _keys(plan_id) == ['k1', 'k2']
@@ -0,0 +1,34 @@
+import db_pool
+import database
+
+def _profile(telegram_id):
+    conn = db_pool.get_connection()
+    row = conn.execute('SELECT username, first_name FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+    conn.close()
+    return row
+
+def test_profile_change_in_the_same_second_is_not_reported_as_created(db_file):
+    assert database._upsert_user(7, 'old', 'Old', None) is True
+    # Same CURRENT_TIMESTAMP second as the insert
+    assert database._upsert_user(7, 'new', 'New', None) is False
+    assert _profile(7) == ('new', 'New')
+
+def test_ensure_user_exists_reports_creation_once(db_file):
+    assert database.ensure_user_exists(7, 'user', 'User') is False
+    assert database.ensure_user_exists(7, 'user', 'User') is True
+
+    database.clear_known_users()
+    assert database.ensure_user_exists(7, 'renamed', 'User') is True
+    assert _profile(7) == ('renamed', 'User')
+
+def test_cleared_cache_sees_a_replaced_database(db_file):
+    database.ensure_user_exists(7, 'user', 'User')
+    # A restore brings in a file without this user
+    conn = db_pool.get_connection()
+    conn.execute('DELETE FROM users')
+    conn.commit()
+    conn.close()
+
+    database.clear_known_users()
+    assert database.ensure_user_exists(7, 'user', 'User') is False
+    assert _profile(7) == ('user', 'User')
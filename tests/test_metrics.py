@@ -0,0 +1,30 @@
+import threading
+
+from metrics import Counters, report
+
+def test_counters_from_many_threads():
+    counters = Counters(sent=0, total_ms=0.0, max_ms=0.0)
+
+    def work():
+        for value in range(1000):
+            counters.bump('sent')
+            counters.add(total_ms=0.5)
+            counters.peak(max_ms=value)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counters.snapshot() == {'sent': 4000, 'total_ms': 2000.0, 'max_ms': 999}
+
+def test_snapshot_is_a_copy():
+    counters = Counters(sent=0)
+    snapshot = counters.snapshot()
+    snapshot['sent'] = 5
+    assert counters.snapshot() == {'sent': 0}
+
+def test_report_stamps_the_time():
+    assert set(report(lambda: {'sent': 1})) == {'sent', 'timestamp'}
+    assert report(lambda: None) is None
@@ -0,0 +1,140 @@
+import hashlib
+import sqlite3
+
+import pytest
+
+import migrations
+
+LEGACY_SCHEMA = '''
+    CREATE TABLE plans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        description TEXT,
+        credits_required INTEGER NOT NULL,
+        duration_days INTEGER NOT NULL,
+        is_active BOOLEAN DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE user_plans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        plan_id INTEGER NOT NULL,
+        vpn_key_id INTEGER,
+        purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expiry_date TIMESTAMP,
+        status TEXT DEFAULT 'active'
+    );
+    CREATE TABLE payment_methods (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        description TEXT,
+        is_active BOOLEAN DEFAULT 1
+    );
+    INSERT INTO plans (name, credits_required, duration_days) VALUES ('VPN 30 days', 10, 30);
+    INSERT INTO plans (name, credits_required, duration_days) VALUES ('QITO 1 device', 25, 30);
+    INSERT INTO user_plans (user_id, plan_id, expiry_date) VALUES (42, 1, '2030-01-01 00:00:00');
+'''
+
+def _connect(path):
+    return sqlite3.connect(str(path))
+
+def _schema(conn):
+    return conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY type, name').fetchall()
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """A database from a release before plan_id_number, device_limit and the later columns"""
+    path = tmp_path / 'legacy.db'
+    conn = _connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.close()
+    return path
+
+def test_fresh_database_gets_every_migration(tmp_path):
+    conn = _connect(tmp_path / 'fresh.db')
+    applied = migrations.apply_migrations(conn, verbose=False)
+
+    assert [version for version, _, _ in applied] == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.get_schema_version(conn) == migrations.MIGRATIONS[-1][0]
+    assert all(applied_at for _, _, applied_at in migrations.migration_status(conn))
+    assert conn.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    conn.close()
+
+def test_legacy_plans_table_is_rebuilt(legacy_db):
+    conn = _connect(legacy_db)
+    migrations.apply_migrations(conn, verbose=False)
+
+    plans = conn.execute('SELECT id, plan_id_number, name, device_limit, plan_type FROM plans ORDER BY id').fetchall()
+    assert plans == [(1, '1', 'VPN 30 days', 1, 'vpn'), (2, '2', 'QITO 1 device', 1, 'qito')]
+    # plan_id_number is UNIQUE after the rebuild
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days) "
+                     "VALUES ('1', 'Copy', 10, 30)")
+    assert 'plans_new' not in [name for _, name, _ in _schema(conn)]
+    assert {'api_response', 'vpn_key', 'expiry_epoch'} <= set(migrations._columns(conn, 'user_plans'))
+    assert 'account_number' in migrations._columns(conn, 'payment_methods')
+    assert conn.execute('SELECT expiry_epoch FROM user_plans').fetchone() == (1893456000,)
+    conn.close()
+
+def test_second_run_changes_nothing(legacy_db):
+    conn = _connect(legacy_db)
+    migrations.apply_migrations(conn, verbose=False)
+    schema = _schema(conn)
+    versions = conn.execute('SELECT version, applied_at FROM schema_version').fetchall()
+
+    assert migrations.apply_migrations(conn, verbose=False) == []
+    assert _schema(conn) == schema
+    assert conn.execute('SELECT version, applied_at FROM schema_version').fetchall() == versions
+    conn.close()
+
+def test_failing_migration_is_rolled_back_and_not_recorded(tmp_path, monkeypatch):
+    conn = _connect(tmp_path / 'fresh.db')
+    migrations.apply_migrations(conn, verbose=False)
+    last_version = migrations.get_schema_version(conn)
+
+    def broken(conn):
+        conn.execute('CREATE TABLE half_done (id INTEGER)')
+        conn.execute('UPDATE plans SET name = name || ?', (' (renamed)',))
+        raise ValueError('broken migration')
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [(last_version + 1, 'broken', broken)])
+    with pytest.raises(ValueError):
+        migrations.apply_migrations(conn, verbose=False)
+
+    assert migrations.get_schema_version(conn) == last_version
+    assert migrations._columns(conn, 'half_done') == []
+    assert not conn.in_transaction
+    conn.close()
+
+def test_dry_run_never_touches_the_source(legacy_db):
+    before = hashlib.sha256(legacy_db.read_bytes()).hexdigest()
+
+    applied = migrations.dry_run(str(legacy_db))
+
+    assert len(applied) == len(migrations.MIGRATIONS)
+    assert hashlib.sha256(legacy_db.read_bytes()).hexdigest() == before
+    conn = _connect(legacy_db)
+    assert migrations._columns(conn, 'schema_version') == []
+    conn.close()
+
+def test_plan_credentials_are_copied_out_of_api_response(legacy_db, monkeypatch):
+    conn = _connect(legacy_db)
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [m for m in migrations.MIGRATIONS if m[0] < 14])
+    migrations.apply_migrations(conn, verbose=False)
+    conn.executemany('INSERT INTO user_plans (user_id, plan_id, api_response) VALUES (42, 2, ?)', [
+        ('{"username": "qito1", "password": "secret", "expires_at": "2030-01-01"}',),
+        ('{"username": "qito2"}',),
+        ('not json',),
+    ])
+    conn.commit()
+    monkeypatch.undo()
+
+    assert [version for version, _, _ in migrations.apply_migrations(conn, verbose=False)][0] == 14
+    assert conn.execute('SELECT account_username, account_password FROM user_plans ORDER BY id').fetchall() == [
+        (None, None),
+        ('qito1', 'secret'),
+        ('qito2', None),
+        (None, None),
+    ]
+    conn.close()
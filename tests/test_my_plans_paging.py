@@ -0,0 +1,63 @@
+import pytest
+
+import db_pool
+import database
+
+USER_ID = 42
+PAGE = 3
+
+@pytest.fixture
+def plan_ids(db_file):
+    """Seven plans for USER_ID, oldest first; two share a purchase_date so the id breaks the tie"""
+    conn = db_pool.get_connection()
+    plan_id = conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days) "
+                           "VALUES (1, 'VPN 30 days', 10, 30)").lastrowid
+    dates = ['2026-01-01', '2026-01-02', '2026-01-03', '2026-01-03', '2026-01-04', '2026-01-05', '2026-01-06']
+    ids = [conn.execute('INSERT INTO user_plans (user_id, plan_id, purchase_date) VALUES (?, ?, ?)',
+                        (USER_ID, plan_id, f'{date} 12:00:00')).lastrowid for date in dates]
+    # Another user's plan never shows up
+    conn.execute("INSERT INTO user_plans (user_id, plan_id, purchase_date) VALUES (7, ?, '2026-01-03 12:00:00')",
+                 (plan_id,))
+    conn.commit()
+    conn.close()
+    return ids
+
+def _page(**edge):
+    plans, has_older, has_newer = database.get_user_plans_page(USER_ID, PAGE, **edge)
+    return [plan[0] for plan in plans], has_older, has_newer
+
+def _delete(user_plan_id):
+    conn = db_pool.get_connection()
+    conn.execute('DELETE FROM user_plans WHERE id = ?', (user_plan_id,))
+    conn.commit()
+    conn.close()
+
+def test_pages_go_older_and_back_newer(plan_ids):
+    newest_first = plan_ids[::-1]
+
+    first = _page()
+    assert first == (newest_first[0:3], True, False)
+    second = _page(before_id=first[0][-1])
+    assert second == (newest_first[3:6], True, True)
+    last = _page(before_id=second[0][-1])
+    assert last == (newest_first[6:], False, True)
+
+    assert _page(after_id=last[0][0]) == second
+    assert _page(after_id=second[0][0]) == first
+
+def test_deleted_edge_plan_falls_back_to_the_first_page(plan_ids):
+    edge = _page()[0][-1]
+    _delete(edge)
+
+    assert _page(before_id=edge) == ([plan_ids[6], plan_ids[5], plan_ids[3]], True, False)
+    assert _page(after_id=edge)[2] is False
+
+def test_other_users_plan_is_not_an_edge(plan_ids):
+    conn = db_pool.get_connection()
+    other_id = conn.execute('SELECT id FROM user_plans WHERE user_id = 7').fetchone()[0]
+    conn.close()
+
+    assert _page(before_id=other_id) == _page()
+
+def test_user_without_plans_gets_an_empty_page(db_file):
+    assert database.get_user_plans_page(USER_ID, PAGE) == ([], False, False)
@@ -0,0 +1,48 @@
+import db_pool
+import database
+
+def _add_key(key_value, is_used=1, owned=False):
+    """A key on its own plan; owned keys are referenced by a user_plans row"""
+    conn = db_pool.get_connection()
+    plan_id = conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days) "
+                           "VALUES (?, 'Plan', 1, 30)", (key_value,)).lastrowid
+    key_id = conn.execute("INSERT INTO vpn_keys (plan_id, key_value, is_used) VALUES (?, ?, ?)",
+                          (plan_id, key_value, is_used)).lastrowid
+    if owned:
+        conn.execute("INSERT INTO user_plans (user_id, plan_id, vpn_key_id, expiry_date) "
+                     "VALUES (42, ?, ?, '2099-01-01 00:00:00')", (plan_id, key_id))
+    conn.commit()
+    conn.close()
+
+def _add_keys():
+    """Three orphans, plus an unsold key and a sold key still in use, which must survive"""
+    _add_key('orphan-0')
+    _add_key('unsold', is_used=0)
+    _add_key('orphan-1')
+    _add_key('owned', owned=True)
+    _add_key('orphan-2')
+
+def _key_values():
+    conn = db_pool.get_connection()
+    values = [row[0] for row in conn.execute('SELECT key_value FROM vpn_keys ORDER BY id').fetchall()]
+    conn.close()
+    return values
+
+def test_dry_run_lists_orphans_without_taking_the_write_lock(db_file, monkeypatch):
+    _add_keys()
+
+    def no_write_lock(*args, **kwargs):
+        raise AssertionError("dry run opened a write transaction")
+    monkeypatch.setattr(database, 'transaction', no_write_lock)
+
+    count, keys = database.cleanup_orphaned_keys(dry_run=True, batch_size=2)
+    assert count == 3
+    assert [key['key_value'] for key in keys] == ['orphan-0', 'orphan-1', 'orphan-2']
+    assert _key_values() == ['orphan-0', 'unsold', 'orphan-1', 'owned', 'orphan-2']
+
+def test_cleanup_deletes_only_orphans_in_batches(db_file):
+    _add_keys()
+
+    count, _ = database.cleanup_orphaned_keys(batch_size=2)
+    assert count == 3
+    assert _key_values() == ['unsold', 'owned']
@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+import db_pool
+import database
+import migrations
+
+@pytest.fixture
+def plans(db_file):
+    """Two VPN plans without keys; returns their ids"""
+    conn = db_pool.get_connection()
+    plan_ids = [conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days) "
+                             "VALUES (?, ?, 10, 30)", (number, f'Plan {number}')).lastrowid for number in (1, 2)]
+    conn.commit()
+    conn.close()
+    return plan_ids
+
+def _execute(sql, parameters=()):
+    conn = db_pool.get_connection()
+    conn.execute(sql, parameters)
+    conn.commit()
+    conn.close()
+
+def test_triggers_follow_every_key_change(plans):
+    first, second = plans
+    database.import_vpn_keys(first, ['a', 'b', 'c'])
+    _execute("INSERT INTO vpn_keys (plan_id, key_value, is_used) VALUES (?, 'sold', 1)", (first,))
+    assert database.get_plan_inventory(first) == (4, 3, 1)
+
+    # Claim
+    _execute("UPDATE vpn_keys SET is_used = 1 WHERE key_value = 'a'")
+    assert database.get_plan_inventory(first) == (4, 2, 2)
+
+    # Move an unsold key to the other plan
+    _execute("UPDATE vpn_keys SET plan_id = ? WHERE key_value = 'b'", (second,))
+    assert database.get_plan_inventory(first) == (3, 1, 2)
+    assert database.get_plan_inventory(second) == (1, 1, 0)
+
+    # Delete a sold and an unsold key
+    _execute("DELETE FROM vpn_keys WHERE key_value IN ('sold', 'c')")
+    assert database.get_plan_inventory(first) == (1, 0, 1)
+    # Updating other columns leaves the counters alone
+    _execute("UPDATE vpn_keys SET key_value = 'renamed' WHERE key_value = 'b'")
+    assert database.get_plan_inventory(second) == (1, 1, 0)
+    assert database.verify_plan_inventory() == []
+
+def test_expiry_sweep_keeps_the_counters_exact(plans):
+    first, _ = plans
+    database.import_vpn_keys(first, ['expired', 'current', 'spare'])
+    conn = db_pool.get_connection()
+    for key_value, expiry_date in (('expired', '2020-01-01 00:00:00'), ('current', '2099-01-01 00:00:00')):
+        key_id = conn.execute("UPDATE vpn_keys SET is_used = 1 WHERE key_value = ? RETURNING id",
+                              (key_value,)).fetchone()[0]
+        conn.execute('INSERT INTO user_plans (user_id, plan_id, vpn_key_id, expiry_date) VALUES (42, ?, ?, ?)',
+                     (first, key_id, expiry_date))
+    conn.commit()
+    conn.close()
+
+    assert database.check_and_delete_expired_keys()[0] == 1
+    assert database.get_plan_inventory(first) == (2, 1, 1)
+    assert database.verify_plan_inventory() == []
+
+def test_verify_reports_drift_and_rebuild_repairs_it(plans):
+    first, second = plans
+    database.import_vpn_keys(first, ['a', 'b'])
+    database.import_vpn_keys(second, ['c'])
+    # Drift the triggers cannot cause: edited by hand, and a row for a plan without keys
+    _execute('UPDATE plan_inventory SET available_keys = 5 WHERE plan_id = ?', (first,))
+    _execute('INSERT INTO plan_inventory (plan_id, total_keys, available_keys) VALUES (99, 1, 1)')
+
+    assert database.verify_plan_inventory() == [
+        {'plan_id': first, 'stored': (2, 5, 0), 'actual': (2, 2, 0)},
+        {'plan_id': 99, 'stored': (1, 1, 0), 'actual': (0, 0, 0)},
+    ]
+    assert database.rebuild_plan_inventory() == 2
+    assert database.verify_plan_inventory() == []
+    assert database.get_plan_inventory(first) == (2, 2, 0)
+    assert database.get_plan_inventory(99) == (0, 0, 0)
+
+def test_migration_counts_existing_keys(tmp_path, monkeypatch):
+    conn = sqlite3.connect(str(tmp_path / 'before_008.db'))
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [migration for migration in migrations.MIGRATIONS
+                                                   if migration[0] < 8])
+    migrations.apply_migrations(conn, verbose=False)
+    conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days) VALUES (1, 'P', 10, 30)")
+    conn.executemany('INSERT INTO vpn_keys (plan_id, key_value, is_used) VALUES (1, ?, ?)',
+                     [('a', 0), ('b', 1), ('c', 0)])
+    conn.commit()
+
+    monkeypatch.undo()
+    migrations.apply_migrations(conn, verbose=False)
+    assert conn.execute('SELECT * FROM plan_inventory').fetchall() == [(1, 3, 2, 1)]
+    conn.close()
@@ -0,0 +1,72 @@
+import sqlite3
+
+import pytest
+
+import db_pool
+import database
+import migrations
+import web_admin
+
+def _plan_type(plan_id):
+    conn = db_pool.get_connection()
+    plan_type = conn.execute('SELECT plan_type FROM plans WHERE id = ?', (plan_id,)).fetchone()[0]
+    conn.close()
+    return plan_type
+
+def _edit_form(name):
+    return {'plan_id_number': '7', 'name': name, 'description': '', 'credits_required': '10',
+            'duration_days': '30', 'is_active': 'on', 'low_stock_threshold': ''}
+
+def test_created_plans_are_vpn_unless_told_otherwise(db_file):
+    assert _plan_type(database.create_plan('1', 'QITO lookalike', '', 10, 30)) == database.PLAN_TYPE_VPN
+    qito_id = database.create_plan('2', 'Fast', '', 10, 30, 1, database.PLAN_TYPE_QITO)
+    assert _plan_type(qito_id) == database.PLAN_TYPE_QITO
+
+def test_update_without_a_type_keeps_the_stored_one(db_file):
+    qito_id = database.create_plan('1', 'QITO 1 device', '', 10, 30, 1, database.PLAN_TYPE_QITO)
+    vpn_id = database.create_plan('2', 'VPN 30 days', '', 10, 30)
+
+    database.update_plan(qito_id, '1', 'Renamed', '', 10, 30, True, 1)
+    database.update_plan(vpn_id, '2', 'QITO ByPass promo', '', 10, 30, True)
+
+    assert _plan_type(qito_id) == database.PLAN_TYPE_QITO
+    assert _plan_type(vpn_id) == database.PLAN_TYPE_VPN
+    database.update_plan(vpn_id, '2', 'Now ByPass', '', 10, 30, True, 1, database.PLAN_TYPE_BYPASS)
+    assert _plan_type(vpn_id) == database.PLAN_TYPE_BYPASS
+
+def test_vpn_edit_page_only_edits_vpn_plans(db_file):
+    qito_id = database.create_plan('1', 'QITO 1 device', '', 10, 30, 1, database.PLAN_TYPE_QITO)
+    vpn_id = database.create_plan('2', 'VPN 30 days', '', 10, 30)
+    client = web_admin.app.test_client()
+
+    assert client.get(f'/plans/edit/{qito_id}').status_code == 302
+    client.post(f'/plans/edit/{qito_id}', data=_edit_form('Edited'))
+    assert database.get_plan(qito_id)[2] == 'QITO 1 device'
+    assert _plan_type(qito_id) == database.PLAN_TYPE_QITO
+
+    assert client.get(f'/plans/edit/{vpn_id}').status_code == 200
+    client.post(f'/plans/edit/{vpn_id}', data=_edit_form('QITO named VPN plan'))
+    assert database.get_plan(vpn_id)[2] == 'QITO named VPN plan'
+    assert _plan_type(vpn_id) == database.PLAN_TYPE_VPN
+
+@pytest.mark.parametrize('name, plan_type', [
+    ('VPN 30 days', 'vpn'),
+    ('QITO 1 device', 'qito'),
+    ('ByPass 2 devices', 'bypass'),
+    ('QITO ByPass bundle', 'bypass'),
+    ('qito lower case', 'vpn'),
+    ('Premium BYPASS', 'vpn'),
+])
+def test_plan_type_backfill_matches_the_old_name_rule(tmp_path, monkeypatch, name, plan_type):
+    conn = sqlite3.connect(str(tmp_path / 'before_007.db'))
+    before_007 = [migration for migration in migrations.MIGRATIONS if migration[0] < 7]
+    monkeypatch.setattr(migrations, 'MIGRATIONS', before_007)
+    migrations.apply_migrations(conn, verbose=False)
+    conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days) VALUES (1, ?, 10, 30)",
+                 (name,))
+    conn.commit()
+
+    monkeypatch.undo()
+    migrations.apply_migrations(conn, verbose=False)
+    assert conn.execute('SELECT plan_type FROM plans').fetchone() == (plan_type,)
+    conn.close()
@@ -0,0 +1,126 @@
+import requests
+
+import provider_client
+from provider_client import (CircuitBreaker, ProviderClient,
+                             BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN)
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.text = str(body)
+        self._body = body
+
+    def json(self):
+        return self._body
+
+class FakeSession:
+    """Returns (or raises) the queued outcomes in order, one per POST"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.posts = 0
+
+    def post(self, url, json=None, timeout=None):
+        self.posts += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+def _breaker(monkeypatch, threshold=3, reset_seconds=30.0):
+    clock = Clock()
+    monkeypatch.setattr(provider_client.time, 'monotonic', clock)
+    return CircuitBreaker(threshold=threshold, reset_seconds=reset_seconds), clock
+
+def test_breaker_opens_after_threshold_consecutive_failures(monkeypatch):
+    breaker, _ = _breaker(monkeypatch)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == BREAKER_CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN
+    assert not breaker.allow()
+    assert breaker.times_opened == 1
+
+def test_success_resets_the_failure_count(monkeypatch):
+    breaker, _ = _breaker(monkeypatch)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == BREAKER_CLOSED
+
+def test_one_trial_call_after_the_cool_down(monkeypatch):
+    breaker, clock = _breaker(monkeypatch)
+    for _ in range(3):
+        breaker.record_failure()
+
+    clock.now += 29
+    assert not breaker.allow()
+    assert breaker.seconds_until_retry() == 1
+
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == BREAKER_HALF_OPEN
+    # Everyone else keeps failing fast until the trial call reports back
+    assert not breaker.allow()
+
+def test_trial_success_closes_the_breaker(monkeypatch):
+    breaker, clock = _breaker(monkeypatch)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == BREAKER_CLOSED
+    assert breaker.allow()
+
+def test_trial_failure_reopens_for_another_cool_down(monkeypatch):
+    breaker, clock = _breaker(monkeypatch)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.times_opened == 2
+    assert breaker.seconds_until_retry() == 30
+
+def test_open_breaker_fails_fast_without_calling_the_api(monkeypatch):
+    session = FakeSession()
+    client = ProviderClient('Test', 'http://provider.invalid/api/users', session=session)
+    for _ in range(provider_client.PROVIDER_BREAKER_THRESHOLD):
+        client.breaker.record_failure()
+
+    assert client.create_user(1, 30) is None
+    assert session.posts == 0
+    assert client.get_stats()['short_circuited'] == 1
+
+def test_turned_away_requests_are_retried(monkeypatch):
+    monkeypatch.setattr(provider_client.time, 'sleep', lambda seconds: None)
+    session = FakeSession(FakeResponse(503, 'busy'), FakeResponse(200, {'username': 'u', 'password': 'p'}))
+    client = ProviderClient('Test', 'http://provider.invalid/api/users', session=session)
+
+    assert client.create_user(1, 30) == {'username': 'u', 'password': 'p'}
+    assert session.posts == 2
+    assert client.breaker.state == BREAKER_CLOSED
+
+def test_read_timeout_is_not_retried_and_counts_against_the_breaker(monkeypatch):
+    monkeypatch.setattr(provider_client.time, 'sleep', lambda seconds: None)
+    session = FakeSession(requests.exceptions.ReadTimeout('slow'))
+    client = ProviderClient('Test', 'http://provider.invalid/api/users', session=session)
+
+    assert client.create_user(1, 30) is None
+    assert session.posts == 1
+    assert client.breaker.failures == 1
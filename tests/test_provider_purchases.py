@@ -0,0 +1,70 @@
+import json
+import threading
+from datetime import datetime
+
+import db_pool
+import database
+
+USER_ID = 42
+
+def _setup(balance, price=10, pooled_accounts=0):
+    """A user with balance, a QITO plan costing price and some pooled accounts; returns the plan id"""
+    conn = db_pool.get_connection()
+    conn.execute('INSERT INTO users (telegram_id, balance) VALUES (?, ?)', (USER_ID, balance))
+    plan_id = conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days, plan_type) "
+                           "VALUES (1, 'QITO 30 days', ?, 30, ?)", (price, database.PLAN_TYPE_QITO)).lastrowid
+    conn.commit()
+    conn.close()
+    for number in range(pooled_accounts):
+        response = json.dumps({'username': f'user{number}', 'password': 'secret'})
+        database.add_provider_account(database.PLAN_TYPE_QITO, 1, 30, f'user{number}|secret', response,
+                                      '2099-01-01 00:00:00')
+    return plan_id
+
+def _query(sql, parameters=()):
+    conn = db_pool.get_connection()
+    rows = conn.execute(sql, parameters).fetchall()
+    conn.close()
+    return rows
+
+def _claim(plan_id, price=10):
+    return database.claim_provider_account(USER_ID, plan_id, database.PLAN_TYPE_QITO, 1, 30, price,
+                                           '2000-01-01 00:00:00')
+
+def test_record_provider_purchase_refuses_an_uncovered_price(db_file):
+    plan_id = _setup(balance=5)
+
+    user_plan_id = database.record_provider_purchase(USER_ID, plan_id, 10, datetime.now(), datetime.now(),
+                                                     'user|secret', json.dumps({'username': 'user'}))
+    assert user_plan_id is None
+    assert _query('SELECT balance FROM users') == [(5.0,)]
+    assert _query('SELECT COUNT(*) FROM user_plans') == [(0,)]
+
+def test_pooled_claims_stop_when_the_balance_runs_out(db_file):
+    plan_id = _setup(balance=25, pooled_accounts=3)
+
+    statuses = [_claim(plan_id).status for _ in range(3)]
+    assert statuses == [database.PURCHASE_SUCCESS, database.PURCHASE_SUCCESS, database.PURCHASE_INSUFFICIENT_FUNDS]
+    assert _query('SELECT balance FROM users') == [(5.0,)]
+    assert _query('SELECT COUNT(*) FROM user_plans') == [(2,)]
+    # The refused claim leaves its account in stock
+    assert _query("SELECT COUNT(*) FROM provider_accounts WHERE status = 'available'") == [(1,)]
+
+def test_concurrent_pooled_claims_never_overdraw(db_file):
+    plan_id = _setup(balance=30, pooled_accounts=8)
+    statuses = []
+
+    def buy():
+        statuses.append(_claim(plan_id).status)
+        db_pool.close_thread_connection()
+
+    threads = [threading.Thread(target=buy) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses.count(database.PURCHASE_SUCCESS) == 3
+    assert _query('SELECT balance FROM users') == [(0.0,)]
+    assert _query('SELECT COUNT(*) FROM user_plans') == [(3,)]
+    assert _query("SELECT COUNT(*) FROM provider_accounts WHERE status = 'claimed'") == [(3,)]
@@ -0,0 +1,147 @@
+import json
+import threading
+
+import pytest
+
+import db_pool
+import database
+import purchase_jobs
+
+USER_ID = 42
+PRICE = 10
+
+class FakeUser:
+    id = USER_ID
+    first_name = 'Test'
+    last_name = None
+    username = None
+
+class FakeProvider:
+    """Stands in for a ProviderClient; hands out numbered accounts"""
+
+    def __init__(self):
+        self.created = []
+        self._lock = threading.Lock()
+
+    def create_user(self, device_limit, duration_days, expires_at=None):
+        with self._lock:
+            self.created.append(device_limit)
+            return {'username': f'user{len(self.created)}', 'password': 'secret'}
+
+@pytest.fixture
+def provider(db_file, monkeypatch):
+    """Callbacks recorded on lists, the QITO API faked and the account pool off"""
+    fake = FakeProvider()
+    fake.delivered = []
+    fake.failed = []
+    monkeypatch.setitem(purchase_jobs.PROVIDER_CLIENTS, database.PLAN_TYPE_QITO, fake)
+    monkeypatch.setattr(purchase_jobs, '_deliver', lambda job, plan, api_response, expiry_date:
+                        fake.delivered.append((job.id, api_response['username'])))
+    monkeypatch.setattr(purchase_jobs, '_report_failure', lambda job, reason: fake.failed.append((job.id, reason)))
+    return fake
+
+def _setup(balance):
+    """A user with balance and a QITO plan costing PRICE; returns the plan id"""
+    conn = db_pool.get_connection()
+    conn.execute('INSERT INTO users (telegram_id, balance) VALUES (?, ?)', (USER_ID, balance))
+    plan_id = conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days, plan_type) "
+                           "VALUES (1, 'QITO 30 days', ?, 30, ?)", (PRICE, database.PLAN_TYPE_QITO)).lastrowid
+    conn.commit()
+    conn.close()
+    return plan_id
+
+def _queue(plan_id, message_id):
+    return purchase_jobs.queue_purchase(FakeUser, database.PLAN_TYPE_QITO, plan_id, USER_ID, message_id)
+
+def _query(sql, parameters=()):
+    conn = db_pool.get_connection()
+    rows = conn.execute(sql, parameters).fetchall()
+    conn.close()
+    return rows
+
+def test_job_is_delivered_and_charged_once(provider):
+    plan_id = _setup(balance=25)
+    job_id = _queue(plan_id, message_id=1)
+
+    purchase_jobs._run_job(job_id)
+    # Running a finished job again (e.g. queued twice) does nothing
+    purchase_jobs._run_job(job_id)
+
+    assert provider.delivered == [(job_id, 'user1')]
+    assert database.get_purchase_job(job_id).status == database.PURCHASE_JOB_DELIVERED
+    assert _query('SELECT balance FROM users') == [(15.0,)]
+    assert _query('SELECT COUNT(*) FROM user_plans') == [(1,)]
+
+def test_second_tap_on_a_confirmation_is_not_queued(provider):
+    plan_id = _setup(balance=25)
+    assert _queue(plan_id, message_id=1) is not None
+    assert _queue(plan_id, message_id=1) is None
+
+def test_provisioned_job_resumes_without_a_new_account(provider):
+    plan_id = _setup(balance=25)
+    job_id = _queue(plan_id, message_id=1)
+    # Restart after the provider call: the account is stored on the job, nothing charged yet
+    database.set_purchase_job_account(job_id, json.dumps({'username': 'made-before-restart', 'password': 'p'}),
+                                      '2099-01-01 00:00:00')
+
+    assert database.get_unfinished_purchase_job_ids() == [job_id]
+    purchase_jobs._run_job(job_id)
+
+    assert provider.created == []
+    assert provider.delivered == [(job_id, 'made-before-restart')]
+    assert _query('SELECT balance FROM users') == [(15.0,)]
+
+def test_recorded_job_resumes_with_delivery_only(provider):
+    plan_id = _setup(balance=25)
+    job_id = _queue(plan_id, message_id=1)
+    database.set_purchase_job_account(job_id, json.dumps({'username': 'u', 'password': 'p'}), '2099-01-01 00:00:00')
+    assert database.record_purchase_job(job_id, PRICE, 'u|p') == database.PURCHASE_SUCCESS
+    # Already charged: a second record is a no-op
+    assert database.record_purchase_job(job_id, PRICE, 'u|p') is None
+
+    purchase_jobs._run_job(job_id)
+
+    assert provider.delivered == [(job_id, 'u')]
+    assert _query('SELECT balance FROM users') == [(15.0,)]
+    assert _query('SELECT COUNT(*) FROM user_plans') == [(1,)]
+
+def test_concurrent_jobs_never_overdraw_one_balance(provider):
+    plan_id = _setup(balance=25)
+    job_ids = [_queue(plan_id, message_id) for message_id in range(1, 5)]
+
+    # Every job passes the balance check before any of them is charged
+    for job_id in job_ids:
+        purchase_jobs._provision(database.get_purchase_job(job_id), database.get_plan(plan_id))
+    assert len(provider.created) == 4
+
+    def run(job_id):
+        purchase_jobs._run_job(job_id)
+        db_pool.close_thread_connection()
+
+    threads = [threading.Thread(target=run, args=(job_id,)) for job_id in job_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(provider.delivered) == 2
+    assert sorted(reason for _, reason in provider.failed) == [database.PURCHASE_INSUFFICIENT_FUNDS] * 2
+    assert _query('SELECT balance FROM users') == [(5.0,)]
+    assert _query('SELECT COUNT(*) FROM user_plans') == [(2,)]
+    assert database.get_purchase_job_counts() == {database.PURCHASE_JOB_DELIVERED: 2, database.PURCHASE_JOB_FAILED: 2}
+
+def test_refused_pooled_claim_does_not_fall_back_to_the_api(provider, monkeypatch):
+    plan_id = _setup(balance=5)
+    database.add_provider_account(database.PLAN_TYPE_QITO, 1, 30, 'pooled|p', json.dumps({'username': 'pooled'}),
+                                  '2099-01-01 00:00:00')
+    monkeypatch.setattr('account_pool.get_pool_target', lambda: 1)
+    # The balance check passes, then another purchase spends the balance before the claim
+    monkeypatch.setattr(purchase_jobs, 'get_user_balance', lambda user_id: 100)
+    job_id = _queue(plan_id, message_id=1)
+
+    purchase_jobs._run_job(job_id)
+
+    assert provider.created == []
+    assert provider.failed == [(job_id, database.PURCHASE_INSUFFICIENT_FUNDS)]
+    assert _query('SELECT balance FROM users') == [(5.0,)]
+    assert _query("SELECT status FROM provider_accounts") == [('available',)]
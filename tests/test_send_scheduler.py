@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+import send_scheduler
+from send_scheduler import SendScheduler, LANE_INTERACTIVE, LANE_BULK, send_lane
+
+CHAT_ID = 5
+
+def _timed(scheduler, count, chat_id=CHAT_ID, lane=LANE_INTERACTIVE):
+    started = time.monotonic()
+    for _ in range(count):
+        scheduler.acquire(chat_id, lane)
+    return time.monotonic() - started
+
+def test_interactive_replies_never_wait_for_their_chat():
+    scheduler = SendScheduler(rate=1000, per_chat_rate=1, per_chat_burst=2)
+    assert _timed(scheduler, 5) < 0.05
+    assert scheduler.get_stats()['lanes'][LANE_INTERACTIVE]['sent'] == 5
+
+def test_bulk_sends_are_spaced_per_chat():
+    scheduler = SendScheduler(rate=1000, per_chat_rate=20, per_chat_burst=1)
+    # One at once, then one every 50 ms
+    assert _timed(scheduler, 3, lane=LANE_BULK) >= 0.09
+    # Other chats are not affected
+    assert _timed(scheduler, 1, chat_id=CHAT_ID + 1, lane=LANE_BULK) < 0.02
+
+def test_interactive_replies_use_up_the_chat_bucket_for_bulk_sends():
+    scheduler = SendScheduler(rate=1000, per_chat_rate=20, per_chat_burst=2)
+    _timed(scheduler, 3)
+    assert _timed(scheduler, 1, lane=LANE_BULK) >= 0.04
+
+def test_bulk_sends_leave_the_reserve_to_interactive_replies():
+    scheduler = SendScheduler(rate=10, bulk_reserve=5)
+    for chat_id in range(5):
+        scheduler.acquire(chat_id, LANE_BULK)
+    # Bulk has used its half of the bucket; an interactive reply still goes at once
+    assert _timed(scheduler, 1, chat_id=100) < 0.02
+    assert _timed(scheduler, 1, chat_id=101, lane=LANE_BULK) >= 0.1
+
+def test_interactive_waiter_goes_before_bulk():
+    scheduler = SendScheduler(rate=1000)
+    scheduler.back_off(0.1)
+    order = []
+
+    def send(lane):
+        scheduler.acquire(None, lane)
+        order.append(lane)
+
+    bulk = threading.Thread(target=send, args=(LANE_BULK,))
+    bulk.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=send, args=(LANE_INTERACTIVE,))
+    interactive.start()
+    bulk.join(2)
+    interactive.join(2)
+
+    assert order == [LANE_INTERACTIVE, LANE_BULK]
+    assert scheduler.get_stats()['rate_limited'] == 1
+
+def test_rate_limited_call_waits_and_is_retried(monkeypatch):
+    scheduler = SendScheduler(rate=1000)
+    monkeypatch.setattr(send_scheduler, '_scheduler', scheduler)
+    calls = []
+
+    def send(text):
+        calls.append((text, time.monotonic()))
+        if len(calls) == 1:
+            raise ApiTelegramException('sendMessage', None, {
+                'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 0.1',
+                'parameters': {'retry_after': 0.1}})
+        return 'sent'
+
+    with send_lane(LANE_BULK):
+        assert send_scheduler.scheduled_call(CHAT_ID, send, 'hi') == 'sent'
+    assert len(calls) == 2
+    assert calls[1][1] - calls[0][1] >= 0.09
+    stats = scheduler.get_stats()
+    assert stats['rate_limited'] == 1
+    assert stats['lanes'][LANE_BULK]['sent'] == 2
+
+def test_other_errors_are_not_retried(monkeypatch):
+    monkeypatch.setattr(send_scheduler, '_scheduler', SendScheduler(rate=1000))
+    calls = []
+
+    def send():
+        calls.append(1)
+        raise ApiTelegramException('sendMessage', None, {'ok': False, 'error_code': 403, 'description': 'Forbidden'})
+
+    with pytest.raises(ApiTelegramException):
+        send_scheduler.scheduled_call(CHAT_ID, send)
+    assert calls == [1]
@@ -0,0 +1,95 @@
+import queue
+
+import pytest
+
+import db_pool
+import database
+import stock_alerts
+from stock_alerts import STOCK_LOW, STOCK_OUT
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(db_file, monkeypatch):
+    """Fresh alert state, threshold 10 / hysteresis 5 / 30 minute debounce, and a fake clock"""
+    monkeypatch.setattr(stock_alerts, '_levels', {})
+    monkeypatch.setattr(stock_alerts, '_alerted_at', {})
+    monkeypatch.setattr(stock_alerts, '_events', queue.Queue())
+    monkeypatch.setattr(stock_alerts, 'LOW_STOCK_THRESHOLD', 10)
+    monkeypatch.setattr(stock_alerts, 'LOW_STOCK_HYSTERESIS', 5)
+    monkeypatch.setattr(stock_alerts, 'LOW_STOCK_ALERT_INTERVAL', 1800)
+    fake = Clock()
+    monkeypatch.setattr(stock_alerts.time, 'monotonic', fake)
+    return fake
+
+def _plan(name='VPN 30 days'):
+    conn = db_pool.get_connection()
+    plan_id = conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days) "
+                           "VALUES (?, ?, 10, 30)", (name, name)).lastrowid
+    conn.commit()
+    conn.close()
+    return plan_id
+
+def _queued():
+    events = []
+    while not stock_alerts._events.empty():
+        events.append(stock_alerts._events.get_nowait())
+    return events
+
+def _sales(plan_id, *levels):
+    return [stock_alerts.record_stock_level(plan_id, available_keys) for available_keys in levels]
+
+def test_alert_only_when_crossing_the_threshold(clock):
+    plan_id = _plan()
+    assert _sales(plan_id, 12, 11, 10, 9, 8, 7) == [False, False, False, True, False, False]
+    assert _queued() == [(plan_id, STOCK_LOW, 9, 10)]
+
+def test_selling_out_is_reported_even_right_after_a_low_alert(clock):
+    plan_id = _plan()
+    assert _sales(plan_id, 9, 0) == [True, True]
+    assert [event[1] for event in _queued()] == [STOCK_LOW, STOCK_OUT]
+
+def test_small_restock_does_not_rearm_the_alert(clock):
+    plan_id = _plan()
+    clock.now += 3600
+    # 12 is above the threshold but below threshold + hysteresis
+    assert _sales(plan_id, 9, 12, 9) == [True, False, False]
+
+def test_restock_past_the_hysteresis_rearms_after_the_interval(clock):
+    plan_id = _plan()
+    assert _sales(plan_id, 9, 15) == [True, False]
+    # Re-armed, but still within the debounce interval
+    assert _sales(plan_id, 9) == [False]
+    assert stock_alerts.get_stock_alert_stats()['low_plans'] == {str(plan_id): STOCK_LOW}
+
+    assert _sales(plan_id, 15) == [False]
+    clock.now += 1800
+    assert _sales(plan_id, 9) == [True]
+
+def test_restock_after_selling_out_stays_quiet_while_low(clock):
+    plan_id = _plan()
+    assert _sales(plan_id, 0, 5, 12) == [True, False, False]
+    assert stock_alerts.get_stock_alert_stats()['low_plans'] == {str(plan_id): STOCK_LOW}
+
+def test_plan_threshold_overrides_the_default(clock):
+    plan_id = _plan()
+    database.set_plan_low_stock_threshold(plan_id, 3)
+    assert _sales(plan_id, 5, 2) == [False, True]
+    assert _queued() == [(plan_id, STOCK_LOW, 2, 3)]
+
+def test_alert_text_keeps_the_latest_crossing_per_plan(clock):
+    low_plan, out_plan = _plan('Low plan'), _plan('Out plan')
+    text, items = stock_alerts.format_stock_alert([
+        (low_plan, STOCK_LOW, 9, 10),
+        (out_plan, STOCK_LOW, 4, 10),
+        (out_plan, STOCK_OUT, 0, 10),
+    ])
+    assert "🔑 **Low plan**\nAvailable Keys: 9 (threshold 10)" in text
+    assert "❌ **Out plan**\nOut of stock!" in text
+    assert "4 (threshold" not in text
+    assert items == [('Low plan', 0, '9 keys left'), ('Out plan', 0, 'Out of stock!')]
@@ -0,0 +1,122 @@
+import json
+import queue
+import threading
+import time
+
+import pytest
+from telebot.types import Update
+
+import bot_webhook
+import update_dispatcher
+from update_dispatcher import ShardedDispatcher, ShardedTeleBot
+
+def _update(update_id, chat_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': 'hi',
+        },
+    }
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+class BlockedBot(ShardedTeleBot):
+    """Records handled update ids, but only once release is set"""
+
+    def __init__(self, **kwargs):
+        self.release = threading.Event()
+        self.handled = []
+        super().__init__('0:test', **kwargs)
+
+    def _process_update(self, update):
+        assert self.release.wait(5)
+        self.handled.append(update.update_id)
+
+@pytest.fixture
+def bot(monkeypatch):
+    monkeypatch.setattr(update_dispatcher, '_active_dispatcher', None)
+    blocked = BlockedBot(workers=2)
+    yield blocked
+    blocked.release.set()
+
+def test_each_chat_is_handled_in_order():
+    handled = []
+    lock = threading.Lock()
+
+    def handler(item):
+        chat_id, seq = item
+        # Later items of other chats overtake slow ones, never items of the same chat
+        time.sleep(0.001 * (seq % 3))
+        with lock:
+            handled.append(item)
+
+    dispatcher = ShardedDispatcher(handler, workers=4, queue_size=100, name='test-worker')
+    for seq in range(20):
+        for chat_id in range(1, 6):
+            dispatcher.submit(chat_id, (chat_id, seq))
+    _wait_for(lambda: len(handled) == 100)
+
+    for chat_id in range(1, 6):
+        assert [seq for chat, seq in handled if chat == chat_id] == list(range(20))
+    assert dispatcher.get_stats()['total_depth'] == 0
+
+def test_full_shard_blocks_submit_until_the_worker_catches_up(monkeypatch):
+    monkeypatch.setattr(update_dispatcher, 'BACKPRESSURE_WARN_SECONDS', 0.05)
+    release = threading.Event()
+    handled = []
+
+    def handler(item):
+        release.wait(5)
+        handled.append(item)
+
+    dispatcher = ShardedDispatcher(handler, workers=1, queue_size=1, name='test-worker')
+    dispatcher.submit('chat', 1)
+    _wait_for(lambda: dispatcher.get_stats()['shards'][0]['busy_seconds'] > 0)
+    # 1 is being handled and 2 fills the queue, so 3 has to wait
+    dispatcher.submit('chat', 2)
+    blocked = threading.Thread(target=dispatcher.submit, args=('chat', 3), daemon=True)
+    blocked.start()
+    blocked.join(0.2)
+
+    assert blocked.is_alive()
+    assert dispatcher.get_stats()['backpressure_waits'] == 1
+
+    release.set()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    _wait_for(lambda: len(handled) == 3)
+    assert handled == [1, 2, 3]
+
+def test_polling_offset_advances_before_the_update_is_handled(bot):
+    bot.process_new_updates([Update.de_json(_update(7, 100)), Update.de_json(_update(8, 200))])
+
+    # The next getUpdates would already ask for offset 9
+    assert bot.last_update_id == 8
+    assert bot.handled == []
+
+    bot.release.set()
+    _wait_for(lambda: len(bot.handled) == 2)
+    assert sorted(bot.handled) == [7, 8]
+
+def test_webhook_updates_go_through_the_shards(bot, monkeypatch):
+    monkeypatch.setattr(bot_webhook, '_update_queue', queue.Queue(maxsize=10))
+    monkeypatch.setattr(bot_webhook, '_dispatcher_thread', None)
+    bot_webhook._ensure_dispatcher(bot)
+
+    assert bot_webhook.enqueue_update(bot, json.dumps(_update(5, 100))) == 200
+    assert bot_webhook.enqueue_update(bot, json.dumps(_update(6, 100))) == 200
+    # The webhook dispatcher hands both over and is free again while the shard is busy
+    _wait_for(lambda: bot.last_update_id == 6 and bot_webhook._update_queue.empty())
+    assert bot.handled == []
+
+    bot.release.set()
+    _wait_for(lambda: len(bot.handled) == 2)
+    assert bot.handled == [5, 6]
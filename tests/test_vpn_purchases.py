@@ -0,0 +1,83 @@
+import threading
+
+import db_pool
+import database
+
+USER_ID = 42
+PRICE = 10
+
+def _setup(balance, keys=1, is_active=1, users=(USER_ID,)):
+    """Users with balance and a VPN plan costing PRICE with some keys; returns the plan id"""
+    conn = db_pool.get_connection()
+    conn.executemany('INSERT INTO users (telegram_id, balance) VALUES (?, ?)',
+                     [(user_id, balance) for user_id in users])
+    plan_id = conn.execute("INSERT INTO plans (plan_id_number, name, credits_required, duration_days, is_active) "
+                           "VALUES (1, 'VPN 30 days', ?, 30, ?)", (PRICE, is_active)).lastrowid
+    conn.executemany('INSERT INTO vpn_keys (plan_id, key_value) VALUES (?, ?)',
+                     [(plan_id, f'vless://key{number}') for number in range(keys)])
+    conn.commit()
+    conn.close()
+    return plan_id
+
+def _query(sql, parameters=()):
+    conn = db_pool.get_connection()
+    rows = conn.execute(sql, parameters).fetchall()
+    conn.close()
+    return rows
+
+def test_purchase_returns_the_key_balance_and_stock_left(db_file):
+    plan_id = _setup(balance=25, keys=3)
+
+    result = database.purchase_vpn_key(plan_id, USER_ID)
+
+    assert result.status == database.PURCHASE_SUCCESS
+    assert (result.vpn_key, result.balance, result.available_keys) == ('vless://key0', 15.0, 2)
+    assert _query('SELECT balance FROM users') == [(15.0,)]
+    assert _query("SELECT user_id, plan_id, vpn_key_id, expiry_date > datetime('now') FROM user_plans "
+                  "WHERE id = ?", (result.user_plan_id,)) == [(USER_ID, plan_id, 1, 1)]
+    assert _query('SELECT used_by_user_id FROM vpn_keys WHERE is_used = 1') == [(USER_ID,)]
+
+def test_insufficient_funds_writes_nothing(db_file):
+    plan_id = _setup(balance=5)
+
+    result = database.purchase_vpn_key(plan_id, USER_ID)
+
+    assert result == database.PurchaseResult(database.PURCHASE_INSUFFICIENT_FUNDS, None, None, None, None)
+    assert _query('SELECT balance FROM users') == [(5.0,)]
+    assert _query('SELECT COUNT(*) FROM vpn_keys WHERE is_used = 0') == [(1,)]
+    assert _query('SELECT COUNT(*) FROM user_plans') == [(0,)]
+
+def test_out_of_stock_keeps_the_balance(db_file):
+    plan_id = _setup(balance=25, keys=0)
+
+    assert database.purchase_vpn_key(plan_id, USER_ID).status == database.PURCHASE_OUT_OF_STOCK
+    assert _query('SELECT balance FROM users') == [(25.0,)]
+
+def test_inactive_plan_is_not_sold(db_file):
+    plan_id = _setup(balance=25, is_active=0)
+
+    assert database.purchase_vpn_key(plan_id, USER_ID).status == database.PURCHASE_PLAN_NOT_FOUND
+    assert database.purchase_vpn_key(plan_id + 1, USER_ID).status == database.PURCHASE_PLAN_NOT_FOUND
+    assert _query('SELECT balance FROM users') == [(25.0,)]
+    assert _query('SELECT COUNT(*) FROM vpn_keys WHERE is_used = 0') == [(1,)]
+
+def test_two_buyers_for_the_last_key(db_file):
+    plan_id = _setup(balance=25, keys=1, users=(41, 42))
+    results = {}
+
+    def buy(user_id):
+        results[user_id] = database.purchase_vpn_key(plan_id, user_id)
+        db_pool.close_thread_connection()
+
+    threads = [threading.Thread(target=buy, args=(user_id,)) for user_id in (41, 42)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    statuses = sorted(result.status for result in results.values())
+    assert statuses == [database.PURCHASE_OUT_OF_STOCK, database.PURCHASE_SUCCESS]
+    winner, loser = sorted(results, key=lambda user_id: results[user_id].status != database.PURCHASE_SUCCESS)
+    assert results[winner].available_keys == 0
+    assert dict(_query('SELECT telegram_id, balance FROM users')) == {winner: 15.0, loser: 25.0}
+    assert _query('SELECT user_id FROM user_plans') == [(winner,)]
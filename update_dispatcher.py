@@ -0,0 +1,179 @@
+"""
+Sharded update dispatcher for the Telegram bot.
+
+Updates are hashed by chat id onto BOT_WORKERS queues, and each queue has
+one worker thread. One user's clicks are handled strictly in order, while
+different users are handled in parallel, so a slow handler (a provider API
+call, an admin broadcast) only holds up the chats that share its shard.
+
+When a shard queue is full, submit() blocks. In polling mode this stops
+the next getUpdates call; in webhook mode the webhook queue fills and the
+route answers 503, so Telegram itself slows down.
+"""
+
+import os
+import threading
+import time
+import queue
+
+import telebot
+
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '8'))
+BOT_WORKER_QUEUE_SIZE = int(os.getenv('BOT_WORKER_QUEUE_SIZE', '100'))
+# How long submit() waits on a full shard before logging and waiting again
+BACKPRESSURE_WARN_SECONDS = 5.0
+
+_active_dispatcher = None
+
+def chat_id_for_update(update):
+    """Return the chat (or user) id an update belongs to, used as the shard key"""
+    message = (update.message or update.edited_message
+               or update.channel_post or update.edited_channel_post)
+    if message is not None:
+        return message.chat.id
+    if update.callback_query is not None:
+        if update.callback_query.message is not None:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    for event in (update.inline_query, update.chosen_inline_result, update.shipping_query,
+                  update.pre_checkout_query, update.poll_answer):
+        if event is not None:
+            return event.user.id if hasattr(event, 'user') else event.from_user.id
+    for event in (update.my_chat_member, update.chat_member, update.chat_join_request):
+        if event is not None:
+            return event.chat.id
+    # Polls and anything unknown: no ordering needed, spread by update id
+    return update.update_id
+
+class ShardedDispatcher:
+    """N single-threaded queues; items with the same key always go to the same queue"""
+
+    def __init__(self, handler, workers=BOT_WORKERS, queue_size=BOT_WORKER_QUEUE_SIZE, name='bot-worker'):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._shard_stats = [{
+            'processed': 0,
+            'errors': 0,
+            'max_depth': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+            'busy_since': None,
+        } for _ in range(self.workers)]
+        self._backpressure_waits = 0
+        self._threads = []
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, args=(index,),
+                                      name=f'{name}-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shard_for(self, key):
+        return hash(key) % self.workers
+
+    def submit(self, key, item):
+        """Queue item on its key's shard, blocking while that shard is full"""
+        index = self.shard_for(key)
+        shard = self.queues[index]
+        entry = (time.perf_counter(), item)
+        try:
+            shard.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self._backpressure_waits += 1
+            while True:
+                try:
+                    shard.put(entry, timeout=BACKPRESSURE_WARN_SECONDS)
+                    break
+                except queue.Full:
+                    print(f"⚠️ Update worker {index} is full ({self.queue_size} queued); waiting")
+        with self._lock:
+            stats = self._shard_stats[index]
+            stats['max_depth'] = max(stats['max_depth'], shard.qsize())
+        return index
+
+    def _worker_loop(self, index):
+        shard = self.queues[index]
+        stats = self._shard_stats[index]
+        while True:
+            enqueued_at, item = shard.get()
+            started = time.perf_counter()
+            wait_ms = (started - enqueued_at) * 1000
+            with self._lock:
+                stats['busy_since'] = time.time()
+            failed = False
+            try:
+                self.handler(item)
+            except Exception as e:
+                failed = True
+                print(f"❌ Error in update worker {index}: {e}")
+            with self._lock:
+                stats['busy_since'] = None
+                stats['processed'] += 1
+                stats['errors'] += 1 if failed else 0
+                stats['total_wait_ms'] += wait_ms
+                stats['max_wait_ms'] = max(stats['max_wait_ms'], wait_ms)
+
+    def get_stats(self):
+        """Per-shard queue depth, wait times and whether the worker is busy"""
+        now = time.time()
+        shards = []
+        with self._lock:
+            for index, stats in enumerate(self._shard_stats):
+                processed = stats['processed']
+                shards.append({
+                    'shard': index,
+                    'depth': self.queues[index].qsize(),
+                    'max_depth': stats['max_depth'],
+                    'processed': processed,
+                    'errors': stats['errors'],
+                    'avg_wait_ms': round(stats['total_wait_ms'] / processed, 3) if processed else 0.0,
+                    'max_wait_ms': round(stats['max_wait_ms'], 3),
+                    'busy_seconds': round(now - stats['busy_since'], 3) if stats['busy_since'] else 0.0,
+                    'alive': self._threads[index].is_alive(),
+                })
+            backpressure_waits = self._backpressure_waits
+        return {
+            'workers': self.workers,
+            'queue_capacity': self.queue_size,
+            'total_depth': sum(shard['depth'] for shard in shards),
+            'backpressure_waits': backpressure_waits,
+            'shards': shards,
+        }
+
+class ShardedTeleBot(telebot.TeleBot):
+    """TeleBot whose updates are handled by a ShardedDispatcher instead of the shared worker pool.
+
+    Handlers run inline (threaded=False) on the shard worker of their chat.
+    Works for both infinity_polling() and webhook mode, since both end in
+    process_new_updates().
+    """
+
+    def __init__(self, token, workers=BOT_WORKERS, queue_size=BOT_WORKER_QUEUE_SIZE, **kwargs):
+        global _active_dispatcher
+        kwargs['threaded'] = False
+        super().__init__(token, **kwargs)
+        self.dispatcher = ShardedDispatcher(self._process_update, workers, queue_size)
+        _active_dispatcher = self.dispatcher
+
+    def _process_update(self, update):
+        super().process_new_updates([update])
+
+    def process_update_now(self, update):
+        """Handle one update on the calling thread instead of its shard (bot_async.py orders updates itself)"""
+        self._process_update(update)
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # Advance the polling offset now; the update is handled later on its shard
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.dispatcher.submit(chat_id_for_update(update), update)
+
+def get_dispatcher_stats():
+    """Return stats for the bot's dispatcher, or None if the bot is not running in this process"""
+    if _active_dispatcher is None:
+        return None
+    return _active_dispatcher.get_stats()
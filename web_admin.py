@@ -1,12 +1,32 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 import sqlite3
 import os
+import io
+import csv
+import threading
 from datetime import datetime
 from database import (init_plan_tables, create_plan, get_all_plans, get_plan, update_plan, 
-                     delete_plan, add_vpn_keys, get_all_keys_for_plan, delete_vpn_key,
+                     delete_plan, add_vpn_keys, import_vpn_keys, get_all_keys_for_plan, delete_vpn_key,
                      init_contact_tables, get_contact_config, update_contact_config,
                      get_active_payment_methods_count, init_account_setup_tables,
-                     get_account_setup_config, update_account_setup_config, get_all_account_setup_configs)
+                     get_account_setup_config, update_account_setup_config, get_all_account_setup_configs,
+                     get_low_stock_thresholds, set_plan_low_stock_threshold, execute_write,
+                     PLAN_TYPE_VPN, PLAN_TYPE_QITO, PLAN_TYPE_BYPASS, get_cache_stats, bump_catalog_version,
+                     clear_known_users)
+from db_pool import get_connection, get_pool_stats, backup_to, restore_from
+from db_writer import get_writer_stats, writes_paused
+from bot_webhook import get_webhook_stats
+from update_dispatcher import get_dispatcher_stats
+from broadcast import get_broadcast_stats
+from send_scheduler import get_send_stats
+from provider_client import get_provider_stats
+from account_pool import get_account_pool_stats
+from purchase_jobs import get_purchase_stats
+from stock_alerts import get_stock_alert_stats, LOW_STOCK_THRESHOLD
+from admin_notifications import get_admin_notification_stats
+from apk_delivery import prewarm_apk, get_apk_delivery_stats
+from migrations import run_migrations
+from metrics import report
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
@@ -26,46 +46,16 @@ def allowed_file(filename):
 
 def get_db_connection():
     """Get database connection"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_connection(row_factory=sqlite3.Row)
 
 def init_admin_tables():
     """Initialize admin tables for topup options and payment info"""
+    # Tables and columns are created by the versioned migrations in migrations.py
+    run_migrations()
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Create topup_options table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS topup_options (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            credits INTEGER NOT NULL,
-            mmk_price INTEGER NOT NULL,
-            is_active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create payment_methods table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payment_methods (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            account_number TEXT,
-            is_active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Add account_number column if it doesn't exist (for existing databases)
-    cursor.execute("PRAGMA table_info(payment_methods)")
-    columns = [column[1] for column in cursor.fetchall()]
-    if 'account_number' not in columns:
-        cursor.execute('ALTER TABLE payment_methods ADD COLUMN account_number TEXT')
-    
     # Insert default topup options if table is empty
     cursor.execute('SELECT COUNT(*) FROM topup_options')
     if cursor.fetchone()[0] == 0:
@@ -136,34 +126,33 @@ def dashboard():
     # Get active payment methods count
     active_payment_methods_count = get_active_payment_methods_count()
     
-    # Get QITO plans (plans with "QITO" in the name, excluding ByPass)
+    # Get QITO plans
     qito_plans = conn.execute('''
         SELECT p.*, 
-               COUNT(CASE WHEN vk.is_used = 0 THEN 1 END) as available_keys
+               COALESCE(pi.available_keys, 0) as available_keys
         FROM plans p
-        LEFT JOIN vpn_keys vk ON p.id = vk.plan_id
-        WHERE p.name LIKE '%QITO%' AND p.name NOT LIKE '%ByPass%' AND p.is_active = 1
-        GROUP BY p.id
+        LEFT JOIN plan_inventory pi ON pi.plan_id = p.id
+        WHERE p.plan_type = ? AND p.is_active = 1
         ORDER BY p.plan_id_number
-    ''').fetchall()
+    ''', (PLAN_TYPE_QITO,)).fetchall()
     
-    # Get QITO plans count (excluding ByPass)
+    # Get QITO plans count
     qito_plans_count = conn.execute('''
-        SELECT COUNT(*) FROM plans WHERE name LIKE '%QITO%' AND name NOT LIKE '%ByPass%' AND is_active = 1
-    ''').fetchone()[0]
+        SELECT COUNT(*) FROM plans WHERE plan_type = ? AND is_active = 1
+    ''', (PLAN_TYPE_QITO,)).fetchone()[0]
     
     # Get ByPass plans count
     bypass_plans_count = conn.execute('''
-        SELECT COUNT(*) FROM plans WHERE name LIKE '%ByPass%' AND is_active = 1
-    ''').fetchone()[0]
+        SELECT COUNT(*) FROM plans WHERE plan_type = ? AND is_active = 1
+    ''', (PLAN_TYPE_BYPASS,)).fetchone()[0]
     
     # Get total available QITO keys count
     qito_keys_count = conn.execute('''
-        SELECT COUNT(*) 
-        FROM vpn_keys vk
-        JOIN plans p ON vk.plan_id = p.id
-        WHERE p.name LIKE '%QITO%' AND vk.is_used = 0
-    ''').fetchone()[0]
+        SELECT COALESCE(SUM(pi.available_keys), 0) 
+        FROM plan_inventory pi
+        JOIN plans p ON pi.plan_id = p.id
+        WHERE p.plan_type = ?
+    ''', (PLAN_TYPE_QITO,)).fetchone()[0]
     
     # Get database file information
     db_info = None
@@ -205,11 +194,8 @@ def add_topup():
         credits = request.form['credits']
         mmk_price = request.form['mmk_price']
         
-        conn = get_db_connection()
-        conn.execute('INSERT INTO topup_options (credits, mmk_price) VALUES (?, ?)', 
-                    (credits, mmk_price))
-        conn.commit()
-        conn.close()
+        execute_write('INSERT INTO topup_options (credits, mmk_price) VALUES (?, ?)', 
+                      (credits, mmk_price))
         
         flash('Topup option added successfully!', 'success')
         return redirect(url_for('topup_management'))
@@ -219,21 +205,18 @@ def add_topup():
 @app.route('/topup/edit/<int:topup_id>', methods=['GET', 'POST'])
 def edit_topup(topup_id):
     """Edit topup option"""
-    conn = get_db_connection()
-    
     if request.method == 'POST':
         credits = request.form['credits']
         mmk_price = request.form['mmk_price']
         is_active = request.form.get('is_active') == 'on'
         
-        conn.execute('UPDATE topup_options SET credits = ?, mmk_price = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-                    (credits, mmk_price, is_active, topup_id))
-        conn.commit()
-        conn.close()
+        execute_write('UPDATE topup_options SET credits = ?, mmk_price = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                      (credits, mmk_price, is_active, topup_id))
         
         flash('Topup option updated successfully!', 'success')
         return redirect(url_for('topup_management'))
     
+    conn = get_db_connection()
     topup = conn.execute('SELECT * FROM topup_options WHERE id = ?', (topup_id,)).fetchone()
     conn.close()
     
@@ -246,10 +229,7 @@ def edit_topup(topup_id):
 @app.route('/topup/delete/<int:topup_id>')
 def delete_topup(topup_id):
     """Delete topup option"""
-    conn = get_db_connection()
-    conn.execute('DELETE FROM topup_options WHERE id = ?', (topup_id,))
-    conn.commit()
-    conn.close()
+    execute_write('DELETE FROM topup_options WHERE id = ?', (topup_id,))
     
     flash('Topup option deleted successfully!', 'success')
     return redirect(url_for('topup_management'))
@@ -270,11 +250,8 @@ def add_payment():
         description = request.form['description']
         account_number = request.form.get('account_number', '')
         
-        conn = get_db_connection()
-        conn.execute('INSERT INTO payment_methods (name, description, account_number) VALUES (?, ?, ?)', 
-                    (name, description, account_number))
-        conn.commit()
-        conn.close()
+        execute_write('INSERT INTO payment_methods (name, description, account_number) VALUES (?, ?, ?)', 
+                      (name, description, account_number))
         
         flash('Payment method added successfully!', 'success')
         return redirect(url_for('payment_management'))
@@ -284,22 +261,19 @@ def add_payment():
 @app.route('/payments/edit/<int:payment_id>', methods=['GET', 'POST'])
 def edit_payment(payment_id):
     """Edit payment method"""
-    conn = get_db_connection()
-    
     if request.method == 'POST':
         name = request.form['name']
         description = request.form['description']
         account_number = request.form.get('account_number', '')
         is_active = request.form.get('is_active') == 'on'
         
-        conn.execute('UPDATE payment_methods SET name = ?, description = ?, account_number = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-                    (name, description, account_number, is_active, payment_id))
-        conn.commit()
-        conn.close()
+        execute_write('UPDATE payment_methods SET name = ?, description = ?, account_number = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                      (name, description, account_number, is_active, payment_id))
         
         flash('Payment method updated successfully!', 'success')
         return redirect(url_for('payment_management'))
     
+    conn = get_db_connection()
     payment = conn.execute('SELECT * FROM payment_methods WHERE id = ?', (payment_id,)).fetchone()
     conn.close()
     
@@ -312,10 +286,7 @@ def edit_payment(payment_id):
 @app.route('/payments/delete/<int:payment_id>')
 def delete_payment(payment_id):
     """Delete payment method"""
-    conn = get_db_connection()
-    conn.execute('DELETE FROM payment_methods WHERE id = ?', (payment_id,))
-    conn.commit()
-    conn.close()
+    execute_write('DELETE FROM payment_methods WHERE id = ?', (payment_id,))
     
     flash('Payment method deleted successfully!', 'success')
     return redirect(url_for('payment_management'))
@@ -363,6 +334,38 @@ def api_payment_methods():
     
     return jsonify(methods)
 
+# Runtime statistics of this process, served by api_stats()
+STATS_SOURCES = {
+    'db-pool': get_pool_stats,                   # connection reuse
+    'db-cache': get_cache_stats,                 # catalog and known-user caches
+    'db-writer': get_writer_stats,               # write queue depth, waits, group commits
+    'webhook': get_webhook_stats,                # Telegram webhook queue (webhook mode only)
+    'dispatcher': get_dispatcher_stats,          # per-worker update queues
+    'broadcasts': get_broadcast_stats,           # sender counters and recent broadcasts
+    'purchases': get_purchase_stats,             # QITO / ByPass purchase workers and job counts
+    'stock-alerts': get_stock_alert_stats,       # low key alerts and the plans reported low
+    'admin-notifications': get_admin_notification_stats,  # sent at once vs. digested
+    'apk': get_apk_delivery_stats,               # sends by cached file_id vs. uploads
+    'send': get_send_stats,                      # outbound send latency per lane
+    'providers': get_provider_stats,             # provider API latency and circuit breakers
+    'account-pool': get_account_pool_stats,      # ready provider accounts
+}
+
+@app.route('/api/stats')
+def api_stats_index():
+    """API endpoint listing the names accepted by /api/stats/<name>"""
+    return jsonify(sorted(STATS_SOURCES))
+
+@app.route('/api/stats/<name>')
+def api_stats(name):
+    """API endpoint to get one component's runtime statistics for this process"""
+    if name not in STATS_SOURCES:
+        return jsonify({'error': f'Unknown statistics: {name}'}), 404
+    stats = report(STATS_SOURCES[name])
+    if stats is None:
+        return jsonify({'error': 'Bot is not running in this process'}), 404
+    return jsonify(stats)
+
 # User Management API endpoints
 @app.route('/api/user/<int:user_id>')
 def api_get_user(user_id):
@@ -427,25 +430,15 @@ def api_update_user_balance():
         if not user_id or new_balance < 0:
             return jsonify({'success': False, 'message': 'Invalid data provided'})
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        user = cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-        if not user:
-            conn.close()
-            return jsonify({'success': False, 'message': 'User not found'})
-        
         # Update user balance
         # Round to 0 decimal places to ensure whole numbers (no floating-point precision issues)
-        cursor.execute('''
+        updated = execute_write('''
             UPDATE users 
             SET balance = ROUND(?, 0), updated_at = CURRENT_TIMESTAMP 
             WHERE id = ?
         ''', (new_balance, user_id))
-        
-        conn.commit()
-        conn.close()
+        if not updated:
+            return jsonify({'success': False, 'message': 'User not found'})
         
         return jsonify({'success': True, 'message': 'User balance updated successfully'})
         
@@ -478,7 +471,7 @@ def api_get_all_users():
 @app.route('/plans')
 def plan_management():
     """Plan management page"""
-    plans = get_all_plans()
+    plans = get_all_plans(PLAN_TYPE_VPN)
     return render_template('plan_management.html', plans=plans)
 
 @app.route('/plans/add', methods=['GET', 'POST'])
@@ -492,7 +485,7 @@ def add_plan():
         duration_days = int(request.form['duration_days'])
         
         try:
-            create_plan(plan_id_number, name, description, credits_required, duration_days)
+            create_plan(plan_id_number, name, description, credits_required, duration_days, plan_type=PLAN_TYPE_VPN)
             flash('Plan added successfully!', 'success')
             return redirect(url_for('plan_management'))
         except sqlite3.IntegrityError:
@@ -504,6 +497,11 @@ def add_plan():
 @app.route('/plans/edit/<int:plan_id>', methods=['GET', 'POST'])
 def edit_plan(plan_id):
     """Edit plan"""
+    plan = get_plan(plan_id, PLAN_TYPE_VPN)
+    if plan is None:
+        flash('Plan not found!', 'error')
+        return redirect(url_for('plan_management'))
+    
     if request.method == 'POST':
         plan_id_number = request.form['plan_id_number']
         name = request.form['name']
@@ -511,22 +509,22 @@ def edit_plan(plan_id):
         credits_required = int(request.form['credits_required'])
         duration_days = int(request.form['duration_days'])
         is_active = request.form.get('is_active') == 'on'
+        # Empty: use the LOW_STOCK_THRESHOLD default
+        low_stock_threshold = request.form.get('low_stock_threshold', '').strip()
+        low_stock_threshold = int(low_stock_threshold) if low_stock_threshold else None
         
         try:
             update_plan(plan_id, plan_id_number, name, description, credits_required, duration_days, is_active)
+            set_plan_low_stock_threshold(plan_id, low_stock_threshold)
             flash('Plan updated successfully!', 'success')
             return redirect(url_for('plan_management'))
         except sqlite3.IntegrityError:
             flash('Plan ID number already exists! Please use a different ID number.', 'error')
-            plan = get_plan(plan_id)
-            return render_template('edit_plan.html', plan=plan)
-    
-    plan = get_plan(plan_id)
-    if plan is None:
-        flash('Plan not found!', 'error')
-        return redirect(url_for('plan_management'))
+            return render_template('edit_plan.html', plan=plan, low_stock_threshold=low_stock_threshold,
+                                   default_low_stock_threshold=LOW_STOCK_THRESHOLD)
     
-    return render_template('edit_plan.html', plan=plan)
+    return render_template('edit_plan.html', plan=plan, low_stock_threshold=get_low_stock_thresholds().get(plan_id),
+                           default_low_stock_threshold=LOW_STOCK_THRESHOLD)
 
 @app.route('/plans/delete/<int:plan_id>')
 def delete_plan_route(plan_id):
@@ -546,18 +544,46 @@ def plan_keys(plan_id):
     keys = get_all_keys_for_plan(plan_id)
     return render_template('plan_keys.html', plan=plan, keys=keys)
 
+def iter_uploaded_keys(upload):
+    """Yield key values from an uploaded .txt (one per line) or .csv file without reading it all"""
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', errors='replace', newline='')
+    if not upload.filename.lower().endswith('.csv'):
+        yield from stream
+        return
+
+    key_column = 0
+    for row_number, row in enumerate(csv.reader(stream)):
+        if row_number == 0:
+            header = [cell.strip().lower() for cell in row]
+            named = [index for index, cell in enumerate(header) if cell in ('key', 'key_value', 'vpn_key')]
+            if named:
+                key_column = named[0]
+                continue
+        yield row[key_column] if len(row) > key_column else None
+
 @app.route('/plans/<int:plan_id>/keys/add', methods=['POST'])
 def add_plan_keys(plan_id):
-    """Add keys to a plan"""
-    keys_text = request.form['keys']
-    keys_list = [key.strip() for key in keys_text.split('\n') if key.strip()]
-    
-    if keys_list:
-        add_vpn_keys(plan_id, keys_list)
-        flash(f'{len(keys_list)} keys added successfully!', 'success')
+    """Add keys to a plan from the textarea and/or an uploaded key file"""
+    counts = {'inserted': 0, 'duplicates': 0, 'invalid': 0}
+
+    keys_text = request.form.get('keys', '')
+    if keys_text.strip():
+        for name, value in add_vpn_keys(plan_id, keys_text.splitlines()).items():
+            counts[name] += value
+
+    keys_file = request.files.get('keys_file')
+    if keys_file and keys_file.filename:
+        for name, value in import_vpn_keys(plan_id, iter_uploaded_keys(keys_file)).items():
+            counts[name] += value
+
+    if counts['inserted']:
+        flash(f"{counts['inserted']} keys added successfully! "
+              f"({counts['duplicates']} duplicates skipped, {counts['invalid']} invalid rows)", 'success')
+    elif counts['duplicates'] or counts['invalid']:
+        flash(f"No keys added: {counts['duplicates']} duplicates skipped, {counts['invalid']} invalid rows", 'error')
     else:
         flash('No valid keys provided!', 'error')
-    
+
     return redirect(url_for('plan_keys', plan_id=plan_id))
 
 @app.route('/keys/delete/<int:key_id>')
@@ -576,9 +602,9 @@ def qito_plan_management():
         SELECT p.*, 
                COALESCE(p.device_limit, 1) as device_limit
         FROM plans p
-        WHERE p.name LIKE '%QITO%' AND p.name NOT LIKE '%ByPass%'
+        WHERE p.plan_type = ?
         ORDER BY p.plan_id_number
-    ''').fetchall()
+    ''', (PLAN_TYPE_QITO,)).fetchall()
     conn.close()
     return render_template('qito_plan_management.html', qito_plans=qito_plans)
 
@@ -594,7 +620,7 @@ def add_qito_plan():
         device_limit = int(request.form.get('device_limit', 1))
         
         try:
-            create_plan(plan_id_number, name, description, credits_required, duration_days, device_limit)
+            create_plan(plan_id_number, name, description, credits_required, duration_days, device_limit, PLAN_TYPE_QITO)
             flash('QITO plan added successfully!', 'success')
             return redirect(url_for('qito_plan_management'))
         except sqlite3.IntegrityError:
@@ -606,6 +632,11 @@ def add_qito_plan():
 @app.route('/qito/edit/<int:plan_id>', methods=['GET', 'POST'])
 def edit_qito_plan(plan_id):
     """Edit QITO plan"""
+    plan = get_plan(plan_id, PLAN_TYPE_QITO)
+    if plan is None:
+        flash('QITO plan not found!', 'error')
+        return redirect(url_for('qito_plan_management'))
+    
     if request.method == 'POST':
         plan_id_number = request.form['plan_id_number']
         name = f"QITO {request.form['name']}"  # Automatically prefix with QITO
@@ -616,19 +647,13 @@ def edit_qito_plan(plan_id):
         is_active = request.form.get('is_active') == 'on'
         
         try:
-            update_plan(plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, device_limit)
+            update_plan(plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, device_limit, PLAN_TYPE_QITO)
             flash('QITO plan updated successfully!', 'success')
             return redirect(url_for('qito_plan_management'))
         except sqlite3.IntegrityError:
             flash('Plan ID number already exists! Please use a different ID number.', 'error')
-            plan = get_plan(plan_id)
             return render_template('edit_qito_plan.html', plan=plan)
     
-    plan = get_plan(plan_id)
-    if plan is None:
-        flash('QITO plan not found!', 'error')
-        return redirect(url_for('qito_plan_management'))
-    
     return render_template('edit_qito_plan.html', plan=plan)
 
 @app.route('/qito/delete/<int:plan_id>')
@@ -651,8 +676,8 @@ def qito_statistics():
             COUNT(CASE WHEN p.is_active = 1 THEN 1 END) as active_plans,
             SUM(COALESCE(p.device_limit, 1)) as total_device_slots
         FROM plans p
-        WHERE p.name LIKE '%QITO%'
-    ''').fetchone()
+        WHERE p.plan_type = ?
+    ''', (PLAN_TYPE_QITO,)).fetchone()
     
     # Get QITO purchase statistics
     qito_purchases = conn.execute('''
@@ -661,11 +686,11 @@ def qito_statistics():
             COUNT(*) as purchase_count
         FROM user_plans up
         JOIN plans p ON up.plan_id = p.id
-        WHERE p.name LIKE '%QITO%'
+        WHERE p.plan_type = ?
         GROUP BY DATE(up.purchase_date)
         ORDER BY purchase_date DESC
         LIMIT 30
-    ''').fetchall()
+    ''', (PLAN_TYPE_QITO,)).fetchall()
     
     # Get most popular QITO plans
     popular_qito_plans = conn.execute('''
@@ -675,10 +700,10 @@ def qito_statistics():
             COUNT(up.id) as purchase_count
         FROM plans p
         LEFT JOIN user_plans up ON p.id = up.plan_id
-        WHERE p.name LIKE '%QITO%'
+        WHERE p.plan_type = ?
         GROUP BY p.id
         ORDER BY purchase_count DESC
-    ''').fetchall()
+    ''', (PLAN_TYPE_QITO,)).fetchall()
     
     conn.close()
     
@@ -696,9 +721,9 @@ def bypass_plan_management():
         SELECT p.*, 
                COALESCE(p.device_limit, 1) as device_limit
         FROM plans p
-        WHERE p.name LIKE '%ByPass%'
+        WHERE p.plan_type = ?
         ORDER BY p.plan_id_number
-    ''').fetchall()
+    ''', (PLAN_TYPE_BYPASS,)).fetchall()
     conn.close()
     return render_template('qito_plan_management.html', qito_plans=bypass_plans)
 
@@ -714,7 +739,7 @@ def add_bypass_plan():
         device_limit = int(request.form.get('device_limit', 1))
         
         try:
-            create_plan(plan_id_number, name, description, credits_required, duration_days, device_limit)
+            create_plan(plan_id_number, name, description, credits_required, duration_days, device_limit, PLAN_TYPE_BYPASS)
             flash('ByPass plan added successfully!', 'success')
             return redirect(url_for('bypass_plan_management'))
         except sqlite3.IntegrityError:
@@ -726,6 +751,11 @@ def add_bypass_plan():
 @app.route('/bypass/edit/<int:plan_id>', methods=['GET', 'POST'])
 def edit_bypass_plan(plan_id):
     """Edit ByPass plan"""
+    plan = get_plan(plan_id, PLAN_TYPE_BYPASS)
+    if plan is None:
+        flash('ByPass plan not found!', 'error')
+        return redirect(url_for('bypass_plan_management'))
+    
     if request.method == 'POST':
         plan_id_number = request.form['plan_id_number']
         name = f"ByPass {request.form['name']}"  # Automatically prefix with ByPass
@@ -736,19 +766,13 @@ def edit_bypass_plan(plan_id):
         is_active = request.form.get('is_active') == 'on'
         
         try:
-            update_plan(plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, device_limit)
+            update_plan(plan_id, plan_id_number, name, description, credits_required, duration_days, is_active, device_limit, PLAN_TYPE_BYPASS)
             flash('ByPass plan updated successfully!', 'success')
             return redirect(url_for('bypass_plan_management'))
         except sqlite3.IntegrityError:
             flash('Plan ID number already exists! Please use a different ID number.', 'error')
-            plan = get_plan(plan_id)
             return render_template('edit_qito_plan.html', plan=plan)
     
-    plan = get_plan(plan_id)
-    if plan is None:
-        flash('ByPass plan not found!', 'error')
-        return redirect(url_for('bypass_plan_management'))
-    
     return render_template('edit_qito_plan.html', plan=plan)
 
 @app.route('/bypass/delete/<int:plan_id>')
@@ -770,8 +794,8 @@ def bypass_statistics():
             COUNT(CASE WHEN p.is_active = 1 THEN 1 END) as active_plans,
             SUM(COALESCE(p.device_limit, 1)) as total_device_slots
         FROM plans p
-        WHERE p.name LIKE '%ByPass%'
-    ''').fetchone()
+        WHERE p.plan_type = ?
+    ''', (PLAN_TYPE_BYPASS,)).fetchone()
     
     # Get ByPass purchase statistics
     bypass_purchases = conn.execute('''
@@ -780,11 +804,11 @@ def bypass_statistics():
             COUNT(*) as purchase_count
         FROM user_plans up
         JOIN plans p ON up.plan_id = p.id
-        WHERE p.name LIKE '%ByPass%'
+        WHERE p.plan_type = ?
         GROUP BY DATE(up.purchase_date)
         ORDER BY purchase_date DESC
         LIMIT 30
-    ''').fetchall()
+    ''', (PLAN_TYPE_BYPASS,)).fetchall()
     
     # Get most popular ByPass plans
     popular_bypass_plans = conn.execute('''
@@ -794,11 +818,11 @@ def bypass_statistics():
             COUNT(up.id) as purchase_count
         FROM plans p
         LEFT JOIN user_plans up ON p.id = up.plan_id
-        WHERE p.name LIKE '%ByPass%'
+        WHERE p.plan_type = ?
         GROUP BY p.id
         ORDER BY purchase_count DESC
         LIMIT 10
-    ''').fetchall()
+    ''', (PLAN_TYPE_BYPASS,)).fetchall()
     
     conn.close()
     
@@ -877,7 +901,10 @@ def upload_apk():
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         
-        flash('APK file uploaded successfully!', 'success')
+        # Upload it once to the admin chat, so the bot sends users the cached file_id
+        threading.Thread(target=prewarm_apk, name='apk-prewarm', daemon=True).start()
+        
+        flash('APK file uploaded successfully! It is being sent to the admin chat for instant delivery.', 'success')
     else:
         flash('Invalid file type! Only APK files are allowed.', 'error')
     
@@ -913,7 +940,6 @@ def download_apk():
 def download_database():
     """Download database file"""
     from flask import send_file
-    import shutil
     from datetime import datetime
     
     try:
@@ -927,8 +953,8 @@ def download_database():
         backup_filename = f'bot_database_backup_{timestamp}.db'
         backup_path = os.path.join('/tmp', backup_filename)
         
-        # Copy database file to temp location
-        shutil.copy2(DB_FILE, backup_path)
+        # Copy the database (with pages still in the WAL) to temp location
+        backup_to(backup_path)
         
         # Send the backup file
         return send_file(
@@ -946,7 +972,6 @@ def download_database():
 def backup_database():
     """Create a backup of the database"""
     from datetime import datetime
-    import shutil
     
     try:
         # Check if database file exists
@@ -963,8 +988,8 @@ def backup_database():
         backup_filename = f'bot_database_backup_{timestamp}.db'
         backup_path = os.path.join(backup_dir, backup_filename)
         
-        # Copy database file to backup location
-        shutil.copy2(DB_FILE, backup_path)
+        # Copy the database (with pages still in the WAL) to backup location
+        backup_to(backup_path)
         
         # Get backup file size
         backup_size = os.path.getsize(backup_path)
@@ -981,7 +1006,6 @@ def backup_database():
 def restore_database():
     """Restore database from uploaded file"""
     from werkzeug.utils import secure_filename
-    import shutil
     from datetime import datetime
     
     try:
@@ -1020,7 +1044,7 @@ def restore_database():
             backup_dir = 'database_backups'
             os.makedirs(backup_dir, exist_ok=True)
             backup_path = os.path.join(backup_dir, backup_filename)
-            shutil.copy2(DB_FILE, backup_path)
+            backup_to(backup_path)
             flash(f'Current database backed up as: {backup_filename}', 'info')
         
         # Save uploaded file as new database
@@ -1040,8 +1064,13 @@ def restore_database():
                 flash('Uploaded database appears to be empty or corrupted!', 'error')
                 return redirect(url_for('dashboard'))
             
-            # If verification passes, replace the current database
-            shutil.move(temp_path, DB_FILE)
+            # If verification passes, copy it into the current database
+            with writes_paused():
+                restore_from(temp_path)
+                clear_known_users()
+            os.remove(temp_path)
+            run_migrations(force=True)
+            bump_catalog_version()
             flash(f'Database restored successfully! Found {len(tables)} tables.', 'success')
             
         except Exception as e:
@@ -1104,7 +1133,6 @@ def download_backup(filename):
 @app.route('/database/backup/<filename>/restore', methods=['POST'])
 def restore_from_backup(filename):
     """Restore database from a specific backup"""
-    import shutil
     from datetime import datetime
     
     try:
@@ -1120,30 +1148,33 @@ def restore_from_backup(filename):
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             current_backup_filename = f'bot_database_before_restore_{timestamp}.db'
             current_backup_path = os.path.join(backup_dir, current_backup_filename)
-            shutil.copy2(DB_FILE, current_backup_path)
+            backup_to(current_backup_path)
             flash(f'Current database backed up as: {current_backup_filename}', 'info')
         
-        # Copy backup to current database location
-        shutil.copy2(backup_path, DB_FILE)
-        
-        # Verify the restored database
+        # Verify the backup before restoring it
         try:
-            conn = sqlite3.connect(DB_FILE)
+            conn = sqlite3.connect(backup_path)
             cursor = conn.cursor()
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
             tables = cursor.fetchall()
             conn.close()
-            
-            if not tables:
-                flash('Restored database appears to be empty or corrupted!', 'error')
-                return redirect(url_for('list_backups'))
-            
-            flash(f'Database restored successfully from {filename}! Found {len(tables)} tables.', 'success')
-            
         except Exception as e:
-            flash(f'Restored database appears to be corrupted: {str(e)}', 'error')
+            flash(f'Backup file appears to be corrupted: {str(e)}', 'error')
+            return redirect(url_for('list_backups'))
+        
+        if not tables:
+            flash('Backup file appears to be empty or corrupted!', 'error')
             return redirect(url_for('list_backups'))
         
+        # Copy the backup into the current database
+        with writes_paused():
+            restore_from(backup_path)
+            clear_known_users()
+        run_migrations(force=True)
+        bump_catalog_version()
+        
+        flash(f'Database restored successfully from {filename}! Found {len(tables)} tables.', 'success')
+        
     except Exception as e:
         flash(f'Error restoring database: {str(e)}', 'error')
     